@@ -1,58 +1,317 @@
 import streamlit as st
 import requests
 import datetime
-import pandas as pd
+import hmac
+import io
 import re 
-import google.generativeai as genai 
 import os 
-import time 
-import altair as alt 
+import streamlit.components.v1 as components
+import time
+import uuid
+
+from hydrocare.activity_tracks import MAX_ACTIVITY_HOURS, detect_track_format, load_activity_track
+from hydrocare.aggregates import DailyIntakeTotals
+from hydrocare.bulk_io import (
+    FORMATS as BULK_FORMATS,
+    MAX_IMPORT_AMOUNT_ML,
+    MIN_IMPORT_AMOUNT_ML,
+    detect_format,
+    export_log,
+    import_log,
+    rows_per_second,
+)
+from hydrocare.charts import build_intake_chart_spec
+from hydrocare.cohort_analytics import CohortRefresher, CohortRollups
+from hydrocare.columnar import DRINK_TYPES, WaterLogColumns
+from hydrocare.disk_cache import DiskCache, memoize
+from hydrocare.gemini import GeminiBlockedError, generate_text, stream_text
+from hydrocare.gemini_scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, GeminiBusyError, GeminiScheduler, GeminiTimeoutError
+from hydrocare.hourly_plan import HourlyPlanEngine, PlannedActivity, plan_hourly_frame
+from hydrocare.images import ImageVariantCache, target_width_for
+from hydrocare.hydration import calculate_activity_water_loss, calculate_base_water_intake, calculate_wbgt
+from hydrocare.lazy import lazy_import, load_now
+from hydrocare.log_features import build_log_features, format_log_features
+from hydrocare.metrics import METRICS, MetricsExporter
+from hydrocare.reminders import LoggingNotifier, ReminderScheduler, WebhookNotifier
+from hydrocare.rollups import SUMMARY_GRANULARITIES, SUMMARY_WINDOWS, summarize_intake
+from hydrocare.storage import WaterLogStore, from_timestamp
+from hydrocare.weather import WeatherClient, describe_weather_error
+from hydrocare.weather_async import WeatherPrefetcher, compare_cities
+
+# pandas・Altair・Gemini SDK は読み込みに時間がかかるため、使うページを開いたときに読み込む
+pd = lazy_import("pandas")
+alt = lazy_import("altair")
+genai = lazy_import("google.generativeai")
 
 
 OPENWEATHER_API_KEY = os.getenv("WEATHER_API")
-OPENWEATHER_URL = "http://api.openweathermap.org/data/2.5/weather"
+OPENWEATHER_URL = os.getenv("OPENWEATHER_URL", "http://api.openweathermap.org/data/2.5/weather")
+
+# 天気を裏で先読みしておく都市 (カンマ区切り。未設定なら先読みしない)
+PREFETCH_CITIES = [city.strip() for city in os.getenv("HYDROCARE_PREFETCH_CITIES", "").split(",") if city.strip()]
 
 GEMINI_API_KEY = os.getenv("GEMINI_API")
+GEMINI_ENABLED = bool(GEMINI_API_KEY) and GEMINI_API_KEY != "YOUR_GEMINI_API_KEY"
+GEMINI_MODEL_NAME = 'gemini-1.5-flash'
+# Gemini API の接続先 (負荷試験などでローカルのスタブサーバーへ向ける場合のみ設定する。REST で接続する)
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+GEMINI_CACHE_PATH = os.getenv(
+    "HYDROCARE_GEMINI_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gemini_cache.db")
+)
+GEMINI_CACHE_MAX_BYTES = int(os.getenv("HYDROCARE_GEMINI_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+
+# 関数の結果のキャッシュの置き場所。"memory": プロセスごとの st.cache_data、
+# "disk": 同じマシンの全プロセス (ロードバランサーの後ろの複数のワーカー) で共有する SQLite のファイル
+CACHE_BACKENDS = ["memory", "disk"]
+CACHE_BACKEND = os.getenv("HYDROCARE_CACHE_BACKEND", "memory")
+if CACHE_BACKEND not in CACHE_BACKENDS:
+    raise ValueError(f"HYDROCARE_CACHE_BACKEND は {' / '.join(CACHE_BACKENDS)} のどれかにしてください: {CACHE_BACKEND}")
+SHARED_CACHE_PATH = os.getenv(
+    "HYDROCARE_SHARED_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "shared_cache.db")
+)
+SHARED_CACHE_MAX_BYTES = int(os.getenv("HYDROCARE_SHARED_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# 共有キャッシュの既定の有効期限 (秒)。記録の版 (revision) をキーに含む結果は古くならないため、使われなくなったものを消すための期限
+SHARED_CACHE_TTL = int(os.getenv("HYDROCARE_SHARED_CACHE_TTL", 24 * 60 * 60))
+# Gemini へのリクエストの上限 (1分あたりの送信数と同時実行数)
+GEMINI_REQUESTS_PER_MINUTE = int(os.getenv("HYDROCARE_GEMINI_RPM", 15))
+GEMINI_MAX_IN_FLIGHT = int(os.getenv("HYDROCARE_GEMINI_MAX_IN_FLIGHT", 4))
+
+# 処理時間の計測結果の出力先 (HYDROCARE_METRICS=1 で計測を有効にした場合のみ使われる)
+METRICS_TEXTFILE_PATH = os.getenv("HYDROCARE_METRICS_FILE")
+METRICS_PORT = int(os.getenv("HYDROCARE_METRICS_PORT")) if os.getenv("HYDROCARE_METRICS_PORT") else None
+METRICS_PANEL_ENABLED = os.getenv("HYDROCARE_METRICS_PANEL", "") == "1"
+
+# 水分補給履歴の1ページあたりの件数の選択肢
+HISTORY_PAGE_SIZES = [10, 20, 50]
+# 取り消しボタンに表示する操作の名前
+LOG_ACTION_LABELS = {"add": "追加", "edit": "修正", "delete": "削除"}
+
+# 次の水分補給までのカウントダウンの更新方式
+REMINDER_REFRESH_MODES = {
+    "client": "ブラウザ内タイマー (期限到達時のみサーバーへ問い合わせ)",
+    "fragment": "リマインダー部分のみ定期的に更新",
+}
+
+# 期限を迎えたリマインダーの通知先 (Webhook の URL。HYDROCARE_REMINDER_LOG=1 ならログに出すだけ。どちらもなければ通知しない)
+REMINDER_WEBHOOK_URL = os.getenv("HYDROCARE_REMINDER_WEBHOOK_URL")
+REMINDER_LOG_ENABLED = os.getenv("HYDROCARE_REMINDER_LOG", "") == "1"
+
+# 運用者向けの全ユーザーの集計ページの合言葉 (設定した場合だけ集計を作る)。
+# URL に ?admin を付けて開くとサイドバーに入力欄が出て、合言葉を入れたセッションにだけページを表示する
+ADMIN_TOKEN = os.getenv("HYDROCARE_ADMIN_TOKEN")
+ADMIN_PAGE_ENABLED = bool(ADMIN_TOKEN)
+# 集計を裏で更新する間隔 (秒)
+COHORT_REFRESH_SECONDS = int(os.getenv("HYDROCARE_COHORT_REFRESH_SECONDS", 30))
+
+# 起動時に重いライブラリと Gemini クライアントを先に読み込んでおくか (HYDROCARE_WARMUP=1 で有効)
+WARMUP_ENABLED = os.getenv("HYDROCARE_WARMUP", "") == "1"
+
+# --- Gemini のモデル (初めて問い合わせるときに SDK を読み込んで作成し、全セッションで共有) ---
+@st.cache_resource
+def get_gemini_model():
+    if not GEMINI_ENABLED:
+        return None
+    if GEMINI_API_ENDPOINT:
+        genai.configure(api_key=GEMINI_API_KEY, transport="rest", client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+    else:
+        genai.configure(api_key=GEMINI_API_KEY)
+    return genai.GenerativeModel(GEMINI_MODEL_NAME)
+
+# --- 水分補給記録のストレージ (全セッションで共有) ---
+@st.cache_resource
+def get_water_log_store():
+    return WaterLogStore()
+
+# --- 関数の結果の共有キャッシュ (HYDROCARE_CACHE_BACKEND=disk の場合だけ使う。全プロセスで同じファイルを開く) ---
+@st.cache_resource
+def get_shared_cache():
+    if CACHE_BACKEND != "disk":
+        return None
+    return DiskCache(SHARED_CACHE_PATH, max_bytes=SHARED_CACHE_MAX_BYTES, default_ttl=SHARED_CACHE_TTL)
+
+# 関数の結果をキャッシュするデコレーター。name は共有キャッシュのキーの接頭辞で、統計もこの名前ごとに数える。
+# memory では今までどおり st.cache_data (プロセスごと)、disk では全プロセスで共有する DiskCache に保存する
+def cache_data(name, ttl=None, max_entries=256):
+    if CACHE_BACKEND == "disk":
+        return memoize(get_shared_cache, name, ttl)
+    return st.cache_data(show_spinner=False, ttl=ttl, max_entries=max_entries)
+
+# --- 天気情報クライアント (全セッションで接続と取得結果を共有。disk の場合は取得結果を全プロセスで共有) ---
+@st.cache_resource
+def get_weather_client():
+    return WeatherClient(OPENWEATHER_API_KEY, base_url=OPENWEATHER_URL, shared_cache=get_shared_cache())
+
+# --- 都市ごと・1時間ごとの暑さの表 (全セッションで共有し、同じ都市の表は1時間に1回だけ作る) ---
+@st.cache_resource
+def get_hourly_plan_engine():
+    return HourlyPlanEngine(get_weather_client())
+
+@st.cache_resource
+def get_weather_prefetcher():
+    if not PREFETCH_CITIES or not OPENWEATHER_API_KEY or OPENWEATHER_API_KEY == "YOUR_OPENWEATHER_API_KEY":
+        return None
+    return WeatherPrefetcher(get_weather_client(), PREFETCH_CITIES).start()
 
-if GEMINI_API_KEY and GEMINI_API_KEY != "YOUR_GEMINI_API_KEY":
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-1.5-flash') 
-else:
-    model = None 
+# --- 全ユーザーの集計 (運用者向けの分析ページを有効にした場合だけ作り、裏で更新し続ける) ---
+@st.cache_resource
+def get_cohort_rollups():
+    if not ADMIN_PAGE_ENABLED:
+        return None
+    return CohortRollups(get_water_log_store().path)
 
-# --- 熱中症指数(WBGT)計算関数 ---
-def calculate_wbgt(temp_celsius, humidity_percent):
-    if temp_celsius is None or humidity_percent is None:
+@st.cache_resource
+def get_cohort_refresher():
+    rollups = get_cohort_rollups()
+    if rollups is None:
         return None
-    wbgt_approx = 0.735 * temp_celsius + 0.057 * humidity_percent - 2.82
-    return max(0, wbgt_approx) 
+    wbgt_source = None
+    if OPENWEATHER_API_KEY and OPENWEATHER_API_KEY != "YOUR_OPENWEATHER_API_KEY":
+        # 利用者の多い都市の現在の天気から暑さ指数を求めて記録する (取得できなければその回は記録しない)
+        def wbgt_source(city_name):
+            try:
+                main_data = get_weather_client().current_weather(city_name).get('main', {})
+            except requests.exceptions.RequestException:
+                return None
+            if main_data.get('temp') is None or main_data.get('humidity') is None:
+                return None
+            return calculate_wbgt(main_data['temp'], main_data['humidity'])
+    return CohortRefresher(rollups, interval_seconds=COHORT_REFRESH_SECONDS, wbgt_source=wbgt_source).start()
+
+# --- 処理時間の計測結果を Prometheus 形式で書き出す (全セッションで1つ) ---
+@st.cache_resource
+def get_metrics_exporter():
+    if not METRICS.enabled or (not METRICS_TEXTFILE_PATH and METRICS_PORT is None):
+        return None
+    return MetricsExporter(METRICS, textfile_path=METRICS_TEXTFILE_PATH, port=METRICS_PORT).start()
+
+# --- リマインダーのスケジューラー (全セッションで1つ。タブを閉じていても期限になれば通知する) ---
+@st.cache_resource
+def get_reminder_scheduler():
+    if REMINDER_WEBHOOK_URL:
+        return ReminderScheduler(WebhookNotifier(REMINDER_WEBHOOK_URL)).start()
+    if REMINDER_LOG_ENABLED:
+        return ReminderScheduler(LoggingNotifier()).start()
+    return None
+
+# 最後に飲んだ時刻か通知間隔が変わったときに、次の期限をスケジューラーへ登録し直す
+def schedule_reminder():
+    scheduler = get_reminder_scheduler()
+    if scheduler is not None:
+        scheduler.schedule(
+            st.session_state.user_id, st.session_state.last_water_intake_time, st.session_state.reminder_interval_minutes
+        )
 
-# --- 水分補給量の計算ロジック ---
-def calculate_base_water_intake(age, gender, weight_kg):
-    if not all([age, gender, weight_kg]):
-        return 0
-    base_ml = 0
-    if age < 18:
-        base_ml = weight_kg * 40 
-    elif age >= 65:
-        base_ml = weight_kg * 30 
-    else:
-        base_ml = weight_kg * 35 
-    return base_ml
-
-def calculate_activity_water_loss(activity_type, duration_minutes):
-    if activity_type == "ウォーキング":
-        return duration_minutes * 5 
-    elif activity_type == "ランニング":
-        return duration_minutes * 10 
-    elif activity_type == "サイクリング":
-        return duration_minutes * 8 
-    return 0
+# --- 運用者の確認 (合言葉を入れたセッションだけが全ユーザーの集計を見られる) ---
+def is_operator():
+    return ADMIN_PAGE_ENABLED and st.session_state.get('is_operator', False)
+
+def render_operator_login():
+    if not ADMIN_PAGE_ENABLED or is_operator() or "admin" not in st.query_params:
+        return
+    token = st.text_input("運用者の合言葉", type="password", key="operator_token_input")
+    if token:
+        if hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+            st.session_state.is_operator = True
+        else:
+            st.error("合言葉が違います。")
+
+# --- ユーザーIDの取得 ---
+# ログイン機能がないため、URLの uid パラメータでユーザーを識別する (ブックマークすれば記録を引き継げる)
+def get_user_id():
+    user_id = st.query_params.get("uid")
+    if not user_id:
+        user_id = uuid.uuid4().hex
+        st.query_params["uid"] = user_id
+    return user_id
+
+# --- 水分補給を記録 ---
+def record_water_intake(amount_ml, drink_type):
+    now = datetime.datetime.now()
+    get_water_log_store().append(st.session_state.user_id, now, amount_ml, drink_type)
+    st.session_state.intake_totals.add(now, amount_ml, drink_type)
+    st.session_state.total_consumed_ml = st.session_state.intake_totals.total_ml
+    st.session_state.last_water_intake_time = now
+    schedule_reminder()
+
+# 記録の修正・削除・取り消し・取り込みのあとに、本日の集計と最後に飲んだ時刻を記録から読み直す
+def refresh_intake_totals(store, user_id):
+    st.session_state.intake_totals.reload(store, user_id)
+    st.session_state.total_consumed_ml = st.session_state.intake_totals.total_ml
+    st.session_state.last_water_intake_time = st.session_state.intake_totals.last_intake_time
+    schedule_reminder()
+
+# --- 直前の操作 (記録の追加・修正・削除) の取り消し ---
+# 記録は変更のイベントとして保存しているため、取り消しは逆向きのイベントを1回書くだけで済む
+def undo_last_action(store, user_id):
+    if store.undo_last(user_id):
+        refresh_intake_totals(store, user_id)
+        st.session_state.log_action_message = "直前の操作を取り消しました。"
+
+def render_undo_button(store, user_id):
+    last_action = store.last_action(user_id)
+    label = "↩️ 直前の操作を取り消す"
+    if last_action is not None:
+        label += f" ({LOG_ACTION_LABELS[last_action.kind]} {last_action.entry_count}件、{last_action.amount_ml:+,}ml)"
+    st.button(label, key="undo_last_action_button", disabled=last_action is None, on_click=undo_last_action, args=(store, user_id))
+
+# --- Gemini の回答キャッシュ (プロンプトとモデル名をキーに、全プロセスでディスク上に共有) ---
+@st.cache_resource
+def get_gemini_cache():
+    return DiskCache(GEMINI_CACHE_PATH, max_bytes=GEMINI_CACHE_MAX_BYTES)
+
+# --- Gemini へのリクエストのスケジューラー (全セッションで送信レートと同時実行数を共有) ---
+@st.cache_resource
+def get_gemini_scheduler():
+    return GeminiScheduler(get_gemini_model(), requests_per_minute=GEMINI_REQUESTS_PER_MINUTE, max_in_flight=GEMINI_MAX_IN_FLIGHT)
+
+# --- Gemini に問い合わせる (stream=True の場合は生成されたそばから文字列を返すジェネレーター) ---
+# 体調へのアドバイスのような対話的な問い合わせは priority=PRIORITY_INTERACTIVE で先に処理される
+def ask_gemini(prompt, label, stream=False, priority=PRIORITY_BACKGROUND):
+    scheduled_model = get_gemini_scheduler().client(priority)
+    if stream:
+        return _stream_gemini(scheduled_model, prompt, label)
+    try:
+        return generate_text(scheduled_model, GEMINI_MODEL_NAME, prompt, get_gemini_cache())
+    except GeminiBlockedError:
+        return f"Gemini AI: 不適切な内容の可能性があり、{label}の生成がブロックされました。"
+    except GeminiBusyError:
+        return f"現在、AIへのリクエストが混み合っているため{label}を取得できませんでした。少し時間をおいて再度お試しください。"
+    except GeminiTimeoutError:
+        return f"AIの{label}の生成に時間がかかりすぎたため、中断しました。少し時間をおいて再度お試しください。"
+    except Exception as e:
+        st.error(f"Gemini AIからの{label}取得中にエラーが発生しました: {e}")
+        return f"現在、AIからの{label}取得に問題が発生しています。しばらくしてから再度お試しください。"
+
+def _stream_gemini(scheduled_model, prompt, label):
+    try:
+        yield from stream_text(scheduled_model, GEMINI_MODEL_NAME, prompt, get_gemini_cache())
+    except GeminiBlockedError:
+        yield f"Gemini AI: 不適切な内容の可能性があり、{label}の生成がブロックされました。"
+    except GeminiBusyError:
+        yield f"現在、AIへのリクエストが混み合っているため{label}を取得できませんでした。少し時間をおいて再度お試しください。"
+    except GeminiTimeoutError:
+        yield f"AIの{label}の生成に時間がかかりすぎたため、中断しました。少し時間をおいて再度お試しください。"
+    except Exception as e:
+        st.error(f"Gemini AIからの{label}取得中にエラーが発生しました: {e}")
+        yield f"現在、AIからの{label}取得に問題が発生しています。しばらくしてから再度お試しください。"
+
+# --- Gemini の回答を表示 (ストリーミングの場合は届いた分から順に書き足す) ---
+def render_gemini_answer(title, answer, spinner_text):
+    placeholder = st.empty()
+    if isinstance(answer, str):
+        placeholder.info(f"**{title}:** {answer}")
+        return answer
+    placeholder.info(spinner_text)
+    text = ""
+    for chunk in answer:
+        text += chunk
+        placeholder.info(f"**{title}:** {text}")
+    return text
 
 # --- Gemini API を使用した体調からのアドバイス生成関数 ---
-@st.cache_data(show_spinner="Gemini AIがアドバイスを生成中...") 
-def get_health_advice_from_gemini(mood_text, user_profile):
-    if model is None:
+@METRICS.instrument("hydrocare_helper_seconds", helper="get_health_advice_from_gemini")
+def get_health_advice_from_gemini(mood_text, user_profile, stream=False):
+    if not GEMINI_ENABLED:
         return "Gemini AIが利用できません。APIキーが正しく設定されているか確認してください。"
 
     if not mood_text:
@@ -67,33 +326,18 @@ def get_health_advice_from_gemini(mood_text, user_profile):
 ---
 アドバイス:
 """
-    try:
-        response = model.generate_content(prompt)
-        if response._chunks: 
-            return response.text 
-        else:
-            return "Gemini AI: 不適切な内容の可能性があり、アドバイスの生成がブロックされました。"
-    except Exception as e:
-        st.error(f"Gemini AIからのアドバイス取得中にエラーが発生しました: {e}")
-        return "現在、AIからのアドバイス取得に問題が発生しています。しばらくしてから再度お試しください。"
+    return ask_gemini(prompt, "アドバイス", stream, PRIORITY_INTERACTIVE)
 
 # --- 新機能: Gemini API を使用した水分補給履歴のインサイト分析 ---
-@st.cache_data(show_spinner="Gemini AIが水分補給習慣を分析中...")
-def get_water_intake_insight_from_gemini(water_log, user_profile, base_daily_target_ml):
-    if model is None:
+# 記録そのものではなく、直近90日分の特徴量の要約 (hydrocare.log_features) を渡すため、記録が何件あってもプロンプトの長さは変わらない
+@METRICS.instrument("hydrocare_helper_seconds", helper="get_water_intake_insight_from_gemini")
+def get_water_intake_insight_from_gemini(log_features_text, user_profile, base_daily_target_ml, stream=False):
+    if not GEMINI_ENABLED:
         return "Gemini AIが利用できません。APIキーが正しく設定されているか確認してください。"
     
-    if not water_log:
+    if not log_features_text:
         return "まだ水分補給の記録がないため、分析できません。数日間の記録を付けてみましょう。"
 
-    log_strings = []
-    recent_logs = water_log[-10:] if len(water_log) > 10 else water_log
-    for entry in recent_logs:
-        log_time = pd.to_datetime(entry['time']).strftime('%Y年%m月%d日 %H時%M分')
-        log_strings.append(f"- {log_time} に {entry['type']} を {entry['amount_ml']}ml 摂取")
-
-    log_text = "\n".join(log_strings)
-
     prompt = f"""あなたは熱中症予防アプリ「HydroCare」の水分補給トレーナーです。
 以下のユーザーの水分補給履歴、プロフィール、1日の基本目標水分量に基づいて、水分補給の習慣に関する具体的な「インサイト（洞察）」と「改善提案」を日本語で簡潔に100文字程度で提供してください。
 医療行為ではなく、一般的な健康管理アドバイスの範囲でお願いします。
@@ -104,30 +348,28 @@ def get_water_intake_insight_from_gemini(water_log, user_profile, base_daily_tar
 体重: {user_profile['weight_kg']}kg
 1日の基本目標水分量: {base_daily_target_ml}ml
 
-最近の水分補給履歴（日付、時間、種類、量）:
-{log_text}
+水分補給履歴の要約:
+{log_features_text}
 ---
 分析と提案:
 """
-    try:
-        response = model.generate_content(prompt)
-        if response._chunks:
-            return response.text
-        else:
-            return "Gemini AI: 不適切な内容の可能性があり、分析の生成がブロックされました。"
-    except Exception as e:
-        st.error(f"Gemini AIからの分析取得中にエラーが発生しました: {e}")
-        return "現在、AIからの分析取得に問題が発生しています。しばらくしてから再度お試しください。"
+    return ask_gemini(prompt, "分析", stream, PRIORITY_BACKGROUND)
 
 
+# --- 新機能: 次の水分補給までの残り秒数を計算 ---
+def calculate_remaining_seconds(last_intake_time, interval_minutes):
+    if last_intake_time is None:
+        return None
+
+    time_since_last = datetime.datetime.now() - last_intake_time
+    return (interval_minutes * 60) - time_since_last.total_seconds()
+
 # --- 新機能: 次の水分補給時刻を計算 ---
 def calculate_next_intake_time(last_intake_time, interval_minutes):
-    if last_intake_time is None:
+    remaining_seconds = calculate_remaining_seconds(last_intake_time, interval_minutes)
+    if remaining_seconds is None:
         return None 
     
-    time_since_last = datetime.datetime.now() - last_intake_time
-    remaining_seconds = (interval_minutes * 60) - time_since_last.total_seconds()
-    
     if remaining_seconds <= 0:
         return "補給時間です！"
     else:
@@ -135,35 +377,384 @@ def calculate_next_intake_time(last_intake_time, interval_minutes):
         seconds = int(remaining_seconds % 60)
         return f"あと {minutes:02d}分 {seconds:02d}秒"
 
-# --- 新機能: 日ごとの水分摂取量を集計 ---
-def calculate_daily_summary(water_log, base_daily_target_ml):
-    if not water_log:
-        today = datetime.date.today()
-        seven_days_ago = today - datetime.timedelta(days=6)
-        date_range = pd.date_range(start=seven_days_ago, end=today, freq='D')
-        df_empty = pd.DataFrame({'Date': date_range})
-        df_empty['Total_ML'] = 0
-        df_empty['Target_ML'] = base_daily_target_ml
-        return df_empty
-
-    df = pd.DataFrame(water_log)
-    df['date'] = pd.to_datetime(df['time']).dt.date
-    
-    daily_summary_actual = df.groupby('date')['amount_ml'].sum().reset_index()
-    daily_summary_actual.columns = ['Date', 'Total_ML']
-    daily_summary_actual['Date'] = pd.to_datetime(daily_summary_actual['Date'])
-    
+# --- 新機能: ブラウザ内で動くカウントダウン表示 ---
+# 1秒ごとの表示更新はブラウザ側で行い、サーバーへは期限到達時のみ問い合わせる
+def render_client_countdown(remaining_seconds):
+    components.html(f"""
+<div style="font-family: 'Source Sans Pro', sans-serif; padding: 0.75rem 1rem; border-radius: 0.5rem; background-color: rgba(28, 131, 225, 0.1); color: rgb(0, 66, 128);">
+次の水分補給まで: <b id="countdown"></b>
+</div>
+<script>
+const deadline = Date.now() + {int(remaining_seconds * 1000)};
+function tick() {{
+    const remaining = Math.max(0, Math.ceil((deadline - Date.now()) / 1000));
+    const minutes = String(Math.floor(remaining / 60)).padStart(2, '0');
+    const seconds = String(remaining % 60).padStart(2, '0');
+    document.getElementById('countdown').textContent = remaining > 0 ? `あと ${{minutes}}分 ${{seconds}}秒` : '補給時間です！';
+    if (remaining > 0) {{
+        setTimeout(tick, 1000 - ((deadline - Date.now()) % 1000));
+    }}
+}}
+tick();
+</script>
+""", height=60)
+
+# --- 新機能: 次の水分補給リマインダー (フラグメントとしてこの部分だけ再実行) ---
+def next_intake_reminder_fragment(refresh_mode, counting_down):
+    last_intake_time = st.session_state.last_water_intake_time
+    interval_minutes = st.session_state.reminder_interval_minutes
+    remaining_seconds = calculate_remaining_seconds(last_intake_time, interval_minutes)
+
+    if remaining_seconds is None:
+        st.info("水分補給の記録がまだありません。最初の補給を記録すると、次の推奨時刻が表示されます。")
+    elif remaining_seconds <= 0:
+        st.warning("⏰ **水分補給の時間です！**")
+        if counting_down:
+            # 期限到達時はページ全体を一度だけ再実行し、定期更新を止める
+            st.rerun()
+    elif refresh_mode == "client":
+        render_client_countdown(remaining_seconds)
+    else:
+        st.info(f"次の水分補給まで: **{calculate_next_intake_time(last_intake_time, interval_minutes)}**")
+
+def render_next_intake_reminder():
+    refresh_mode = st.session_state.reminder_refresh_mode
+    remaining_seconds = calculate_remaining_seconds(st.session_state.last_water_intake_time, st.session_state.reminder_interval_minutes)
+
+    run_every = None
+    if remaining_seconds is not None and remaining_seconds > 0:
+        if refresh_mode == "client":
+            # 期限を少し過ぎてから1回だけ再実行する
+            run_every = remaining_seconds + 1
+        else:
+            run_every = st.session_state.reminder_refresh_seconds
+
+    st.fragment(next_intake_reminder_fragment, run_every=run_every)(refresh_mode, run_every is not None)
+
+# --- 処理時間の計測結果をサイドバーに表示 (HYDROCARE_METRICS_PANEL=1 の場合) ---
+def render_metrics_panel():
+    with st.expander("🛠 処理時間の計測"):
+        rows = METRICS.summary()
+        if not rows:
+            st.caption("まだ計測結果がありません。")
+            return
+        st.dataframe(pd.DataFrame(rows).round(2), hide_index=True, use_container_width=True)
+        if st.button("計測結果をリセット", key="metrics_reset_button"):
+            METRICS.reset()
+
+# --- キャッシュの使用量とヒット率をサイドバーに表示 (HYDROCARE_METRICS_PANEL=1 の場合) ---
+# 共有キャッシュと Gemini の回答キャッシュは全プロセス分、天気はこのプロセスの分
+def render_cache_stats_panel():
+    with st.expander("🗄 キャッシュの統計"):
+        rows = []
+        for label, cache in (("共有", get_shared_cache()), ("Gemini", get_gemini_cache())):
+            if cache is None:
+                continue
+            stats = cache.stats()
+            st.caption(f"{label}: {stats['entries']:,}件、{stats['total_bytes'] / 1e6:.1f} / {stats['max_bytes'] / 1e6:.0f} MB")
+            for namespace, counts in stats['namespaces'].items():
+                rows.append({'cache': label, 'namespace': namespace, **counts})
+        weather_stats = get_weather_client().stats()
+        st.caption(
+            f"天気 (このプロセス): ヒット {weather_stats['hits']}、共有キャッシュから {weather_stats['shared_hits']}、"
+            f"取得 {weather_stats['misses'] - weather_stats['shared_hits']}"
+        )
+        if rows:
+            st.dataframe(pd.DataFrame(rows).round(3), hide_index=True, use_container_width=True)
+
+# --- プロフィールの保存 (全ユーザーの集計で年代・都市・目標量ごとに分けるため、次に開いたときにも使う) ---
+def save_user_profile(store, user_id):
+    profile = st.session_state.user_profile
+    store.save_profile(
+        user_id, profile['age'], profile['gender'], profile['weight_kg'],
+        st.session_state.daily_target_ml, st.session_state.city_name
+    )
+
+# --- 運用者向け分析 (全ユーザーの集計テーブルから表示。どの表も期間の日数分の集計行を読むだけで済む) ---
+def render_cohort_analytics():
+    st.header("📊 運用者向け分析")
+    st.markdown("全ユーザーの記録を、日・都市・年代・飲み物の種類・時間帯ごとに集計したものです。")
+    rollups = get_cohort_rollups()
+    refresher = get_cohort_refresher()
+    if not rollups.is_built():
+        st.info("集計を準備しています。しばらくしてから開き直してください。")
+        return
+
+    days = st.selectbox("期間", SUMMARY_WINDOWS, format_func=lambda days: f"過去{days}日間", key="cohort_days_selector")
+    end = datetime.date.today() + datetime.timedelta(days=1)
+    start = end - datetime.timedelta(days=days)
+    query_started = time.perf_counter()
+    trend_df = rollups.daily_trend(start, end)
+    city_df = rollups.by_group("city", start, end)
+    age_df = rollups.by_group("age_band", start, end)
+    wbgt_df = rollups.wbgt_exposure(start, end)
+    hour_df = rollups.by_hour(start, end)
+    drink_df = rollups.by_drink_type(start, end)
+    query_ms = (time.perf_counter() - query_started) * 1000
+    if trend_df.empty:
+        st.info("この期間の記録はまだありません。")
+        return
+
+    user_days = int(trend_df['users'].sum())
+    targeted_users = int(trend_df['targeted_users'].sum())
+    col_users, col_rate, col_ml = st.columns(3)
+    col_users.metric("延べ利用者日数", f"{user_days:,}")
+    col_rate.metric(
+        "目標の達成率",
+        f"{trend_df['attained_users'].sum() / targeted_users:.1%}" if targeted_users else "-",
+        help="目標量を設定している人のうち、その日の摂取量が目標量に届いた人の割合"
+    )
+    col_ml.metric("1人1日あたりの摂取量", f"{trend_df['total_ml'].sum() / user_days / 1000:.2f} L")
+
+    st.subheader("日ごとの推移")
+    st.line_chart(trend_df.set_index('日付')[['attainment_rate']].rename(columns={'attainment_rate': '達成率'}))
+
+    group_columns = {
+        'users': '延べ利用者日数', 'attainment_rate': '達成率', 'ml_per_user_day': '1人1日あたり (ml)',
+    }
+    st.subheader("都市別")
+    st.dataframe(
+        city_df.set_index('city')[list(group_columns)].rename(columns=group_columns), use_container_width=True
+    )
+    if not wbgt_df.empty:
+        st.caption("暑さ指数 (記録した日の最高値) と、暑い日 (厳重警戒以上) とそれ以外の日の1人1日あたりの摂取量")
+        st.dataframe(
+            wbgt_df.set_index('city').rename(columns={
+                'wbgt_days': '記録した日数', 'avg_max_wbgt': '平均の最高WBGT', 'hot_days': '暑い日',
+                'hot_day_ml_per_user': '暑い日 (ml)', 'other_day_ml_per_user': 'それ以外の日 (ml)',
+            }),
+            use_container_width=True
+        )
+    st.subheader("年代別")
+    st.dataframe(
+        age_df.set_index('age_band')[list(group_columns)].rename(columns=group_columns), use_container_width=True
+    )
+
+    st.subheader("時間帯別の摂取量")
+    st.bar_chart(hour_df.set_index('hour')[['total_ml']].rename(columns={'total_ml': '摂取量 (ml)'}))
+    st.subheader("飲み物の種類別")
+    st.dataframe(
+        drink_df.set_index('drink_type').rename(columns={'total_ml': '摂取量 (ml)', 'entry_count': '件数', 'share': '割合'}).round(3),
+        use_container_width=True
+    )
+
+    status = rollups.status()
+    refreshed = refresher.last_refreshed.strftime('%H:%M:%S') if refresher and refresher.last_refreshed else "-"
+    st.caption(
+        f"集計の最終更新: {refreshed} / 未反映の変更: {status['pending_events']:,}件 / 問い合わせ: {query_ms:.1f} ms"
+        + (f" / 前回の更新の失敗: {refresher.last_error}" if refresher and refresher.last_error else "")
+    )
+
+# --- 水分補給履歴 (日付を選び、1ページ分だけ読み出して表示) ---
+# 件数・ページ・前後の記録がある日は、ユーザーIDと時刻のインデックスの範囲検索で求めるため、
+# 表示にかかる時間は履歴全体の件数ではなくページの大きさで決まる
+def jump_to_history_date(date):
+    st.session_state.history_date_input = date
+    st.session_state.history_page_input = 1
+
+def reset_history_page():
+    st.session_state.history_page_input = 1
+
+def edit_history_entry(store, user_id, entry_id, time, amount_ml, drink_type):
+    try:
+        store.edit_entry(user_id, entry_id, time, amount_ml, drink_type)
+    except ValueError as e:
+        st.session_state.log_action_message = f"修正できませんでした: {e}"
+        return
+    refresh_intake_totals(store, user_id)
+    st.session_state.log_action_message = "記録を修正しました。"
+
+def delete_history_entry(store, user_id, entry_id):
+    try:
+        store.delete_entry(user_id, entry_id)
+    except ValueError as e:
+        st.session_state.log_action_message = f"削除できませんでした: {e}"
+        return
+    refresh_intake_totals(store, user_id)
+    st.session_state.log_action_message = "記録を削除しました。"
+
+def render_water_log_history(store, user_id):
     today = datetime.date.today()
-    seven_days_ago = today - datetime.timedelta(days=6)
-    date_range = pd.date_range(start=seven_days_ago, end=today, freq='D')
-    
-    full_df = pd.DataFrame({'Date': date_range})
-    full_df = pd.merge(full_df, daily_summary_actual, on='Date', how='left').fillna(0)
-    full_df['Total_ML'] = full_df['Total_ML'].astype(int) 
+    if 'history_date_input' not in st.session_state:
+        st.session_state.history_date_input = today
+
+    col_date, col_page_size = st.columns([2, 1])
+    with col_date:
+        history_date = st.date_input("日付", max_value=today, key="history_date_input", on_change=reset_history_page)
+    with col_page_size:
+        page_size = st.selectbox("1ページの件数", HISTORY_PAGE_SIZES, index=1, key="history_page_size_selector", on_change=reset_history_page)
+    day_start = history_date
+    day_end = history_date + datetime.timedelta(days=1)
+
+    previous_time = store.previous_entry_time(user_id, day_start)
+    next_time = store.next_entry_time(user_id, day_end)
+    col_previous, col_next = st.columns(2)
+    with col_previous:
+        st.button(
+            "◀ 前の記録がある日", key="history_previous_button", disabled=previous_time is None,
+            on_click=jump_to_history_date, args=(previous_time.date() if previous_time else None,)
+        )
+    with col_next:
+        st.button(
+            "次の記録がある日 ▶", key="history_next_button", disabled=next_time is None or next_time.date() > today,
+            on_click=jump_to_history_date, args=(next_time.date() if next_time else None,)
+        )
 
-    full_df['Target_ML'] = base_daily_target_ml
-    
-    return full_df.sort_values('Date')
+    total = store.count_between(user_id, day_start, day_end)
+    if total == 0:
+        if history_date == today:
+            st.info("まだ本日の水分補給記録はありません。")
+        else:
+            st.info(f"{history_date:%Y年%m月%d日}の水分補給記録はありません。")
+        return
+
+    page_count = -(-total // page_size)
+    if st.session_state.get('history_page_input', 1) > page_count:
+        st.session_state.history_page_input = page_count
+    page_number = st.number_input("ページ", min_value=1, max_value=page_count, step=1, key="history_page_input") if page_count > 1 else 1
+    offset = (page_number - 1) * page_size
+
+    page_rows = store.rows_page(user_id, day_start, day_end, offset, page_size, with_ids=True)
+    df_log = WaterLogColumns.from_rows([row[1:] for row in page_rows]).to_frame()
+    df_log.index = range(offset + 1, offset + len(df_log) + 1)
+    df_log['time'] = df_log['time'].dt.strftime('%H:%M:%S')
+    st.dataframe(df_log.rename(columns={'time': '時刻', 'amount_ml': '摂取量 (ml)', 'type': '種類'}), use_container_width=True)
+    st.caption(f"{history_date:%Y年%m月%d日}: {total}件中 {offset + 1}〜{offset + len(df_log)}件目 ({page_number}/{page_count}ページ)")
+
+    # 表示中のページの記録を1件選んで修正・削除する (取り消しボタンで元に戻せる)
+    with st.expander("記録を修正・削除"):
+        rows_by_id = {row[0]: (number, *row[1:]) for number, row in enumerate(page_rows, offset + 1)}
+        entry_id = st.selectbox(
+            "記録", list(rows_by_id), key="history_edit_entry_selector",
+            format_func=lambda entry_id: f"{rows_by_id[entry_id][0]}. {df_log.at[rows_by_id[entry_id][0], 'time']} "
+                                         f"{rows_by_id[entry_id][3]} {rows_by_id[entry_id][2]}ml"
+        )
+        _, ts, amount_ml, drink_type = rows_by_id[entry_id]
+        entry_time = from_timestamp(ts)
+        drink_types = DRINK_TYPES if drink_type in DRINK_TYPES else DRINK_TYPES + [drink_type]
+        col_time, col_amount, col_type = st.columns(3)
+        with col_time:
+            new_time = st.time_input("時刻", value=entry_time.time(), step=60, key=f"history_edit_time_{entry_id}")
+        with col_amount:
+            new_amount_ml = st.number_input(
+                "量 (ml)", min_value=MIN_IMPORT_AMOUNT_ML, max_value=MAX_IMPORT_AMOUNT_ML, value=amount_ml, step=50,
+                key=f"history_edit_amount_{entry_id}"
+            )
+        with col_type:
+            new_drink_type = st.selectbox("種類", drink_types, index=drink_types.index(drink_type), key=f"history_edit_type_{entry_id}")
+        # 時刻の秒は画面で変えられないため、時・分を変えていなければ元の時刻のままにする
+        new_entry_time = datetime.datetime.combine(history_date, new_time)
+        if new_entry_time == entry_time.replace(second=0, microsecond=0):
+            new_entry_time = entry_time
+        col_update, col_delete = st.columns(2)
+        with col_update:
+            st.button(
+                "更新", key="history_edit_button", on_click=edit_history_entry,
+                args=(store, user_id, entry_id, new_entry_time, new_amount_ml, new_drink_type)
+            )
+        with col_delete:
+            st.button("削除", key="history_delete_button", on_click=delete_history_entry, args=(store, user_id, entry_id))
+
+# --- 記録のまとめて取り込み・書き出し (CSV / JSON Lines / Parquet) ---
+# ファイルは一定の行数ずつ読み込んで検証し、1かたまりずつ追加するため、大きなファイルでもメモリ使用量は増えない
+BULK_EXPORT_MIME_TYPES = {"csv": "text/csv", "jsonl": "application/x-ndjson", "parquet": "application/vnd.apache.parquet"}
+
+def render_bulk_import_export(store, user_id):
+    with st.expander("ファイルから取り込む"):
+        st.caption("時刻 (time)・量 (amount_ml)・種類 (type) の列を持つファイルを取り込めます。読めない時刻や範囲外の量の行は取り込みません。")
+        uploaded_file = st.file_uploader(
+            "CSV / JSON Lines / Parquet", type=["csv", "jsonl", "ndjson", "json", "parquet"], key="bulk_import_uploader"
+        )
+        if st.button("取り込む", key="bulk_import_button", disabled=uploaded_file is None):
+            try:
+                with st.spinner("取り込み中..."):
+                    report = import_log(store, user_id, uploaded_file, detect_format(uploaded_file.name))
+            except ValueError as e:
+                # 失敗する前に取り込んだ分は、取り消しのボタンでまとめて取り消せる
+                refresh_intake_totals(store, user_id)
+                st.error(f"取り込みに失敗しました: {e}")
+            else:
+                refresh_intake_totals(store, user_id)
+                st.success(f"{report.rows}行中 {report.imported}件を取り込みました ({rows_per_second(report):,.0f}行/秒)。")
+                if report.rejected:
+                    st.warning(f"{report.rejected}行は取り込めませんでした (先頭の行番号: {', '.join(str(row + 1) for row in report.rejected_rows)})。")
+
+    with st.expander("ファイルに書き出す"):
+        export_format = st.selectbox("形式", BULK_FORMATS, key="bulk_export_format_selector")
+        if st.button("書き出しファイルを作成", key="bulk_export_button"):
+            buffer = io.BytesIO()
+            with st.spinner("書き出し中..."):
+                rows, _ = export_log(store, user_id, buffer, export_format)
+            st.session_state.bulk_export = (export_format, rows, buffer.getvalue())
+        if st.session_state.get('bulk_export'):
+            export_format, rows, data = st.session_state.bulk_export
+            st.download_button(
+                f"{rows}件をダウンロード ({export_format})", data, file_name=f"hydrocare-{datetime.date.today():%Y%m%d}.{export_format}",
+                mime=BULK_EXPORT_MIME_TYPES[export_format], key="bulk_export_download_button"
+            )
+
+# --- 活動の記録ファイル (GPX / TCX) の取り込み ---
+# ファイルは少しずつ読みながら5分ごとの区間にまとめ、区間ごとの速さ・上り勾配と、その時刻の暑さ指数から失われる水分を求める。
+# 今日の活動であれば、失われる水分を本日全体の推奨量に加える
+def render_activity_track_import(activity_type, city_name_disabled):
+    with st.expander("活動の記録ファイルから計算する (GPX / TCX)"):
+        st.caption("スマートウォッチやアプリから書き出した記録を読み込みます。ファイルに種目がない場合は、上で選んだ活動の種類を使います。")
+        uploaded_file = st.file_uploader("GPX / TCX", type=["gpx", "tcx"], key="activity_track_uploader")
+        if st.button("読み込む", key="activity_track_button", disabled=uploaded_file is None):
+            city_table = None
+            if not city_name_disabled:
+                try:
+                    city_table = get_hourly_plan_engine().table(st.session_state.city_name)
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    st.warning(f"予報の取得に失敗したため、暑さ指数による補正なしで計算します ({describe_weather_error(e)})")
+            try:
+                with st.spinner("読み込み中..."):
+                    st.session_state.activity_track = load_activity_track(
+                        uploaded_file, detect_track_format(uploaded_file.name),
+                        activity_type if activity_type != "選択してください" else None, city_table
+                    )
+            except ValueError as e:
+                st.error(f"読み込みに失敗しました: {e}")
+        track = st.session_state.get('activity_track')
+        if track is not None:
+            st.info(
+                f"**{track.activity_type} {track.moving_minutes:.0f}分 ({track.distance_km:.1f} km) で、"
+                f"約 {track.water_loss_ml} ml の水分が失われたと考えられます。**"
+            )
+            st.caption(
+                f"{track.points:,}点を {track.seconds:.2f}秒で読み込みました。予報の範囲外の時刻には、最も近い時の暑さ指数を使っています。"
+                + (f" 最初の点から{MAX_ACTIVITY_HOURS}時間の範囲外の時刻の {track.skipped_points:,}点は読み飛ばしました。" if track.skipped_points else "")
+            )
+            st.dataframe(track.segments, use_container_width=True, hide_index=True)
+
+def activity_track_water_loss_today():
+    track = st.session_state.get('activity_track')
+    if track is None or track.segments.empty:
+        return 0
+    return track.water_loss_ml if track.segments['開始'].iloc[0].date() == datetime.date.today() else 0
+
+# --- 新機能: 日ごと・週ごと・月ごとの水分摂取量を集計 ---
+# 日別・月別の集計テーブルから作成し、記録が増えた (revision が変わった) ときだけ作り直す
+@METRICS.instrument("hydrocare_helper_seconds", helper="calculate_daily_summary")
+@cache_data("calculate_daily_summary")
+def calculate_daily_summary(user_id, revision, base_daily_target_ml, days=7, granularity="day", today=None):
+    return summarize_intake(get_water_log_store(), user_id, base_daily_target_ml, days, granularity, today)
+
+# --- インサイト分析に渡す水分補給履歴の要約 ---
+# 集計テーブルから作り、記録が増えた (revision が変わった) ときだけ作り直す。記録がなければ None
+@METRICS.instrument("hydrocare_helper_seconds", helper="get_log_features_text")
+@cache_data("get_log_features_text")
+def get_log_features_text(user_id, revision, base_daily_target_ml, today):
+    features = build_log_features(get_water_log_store(), user_id, base_daily_target_ml, today)
+    return format_log_features(features, base_daily_target_ml) if features is not None else None
+
+# --- 摂取ログのグラフ仕様 (Vega-Lite) ---
+# 縦持ちへの変換と長い期間の間引きをサーバー側で済ませ、記録の版 (revision) と期間ごとにキャッシュする。
+# 同じ仕様なら Streamlit が送信済みのメッセージを参照で済ませるため、ブラウザへも送り直さない
+@cache_data("get_intake_chart_spec")
+def get_intake_chart_spec(user_id, revision, base_daily_target_ml, days, granularity, today, title, y_max):
+    summary = calculate_daily_summary(user_id, revision, base_daily_target_ml, days, granularity, today)
+    return build_intake_chart_spec(summary, title, y_max, include_target=base_daily_target_ml > 0)
 
 
 # --- メインアプリケーション関数 ---
@@ -187,25 +778,51 @@ def main_app():
             'gender': None,
             'weight_kg': None
         }
-    if 'water_log' not in st.session_state:
-        st.session_state.water_log = [] 
+    if 'user_id' not in st.session_state:
+        st.session_state.user_id = get_user_id()
+    store = get_water_log_store()
+    # 保存したプロフィールがあれば、セッションを開いたときに1回だけ読み込む
+    if 'profile_loaded' not in st.session_state:
+        saved_profile = store.load_profile(st.session_state.user_id)
+        if saved_profile is not None:
+            st.session_state.user_profile = {key: saved_profile[key] for key in ('age', 'gender', 'weight_kg')}
+            st.session_state.daily_target_ml = saved_profile['daily_target_ml']
+            if saved_profile['city_name']:
+                st.session_state.city_name = saved_profile['city_name']
+        st.session_state.profile_loaded = True
+    get_weather_prefetcher()
+    get_metrics_exporter()
+    get_cohort_refresher()
+    if 'intake_totals' not in st.session_state:
+        st.session_state.intake_totals = DailyIntakeTotals.load(store, st.session_state.user_id, datetime.date.today())
+    intake_totals = st.session_state.intake_totals
+    intake_totals.roll_over(store, st.session_state.user_id)
     if 'daily_target_ml' not in st.session_state:
         st.session_state.daily_target_ml = 0
-    if 'total_consumed_ml' not in st.session_state:
-        st.session_state.total_consumed_ml = 0
+    st.session_state.total_consumed_ml = intake_totals.total_ml
     if 'last_water_intake_time' not in st.session_state:
-        st.session_state.last_water_intake_time = None
+        st.session_state.last_water_intake_time = intake_totals.last_intake_time
     if 'city_name' not in st.session_state:
         st.session_state.city_name = "Tokyo" 
     if 'reminder_interval_minutes' not in st.session_state:
         st.session_state.reminder_interval_minutes = 60 
+    if 'reminder_refresh_mode' not in st.session_state:
+        st.session_state.reminder_refresh_mode = "client"
+    if 'reminder_refresh_seconds' not in st.session_state:
+        st.session_state.reminder_refresh_seconds = 1
+    # セッションを開いたときに1回だけ登録する (以降は記録時と設定の更新時のみ)
+    if 'reminder_scheduled' not in st.session_state:
+        schedule_reminder()
+        st.session_state.reminder_scheduled = True
 
     # --- サイドバーナビゲーション ---
     with st.sidebar:
         st.header("メニュー")
+        render_operator_login()
         page = st.radio(
             "表示するページを選択してください", 
             ["ホーム", "水分を記録", "摂取ログ", "天気とアクティビティ", "AIヘルスケア", "マイ設定"]
+            + (["運用者向け分析"] if is_operator() else [])
         )
         
         st.markdown("---")
@@ -216,6 +833,14 @@ def main_app():
             st.write(f"**基本目標**: {st.session_state.daily_target_ml / 1000:.1f} L")
         else:
             st.info("プロフィールが未設定です。")
+        # 記録ボタンで加算された後の値を表示するため、ページ描画後に書き込む
+        today_total_placeholder = st.empty()
+        if METRICS.enabled and METRICS_PANEL_ENABLED:
+            render_metrics_panel()
+        if METRICS_PANEL_ENABLED:
+            render_cache_stats_panel()
+
+    page_started = time.perf_counter()
 
 
     # --- コンテンツ表示 ---
@@ -232,9 +857,10 @@ def main_app():
         else:
             st.info(f"**目標水分摂取量 (基本):** {base_daily_target_ml / 1000:.1f} リットル")
 
-            current_consumed_ml = sum(entry['amount_ml'] for entry in st.session_state.water_log if pd.to_datetime(entry['time']).date() == datetime.date.today())
-            st.session_state.total_consumed_ml = current_consumed_ml
+            current_consumed_ml = intake_totals.total_ml
             st.info(f"**本日摂取した水分量:** {current_consumed_ml / 1000:.1f} リットル")
+            if intake_totals.by_type:
+                st.caption("内訳: " + " / ".join(f"{drink_type} {amount_ml}ml" for drink_type, amount_ml in intake_totals.by_type.items()))
 
             progress_percentage = (current_consumed_ml / base_daily_target_ml) * 100 if base_daily_target_ml > 0 else 0
             st.progress(min(int(progress_percentage), 100), text=f"目標達成度: {progress_percentage:.1f}%")
@@ -246,17 +872,7 @@ def main_app():
             st.markdown("---")
             # 次の水分補給リマインダー表示
             st.subheader("⏰ 次の水分補給推奨時刻")
-            next_intake_display = calculate_next_intake_time(st.session_state.last_water_intake_time, st.session_state.reminder_interval_minutes)
-            if next_intake_display == "補給時間です！":
-                st.warning("⏰ **水分補給の時間です！**")
-            elif next_intake_display:
-                st.info(f"次の水分補給まで: **{next_intake_display}**")
-            else:
-                st.info("水分補給の記録がまだありません。最初の補給を記録すると、次の推奨時刻が表示されます。")
-            
-            if isinstance(next_intake_display, str) and "あと" in next_intake_display:
-                time.sleep(1) 
-                st.rerun() 
+            render_next_intake_reminder()
 
             st.markdown("---")
             st.subheader("💧 あなたへの水分補給推奨")
@@ -275,7 +891,7 @@ def main_app():
 
         drink_type = st.selectbox(
             "飲み物の種類",
-            ["水", "お茶", "スポーツドリンク", "ジュース", "コーヒー", "その他"],
+            DRINK_TYPES,
             key="drink_type_selector"
         )
 
@@ -284,15 +900,13 @@ def main_app():
         with col_cup:
             st.write("### コップ1杯")
             if st.button("150ml 記録", key="record_150ml_btn"):
-                st.session_state.water_log.append({'time': datetime.datetime.now(), 'amount_ml': 150, 'type': drink_type})
-                st.session_state.last_water_intake_time = datetime.datetime.now()
+                record_water_intake(150, drink_type)
                 st.success(f"{drink_type}を150ml 記録しました！")
         
         with col_bottle:
             st.write("### ペットボトル")
             if st.button("500ml 記録", key="record_500ml_btn"):
-                st.session_state.water_log.append({'time': datetime.datetime.now(), 'amount_ml': 500, 'type': drink_type})
-                st.session_state.last_water_intake_time = datetime.datetime.now()
+                record_water_intake(500, drink_type)
                 st.success(f"{drink_type}を500ml 記録しました！")
 
         with col_slider:
@@ -308,22 +922,23 @@ def main_app():
             )
             if st.button(f"{custom_amount_ml_slider}ml を記録", key="custom_record_button"): 
                 if custom_amount_ml_slider > 0:
-                    st.session_state.water_log.append({'time': datetime.datetime.now(), 'amount_ml': custom_amount_ml_slider, 'type': drink_type})
-                    st.session_state.last_water_intake_time = datetime.datetime.now()
+                    record_water_intake(custom_amount_ml_slider, drink_type)
                     st.success(f"{drink_type}を{custom_amount_ml_slider}ml 記録しました！")
                 else:
                     st.warning("記録する量を0より大きく設定してください。")
 
+        render_undo_button(store, st.session_state.user_id)
+        if st.session_state.get('log_action_message'):
+            st.info(st.session_state.pop('log_action_message'))
+
         st.markdown("---")
-        st.subheader("今日の水分補給履歴")
-        if st.session_state.water_log:
-            today_logs = [log for log in st.session_state.water_log if pd.to_datetime(log['time']).date() == datetime.date.today()]
-            if today_logs:
-                df_log = pd.DataFrame(today_logs)
-                df_log['time'] = df_log['time'].dt.strftime('%H:%M:%S')
-                st.dataframe(df_log.rename(columns={'time': '時刻', 'amount_ml': '摂取量 (ml)', 'type': '種類'}), use_container_width=True)
-            else:
-                st.info("まだ本日の水分補給記録はありません。")
+        st.subheader("📦 記録のまとめて取り込み・書き出し")
+        render_bulk_import_export(store, st.session_state.user_id)
+
+        st.markdown("---")
+        st.subheader("水分補給履歴")
+        if intake_totals.last_intake_time is not None:
+            render_water_log_history(store, st.session_state.user_id)
         else:
             st.info("まだ水分補給記録はありません。")
         
@@ -335,43 +950,40 @@ def main_app():
 
         base_daily_target_ml = st.session_state.daily_target_ml
         
-        st.subheader("週間水分摂取ログ")
-        df_daily_summary = calculate_daily_summary(st.session_state.water_log, base_daily_target_ml)
+        st.subheader("水分摂取ログ")
+        col_window, col_granularity = st.columns(2)
+        with col_window:
+            summary_days = st.selectbox("期間", SUMMARY_WINDOWS, format_func=lambda days: f"過去{days}日間", key="summary_days_selector")
+        with col_granularity:
+            summary_granularity = st.selectbox(
+                "集計単位", list(SUMMARY_GRANULARITIES.keys()), format_func=lambda granularity: SUMMARY_GRANULARITIES[granularity], key="summary_granularity_selector"
+            )
+        revision = store.revision(st.session_state.user_id)
+        today = datetime.date.today()
+        df_daily_summary = calculate_daily_summary(
+            st.session_state.user_id, revision, base_daily_target_ml, summary_days, summary_granularity, today
+        )
+        chart_title = f"過去{summary_days}日間の水分摂取量の推移 ({SUMMARY_GRANULARITIES[summary_granularity]})"
         
-        # グラフのY軸最大値設定 (ml単位)
-        dynamic_y_max = max(base_daily_target_ml * 1.5, 3000) if base_daily_target_ml > 0 else 3000
+        # グラフのY軸最大値設定 (ml単位) 週ごと・月ごとは1区間の目標量・摂取量に合わせて広げる
+        dynamic_y_max = max(df_daily_summary['Target_ML'].max() * 1.5, df_daily_summary['Total_ML'].max() * 1.1, 3000) if base_daily_target_ml > 0 else max(df_daily_summary['Total_ML'].max() * 1.1, 3000)
         
         if base_daily_target_ml == 0:
             st.warning("⚠️ **マイ設定**ページで年齢と体重を入力すると、目標線も表示されたグラフを見ることができます。")
-            if not df_daily_summary.empty and not all(df_daily_summary['Total_ML'] == 0):
-                # Altairチャートを作成
-                chart = alt.Chart(df_daily_summary).mark_line().encode(
-                    x=alt.X('Date:T', title='日付'),
-                    y=alt.Y('Total_ML:Q', title='摂取量 (ml)', scale=alt.Scale(domain=[0, dynamic_y_max]))
-                ).properties(
-                    title='過去7日間の水分摂取量の推移'
+        if not df_daily_summary.empty and not all(df_daily_summary['Total_ML'] == 0):
+            # 縦持ち・間引き済みのグラフ仕様を作る (記録と期間が変わらなければキャッシュから同じものを返す)
+            with METRICS.time("hydrocare_chart_build_seconds", chart="intake_log"):
+                chart_spec = get_intake_chart_spec(
+                    st.session_state.user_id, revision, base_daily_target_ml,
+                    summary_days, summary_granularity, today, chart_title, dynamic_y_max
                 )
-                st.altair_chart(chart, use_container_width=True) 
-                st.write("過去7日間の水分摂取量の推移です。")
+                st.vega_lite_chart(chart_spec, use_container_width=True)
+            if base_daily_target_ml > 0:
+                st.write(f"{chart_title}です。（青線: 摂取量, オレンジ線: 目標量）")
             else:
-                st.info("まだ水分補給の記録が少ないため、トレンドは表示できません。数日間記録を続けると表示されます。")
+                st.write(f"{chart_title}です。")
         else:
-            if not df_daily_summary.empty and not all(df_daily_summary['Total_ML'] == 0):
-                # Altairチャートを作成
-                chart = alt.Chart(df_daily_summary).mark_line().encode(
-                    x=alt.X('Date:T', title='日付'),
-                    y=alt.Y('value:Q', title='摂取量/目標量 (ml)', scale=alt.Scale(domain=[0, dynamic_y_max])), 
-                    color=alt.Color('variable:N', title='項目', legend=alt.Legend(title="項目")) 
-                ).transform_fold( 
-                    ['Total_ML', 'Target_ML'],
-                    as_=['variable', 'value']
-                ).properties(
-                    title='過去7日間の水分摂取量の推移'
-                )
-                st.altair_chart(chart, use_container_width=True) 
-                st.write("過去7日間の水分摂取量の推移です。（青線: 摂取量, オレンジ線: 目標量）")
-            else:
-                st.info("まだ水分補給の記録が少ないため、トレンドは表示できません。数日間記録を続けると表示されます。")
+            st.info("まだ水分補給の記録が少ないため、トレンドは表示できません。数日間記録を続けると表示されます。")
 
 
     # 4. 環境と活動量 (旧環境と活動)
@@ -380,25 +992,20 @@ def main_app():
         st.markdown("現在の気象情報と活動量から、水分補給の必要性を判断しましょう。")
 
         city_name_disabled = not OPENWEATHER_API_KEY or OPENWEATHER_API_KEY == "YOUR_OPENWEATHER_API_KEY"
-        st.session_state.city_name = st.text_input(
+        city_name = st.text_input(
             "現在の都市名を入力してください (例: Tokyo)", 
             value=st.session_state.city_name, 
             disabled=city_name_disabled
         )
-        if st.button("天気情報を取得", disabled=city_name_disabled):
+        if city_name != st.session_state.city_name:
+            st.session_state.city_name = city_name
+            save_user_profile(store, st.session_state.user_id)
+        if st.button("天気情報を取得", disabled=city_name_disabled, key="fetch_weather_button"):
             if not OPENWEATHER_API_KEY or OPENWEATHER_API_KEY == "YOUR_OPENWEATHER_API_KEY":
                 st.error("OpenWeatherMap APIキーが設定されていません。コード内の 'OPENWEATHER_API_KEY' を置き換えてください。")
             else:
                 try:
-                    params = {
-                        'q': st.session_state.city_name,
-                        'appid': OPENWEATHER_API_KEY,
-                        'units': 'metric', 
-                        'lang': 'ja'
-                    }
-                    response = requests.get(OPENWEATHER_URL, params=params)
-                    response.raise_for_status() 
-                    weather_data = response.json()
+                    weather_data = get_weather_client().current_weather(st.session_state.city_name)
 
                     main_data = weather_data.get('main', {})
                     temp = main_data.get('temp')
@@ -428,11 +1035,29 @@ def main_app():
                         st.warning("気温または湿度の情報が取得できませんでした。")
 
                 except requests.exceptions.RequestException as e:
-                    st.error(f"天気情報の取得に失敗しました: {e}")
+                    st.error(f"天気情報の取得に失敗しました ({describe_weather_error(e)})")
                 except KeyError:
                     st.error("天気データの形式が不正です。")
                 except Exception as e:
                     st.error(f"予期せぬエラーが発生しました: {e}")
+
+        st.markdown("---")
+        st.subheader("🗺️ 複数都市の比較")
+        st.write("移動先の都市の現在の暑さ指数と、24時間以内の最高値を比べましょう。")
+        compare_cities_text = st.text_input(
+            "比較する都市 (カンマ区切り)",
+            value=", ".join(dict.fromkeys([st.session_state.city_name] + PREFETCH_CITIES)),
+            disabled=city_name_disabled,
+            key="compare_cities_input"
+        )
+        if st.button("都市を比較", disabled=city_name_disabled, key="compare_cities_button"):
+            city_names = list(dict.fromkeys(city.strip() for city in compare_cities_text.split(",") if city.strip()))
+            if city_names:
+                with st.spinner("天気情報を取得中..."):
+                    comparison_df = compare_cities(get_weather_client(), city_names)
+                st.dataframe(comparison_df, use_container_width=True, hide_index=True)
+            else:
+                st.warning("比較する都市を入力してください。")
         
         st.markdown("---")
         st.header("🏃 アクティビティ")
@@ -440,6 +1065,7 @@ def main_app():
 
         activity_type = st.selectbox("活動の種類", ["選択してください", "ウォーキング", "ランニング", "サイクリング"], key="activity_type_selector")
         duration_minutes = st.number_input("活動時間 (分)", min_value=0, value=0, key="duration_minutes_input")
+        activity_start_time = st.time_input("活動の開始時刻 (予定)", value=datetime.time(18, 0), step=900, key="activity_start_time_input")
 
         submitted_activity = st.button("活動量を更新", key="submit_activity_button")
 
@@ -451,6 +1077,8 @@ def main_app():
                 st.success("活動量を更新しました！")
             else:
                 st.warning("活動の種類と時間を入力してください。")
+        render_activity_track_import(activity_type, city_name_disabled)
+        additional_water_needed_ml += activity_track_water_loss_today()
 
         if st.session_state.daily_target_ml > 0:
             total_recommended_today = st.session_state.daily_target_ml + additional_water_needed_ml
@@ -460,11 +1088,41 @@ def main_app():
         else:
             st.warning("推奨水分摂取量を計算するには、まず「マイ設定」ページで年齢と体重を入力してください。")
 
+        st.markdown("---")
+        st.subheader("⏱️ 時間ごとの水分補給プラン")
+        st.write(f"{st.session_state.city_name} の予報の暑さ指数と、あなたの推奨量・予定している活動から、これから24時間の飲む量の目安を出します。")
+        if city_name_disabled:
+            st.info("OpenWeatherMap APIキーが設定されていないため、プランを作成できません。")
+        elif not st.session_state.city_name.strip():
+            st.info("都市名を入力すると、プランを作成できます。")
+        else:
+            # 予報はボタンを押したときだけ取得する。他のセッションや先読みで今の時の表が既にあれば、押さなくてもそれを使う
+            city_table = get_hourly_plan_engine().cached_table(st.session_state.city_name)
+            if st.button("プランを作成", key="hourly_plan_button"):
+                try:
+                    city_table = get_hourly_plan_engine().table(st.session_state.city_name)
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    st.error(f"予報の取得に失敗しました ({describe_weather_error(e)})")
+            if city_table is None:
+                st.caption("「プランを作成」を押すと、予報を取得してプランを表示します。")
+            else:
+                planned_activities = []
+                if activity_type != "選択してください" and duration_minutes > 0:
+                    # 入力した時刻が現在の時より前なら翌日の予定として扱う
+                    activity_start = datetime.datetime.combine(city_table.local_now().date(), activity_start_time)
+                    if activity_start < city_table.hours[0].astype(datetime.datetime):
+                        activity_start += datetime.timedelta(days=1)
+                    planned_activities.append(PlannedActivity(activity_start, activity_type, duration_minutes))
+                plan_df = plan_hourly_frame(city_table, st.session_state.daily_target_ml, planned_activities)
+                st.metric(label="24時間の推奨量 (暑さ・活動を考慮)", value=f"{plan_df['推奨量 (ml)'].sum() / 1000:.2f} リットル")
+                st.dataframe(plan_df, use_container_width=True, hide_index=True)
+
 
     # 5. AIヘルスケア (旧AIアシスタント)
     elif page == "AIヘルスケア":
         st.header("✨ AIヘルスケア")
         st.markdown("AIを活用して、よりパーソナルな水分補給サポートを受けましょう！")
+        stream_answers = st.toggle("AIの回答を生成されたそばから表示する", value=True, key="gemini_stream_toggle")
 
         st.markdown("---")
 
@@ -482,14 +1140,14 @@ def main_app():
                 if st.session_state.user_profile['age'] is None or st.session_state.user_profile['weight_kg'] is None:
                     st.warning("より的確なアドバイスのため、**マイ設定**ページで年齢と体重を入力してください。")
                     temp_user_profile = {'age': 25, 'weight_kg': 60} 
-                    advice = get_health_advice_from_gemini(mood_input_text, temp_user_profile)
+                    advice = get_health_advice_from_gemini(mood_input_text, temp_user_profile, stream_answers)
                 else:
-                    advice = get_health_advice_from_gemini(mood_input_text, st.session_state.user_profile)
+                    advice = get_health_advice_from_gemini(mood_input_text, st.session_state.user_profile, stream_answers)
                 
                 if GEMINI_API_KEY == "YOUR_GEMINI_API_KEY":
                     st.error("Gemini APIキーが設定されていません。コード内の 'GEMINI_API_KEY' を置き換えてください。")
                 else:
-                    st.info(f"**AIからのアドバイス:** {advice}")
+                    render_gemini_answer("AIからのアドバイス", advice, "Gemini AIがアドバイスを生成中...")
             else:
                 st.warning("気分や体調を入力してください。")
         elif mood_text_disabled:
@@ -503,21 +1161,24 @@ def main_app():
 
         insight_disabled = mood_text_disabled 
         if st.button("インサイトを得る", key="get_insight_button", disabled=insight_disabled):
+            log_features_text = get_log_features_text(
+                st.session_state.user_id, store.revision(st.session_state.user_id), st.session_state.daily_target_ml, datetime.date.today()
+            )
             if st.session_state.user_profile['age'] is None or st.session_state.user_profile['weight_kg'] is None:
                 st.warning("より的確な分析のため、**マイ設定**ページで年齢と体重を入力してください。")
                 temp_user_profile = {'age': 25, 'weight_kg': 60} 
                 insight = get_water_intake_insight_from_gemini(
-                    st.session_state.water_log, temp_user_profile, st.session_state.daily_target_ml
+                    log_features_text, temp_user_profile, st.session_state.daily_target_ml, stream_answers
                 )
             else:
                 insight = get_water_intake_insight_from_gemini(
-                    st.session_state.water_log, st.session_state.user_profile, st.session_state.daily_target_ml
+                    log_features_text, st.session_state.user_profile, st.session_state.daily_target_ml, stream_answers
                 )
             
             if GEMINI_API_KEY == "YOUR_GEMINI_API_KEY":
                 st.error("Gemini APIキーが設定されていません。コード内の 'GEMINI_API_KEY' を置き換えてください。")
             else:
-                st.info(f"**AIからの分析:** {insight}")
+                render_gemini_answer("AIからの分析", insight, "Gemini AIが水分補給習慣を分析中...")
         elif insight_disabled:
             st.error("Gemini APIキーが設定されていません。コード内の 'GEMINI_API_KEY' を置き換えてください。")
 
@@ -546,6 +1207,7 @@ def main_app():
                     st.session_state.user_profile['gender'], 
                     st.session_state.user_profile['weight_kg']
                 )
+                save_user_profile(store, st.session_state.user_id)
         
         st.markdown("---")
         # リマインダー間隔設定をここに移動
@@ -561,15 +1223,51 @@ def main_app():
                 key="reminder_slider_settings"
             )
             st.write(f"現在の設定: **{st.session_state.reminder_interval_minutes}分** ごとに水分補給を推奨します。")
+            st.session_state.reminder_refresh_mode = st.radio(
+                "カウントダウンの更新方式",
+                list(REMINDER_REFRESH_MODES.keys()),
+                index=list(REMINDER_REFRESH_MODES.keys()).index(st.session_state.reminder_refresh_mode),
+                format_func=lambda mode: REMINDER_REFRESH_MODES[mode],
+                key="reminder_refresh_mode_radio"
+            )
+            st.session_state.reminder_refresh_seconds = st.slider(
+                "リマインダー部分の更新間隔 (秒)",
+                min_value=1,
+                max_value=60,
+                value=st.session_state.reminder_refresh_seconds,
+                format="%d秒ごと",
+                key="reminder_refresh_seconds_slider",
+                help="「リマインダー部分のみ定期更新」を選んだ場合に使われます。"
+            )
             submitted_reminder_settings = st.form_submit_button("リマインダー設定を更新")
             if submitted_reminder_settings:
+                schedule_reminder()
                 st.success("リマインダー設定を更新しました！")
 
+    # 7. 運用者向け分析 (HYDROCARE_ADMIN_TOKEN の合言葉を入れたセッションだけ)
+    elif page == "運用者向け分析" and is_operator():
+        render_cohort_analytics()
+
+    today_total_placeholder.write(f"**本日の摂取量**: {intake_totals.total_ml / 1000:.1f} L")
+    METRICS.observe("hydrocare_page_render_seconds", time.perf_counter() - page_started, page=page)
 
     st.markdown("---")
     st.caption("© 2023 HydroCare. 熱中症予防をサポートします。")
 
 
+# --- ウォームアップ (プロセスごとに1回、最初の訪問者の待ち時間をなくしたい場合に使う) ---
+@st.cache_resource
+def warm_up():
+    load_now(pd, alt, genai)
+    get_gemini_model()
+    get_walkthrough_images().warm(step["image"] for step in walkthrough_steps)
+    return True
+
+# --- ウォークスルー画像 (縮小・再圧縮した版を全セッションで共有) ---
+@st.cache_resource
+def get_walkthrough_images():
+    return ImageVariantCache()
+
 # --- ウォークスルーロジック ---
 # セッションステートでウォークスルーの完了状態とステップを管理
 if 'walkthrough_completed' not in st.session_state:
@@ -596,6 +1294,9 @@ walkthrough_steps = [
     }
 ]
 
+if WARMUP_ENABLED:
+    warm_up()
+
 # アプリの開始点
 if not st.session_state.walkthrough_completed:
     # ウォークスルー画面の描画
@@ -607,8 +1308,11 @@ if not st.session_state.walkthrough_completed:
 
         current_step_data = walkthrough_steps[st.session_state.walkthrough_step]
 
-        # use_column_width を use_container_width に修正
-        st.image(current_step_data["image"], use_container_width=True) 
+        # 元の画像ではなく、画面幅に合わせて縮小・再圧縮した版を表示する
+        walkthrough_image = get_walkthrough_images().get(
+            current_step_data["image"], target_width_for(st.context.headers.get("User-Agent"))
+        )
+        st.image(walkthrough_image, use_container_width=True) 
         st.markdown(f"## {current_step_data['title']}")
         st.markdown(f"#### {current_step_data['text']}")
         
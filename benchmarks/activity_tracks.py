@@ -0,0 +1,109 @@
+# --- 活動の記録ファイル (GPX / TCX) の読み込みと区間ごとの水分の損失の計算にかかる時間・メモリを計測 ---
+# 使い方: python -m benchmarks.activity_tracks [--points 100000 500000] [--formats gpx tcx] [--repeat 3]
+#
+# 1秒ごとに points 点を記録した合成のランニングの記録ファイルについて
+# - etree: 以前の書き方の目安として、xml.etree.ElementTree でファイル全体の木を作り、点を1つずつ読む
+# - streaming: hydrocare.activity_tracks で少しずつ読みながら、5分ごとの区間の水分の損失まで求める
+# の時間 (repeat 回の最小)・1秒あたりの点の数と、tracemalloc で測った読み込み中の最大メモリ使用量を比べる。
+import argparse
+import datetime
+import math
+import os
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from hydrocare.activity_tracks import load_activity_track
+
+START = datetime.datetime(2026, 7, 1, 6, 0, 0)
+
+
+def write_gpx(path, points):
+    with open(path, "w") as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n<gpx version="1.1" creator="bench" xmlns="http://www.topografix.com/GPX/1/1"'
+            ' xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1">\n'
+            '<metadata><time>2026-07-01T06:00:00Z</time></metadata>\n<trk><type>running</type><trkseg>\n'
+        )
+        for i in range(points):
+            lat, lon, ele, hr = track_point(i)
+            f.write(
+                f'<trkpt lat="{lat:.7f}" lon="{lon:.7f}"><ele>{ele:.1f}</ele><time>{START + datetime.timedelta(seconds=i):%Y-%m-%dT%H:%M:%S}Z</time>'
+                f'<extensions><gpxtpx:TrackPointExtension><gpxtpx:hr>{hr}</gpxtpx:hr></gpxtpx:TrackPointExtension></extensions></trkpt>\n'
+            )
+        f.write("</trkseg></trk></gpx>\n")
+
+
+def write_tcx(path, points):
+    with open(path, "w") as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">\n'
+            '<Activities><Activity Sport="Running"><Id>2026-07-01T06:00:00Z</Id><Lap StartTime="2026-07-01T06:00:00Z"><Track>\n'
+        )
+        for i in range(points):
+            lat, lon, ele, hr = track_point(i)
+            f.write(
+                f'<Trackpoint><Time>{START + datetime.timedelta(seconds=i):%Y-%m-%dT%H:%M:%S}Z</Time>'
+                f'<Position><LatitudeDegrees>{lat:.7f}</LatitudeDegrees><LongitudeDegrees>{lon:.7f}</LongitudeDegrees></Position>'
+                f'<AltitudeMeters>{ele:.1f}</AltitudeMeters><DistanceMeters>{i * 2.8:.1f}</DistanceMeters>'
+                f'<HeartRateBpm><Value>{hr}</Value></HeartRateBpm></Trackpoint>\n'
+            )
+        f.write("</Track></Lap></Activity></Activities></TrainingCenterDatabase>\n")
+
+
+# 約 10 km/h で北へ進み、ゆるい上り下りと心拍の変化がある点
+def track_point(i):
+    return 35.0 + i * 2.5e-5, 139.0 + 0.001 * math.sin(i / 500), 20 + 10 * math.sin(i / 900), 140 + i % 25
+
+
+def etree_points(path):
+    points = []
+    for elem in ET.parse(path).getroot().iter():
+        if elem.tag.rpartition("}")[2] in ("trkpt", "Trackpoint"):
+            points.append({child.tag.rpartition("}")[2]: child.text for child in elem.iter()})
+    return len(points)
+
+
+# 500,000点 (約139時間) の記録は最初の48時間より後の点を読み飛ばすため、読んだ点の数には読み飛ばした点も含める
+def streaming_points(path, fmt):
+    track = load_activity_track(path, fmt)
+    return track.points + track.skipped_points
+
+
+def measure(load, repeat):
+    best = math.inf
+    for _ in range(repeat):
+        started = time.perf_counter()
+        points = load()
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    load()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return points, best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="活動の記録ファイルの読み込みの時間とメモリを計測します。")
+    parser.add_argument("--points", type=int, nargs="+", default=[100_000, 500_000], help="記録の点の数 (複数指定で順に計測)")
+    parser.add_argument("--formats", nargs="+", default=["gpx", "tcx"], choices=["gpx", "tcx"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="hydrocare-tracks-")
+    print(f"{'format':<7}{'points':>10}{'file MB':>9}  {'reader':<10}{'seconds':>9}{'points/s':>12}{'peak MB':>9}")
+    for fmt in args.formats:
+        for points in args.points:
+            path = os.path.join(directory, f"track-{points}.{fmt}")
+            (write_gpx if fmt == "gpx" else write_tcx)(path, points)
+            size_mb = os.path.getsize(path) / 1e6
+            for label, load in (("etree", lambda: etree_points(path)), ("streaming", lambda: streaming_points(path, fmt))):
+                read, seconds, peak = measure(load, args.repeat)
+                print(f"{fmt:<7}{read:>10,}{size_mb:>9.1f}  {label:<10}{seconds:>9.2f}{read / seconds:>12,.0f}{peak / 1e6:>9.1f}")
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
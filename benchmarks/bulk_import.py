@@ -0,0 +1,114 @@
+# --- 水分補給記録のまとめて取り込み・書き出しの速度とメモリ使用量を計測 ---
+# 使い方: python -m benchmarks.bulk_import [--rows 1000000] [--formats csv jsonl parquet] [--chunksize 100000]
+#
+# 形式ごとに rows 行のファイルを作り、hydrocare.bulk_io で新しいデータベースへ取り込んでから同じ形式で書き出す。
+# 取り込み・書き出しはそれぞれ別の Python プロセスで実行し、1秒あたりの行数とプロセスの最大RSSを表示する。
+# 行数を変えても最大RSSがほぼ変わらないこと (ファイル全体をメモリに載せていないこと) を確認する。
+import argparse
+import datetime
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from hydrocare.bulk_io import FORMATS, export_log, import_log, rows_per_second
+from hydrocare.storage import WaterLogStore
+
+BENCH_USER_ID = "bench-import"
+DRINKS = ["water", "tea", "coffee", "水", "お茶", "スポーツドリンク", "juice"]
+
+
+# 1日あたり約10回の記録を、数年前から現在まで並べたファイルを chunksize 行ずつ書く
+def write_synthetic_file(path, fmt, rows, chunksize):
+    rng = np.random.default_rng(rows)
+    end = np.datetime64(datetime.datetime.now().replace(microsecond=0), "s")
+    writer = None
+    with open(path, "wb") as destination:
+        for offset in range(0, rows, chunksize):
+            size = min(chunksize, rows - offset)
+            seconds_before_end = (rows - offset - np.arange(size)) * 8640 + rng.integers(0, 600, size)
+            frame = pd.DataFrame({
+                'time': (end - seconds_before_end.astype("timedelta64[s]")).astype(str),
+                'amount_ml': rng.choice([150, 200, 250, 350, 500], size),
+                'type': rng.choice(DRINKS, size),
+            })
+            if fmt == "csv":
+                destination.write(frame.to_csv(header=offset == 0, index=False).encode("utf-8"))
+            elif fmt == "jsonl":
+                destination.write(frame.to_json(orient="records", lines=True, force_ascii=False).encode("utf-8") + b"\n")
+            else:
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                writer = writer or pq.ParquetWriter(destination, table.schema)
+                writer.write_table(table)
+        if writer is not None:
+            writer.close()
+
+
+# 子プロセス側: 取り込みまたは書き出しを1回実行して結果を JSON で標準出力に書く
+def run_child(action, fmt, path, db_path, chunksize):
+    store = WaterLogStore(db_path)
+    if action == "import":
+        report = import_log(store, BENCH_USER_ID, path, fmt, chunksize)
+        result = {'rows': report.rows, 'seconds': report.seconds, 'rows_per_second': rows_per_second(report), 'rejected': report.rejected}
+    else:
+        with open(path, "wb") as destination:
+            rows, seconds = export_log(store, BENCH_USER_ID, destination, fmt, chunksize)
+        result = {'rows': rows, 'seconds': seconds, 'rows_per_second': rows / max(seconds, 1e-9)}
+    result['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps(result))
+
+
+def run_action(action, fmt, path, db_path, chunksize):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bulk_import", "--child", action, "--format", fmt,
+         "--path", path, "--db", db_path, "--chunksize", str(chunksize)],
+        cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."),
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="まとめて取り込み・書き出しの速度とメモリ使用量を計測します。")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--formats", nargs="+", default=FORMATS, choices=FORMATS)
+    parser.add_argument("--chunksize", type=int, default=100_000)
+    parser.add_argument("--child", choices=["import", "export"], help=argparse.SUPPRESS)
+    parser.add_argument("--format", choices=FORMATS, help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.format, args.path, args.db, args.chunksize)
+        return
+
+    tmp_dir = tempfile.mkdtemp(prefix="hydrocare-bulk-")
+    print(f"{args.rows:,} rows, chunksize {args.chunksize:,}")
+    print(f"{'format':<9}{'action':<8}{'file MB':>9}{'seconds':>9}{'rows/s':>11}{'max RSS MB':>12}")
+    for fmt in args.formats:
+        source = os.path.join(tmp_dir, f"source.{fmt}")
+        started = time.perf_counter()
+        write_synthetic_file(source, fmt, args.rows, args.chunksize)
+        print(f"{fmt:<9}{'(write)':<8}{os.path.getsize(source) / 1e6:>9.1f}{time.perf_counter() - started:>9.2f}")
+
+        db_path = os.path.join(tmp_dir, f"{fmt}.db")
+        exported = os.path.join(tmp_dir, f"exported.{fmt}")
+        for action, path in (("import", source), ("export", exported)):
+            result = run_action(action, fmt, path, db_path, args.chunksize)
+            print(
+                f"{fmt:<9}{action:<8}{os.path.getsize(path) / 1e6:>9.1f}{result['seconds']:>9.2f}"
+                f"{result['rows_per_second']:>11,.0f}{result['max_rss_mb']:>12.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# --- 摂取ログのグラフ仕様の大きさと作成時間を計測 ---
+# 使い方: python -m benchmarks.chart_spec [--days 7 30 90 365 1825]
+#
+# 期間ごとの日別サマリーから、
+# - 従来の方式 (サマリー全体を埋め込み、ブラウザ側で transform_fold する Altair のグラフ)
+# - 縦持ち・間引き済みの方式 (hydrocare.charts.build_intake_chart_spec)
+# の Vega-Lite 仕様を作り、JSON の大きさ・ブラウザで描く点数・作成時間 (中央値) を比べる。
+import argparse
+import datetime
+import json
+import random
+import statistics
+import time
+
+import altair as alt
+import pandas as pd
+
+from hydrocare.charts import MAX_CHART_POINTS, build_intake_chart_spec
+
+TARGET_ML = 2100
+
+
+def synthetic_summary(days):
+    rng = random.Random(days)
+    today = datetime.date.today()
+    return pd.DataFrame({
+        'Date': pd.to_datetime([today - datetime.timedelta(days=days - 1 - offset) for offset in range(days)]),
+        'Total_ML': [rng.randint(800, 3200) for _ in range(days)],
+        'Target_ML': [TARGET_ML] * days,
+    })
+
+
+def legacy_chart_spec(summary, title, y_max):
+    chart = alt.Chart(summary).mark_line().encode(
+        x=alt.X('Date:T', title='日付'),
+        y=alt.Y('value:Q', title='摂取量/目標量 (ml)', scale=alt.Scale(domain=[0, y_max])),
+        color=alt.Color('variable:N', title='項目', legend=alt.Legend(title="項目"))
+    ).transform_fold(
+        ['Total_ML', 'Target_ML'],
+        as_=['variable', 'value']
+    ).properties(
+        title=title
+    )
+    return chart.to_dict()
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="摂取ログのグラフ仕様の大きさと作成時間を計測します。")
+    parser.add_argument("--days", type=int, nargs="+", default=[7, 30, 90, 365, 1825])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"max points per line: {MAX_CHART_POINTS}")
+    print(f"{'days':>6}  {'method':<10}{'spec KB':>9}{'points':>8}{'build ms':>10}")
+    for days in args.days:
+        summary = synthetic_summary(days)
+        title = f"過去{days}日間の水分摂取量の推移"
+        y_max = max(summary['Total_ML'].max() * 1.1, TARGET_ML * 1.5)
+
+        legacy, legacy_ms = timed(lambda: legacy_chart_spec(summary, title, y_max), args.repeat)
+        folded, folded_ms = timed(lambda: build_intake_chart_spec(summary, title, y_max), args.repeat)
+        for name, spec, elapsed_ms, points in (
+            ("legacy", legacy, legacy_ms, 2 * len(summary)),
+            ("folded", folded, folded_ms, sum(len(rows) for rows in folded['datasets'].values())),
+        ):
+            size = len(json.dumps(spec, ensure_ascii=False, default=str).encode("utf-8"))
+            print(f"{days:>6}  {name:<10}{size / 1024:>9.1f}{points:>8}{elapsed_ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
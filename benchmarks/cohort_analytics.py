@@ -0,0 +1,207 @@
+# --- 全ユーザーの集計 (hydrocare.cohort_analytics) の作成・問い合わせ・差分の反映の時間を計測 ---
+# 使い方: python -m benchmarks.cohort_analytics [--entries 10000000] [--users 5000] [--days 365] [--changes 100000] [--path data/cohort_bench.db]
+#
+# users 人・days 日分、合計 entries 件の記録とプロフィール (年齢・都市・目標量) を合成してデータベースに直接書き込み、
+# - 最初の集計 (記録全体から集計テーブルを作る) の時間
+# - 分析の画面の問い合わせ (日ごとの推移・都市別・年代別・暑さ指数・時間帯別・飲み物別) の時間を、
+#   集計テーブルから読む場合と、記録のテーブルから毎回集計する場合とで比べる
+# - changes 件の追加・修正・削除を記録のストレージ経由で行った後、差分を反映する時間
+# を表示する。最後に集計テーブルと記録のテーブルの合計が一致することを確かめる。
+import argparse
+import datetime
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from hydrocare.cohort_analytics import CohortRollups
+from hydrocare.hydration import calculate_base_water_intake_array
+from hydrocare.storage import MICROSECONDS_PER_DAY, MICROSECONDS_PER_HOUR, UPSERT_PROFILE, WaterLogStore, to_timestamp
+
+CITIES = ["Tokyo", "Osaka", "Nagoya", "Sapporo", "Fukuoka", "Sendai", "Hiroshima", "Naha", "Kyoto", "Yokohama"]
+DRINKS = ["水", "お茶", "スポーツドリンク", "ジュース", "コーヒー"]
+AMOUNTS = [100, 150, 200, 250, 300, 350, 500]
+GENDERS = ["男性", "女性", "その他"]
+# 時間帯ごとの記録のされやすさ (0〜23時。日中に多く、深夜は少ない)
+HOUR_WEIGHTS = np.array([1, 1, 1, 1, 1, 2, 5, 8, 9, 8, 7, 8, 10, 8, 7, 7, 8, 8, 9, 8, 7, 5, 3, 2], dtype=np.float64)
+USERS_PER_CHUNK = 100
+QUERY_REPEATS = 20
+
+# 記録のテーブルから毎回集計する場合の、都市・年代別の達成率 (分析の画面で一番重い表と同じもの)
+NAIVE_BY_CITY = f"""
+SELECT p.city_name, COUNT(*), SUM(p.daily_target_ml > 0 AND d.total_ml >= p.daily_target_ml), SUM(d.total_ml)
+FROM (
+    SELECT user_id, ts / {MICROSECONDS_PER_DAY} AS day, SUM(amount_ml) AS total_ml FROM water_log
+    WHERE ts >= ? AND ts < ? GROUP BY user_id, day
+) AS d LEFT JOIN user_profiles AS p ON p.user_id = d.user_id
+GROUP BY p.city_name
+"""
+NAIVE_BY_HOUR = f"""
+SELECT (ts / {MICROSECONDS_PER_HOUR}) % 24 AS hour, SUM(amount_ml), COUNT(*) FROM water_log WHERE ts >= ? AND ts < ? GROUP BY hour
+"""
+
+
+def user_id_for(index):
+    return f"user-{index:06d}"
+
+
+# プロフィールと記録を合成して書き込む (ユーザーごとに時刻順に並べ、インデックスへの追加が末尾への追加になるようにする)
+def generate(path, entries, users, days, seed=0):
+    rng = np.random.default_rng(seed)
+    # 記録のストレージで一度開いてテーブルを作ってから、直接書き込む
+    WaterLogStore(path, compact_min_events=None).close()
+    ages = rng.integers(15, 81, size=users)
+    genders = rng.choice(GENDERS, size=users, p=[0.48, 0.48, 0.04])
+    weights = np.round(rng.normal(62, 11, size=users).clip(35, 130), 1)
+    targets = calculate_base_water_intake_array(ages, genders, weights).round().astype(int)
+    cities = rng.choice(CITIES, size=users, p=np.linspace(2, 0.5, len(CITIES)) / np.linspace(2, 0.5, len(CITIES)).sum())
+    # 1割ほどはプロフィールを設定していない
+    has_profile = rng.random(users) >= 0.1
+    now = to_timestamp(datetime.datetime.now())
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("BEGIN")
+    conn.executemany(UPSERT_PROFILE, [
+        (user_id_for(index), int(ages[index]), genders[index], float(weights[index]), int(targets[index]), cities[index], now)
+        for index in np.flatnonzero(has_profile)
+    ])
+    conn.execute("COMMIT")
+
+    # よく使う人ほど記録が多い
+    activity = rng.lognormal(0, 0.6, size=users)
+    per_user = rng.multinomial(entries, activity / activity.sum())
+    first_day = to_timestamp(datetime.date.today() - datetime.timedelta(days=days - 1)) // MICROSECONDS_PER_DAY
+    hour_p = HOUR_WEIGHTS / HOUR_WEIGHTS.sum()
+    next_id = 1
+    for chunk_start in range(0, users, USERS_PER_CHUNK):
+        counts = per_user[chunk_start:chunk_start + USERS_PER_CHUNK]
+        n = int(counts.sum())
+        user_index = np.repeat(np.arange(chunk_start, chunk_start + len(counts)), counts)
+        ts = (
+            (first_day + rng.integers(0, days, size=n)) * MICROSECONDS_PER_DAY
+            + rng.choice(24, size=n, p=hour_p) * MICROSECONDS_PER_HOUR
+            + rng.integers(0, MICROSECONDS_PER_HOUR // 1_000_000, size=n) * 1_000_000
+        )
+        order = np.lexsort((ts, user_index))
+        amounts = rng.choice(AMOUNTS, size=n)
+        drinks = rng.choice(len(DRINKS), size=n, p=[0.4, 0.25, 0.1, 0.05, 0.2])
+        ids = range(next_id, next_id + n)
+        next_id += n
+        conn.execute("BEGIN")
+        conn.executemany("INSERT INTO water_log (id, user_id, ts, amount_ml, drink_type) VALUES (?, ?, ?, ?, ?)", zip(
+            ids, (user_id_for(index) for index in user_index[order].tolist()), ts[order].tolist(),
+            amounts[order].tolist(), (DRINKS[code] for code in drinks[order].tolist()),
+        ))
+        conn.execute("COMMIT")
+    # 記録のストレージ経由で追加した記録の ID が合成した記録の続きになるように、イベントの番号を進めておく
+    conn.execute("DELETE FROM sqlite_sequence WHERE name = 'water_log_events'")
+    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('water_log_events', ?)", (next_id - 1,))
+    conn.close()
+    return next_id - 1
+
+
+def dashboard_queries(rollups, start, end):
+    return [
+        rollups.daily_trend(start, end), rollups.by_group("city", start, end), rollups.by_group("age_band", start, end),
+        rollups.wbgt_exposure(start, end), rollups.by_hour(start, end), rollups.by_drink_type(start, end),
+    ]
+
+
+def median_ms(func, repeats):
+    seconds = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - started)
+    return statistics.median(seconds) * 1000
+
+
+# 記録のストレージ経由で changes 件の変更 (7割が追加、残りを修正と削除で半分ずつ) を行う
+def make_changes(store, changes, users, seed=1):
+    rng = np.random.default_rng(seed)
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    appended = 0
+    for user_index in rng.integers(0, users, size=int(changes * 0.7) // 10):
+        store.append_many(user_id_for(int(user_index)), [
+            {
+                'time': today + datetime.timedelta(minutes=int(minute)),
+                'amount_ml': int(rng.choice(AMOUNTS)), 'type': DRINKS[int(rng.integers(len(DRINKS)))],
+            }
+            for minute in rng.integers(6 * 60, 23 * 60, size=10)
+        ])
+        appended += 10
+    edited = deleted = 0
+    start, end = today - datetime.timedelta(days=30), today + datetime.timedelta(days=1)
+    while edited + deleted < changes - appended:
+        user_id = user_id_for(int(rng.integers(users)))
+        rows = store.rows_page(user_id, start, end, 0, 20, with_ids=True)
+        if not rows:
+            continue
+        entry_id = rows[int(rng.integers(len(rows)))][0]
+        if rng.random() < 0.5:
+            store.edit_entry(user_id, entry_id, amount_ml=int(rng.choice(AMOUNTS)))
+            edited += 1
+        else:
+            store.delete_entry(user_id, entry_id)
+            deleted += 1
+    return appended, edited, deleted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全ユーザーの集計の作成・問い合わせ・差分の反映の時間を計測します。")
+    parser.add_argument("--entries", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=5_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--changes", type=int, default=100_000, help="集計の後に行う追加・修正・削除の数")
+    parser.add_argument("--path", help="合成したデータベースの置き場所 (既にあれば合成せずに使う)")
+    args = parser.parse_args()
+
+    path = args.path or os.path.join(tempfile.mkdtemp(prefix="hydrocare-cohorts-"), "cohorts.db")
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        generate(path, args.entries, args.users, args.days)
+        print(f"generated {args.entries:,} entries for {args.users:,} users in {time.perf_counter() - started:.1f} s "
+              f"({os.path.getsize(path) / 1e6:,.0f} MB)")
+
+    rollups = CohortRollups(path)
+    started = time.perf_counter()
+    built = rollups.build()
+    print(f"initial build: {built:,} entries in {time.perf_counter() - started:.1f} s")
+    today = datetime.date.today()
+    for city in CITIES:
+        for offset in range(0, args.days, 3):
+            rollups.record_wbgt(city, today - datetime.timedelta(days=offset), 20 + (offset * 7 + len(city)) % 14)
+
+    conn = sqlite3.connect(path)
+    print(f"{'query':<26}{'window':>8}{'rollups ms':>12}{'raw ms':>10}")
+    for days in (7, 30, 365):
+        end = today + datetime.timedelta(days=1)
+        start = end - datetime.timedelta(days=days)
+        bounds = (to_timestamp(start), to_timestamp(end))
+        rollup_ms = median_ms(lambda: dashboard_queries(rollups, start, end), QUERY_REPEATS)
+        # 記録のテーブルから集計する場合は遅いので、1回だけ測る (都市別と時間帯別の2つだけ)
+        raw_ms = median_ms(lambda: (conn.execute(NAIVE_BY_CITY, bounds).fetchall(), conn.execute(NAIVE_BY_HOUR, bounds).fetchall()), 1)
+        print(f"{'dashboard (6 queries)':<26}{days:>7}d{rollup_ms:>12.2f}{raw_ms:>10.0f}")
+
+    store = WaterLogStore(path)
+    started = time.perf_counter()
+    appended, edited, deleted = make_changes(store, args.changes, args.users)
+    print(f"changes: {appended:,} appended, {edited:,} edited, {deleted:,} deleted in {time.perf_counter() - started:.1f} s")
+    pending = rollups.status()['pending_events']
+    started = time.perf_counter()
+    applied = rollups.refresh_all()
+    seconds = time.perf_counter() - started
+    print(f"incremental refresh: {applied:,} of {pending:,} pending events in {seconds:.2f} s ({applied / seconds:,.0f} events/s)")
+
+    raw = conn.execute(f"SELECT SUM(amount_ml), COUNT(*), COUNT(DISTINCT user_id || ':' || (ts / {MICROSECONDS_PER_DAY})) FROM water_log").fetchone()
+    rolled = conn.execute("SELECT SUM(total_ml), SUM(entry_count), SUM(users) FROM cohort_daily").fetchone()
+    print(f"rollups match raw table: {raw == rolled} (ml, entries, user-days = {rolled})")
+    conn.close()
+    store.close()
+    rollups.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# --- 多人数分の水分補給計画の計算時間を計測 ---
+# 使い方: python -m benchmarks.cohort_plan [--rows 1000000]
+#
+# 合成した名簿に対して、
+# - 単体版の関数を1人ずつ呼ぶ方式 (--scalar-rows 人分を測って換算)
+# - 配列版の plan_hydration を1回呼ぶ方式
+# - CSV を --chunksize 行ずつ読み書きする cohort_plan コマンドと同じ処理
+# の時間を測る。
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from hydrocare.cohort_plan import plan_csv, plan_hydration
+from hydrocare.hydration import calculate_activity_water_loss, calculate_base_water_intake, calculate_wbgt
+
+
+def synthetic_roster(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "id": np.arange(rows),
+        "age": rng.integers(10, 80, rows),
+        "gender": rng.choice(["男性", "女性", "その他"], rows),
+        "weight_kg": np.round(rng.uniform(30, 100, rows), 1),
+        "temp_c": np.round(rng.uniform(20, 38, rows), 1),
+        "humidity": rng.integers(30, 90, rows),
+        "activity": rng.choice(["ウォーキング", "ランニング", "サイクリング", "running", "none"], rows),
+        "duration_min": rng.integers(0, 180, rows),
+    })
+
+
+def scalar_plan(roster):
+    return [
+        (
+            calculate_wbgt(row.temp_c, row.humidity),
+            calculate_base_water_intake(row.age, row.gender, row.weight_kg)
+            + calculate_activity_water_loss(row.activity, row.duration_min),
+        )
+        for row in roster.itertuples(index=False)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="水分補給計画の一括計算の時間を計測します。")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--scalar-rows", type=int, default=100_000)
+    parser.add_argument("--chunksize", type=int, default=100_000)
+    args = parser.parse_args()
+
+    roster = synthetic_roster(args.rows)
+    print(f"rows: {args.rows:,}")
+
+    sample = roster.head(args.scalar_rows)
+    started = time.perf_counter()
+    scalar_plan(sample)
+    scalar_elapsed = (time.perf_counter() - started) * args.rows / len(sample)
+    print(f"{'scalar loop (estimated)':<26}{scalar_elapsed:>9.2f} s")
+
+    started = time.perf_counter()
+    plan_hydration(roster)
+    vector_elapsed = time.perf_counter() - started
+    print(f"{'vectorized plan':<26}{vector_elapsed:>9.2f} s")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        roster_path = os.path.join(tmp_dir, "roster.csv")
+        plan_path = os.path.join(tmp_dir, "plan.csv")
+        roster.to_csv(roster_path, index=False)
+        started = time.perf_counter()
+        with open(plan_path, "w", newline="", encoding="utf-8") as destination:
+            plan_csv(roster_path, destination, args.chunksize)
+        csv_elapsed = time.perf_counter() - started
+    print(f"{'CSV in -> CSV out':<26}{csv_elapsed:>9.2f} s ({args.rows / csv_elapsed:,.0f} rows/s, chunksize {args.chunksize:,})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# --- 記録の変更イベントからの作り直し (rebuild) の時間と、スナップショットによる整理の効果を計測 ---
+# 使い方: python -m benchmarks.event_log [--entries 200000] [--changes 2000] [--pending 0 1000 10000 100000]
+#
+# entries 件の記録を追加し、changes 回の修正・削除を行ったユーザーについて
+# - 整理なし: 最初のイベントからすべてを再生して記録と集計テーブルを作り直す
+# - 整理あり: スナップショットを作り、その後に pending 件のイベントを積んでから作り直す (スナップショット + 後のイベントだけを再生)
+# の時間と、保存しているイベントの数・スナップショットの大きさを比べる。あわせて直前の操作の取り消しの時間も表示する。
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+
+from hydrocare.storage import WaterLogStore, to_timestamp
+
+BENCH_USER_ID = "bench-events"
+DRINKS = ["水", "お茶", "スポーツドリンク", "ジュース", "コーヒー"]
+CHUNKSIZE = 100_000
+
+
+def append_entries(store, rng, count, end):
+    end_ts = to_timestamp(end)
+    for offset in range(0, count, CHUNKSIZE):
+        size = min(CHUNKSIZE, count - offset)
+        store.append_rows(BENCH_USER_ID, [
+            (end_ts - (count - offset - i) * 8_640_000_000 - rng.randint(0, 600_000_000), rng.choice([150, 250, 350, 500]), rng.choice(DRINKS))
+            for i in range(size)
+        ])
+
+
+# 記録を1件ずつ選んで、量の修正 (3回に2回) か削除を行う。1件あたりの秒数を返す
+def change_entries(store, rng, count):
+    entry_ids = [row[0] for row in store._conn.execute("SELECT id FROM water_log WHERE user_id = ?", (BENCH_USER_ID,))]
+    started = time.perf_counter()
+    for entry_id in rng.sample(entry_ids, count):
+        if rng.random() < 2 / 3:
+            store.edit_entry(BENCH_USER_ID, entry_id, amount_ml=rng.choice([100, 200, 300]))
+        else:
+            store.delete_entry(BENCH_USER_ID, entry_id)
+    return (time.perf_counter() - started) / max(count, 1)
+
+
+def measure_rebuild(store):
+    started = time.perf_counter()
+    replayed = store.rebuild(BENCH_USER_ID)
+    return replayed, time.perf_counter() - started
+
+
+def print_row(label, store, replayed, seconds):
+    stats = store.event_stats(BENCH_USER_ID)
+    print(
+        f"{label:<22}{store.count(BENCH_USER_ID):>10,}{replayed:>10,}{seconds:>10.2f}"
+        f"{stats['stored_events']:>10,}{stats['snapshot_bytes'] / 1e6:>12.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="記録の変更イベントからの作り直しの時間を計測します。")
+    parser.add_argument("--entries", type=int, default=200_000)
+    parser.add_argument("--changes", type=int, default=2_000, help="最初に行う修正・削除の回数")
+    parser.add_argument("--pending", type=int, nargs="+", default=[0, 1_000, 10_000, 100_000], help="スナップショットの後に積むイベントの数")
+    parser.add_argument("--undo", type=int, default=200, help="取り消しの時間を計測する回数")
+    args = parser.parse_args()
+
+    rng = random.Random(args.entries)
+    end = datetime.datetime.now()
+    # 自動の整理を止めて、すべてのイベントを残したデータベースを作る
+    store = WaterLogStore(os.path.join(tempfile.mkdtemp(prefix="hydrocare-events-"), "hydrocare.db"), compact_min_events=None)
+    append_entries(store, rng, args.entries, end)
+    change_entries(store, rng, args.changes)
+
+    print(f"{args.entries:,} entries added, {args.changes:,} edits/deletes")
+    print(f"{'':<22}{'entries':>10}{'replayed':>10}{'seconds':>10}{'stored ev':>10}{'snapshot MB':>12}")
+    replayed, seconds = measure_rebuild(store)
+    print_row("no snapshot", store, replayed, seconds)
+
+    store.compact(BENCH_USER_ID)
+    for pending in args.pending:
+        # 前回の計測からの差分だけイベントを積む (9割を追加、1割を修正・削除)
+        added = store.event_stats(BENCH_USER_ID)['pending_events']
+        if pending > added:
+            changes = (pending - added) // 10
+            append_entries(store, rng, pending - added - changes, end)
+            change_entries(store, rng, changes)
+        replayed, seconds = measure_rebuild(store)
+        print_row(f"snapshot + {pending:,}", store, replayed, seconds)
+
+    change_seconds = change_entries(store, rng, args.undo)
+    started = time.perf_counter()
+    undone = sum(store.undo_last(BENCH_USER_ID) for _ in range(args.undo))
+    undo_seconds = time.perf_counter() - started
+    print()
+    print(f"edit/delete: {change_seconds * 1000:.2f} ms each, undo: {undo_seconds / max(undone, 1) * 1000:.2f} ms each ({undone} undone)")
+
+
+if __name__ == "__main__":
+    main()
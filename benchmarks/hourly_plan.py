@@ -0,0 +1,81 @@
+# --- 都市ごとの暑さの表を共有した場合の、ユーザーごとの水分補給計画の作成時間を計測 ---
+# 使い方: python -m benchmarks.hourly_plan [--users 10000] [--cities 50]
+#
+# users 人が cities 都市に散らばって、同じ時の間にそれぞれ計画を開いた場合について
+# - 共有なし: ユーザーごとに予報を取得し、表を作り直してから計画を作る
+# - 共有あり: hydrocare.hourly_plan.HourlyPlanEngine で都市ごとの表を1回だけ作り、各ユーザーは表を引いて計画を作る
+# の合計時間と予報の取得回数を比べる。予報の取得は通信を伴わない偽のクライアントで置き換え、取得1回あたりの遅延を --latency 秒加える。
+import argparse
+import datetime
+import random
+import time
+
+from hydrocare.hourly_plan import CityHourTable, HourlyPlanEngine, PlannedActivity, plan_hourly
+
+
+# 3時間ごと40件の予報を返す偽のクライアント (取得回数を数える)
+class FakeForecastClient:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def forecast(self, city_name):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        start = int(time.time()) // 10800 * 10800
+        rng = random.Random(city_name)
+        peak = rng.uniform(26, 36)
+        return {
+            'list': [
+                {'dt': start + i * 10800, 'main': {'temp': peak - 6 + 6 * abs(((i * 3) % 24) - 12) / 12, 'humidity': rng.randint(40, 90)}}
+                for i in range(40)
+            ],
+            'city': {'name': city_name, 'timezone': 32400},
+        }
+
+
+def synthetic_users(users, cities):
+    rng = random.Random(users)
+    now = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+    result = []
+    for i in range(users):
+        activities = []
+        if rng.random() < 0.5:
+            activities.append(PlannedActivity(now + datetime.timedelta(hours=rng.randint(1, 20)), rng.choice(["ウォーキング", "ランニング", "サイクリング"]), rng.choice([30, 60, 90])))
+        result.append((f"City{i % cities}", rng.randint(1500, 3000), activities))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="都市ごとの暑さの表を共有した場合の計画の作成時間を計測します。")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--cities", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0, help="予報の取得1回あたりの遅延 (秒)")
+    args = parser.parse_args()
+
+    users = synthetic_users(args.users, args.cities)
+
+    client = FakeForecastClient(args.latency)
+    started = time.perf_counter()
+    for city_name, daily_target_ml, activities in users:
+        plan_hourly(CityHourTable.from_forecast(city_name, client.forecast(city_name)), daily_target_ml, activities)
+    unshared_seconds = time.perf_counter() - started
+    unshared_calls = client.calls
+
+    client = FakeForecastClient(args.latency)
+    engine = HourlyPlanEngine(client)
+    started = time.perf_counter()
+    for city_name, daily_target_ml, activities in users:
+        plan_hourly(engine.table(city_name), daily_target_ml, activities)
+    shared_seconds = time.perf_counter() - started
+
+    print(f"{args.users:,} users in {args.cities} cities")
+    print(f"{'':<10}{'total s':>10}{'µs/user':>10}{'forecasts':>11}")
+    print(f"{'unshared':<10}{unshared_seconds:>10.3f}{unshared_seconds / args.users * 1e6:>10.1f}{unshared_calls:>11,}")
+    print(f"{'shared':<10}{shared_seconds:>10.3f}{shared_seconds / args.users * 1e6:>10.1f}{client.calls:>11,}")
+    print(f"engine stats: {engine.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+# --- 同時セッション数を増やしたときの処理量と応答時間を計測する負荷試験 ---
+# 使い方:
+#   python -m benchmarks.load_test                                   # 1, 5, 10, 20 セッションで計測
+#   python -m benchmarks.load_test --sessions 10 40 --iterations 5
+#   python -m benchmarks.load_test --weather-latency 0.2 --gemini-latency 1.5 --error-rate 0.05 --quota-error-rate 0.05
+#   python -m benchmarks.load_test --gemini-rpm 600                  # Gemini の送信数の上限を緩めて計測
+#   python -m benchmarks.load_test --json results.json
+#
+# 1つのプロセスの中で AppTest のセッションを N 個同時に動かし (キャッシュ・共有リソースは本番と同じくプロセス内で共有)、
+# 各セッションは ウォークスルー → (水分を記録 → 摂取ログ → 天気の取得 → AIアドバイス) × iterations を順に行う。
+# OpenWeatherMap と Gemini API はローカルのスタブサーバー (hydrocare.stubs) へ向け、遅延とエラー率を指定できる。
+# Gemini は本物の SDK を REST で接続するため、SDK の処理も含めて計測される。
+# 同時セッション数ごとに、操作ごとの件数・エラー数・1秒あたりの処理数と p50 / p95 / p99 の応答時間を表示する。
+import argparse
+import contextlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from hydrocare.stubs import StubGeminiServer, StubOpenWeatherServer
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app.py")
+ACTIONS = ["walkthrough", "record", "intake_log", "weather", "ai_advice"]
+CITIES = ["Tokyo", "Osaka", "Nagoya", "Sapporo", "Fukuoka", "Sendai", "Hiroshima", "Naha", "Kyoto", "Kobe"]
+MOODS = ["少し疲れています", "頭痛がします", "元気です", "よく眠れませんでした", "少しだるいです"]
+
+
+# --- AppTest を複数スレッドから同時に使えるようにする ---
+# AppTest は1回の実行ごとに Runtime のインスタンス・設定 (global.appTest)・コンパイル済みの app.py を
+# プロセス全体の変数に設定して戻すため、同時に実行すると互いに上書きしてしまう。実際のサーバーと同じく、
+# 1つの Runtime・設定・コンパイル結果 (ScriptCache) を全セッションで共有させる。戻り値を閉じると設定が元に戻る
+def share_app_test_globals():
+    from unittest.mock import MagicMock
+
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test, local_script_runner
+    from streamlit.testing.v1.util import patch_config_options
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.dataframe_source_mgr = DataframeSourceManager()
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    # AppTest が書き換える Runtime._instance は、本物の Runtime ではなくこのクラスの属性になる
+    app_test.Runtime = type("SharedRuntime", (), {'_instance': None})
+
+    script_cache = ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: script_cache
+
+    stack = contextlib.ExitStack()
+    stack.enter_context(patch_config_options({"global.appTest": True}))
+    app_test.patch_config_options = lambda overrides: contextlib.nullcontext()
+    return stack
+
+
+# 1回の操作 (1回以上の再実行) の時間と成否を記録する
+class ActionRecorder:
+    def __init__(self):
+        self.samples = []  # (操作名, 秒, 成功したか)
+        self._lock = threading.Lock()
+
+    def record(self, action, seconds, ok):
+        with self._lock:
+            self.samples.append((action, seconds, ok))
+
+
+# Gemini が混雑・失敗したときは st.error ではなく代わりの文言が表示されるため、それも失敗として数える
+DEGRADED_MESSAGES = ["混み合っている", "問題が発生しています"]
+
+
+def _failed(at):
+    if at.exception or len(at.error) > 0:
+        return True
+    return any(message in info.value for info in at.info for message in DEGRADED_MESSAGES)
+
+
+def run_action(recorder, action, at, steps):
+    started = time.perf_counter()
+    try:
+        for step in steps:
+            step(at)
+        ok = not _failed(at)
+    except Exception:
+        ok = False
+    recorder.record(action, time.perf_counter() - started, ok)
+
+
+def _navigate(page):
+    return lambda at: at.sidebar.radio[0].set_value(page).run()
+
+
+def _click(key):
+    return lambda at: at.button(key=key).click().run()
+
+
+def _finish_walkthrough(at):
+    at.run()
+    while not at.session_state.walkthrough_completed:
+        keys = {button.key for button in at.button}
+        at.button(key="walkthrough_next" if "walkthrough_next" in keys else "walkthrough_start_app").click().run()
+
+
+# --- 1セッション分のシナリオ ---
+def run_session(recorder, user_id, iterations, barrier, seed):
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed)
+    at = AppTest.from_file(os.path.abspath(APP_PATH), default_timeout=300)
+    at.query_params["uid"] = user_id
+    barrier.wait()
+
+    run_action(recorder, "walkthrough", at, [_finish_walkthrough])
+    at.session_state.user_profile = {'age': rng.randint(18, 70), 'gender': "男性", 'weight_kg': float(rng.randint(45, 90))}
+    at.session_state.daily_target_ml = 2100
+
+    for iteration in range(iterations):
+        run_action(recorder, "record", at, [_navigate("水分を記録"), _click("record_150ml_btn")])
+        run_action(recorder, "intake_log", at, [_navigate("摂取ログ")])
+        run_action(recorder, "weather", at, [
+            _navigate("天気とアクティビティ"),
+            lambda at: at.text_input[0].set_value(rng.choice(CITIES)).run(),
+            _click("fetch_weather_button"),
+        ])
+        # 回答のキャッシュに当たらないように、セッション・回数ごとに違う内容を送る
+        mood = f"{rng.choice(MOODS)} ({user_id} #{iteration})"
+        run_action(recorder, "ai_advice", at, [
+            _navigate("AIヘルスケア"),
+            lambda at: at.text_area(key="mood_text_area").set_value(mood).run(),
+            _click("get_gemini_advice_button"),
+        ])
+
+
+def run_level(sessions, iterations, label):
+    recorder = ActionRecorder()
+    barrier = threading.Barrier(sessions + 1)
+    threads = [
+        threading.Thread(target=run_session, args=(recorder, f"load-{label}-{i}", iterations, barrier, i), daemon=True)
+        for i in range(sessions)
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return recorder.samples, time.perf_counter() - started
+
+
+def summarize(samples, elapsed):
+    rows = []
+    for action in ACTIONS + ["all"]:
+        selected = [sample for sample in samples if action == "all" or sample[0] == action]
+        if not selected:
+            continue
+        seconds = np.array([sample[1] for sample in selected]) * 1000
+        p50, p95, p99 = np.percentile(seconds, [50, 95, 99])
+        rows.append({
+            'action': action,
+            'count': len(selected),
+            'errors': sum(1 for sample in selected if not sample[2]),
+            'per_second': len(selected) / elapsed,
+            'p50_ms': p50,
+            'p95_ms': p95,
+            'p99_ms': p99,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同時セッション数ごとの処理量と応答時間を計測します。")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 5, 10, 20], help="同時セッション数 (複数指定で順に計測)")
+    parser.add_argument("--iterations", type=int, default=3, help="1セッションあたりの操作の繰り返し回数")
+    parser.add_argument("--weather-latency", type=float, default=0.1, help="OpenWeatherMap のスタブの遅延 (秒)")
+    parser.add_argument("--gemini-latency", type=float, default=0.8, help="Gemini のスタブの遅延 (秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="スタブが 503 を返す割合 (0〜1)")
+    parser.add_argument("--quota-error-rate", type=float, default=0.0, help="Gemini のスタブが 429 を返す割合 (0〜1)")
+    parser.add_argument("--gemini-rpm", type=int, help="app.py の Gemini の1分あたりの送信数の上限 (HYDROCARE_GEMINI_RPM。省略時はアプリの既定値)")
+    parser.add_argument("--json", help="結果を書き出す JSON ファイル")
+    args = parser.parse_args()
+
+    weather_server = StubOpenWeatherServer(latency=args.weather_latency, error_rate=args.error_rate, seed=1).start()
+    gemini_server = StubGeminiServer(
+        latency=args.gemini_latency, error_rate=args.error_rate, quota_error_rate=args.quota_error_rate, seed=2
+    ).start()
+
+    # app.py を実行する前に、記録・キャッシュの保存先と外部APIの接続先をスタブへ差し替える
+    tmp_dir = tempfile.mkdtemp(prefix="hydrocare-load-")
+    os.environ["HYDROCARE_DB_PATH"] = os.path.join(tmp_dir, "hydrocare.db")
+    os.environ["HYDROCARE_GEMINI_CACHE_PATH"] = os.path.join(tmp_dir, "gemini_cache.db")
+    os.environ["OPENWEATHER_URL"] = weather_server.weather_url
+    os.environ["WEATHER_API"] = "stub"
+    os.environ["GEMINI_API_ENDPOINT"] = gemini_server.api_endpoint
+    os.environ["GEMINI_API"] = "stub"
+    if args.gemini_rpm:
+        os.environ["HYDROCARE_GEMINI_RPM"] = str(args.gemini_rpm)
+
+    shared_globals = share_app_test_globals()
+    print(
+        f"weather latency {args.weather_latency}s, gemini latency {args.gemini_latency}s, "
+        f"error rate {args.error_rate}, quota error rate {args.quota_error_rate}, {args.iterations} iterations/session, "
+        f"gemini rpm {os.getenv('HYDROCARE_GEMINI_RPM', 'default')}"
+    )
+    results = []
+    for sessions in args.sessions:
+        samples, elapsed = run_level(sessions, args.iterations, sessions)
+        rows = summarize(samples, elapsed)
+        results.append({'sessions': sessions, 'elapsed_seconds': elapsed, 'actions': rows})
+        print()
+        print(f"{sessions} concurrent sessions: {len(samples)} actions in {elapsed:.1f}s")
+        print(f"{'action':<12}{'count':>7}{'errors':>8}{'per s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for row in rows:
+            print(
+                f"{row['action']:<12}{row['count']:>7}{row['errors']:>8}{row['per_second']:>8.2f}"
+                f"{row['p50_ms']:>9.0f}{row['p95_ms']:>9.0f}{row['p99_ms']:>9.0f}"
+            )
+    print()
+    print(f"stub requests: openweather {weather_server.request_count}, gemini {gemini_server.request_count}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({'args': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+
+    shared_globals.close()
+    weather_server.stop()
+    gemini_server.stop()
+
+
+if __name__ == "__main__":
+    main()
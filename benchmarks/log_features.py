@@ -0,0 +1,82 @@
+# --- インサイト分析のプロンプトに渡す水分補給履歴の大きさと作成時間を計測 ---
+# 使い方: python -m benchmarks.log_features [--days 30 365 1825] [--per-day 10] [--repeat 20]
+#
+# 1日あたり per-day 件の記録を days 日分入れたデータベースについて
+# - 直近の記録: 以前のプロンプトと同じく、直近10件を1件ずつ文章にしたもの (見えるのは直近の1日分程度)
+# - 特徴量の要約: hydrocare.log_features で集計テーブルから作った直近90日分の要約
+# の文字数・UTF-8 のバイト数と、1回の作成時間を比べる。記録の期間を延ばしても要約の大きさと作成時間がほぼ変わらないことを確認する。
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+
+import pandas as pd
+
+from hydrocare.log_features import build_log_features, format_log_features
+from hydrocare.storage import WaterLogStore
+
+BENCH_USER_ID = "bench-features"
+DAILY_TARGET_ML = 2000
+DRINKS = ["水", "お茶", "スポーツドリンク", "ジュース", "コーヒー"]
+
+
+def fill_store(store, days, per_day, today):
+    rng = random.Random(days)
+    rows = []
+    for offset in range(days):
+        day = datetime.datetime.combine(today - datetime.timedelta(days=offset), datetime.time(7))
+        for _ in range(per_day):
+            rows.append({'time': day + datetime.timedelta(minutes=rng.randint(0, 15 * 60)), 'amount_ml': rng.choice([150, 250, 350, 500]), 'type': rng.choice(DRINKS)})
+    store.append_many(BENCH_USER_ID, rows)
+
+
+# 以前の get_water_intake_insight_from_gemini と同じ書き方
+def recent_entries_text(store):
+    log_strings = []
+    for entry in store.last_entries(BENCH_USER_ID, 10):
+        log_time = pd.to_datetime(entry['time']).strftime('%Y年%m月%d日 %H時%M分')
+        log_strings.append(f"- {log_time} に {entry['type']} を {entry['amount_ml']}ml 摂取")
+    return "\n".join(log_strings)
+
+
+def features_text(store, today):
+    return format_log_features(build_log_features(store, BENCH_USER_ID, DAILY_TARGET_ML, today), DAILY_TARGET_ML)
+
+
+def measure(build, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        text = build()
+    return text, (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="インサイト分析に渡す履歴の大きさと作成時間を計測します。")
+    parser.add_argument("--days", type=int, nargs="+", default=[30, 365, 1825], help="記録の日数 (複数指定で順に計測)")
+    parser.add_argument("--per-day", type=int, default=10, help="1日あたりの記録の件数")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    today = datetime.date.today()
+    print(f"{args.per_day} entries/day, prompt history built {args.repeat} times each")
+    print(f"{'days':>6}{'entries':>10}  {'history':<8}{'days seen':>10}{'chars':>7}{'bytes':>7}{'ms/build':>10}")
+    for days in args.days:
+        store = WaterLogStore(os.path.join(tempfile.mkdtemp(prefix="hydrocare-features-"), "hydrocare.db"))
+        fill_store(store, days, args.per_day, today)
+        oldest_recent = store.last_entries(BENCH_USER_ID, 10)[0]['time']
+        for label, build, days_seen in (
+            ("recent10", lambda: recent_entries_text(store), (today - oldest_recent.date()).days + 1),
+            ("features", lambda: features_text(store, today), min(days, 90)),
+        ):
+            text, seconds = measure(build, args.repeat)
+            print(
+                f"{days:>6}{store.count(BENCH_USER_ID):>10,}  {label:<8}{days_seen:>10}"
+                f"{len(text):>7}{len(text.encode('utf-8')):>7}{seconds * 1000:>10.2f}"
+            )
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# --- 水分補給記録の保持に必要なメモリを計測 ---
+# 使い方: python -m benchmarks.log_memory [--sizes 10000 100000 1000000]
+#
+# 同じ記録を
+# - 従来の辞書のリスト ({'time': datetime, 'amount_ml': int, 'type': str})
+# - 列指向コンテナ (hydrocare.columnar.WaterLogColumns)
+# で保持した場合のメモリ量 (tracemalloc で計測) と、そこから pandas の DataFrame を作る時間・追加メモリを比べる。
+# どちらも SQLite から読み出した行 (1行ごとに別々の文字列オブジェクト) から作る。元の行は計測の外で作るため、
+# 辞書のリストの値には種類の文字列の分が含まれない (実際より控えめな値になる)。
+import argparse
+import datetime
+import random
+import time
+import tracemalloc
+
+import pandas as pd
+
+from hydrocare.columnar import DRINK_TYPES, WaterLogColumns
+from hydrocare.storage import from_timestamp, to_timestamp
+
+
+def synthetic_rows(size, now):
+    rng = random.Random(size)
+    end = to_timestamp(now)
+    # 1日あたり約10回の記録を、現在から過去に向かって並べる
+    return [
+        (end - (size - i) * 8_640_000_000, rng.choice([150, 250, 500]), "".join(rng.choice(DRINK_TYPES)))
+        for i in range(size)
+    ]
+
+
+def measure(build):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="水分補給記録の保持に必要なメモリを計測します。")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    now = datetime.datetime.now()
+    print(f"{'entries':>10}  {'container':<14}{'memory MB':>11}{'bytes/entry':>13}{'build s':>9}{'DataFrame MB':>14}{'DataFrame s':>13}")
+    for size in args.sizes:
+        rows = synthetic_rows(size, now)
+
+        entries, entries_bytes, entries_seconds = measure(
+            lambda: [{'time': from_timestamp(ts), 'amount_ml': amount_ml, 'type': drink_type} for ts, amount_ml, drink_type in rows]
+        )
+        _, entries_frame_bytes, entries_frame_seconds = measure(lambda: pd.DataFrame(entries))
+        del entries
+
+        columns, columns_bytes, columns_seconds = measure(lambda: WaterLogColumns.from_rows(rows))
+        _, columns_frame_bytes, columns_frame_seconds = measure(columns.to_frame)
+
+        for name, memory, build_seconds, frame_memory, frame_seconds in (
+            ("list of dicts", entries_bytes, entries_seconds, entries_frame_bytes, entries_frame_seconds),
+            ("columnar", columns_bytes, columns_seconds, columns_frame_bytes, columns_frame_seconds),
+        ):
+            print(
+                f"{size:>10,}  {name:<14}{memory / 1e6:>11.1f}{memory / size:>13.1f}{build_seconds:>9.2f}"
+                f"{frame_memory / 1e6:>14.1f}{frame_seconds:>13.4f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
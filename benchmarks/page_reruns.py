@@ -0,0 +1,163 @@
+# --- ページごとの再実行コストを記録件数ごとに計測 ---
+# 使い方:
+#   python -m benchmarks.page_reruns                              # 10〜1,000,000件で計測し JSON に保存
+#   python -m benchmarks.page_reruns --sizes 10 1000 --repeat 3
+#   python -m benchmarks.page_reruns --compare benchmarks/results/page_reruns-<commit>.json
+#
+# AppTest で app.py を実行し、ホーム・水分を記録・摂取ログ・AIヘルスケアの各ページについて
+# スクリプト全体の再実行にかかる時間 (中央値・最大) と、その間に確保されたメモリのピークを測る。
+# 天気は hydrocare.stubs のスタブサーバー、Gemini は FakeGenerativeModel に置き換える。
+# 結果はコミットごとに JSON ファイルへ書き出し、--compare で以前の結果と比べられる。
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(BENCH_DIR, "..", "app.py")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+PAGES = ["ホーム", "水分を記録", "摂取ログ", "AIヘルスケア"]
+DRINK_TYPES = ["水", "お茶", "スポーツドリンク", "ジュース", "コーヒー", "その他"]
+
+# app.py を読み込む前に、記録・キャッシュの保存先と外部APIの接続先を差し替える
+_tmp_dir = tempfile.mkdtemp(prefix="hydrocare-bench-")
+os.environ["HYDROCARE_DB_PATH"] = os.path.join(_tmp_dir, "hydrocare.db")
+os.environ["HYDROCARE_GEMINI_CACHE_PATH"] = os.path.join(_tmp_dir, "gemini_cache.db")
+os.environ["GEMINI_API"] = "stub"
+os.environ["WEATHER_API"] = "stub"
+
+import google.generativeai as genai  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+from hydrocare.storage import WaterLogStore, from_timestamp, to_timestamp  # noqa: E402
+from hydrocare.stubs import FakeGenerativeModel, StubOpenWeatherServer  # noqa: E402
+
+genai.configure = lambda **kwargs: None
+genai.GenerativeModel = lambda model_name: FakeGenerativeModel()
+
+
+# 過去365日に size 件の記録を均等に並べる (件数が多いほど1日あたりの記録が増える)
+def seed_history(store, user_id, size, now, batch_size=200_000):
+    rng = np.random.default_rng(size)
+    end = to_timestamp(now)
+    start = to_timestamp(now - datetime.timedelta(days=365))
+    timestamps = np.sort(rng.integers(start, end, size))
+    amounts = rng.choice([150, 250, 500], size)
+    types = rng.integers(0, len(DRINK_TYPES), size)
+    for offset in range(0, size, batch_size):
+        store.append_many(user_id, [
+            {'time': from_timestamp(int(ts)), 'amount_ml': int(amount), 'type': DRINK_TYPES[type_code]}
+            for ts, amount, type_code in zip(
+                timestamps[offset:offset + batch_size], amounts[offset:offset + batch_size], types[offset:offset + batch_size]
+            )
+        ])
+
+
+def new_app(user_id):
+    at = AppTest.from_file(os.path.abspath(APP_PATH), default_timeout=600)
+    at.query_params["uid"] = user_id
+    at.session_state.walkthrough_completed = True
+    at.session_state.user_profile = {'age': 30, 'gender': "男性", 'weight_kg': 60.0}
+    at.session_state.daily_target_ml = 2100
+    return at
+
+
+def measure_page(user_id, page, repeat):
+    at = new_app(user_id)
+    at.run()
+    at.sidebar.radio[0].set_value(page).run()
+    if at.exception:
+        raise RuntimeError(f"{page}: {at.exception[0].message}")
+
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        at.run()
+        samples.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    at.run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'wall_ms_median': round(statistics.median(samples), 2),
+        'wall_ms_max': round(max(samples), 2),
+        'peak_alloc_kb': round(peak / 1024, 1),
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(row['page'], row['log_size']): row for row in json.load(f)['results']}
+    print(f"\ncompared with {baseline_path}")
+    print(f"{'page':<14}{'entries':>10}{'wall ratio':>12}{'memory ratio':>14}")
+    for row in results:
+        before = baseline.get((row['page'], row['log_size']))
+        if before is None:
+            continue
+        wall_ratio = row['wall_ms_median'] / max(before['wall_ms_median'], 1e-9)
+        memory_ratio = row['peak_alloc_kb'] / max(before['peak_alloc_kb'], 1e-9)
+        print(f"{row['page']:<14}{row['log_size']:>10}{wall_ratio:>12.2f}{memory_ratio:>14.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ページごとの再実行コストを計測します。")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--pages", nargs="+", default=PAGES, choices=PAGES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="結果の JSON ファイル (既定: benchmarks/results/page_reruns-<commit>.json)")
+    parser.add_argument("--compare", help="比較する以前の結果の JSON ファイル")
+    args = parser.parse_args()
+
+    commit = current_commit()
+    output = args.output or os.path.join(RESULTS_DIR, f"page_reruns-{commit}.json")
+    now = datetime.datetime.now()
+    store = WaterLogStore()
+
+    results = []
+    with StubOpenWeatherServer() as weather_server:
+        os.environ["OPENWEATHER_URL"] = weather_server.weather_url
+        print(f"{'page':<14}{'entries':>10}{'median ms':>12}{'max ms':>10}{'peak KiB':>12}")
+        for size in args.sizes:
+            user_id = f"bench-{size}"
+            seed_history(store, user_id, size, now)
+            for page in args.pages:
+                row = {'page': page, 'log_size': size, **measure_page(user_id, page, args.repeat)}
+                results.append(row)
+                print(f"{page:<14}{size:>10}{row['wall_ms_median']:>12.2f}{row['wall_ms_max']:>10.2f}{row['peak_alloc_kb']:>12.1f}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            'benchmark': "page_reruns",
+            'commit': commit,
+            'created_at': now.isoformat(timespec="seconds"),
+            'python': platform.python_version(),
+            'repeat': args.repeat,
+            'results': results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\nresults written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# --- ホーム画面を開いたまま放置したタブ1つあたりのサーバー再実行回数を計測 ---
+# 使い方:
+#   python -m benchmarks.reminder_reruns                    # 現在の app.py を計測
+#   python -m benchmarks.reminder_reruns --script old.py    # 比較したい版の app.py を計測
+#
+# AppTest でホーム画面を描画し、一定時間 (--window 秒) 放置した間に
+# - サーバー側で発生したスクリプト全体の再実行回数
+# - フラグメントの自動再実行 (run_every) によってブラウザから要求される再実行回数
+# を数え、1分あたりの回数に換算して表示する。
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+
+from streamlit.runtime.scriptrunner import ScriptRunnerEvent
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app.py")
+BENCH_USER_ID = "bench-user"
+
+# 計測用の記録は一時ファイルのデータベースに入れる (app.py の読み込みより前に設定する)
+os.environ["HYDROCARE_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="hydrocare-bench-"), "hydrocare.db")
+from hydrocare.storage import WaterLogStore  # noqa: E402
+
+captured_runners = []
+_original_init = LocalScriptRunner.__init__
+
+
+def _capturing_init(self, *args, **kwargs):
+    _original_init(self, *args, **kwargs)
+    captured_runners.append(self)
+
+
+LocalScriptRunner.__init__ = _capturing_init
+
+
+def build_water_log(size):
+    now = datetime.datetime.now()
+    return [
+        {
+            'time': now - datetime.timedelta(minutes=30 * (size - i)),
+            'amount_ml': random.choice([150, 250, 500]),
+            'type': random.choice(["水", "お茶", "スポーツドリンク"]),
+        }
+        for i in range(size)
+    ]
+
+
+def measure(script_path, refresh_mode, refresh_seconds, window, water_log):
+    captured_runners.clear()
+    at = AppTest.from_file(os.path.abspath(script_path), default_timeout=window)
+    at.query_params["uid"] = BENCH_USER_ID
+    at.session_state.walkthrough_completed = True
+    at.session_state.daily_target_ml = 2100
+    # ストレージ導入前の版 (session_state.water_log を使う版) も計測できるようにしておく
+    at.session_state.water_log = water_log
+    at.session_state.last_water_intake_time = datetime.datetime.now()
+    at.session_state.reminder_refresh_mode = refresh_mode
+    at.session_state.reminder_refresh_seconds = refresh_seconds
+
+    started = time.perf_counter()
+    try:
+        at.run()
+    except RuntimeError:
+        # 毎秒再実行し続けるスクリプトは計測時間いっぱいで打ち切られる
+        pass
+    elapsed = time.perf_counter() - started
+
+    runner = captured_runners[-1]
+    script_runs = sum(1 for event in runner.events if event == ScriptRunnerEvent.SCRIPT_STARTED)
+    auto_rerun_intervals = [
+        msg.auto_rerun.interval for msg in runner.forward_msgs() if msg.WhichOneof("type") == "auto_rerun"
+    ]
+    # 最初の描画は数えず、放置中に発生した再実行だけを数える
+    server_reruns_per_minute = (script_runs - 1) * 60 / max(elapsed, window)
+    fragment_reruns_per_minute = sum(60 / interval for interval in auto_rerun_intervals if interval > 0)
+    return elapsed, server_reruns_per_minute, fragment_reruns_per_minute
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ホーム画面放置時の再実行回数を計測します。")
+    parser.add_argument("--script", default=APP_PATH, help="計測する app.py のパス")
+    parser.add_argument("--window", type=float, default=10.0, help="放置する時間 (秒)")
+    parser.add_argument("--log-size", type=int, default=1000, help="事前に登録しておく記録件数")
+    parser.add_argument("--refresh-seconds", type=int, default=1, help="fragment モードの更新間隔 (秒)")
+    args = parser.parse_args()
+
+    water_log = build_water_log(args.log_size)
+    store = WaterLogStore()
+    store.append_many(BENCH_USER_ID, water_log)
+    store.close()
+
+    print(f"script: {os.path.abspath(args.script)}")
+    print(f"window: {args.window:.0f}s, water_log: {args.log_size} entries")
+    print(f"{'mode':<10}{'full reruns/min':>18}{'fragment reruns/min':>22}")
+    for refresh_mode in ["client", "fragment"]:
+        _, server_rate, fragment_rate = measure(args.script, refresh_mode, args.refresh_seconds, args.window, water_log)
+        print(f"{refresh_mode:<10}{server_rate:>18.2f}{fragment_rate:>22.2f}")
+
+
+if __name__ == "__main__":
+    main()
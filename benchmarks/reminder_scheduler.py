@@ -0,0 +1,102 @@
+# --- リマインダースケジューラーの処理量を計測 ---
+# 使い方: python -m benchmarks.reminder_scheduler [--users 1000 100000 1000000] [--due 10000] [--idle 5]
+#
+# hydrocare.reminders.ReminderScheduler について
+# - users 人分の予定を登録する時間 (1件あたり) と、同じ予定をもう一度登録したとき (セッションの再実行相当) の時間
+# - users 人分の予定を抱えたまま、期限が来ない間 (--idle 秒) にスレッドが使う CPU 時間
+# - 同時に期限を迎えた --due 件を、件数を数えるだけの通知先へバッチで送り終えるまでの時間
+# を計測する。待っている予定の数ではなく、期限を迎えた件数に比例して処理が増えることを確認する。
+import argparse
+import datetime
+import threading
+import time
+
+from hydrocare.reminders import DEFAULT_BATCH_SIZE, ReminderScheduler
+
+
+# 受け取った件数を数えるだけの通知先 (expected 件に達したら done を立てる)
+class CountingNotifier:
+    def __init__(self, expected):
+        self.expected = expected
+        self.count = 0
+        self.batches = 0
+        self.done = threading.Event()
+
+    def notify(self, reminders):
+        self.count += len(reminders)
+        self.batches += 1
+        if self.count >= self.expected:
+            self.done.set()
+
+
+# ワーカースレッドだけの CPU 時間 (プロセス全体の CPU 時間からメインスレッドの分を引く)
+def scheduler_cpu_seconds(idle_seconds):
+    process_started = time.process_time()
+    thread_started = time.thread_time()
+    time.sleep(idle_seconds)
+    return max(0.0, (time.process_time() - process_started) - (time.thread_time() - thread_started))
+
+
+def bench_schedule(users, idle_seconds):
+    scheduler = ReminderScheduler(CountingNotifier(users)).start()
+    last_intake_time = datetime.datetime.now()
+    started = time.perf_counter()
+    for i in range(users):
+        # 期限を1時間後から少しずつずらす (計測中には期限が来ない)
+        scheduler.schedule(f"user-{i}", last_intake_time + datetime.timedelta(seconds=i % 3600), 60)
+    schedule_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for i in range(users):
+        scheduler.schedule(f"user-{i}", last_intake_time + datetime.timedelta(seconds=i % 3600), 60)
+    reschedule_seconds = time.perf_counter() - started
+
+    idle_cpu = scheduler_cpu_seconds(idle_seconds)
+    scheduler.stop()
+    return schedule_seconds, reschedule_seconds, idle_cpu
+
+
+# 全員の期限が同じ時刻に来るように登録し、時計を進めてから全件送り終えるまでを計る
+def bench_dispatch(due, batch_size):
+    now = datetime.datetime.now()
+    clock = [now]
+    notifier = CountingNotifier(due)
+    scheduler = ReminderScheduler(notifier, batch_size=batch_size, clock=lambda: clock[0]).start()
+    for i in range(due):
+        scheduler.schedule(f"user-{i}", now, 60)
+
+    started = time.perf_counter()
+    clock[0] = now + datetime.timedelta(minutes=60)
+    scheduler.wake()
+    notifier.done.wait()
+    elapsed = time.perf_counter() - started
+    scheduler.stop()
+    return elapsed, notifier.batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="リマインダースケジューラーの処理量を計測します。")
+    parser.add_argument("--users", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--due", type=int, default=10_000)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--idle", type=float, default=5.0, help="アイドル時の CPU 時間を計測する秒数")
+    args = parser.parse_args()
+
+    print(f"{'users':>10}{'schedule µs/user':>18}{'reschedule µs/user':>20}{'idle CPU ms/s':>15}")
+    for users in args.users:
+        schedule_seconds, reschedule_seconds, idle_cpu = bench_schedule(users, args.idle)
+        print(
+            f"{users:>10,}{schedule_seconds / users * 1e6:>18.2f}{reschedule_seconds / users * 1e6:>20.2f}"
+            f"{idle_cpu / args.idle * 1000:>15.3f}"
+        )
+
+    elapsed, batches = bench_dispatch(args.due, args.batch_size)
+    print()
+    print(
+        f"dispatch: {args.due:,} reminders due at once -> {batches} batches in {elapsed * 1000:.1f} ms "
+        f"({elapsed / args.due * 1e6:.2f} µs/reminder)"
+    )
+
+
+if __name__ == "__main__":
+    main()
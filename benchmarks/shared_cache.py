@@ -0,0 +1,108 @@
+# --- ワーカープロセスごとのキャッシュと、全プロセスで共有するキャッシュ (DiskCache) の比較 ---
+# 使い方: python -m benchmarks.shared_cache [--workers 4] [--lookups 2000] [--keys 200] [--compute-ms 20] [--payload-kb 4]
+#
+# ロードバランサーの後ろで workers 個のプロセスが、keys 種類の引数 (よく使われるものほど多く呼ばれる) で
+# compute-ms かかる関数を合計 lookups 回ずつ呼ぶ場合について
+# - memory: 今までの st.cache_data と同じく、プロセスごとに結果を持つ
+# - disk: hydrocare.disk_cache.memoize で、全プロセスが同じ SQLite のファイルに結果を持つ
+# の実際に計算した回数・ヒット率・1回の呼び出しの時間・全プロセスで持つキャッシュの合計サイズを比べる。
+# あわせて max-mb を小さくした場合に、サイズの上限による追い出しが効いていることを確認する。
+import argparse
+import multiprocessing
+import os
+import pickle
+import random
+import tempfile
+import time
+
+from hydrocare.disk_cache import DiskCache, memoize
+
+
+def make_function(compute_ms, payload_kb, computed):
+    def compute(key):
+        computed.append(key)
+        time.sleep(compute_ms / 1000)
+        return {'key': key, 'payload': b"x" * (payload_kb * 1024)}
+    return compute
+
+
+def keys_for(worker, lookups, keys):
+    # よく使われる引数ほど多く呼ばれる (Zipf 分布に近い偏り)
+    rng = random.Random(worker)
+    weights = [1 / (rank + 1) for rank in range(keys)]
+    return rng.choices(range(keys), weights=weights, k=lookups)
+
+
+def run_worker(backend, path, max_bytes, worker, args, results):
+    computed = []
+    compute = make_function(args.compute_ms, args.payload_kb, computed)
+    if backend == "disk":
+        cache = DiskCache(path, max_bytes=max_bytes)
+        cached = memoize(lambda: cache, "bench")(compute)
+    else:
+        memory = {}
+
+        def cached(key):
+            if key not in memory:
+                memory[key] = compute(key)
+            return memory[key]
+
+    started = time.perf_counter()
+    for key in keys_for(worker, args.lookups, args.keys):
+        cached(key)
+    seconds = time.perf_counter() - started
+    stored_bytes = 0 if backend == "disk" else sum(len(pickle.dumps(value)) for value in memory.values())
+    if backend == "disk":
+        cache.close()
+    results.put((len(computed), seconds, stored_bytes))
+
+
+def run(backend, args, max_bytes):
+    path = os.path.join(tempfile.mkdtemp(prefix="hydrocare-shared-cache-"), "shared_cache.db")
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(backend, path, max_bytes, worker, args, results))
+        for worker in range(args.workers)
+    ]
+    started = time.perf_counter()
+    for process in workers:
+        process.start()
+    rows = [results.get() for _ in workers]
+    for process in workers:
+        process.join()
+    wall_seconds = time.perf_counter() - started
+
+    computed = sum(row[0] for row in rows)
+    lookups = args.workers * args.lookups
+    worker_seconds = sum(row[1] for row in rows)
+    if backend == "disk":
+        stats = DiskCache(path, max_bytes=max_bytes).stats()
+        stored_bytes, evictions = stats['total_bytes'], sum(counts['evictions'] for counts in stats['namespaces'].values())
+    else:
+        stored_bytes, evictions = sum(row[2] for row in rows), 0
+    label = backend if max_bytes >= 1 << 40 else f"{backend} {max_bytes / 1e6:g}MB"
+    print(
+        f"{label:<14}{computed:>10,}{1 - computed / lookups:>10.1%}{worker_seconds / lookups * 1000:>10.2f}"
+        f"{wall_seconds:>9.2f}{stored_bytes / 1e6:>11.2f}{evictions:>11,}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="プロセスごとのキャッシュと共有キャッシュを比較します。")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--lookups", type=int, default=2_000, help="1プロセスあたりの呼び出し回数")
+    parser.add_argument("--keys", type=int, default=200, help="引数の種類の数")
+    parser.add_argument("--compute-ms", type=float, default=20, help="1回の計算にかかる時間 (ミリ秒)")
+    parser.add_argument("--payload-kb", type=int, default=4, help="1件の結果の大きさ (KB)")
+    parser.add_argument("--max-mb", type=float, default=0.25, help="追い出しを確認するときの共有キャッシュの上限 (MB)")
+    args = parser.parse_args()
+
+    print(f"{args.workers} workers x {args.lookups:,} lookups over {args.keys} keys, {args.compute_ms:g} ms/compute, {args.payload_kb} KB/result")
+    print(f"{'backend':<14}{'computed':>10}{'hit rate':>10}{'ms/call':>10}{'wall s':>9}{'cached MB':>11}{'evictions':>11}")
+    run("memory", args, 1 << 62)
+    run("disk", args, 1 << 62)
+    run("disk", args, int(args.max_mb * 1e6))
+
+
+if __name__ == "__main__":
+    main()
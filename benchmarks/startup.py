@@ -0,0 +1,113 @@
+# --- 起動時間とメモリ使用量を計測 ---
+# 使い方:
+#   python -m benchmarks.startup                    # 現在の app.py を計測
+#   python -m benchmarks.startup --script old.py    # 比較したい版の app.py を計測
+#   python -m benchmarks.startup --repeat 5
+#
+# 新しいワーカープロセスを想定して、計測ごとに Python プロセスを起動し直し、次の3通りを測る。
+# - walkthrough: ウォークスルーの1画面目だけを表示する (初めての訪問者)
+# - walkthrough+warmup: 同じ画面を HYDROCARE_WARMUP=1 で表示する (起動時に重いライブラリを読み込む)
+# - full-app: メインアプリの全ページを順に表示する
+# streamlit 自体の読み込み時間とは分けて、app.py の最初の実行にかかった時間・プロセスの最大RSS・
+# 読み込まれた重いライブラリを表示する。
+import argparse
+import datetime
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app.py")
+SCENARIOS = ["walkthrough", "walkthrough+warmup", "full-app"]
+PAGES = ["ホーム", "水分を記録", "摂取ログ", "天気とアクティビティ", "AIヘルスケア", "マイ設定"]
+HEAVY_MODULES = ["numpy", "pandas", "pyarrow", "altair", "google.generativeai"]
+
+
+def _loaded_heavy_modules():
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+
+# 子プロセス側: 1つのシナリオを実行して結果を JSON で標準出力に書く
+def run_child(scenario, script):
+    tmp_dir = tempfile.mkdtemp(prefix="hydrocare-startup-")
+    os.environ["HYDROCARE_DB_PATH"] = os.path.join(tmp_dir, "hydrocare.db")
+    os.environ["HYDROCARE_GEMINI_CACHE_PATH"] = os.path.join(tmp_dir, "gemini_cache.db")
+    os.environ["GEMINI_API"] = "stub"
+    os.environ.pop("WEATHER_API", None)
+    if scenario == "walkthrough+warmup":
+        os.environ["HYDROCARE_WARMUP"] = "1"
+
+    started = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    streamlit_import_ms = (time.perf_counter() - started) * 1000
+
+    at = AppTest.from_file(os.path.abspath(script), default_timeout=120)
+    if scenario == "full-app":
+        at.query_params["uid"] = "startup-bench"
+        at.session_state.walkthrough_completed = True
+        at.session_state.user_profile = {'age': 30, 'gender': "男性", 'weight_kg': 60.0}
+        at.session_state.daily_target_ml = 2100
+
+    started = time.perf_counter()
+    at.run()
+    first_run_ms = (time.perf_counter() - started) * 1000
+    if scenario == "full-app":
+        for page in PAGES:
+            at.sidebar.radio[0].set_value(page).run()
+            if page == "水分を記録":
+                at.button(key="record_150ml_btn").click().run()
+    total_ms = (time.perf_counter() - started) * 1000
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+
+    print(json.dumps({
+        'scenario': scenario,
+        'streamlit_import_ms': streamlit_import_ms,
+        'first_run_ms': first_run_ms,
+        'total_ms': total_ms,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'heavy_modules': _loaded_heavy_modules(),
+    }))
+
+
+def run_scenario(scenario, script):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child", scenario, "--script", script],
+        cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."),
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="起動時間とメモリ使用量を計測します。")
+    parser.add_argument("--script", default=APP_PATH, help="計測する app.py のパス")
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.script)
+        return
+
+    print(f"script: {os.path.abspath(args.script)}  ({datetime.datetime.now():%Y-%m-%d %H:%M})")
+    print(f"{'scenario':<20}{'st import ms':>14}{'app run ms':>12}{'total ms':>10}{'max RSS MB':>12}  heavy modules")
+    for scenario in args.scenarios:
+        results = [run_scenario(scenario, args.script) for _ in range(args.repeat)]
+        print(
+            f"{scenario:<20}"
+            f"{statistics.median(r['streamlit_import_ms'] for r in results):>14.0f}"
+            f"{statistics.median(r['first_run_ms'] for r in results):>12.0f}"
+            f"{statistics.median(r['total_ms'] for r in results):>10.0f}"
+            f"{statistics.median(r['max_rss_mb'] for r in results):>12.1f}"
+            f"  {', '.join(results[-1]['heavy_modules']) or '-'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# --- 水分補給記録ストレージの読み出し遅延を記録件数ごとに計測 ---
+# 使い方: python -m benchmarks.storage_latency [--sizes 100 1000 10000 100000 1000000]
+#
+# 件数を増やしながら「今日の記録」「直近10件」「直近7日間」「履歴の1ページ」の読み出しにかかる時間 (中央値) を測る。
+# 履歴の1ページは、履歴の中ほどの日について件数・20件分のページ・前後の記録がある日を求める時間。
+# 比較として、従来の session_state.water_log (辞書のリスト) を全件走査する方式も 100,000 件まで測る。
+import argparse
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import pandas as pd
+
+from hydrocare.storage import WaterLogStore
+
+USER_ID = "bench-user"
+LIST_SCAN_LIMIT = 100_000
+
+
+def synthetic_entries(size, now):
+    # 1日あたり約10回の記録を、現在から過去に向かって並べる
+    return [
+        {
+            'time': now - datetime.timedelta(minutes=144 * (size - i)),
+            'amount_ml': random.choice([150, 250, 500]),
+            'type': random.choice(["水", "お茶", "スポーツドリンク", "コーヒー"]),
+        }
+        for i in range(size)
+    ]
+
+
+def median_microseconds(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1_000_000)
+    return statistics.median(samples)
+
+
+def history_page(store, date, page_size=20):
+    day_end = date + datetime.timedelta(days=1)
+    store.count_between(USER_ID, date, day_end)
+    store.rows_page(USER_ID, date, day_end, 0, page_size)
+    store.previous_entry_time(USER_ID, date)
+    store.next_entry_time(USER_ID, day_end)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ストレージの読み出し遅延を計測します。")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    now = datetime.datetime.now()
+    today = now.date()
+    week_start = today - datetime.timedelta(days=6)
+    tomorrow = today + datetime.timedelta(days=1)
+
+    print(f"{'entries':>10}{'today (us)':>14}{'last 10 (us)':>14}{'7 days (us)':>14}{'history page (us)':>20}{'list scan today (us)':>24}")
+    for size in args.sizes:
+        entries = synthetic_entries(size, now)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = WaterLogStore(os.path.join(tmp_dir, "bench.db"))
+            # 他のユーザーの記録も混ぜて、インデックスでユーザーを絞り込めていることも確認する
+            store.append_many("other-user", entries[: size // 2])
+            store.append_many(USER_ID, entries)
+
+            today_us = median_microseconds(lambda: store.entries_on(USER_ID, today), args.repeat)
+            last_us = median_microseconds(lambda: store.last_entries(USER_ID, 10), args.repeat)
+            week_us = median_microseconds(lambda: store.entries_between(USER_ID, week_start, tomorrow), args.repeat)
+            history_date = entries[len(entries) // 2]['time'].date()
+            history_us = median_microseconds(lambda: history_page(store, history_date), args.repeat)
+            store.close()
+
+        if size <= LIST_SCAN_LIMIT:
+            scan_us = median_microseconds(
+                lambda: [entry for entry in entries if pd.to_datetime(entry['time']).date() == today], 3
+            )
+            scan_text = f"{scan_us:>24.0f}"
+        else:
+            scan_text = f"{'-':>24}"
+        print(f"{size:>10}{today_us:>14.0f}{last_us:>14.0f}{week_us:>14.0f}{history_us:>20.0f}{scan_text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# --- 摂取ログのサマリー作成時間を期間・集計単位ごとに計測 ---
+# 使い方: python -m benchmarks.summary_latency [--per-day 100]
+#
+# 1年分の記録 (1日 --per-day 件) を登録し、集計テーブルから作るサマリーの作成時間 (中央値) を測る。
+# 比較として、従来の calculate_daily_summary (全記録から DataFrame を作る7日間表示) も測る。
+import argparse
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import pandas as pd
+
+from hydrocare.rollups import SUMMARY_GRANULARITIES, SUMMARY_WINDOWS, summarize_intake
+from hydrocare.storage import WaterLogStore
+
+USER_ID = "bench-user"
+TARGET_ML = 2100
+
+
+# 従来の実装 (記録全体から DataFrame を作り、7日間の日付範囲と結合する)
+def legacy_daily_summary(water_log, base_daily_target_ml):
+    df = pd.DataFrame(water_log)
+    df['date'] = pd.to_datetime(df['time']).dt.date
+    daily_summary_actual = df.groupby('date')['amount_ml'].sum().reset_index()
+    daily_summary_actual.columns = ['Date', 'Total_ML']
+    daily_summary_actual['Date'] = pd.to_datetime(daily_summary_actual['Date'])
+    today = datetime.date.today()
+    date_range = pd.date_range(start=today - datetime.timedelta(days=6), end=today, freq='D')
+    full_df = pd.merge(pd.DataFrame({'Date': date_range}), daily_summary_actual, on='Date', how='left').fillna(0)
+    full_df['Total_ML'] = full_df['Total_ML'].astype(int)
+    full_df['Target_ML'] = base_daily_target_ml
+    return full_df.sort_values('Date')
+
+
+def median_milliseconds(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="摂取ログのサマリー作成時間を計測します。")
+    parser.add_argument("--per-day", type=int, default=100, help="1日あたりの記録件数")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    now = datetime.datetime.now()
+    minutes_between = 24 * 60 / args.per_day
+    water_log = [
+        {
+            'time': now - datetime.timedelta(minutes=minutes_between * i),
+            'amount_ml': random.choice([150, 250, 500]),
+            'type': random.choice(["水", "お茶", "スポーツドリンク", "コーヒー"]),
+        }
+        for i in range(365 * args.per_day)
+    ]
+    water_log.reverse()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = WaterLogStore(os.path.join(tmp_dir, "bench.db"))
+        store.append_many(USER_ID, water_log)
+        print(f"entries: {len(water_log)} (365 days x {args.per_day}/day)")
+
+        legacy_ms = median_milliseconds(lambda: legacy_daily_summary(water_log, TARGET_ML), max(3, args.repeat // 5))
+        print(f"{'legacy 7 days (full log)':<28}{legacy_ms:>10.2f} ms")
+        for days in SUMMARY_WINDOWS:
+            for granularity in SUMMARY_GRANULARITIES:
+                elapsed_ms = median_milliseconds(
+                    lambda: summarize_intake(store, USER_ID, TARGET_ML, days, granularity), args.repeat
+                )
+                print(f"{f'rollup {days} days / {granularity}':<28}{elapsed_ms:>10.2f} ms")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# --- ウォークスルー画像の転送量と描画時間を計測 ---
+# 使い方:
+#   python -m benchmarks.walkthrough_images                    # 現在の app.py を計測
+#   python -m benchmarks.walkthrough_images --script old.py    # 比較したい版の app.py を計測
+#
+# AppTest でウォークスルーの各ステップを表示し、
+# - st.image がブラウザへ配信する画像のバイト数 (Streamlit が縮小・変換した後の大きさ)
+# - 最初の表示と、2回目以降の再実行にかかる時間 (中央値)
+# を表示する。最後に、縮小・再圧縮した版の幅ごとの大きさを元の画像と並べて表示する。
+import argparse
+import os
+import statistics
+import time
+
+from streamlit.elements.lib import image_utils
+from streamlit.testing.v1 import AppTest
+
+from hydrocare.images import ImageVariantCache
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app.py")
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+WALKTHROUGH_STEPS = 3
+
+# st.image が最終的に配信するバイト列の大きさを記録する
+served_bytes = []
+_original_ensure = image_utils._ensure_image_size_and_format
+
+
+def _recording_ensure(image_data, layout_config, image_format):
+    result = _original_ensure(image_data, layout_config, image_format)
+    served_bytes.append(len(result))
+    return result
+
+
+image_utils._ensure_image_size_and_format = _recording_ensure
+
+
+def measure_step(script, step, repeat):
+    at = AppTest.from_file(os.path.abspath(script), default_timeout=120)
+    at.session_state.walkthrough_step = step
+    served_bytes.clear()
+    started = time.perf_counter()
+    at.run()
+    first_ms = (time.perf_counter() - started) * 1000
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    step_bytes = sum(served_bytes)
+
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        at.run()
+        samples.append((time.perf_counter() - started) * 1000)
+    return step_bytes, first_ms, statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ウォークスルー画像の転送量と描画時間を計測します。")
+    parser.add_argument("--script", default=APP_PATH, help="計測する app.py のパス")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # app.py は data/ からの相対パスで画像を読むため、リポジトリの直下で実行する
+    os.chdir(REPO_DIR)
+    print(f"script: {os.path.abspath(args.script)}")
+    print(f"{'step':>4}{'served KB':>12}{'first run ms':>14}{'rerun ms':>10}")
+    for step in range(WALKTHROUGH_STEPS):
+        step_bytes, first_ms, rerun_ms = measure_step(args.script, step, args.repeat)
+        print(f"{step + 1:>4}{step_bytes / 1024:>12.1f}{first_ms:>14.0f}{rerun_ms:>10.0f}")
+
+    cache = ImageVariantCache()
+    print(f"\n{'image':<48}{'original KB':>12}  variants (width: KB)")
+    for name in sorted(os.listdir("data")):
+        path = os.path.join("data", name)
+        if not name.lower().endswith((".png", ".jpg", ".jpeg")):
+            continue
+        variants = cache.variants(path)
+        sizes = ", ".join(f"{width}: {len(data) / 1024:.1f}" for width, data in sorted(variants.items()))
+        print(f"{name[:46]:<48}{os.path.getsize(path) / 1024:>12.1f}  {sizes}")
+
+
+if __name__ == "__main__":
+    main()
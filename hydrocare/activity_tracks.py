@@ -0,0 +1,354 @@
+import collections
+import re
+import time
+
+from hydrocare.hourly_plan import LEVEL_LABELS
+from hydrocare.hydration import (
+    ACTIVITY_CODES,
+    ACTIVITY_WATER_LOSS_PER_MINUTE,
+    WBGT_SWEAT_FACTORS,
+    wbgt_level_index_array,
+)
+from hydrocare.lazy import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+TRACK_FORMATS = {".gpx": "gpx", ".tcx": "tcx"}
+# 区間の長さ (秒)
+SEGMENT_SECONDS = 300
+# ファイルを一度に読むバイト数。読み込み中に持つのはこの大きさ分の点だけで、途中で切れた点は次の読み込みにつなぐ
+CHUNK_BYTES = 4 * 1024 * 1024
+# 閉じていない1点としてつなぐ大きさの上限と、最初の点が見つからないまま読む大きさの上限 (GPX / TCX でないファイルを読み続けない)
+MAX_POINT_BYTES = 64 * 1024
+MAX_BYTES_BEFORE_FIRST_POINT = 16 * 1024 * 1024
+# 最初の点からこの時間より後・前の時刻の点は壊れた値として読み飛ばす (区間の数を抑える)
+MAX_ACTIVITY_HOURS = 48
+# 前の点からこれより時間が空いた・遅い区間は止まっていたものとして、活動時間に数えない
+MAX_STEP_SECONDS = 60
+MIN_MOVING_KMH = 1.0
+EARTH_RADIUS_M = 6_371_000
+
+# 活動の種類ごとの基準の速さ (km/h)。ACTIVITY_WATER_LOSS_PER_MINUTE の量はこの速さ・平地で動いた場合とみなす
+REFERENCE_SPEED_KMH = {"ウォーキング": 5.0, "ランニング": 10.0, "サイクリング": 20.0}
+# 強度 = 基準の速さに対する比 × (1 + 上り勾配 × GRADE_FACTOR)。極端な値は MAX_INTENSITY で抑える
+GRADE_FACTOR = 10.0
+MAX_INTENSITY = 2.5
+_SWEAT_FACTORS = [WBGT_SWEAT_FACTORS[label] for label in LEVEL_LABELS]
+
+# ファイルに書かれた種目名 (小文字) から活動の種類へ
+SPORT_ALIASES = {
+    **ACTIVITY_CODES,
+    "run": "ランニング", "trail_running": "ランニング",
+    "walk": "ウォーキング", "hiking": "ウォーキング",
+    "biking": "サイクリング", "bike": "サイクリング", "ride": "サイクリング", "road_biking": "サイクリング",
+}
+
+
+def _value(name):
+    # <name> の値 (名前空間の接頭辞があってもよい)。空白だけの値と終了タグには一致しない
+    return re.compile(name + rb">\s*([^<\s][^<]*)<")
+
+
+TrackPatterns = collections.namedtuple("TrackPatterns", ['point_start', 'point_end', 'sport', 'fields'])
+# 形式ごとの点の開始・終了タグ、種目、点の中の値 (lat, lon, ele, distance, hr, time)。
+# どれも先頭が決まった文字列の正規表現にして、正規表現の高速な文字列探索が使えるようにしている
+TRACK_PATTERNS = {
+    "gpx": TrackPatterns(
+        point_start=re.compile(rb"<trkpt[\s>]"),
+        point_end=re.compile(rb"</trkpt>"),
+        sport=_value(rb"<type"),
+        fields={
+            'lat': re.compile(rb"""lat=["']([^"']*)"""),
+            'lon': re.compile(rb"""lon=["']([^"']*)"""),
+            'ele': _value(rb"ele"),
+            'hr': _value(rb"hr"),  # <gpxtpx:hr> など
+            'time': _value(rb"time"),
+        },
+    ),
+    "tcx": TrackPatterns(
+        point_start=re.compile(rb"<Trackpoint[\s>]"),
+        point_end=re.compile(rb"</Trackpoint>"),
+        sport=re.compile(rb"""<Activity\s[^>]*Sport=["']([^"']*)"""),
+        fields={
+            'lat': _value(rb"LatitudeDegrees"),
+            'lon': _value(rb"LongitudeDegrees"),
+            'ele': _value(rb"AltitudeMeters"),
+            'distance': _value(rb"DistanceMeters"),
+            # 周回の <AverageHeartRateBpm>・<MaximumHeartRateBpm> には一致させない
+            'hr': re.compile(rb"[<:]HeartRateBpm[^>]*>\s*<(?:[\w.-]+:)?Value>\s*([^<]*)<"),
+            'time': _value(rb"Time"),
+        },
+    ),
+}
+NUMBER_FIELDS = ['lat', 'lon', 'ele', 'distance', 'hr']
+NAT = -(2 ** 63)
+
+ActivityTrack = collections.namedtuple("ActivityTrack", [
+    'activity_type',
+    'start',  # 最初の点の時刻 (UTC、datetime64[s])
+    'points',
+    'skipped_points',  # 時刻が最初の点から MAX_ACTIVITY_HOURS の範囲外で読み飛ばした点の数
+    'moving_minutes',
+    'distance_km',
+    'water_loss_ml',
+    'segments',  # 区間ごとの DataFrame (segment_frame)
+    'seconds',  # 読み込みと計算にかかった時間
+])
+
+
+def detect_track_format(filename):
+    for extension, fmt in TRACK_FORMATS.items():
+        if filename.lower().endswith(extension):
+            return fmt
+    raise ValueError(f"対応していないファイル形式です: {filename} (GPX / TCX に対応しています)")
+
+
+# --- 区間ごとの集計 ---
+# 点をブロックごとに受け取り、隣り合う点の間 (ステップ) の時間・距離・上昇量・心拍を、
+# ステップの開始時刻が属する区間へ np.bincount でまとめて足し込む。ブロックの境目は前のブロックの最後の点から続ける
+class _SegmentAccumulator:
+    COLUMNS = ["moving_seconds", "distance_m", "ascent_m", "hr_seconds", "hr_weighted"]
+
+    def __init__(self):
+        self.start_ns = None
+        self.points = 0
+        self.skipped = 0
+        self.totals = {column: np.zeros(0, dtype=np.float64) for column in self.COLUMNS}
+        self._last = None  # 前のブロックの最後の点 (ns, 緯度, 経度, 標高, 累積距離, 心拍)
+
+    def add_block(self, ns, lat, lon, ele, distance, hr):
+        columns = [ns.astype(np.float64), lat, lon, ele, distance, hr]
+        valid = ns != NAT
+        if self.start_ns is None and valid.any():
+            self.start_ns = columns[0][valid][0]
+        if self.start_ns is not None:
+            offset = columns[0] - self.start_ns
+            in_range = valid & (offset >= 0) & (offset <= MAX_ACTIVITY_HOURS * 3600e9)
+            self.skipped += int(valid.sum() - in_range.sum())
+            valid = in_range
+        columns = [column[valid] for column in columns]
+        if not len(columns[0]):
+            return
+        self.points += len(columns[0])
+        if self._last is not None:
+            columns = [np.concatenate(([last], column)) for last, column in zip(self._last, columns)]
+        self._last = [column[-1] for column in columns]
+        if len(columns[0]) > 1:
+            self._add_steps(*columns)
+
+    def _add_steps(self, ns, lat, lon, ele, distance, hr):
+        dt = np.diff(ns) / 1e9
+        # 距離は TCX の累積距離があればその差、なければ緯度・経度から (haversine)
+        step_m = np.diff(distance)
+        lat_rad, lon_rad = np.radians(lat), np.radians(lon)
+        a = np.sin(np.diff(lat_rad) / 2) ** 2 + np.cos(lat_rad[:-1]) * np.cos(lat_rad[1:]) * np.sin(np.diff(lon_rad) / 2) ** 2
+        haversine_m = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+        step_m = np.where(np.isnan(step_m), haversine_m, step_m)
+        step_m = np.nan_to_num(np.maximum(step_m, 0))
+
+        moving = (dt > 0) & (dt <= MAX_STEP_SECONDS) & (step_m / np.maximum(dt, 1e-9) * 3.6 >= MIN_MOVING_KMH)
+        ascent = np.where(moving, np.nan_to_num(np.maximum(np.diff(ele), 0)), 0)
+        step_hr = hr[:-1]
+        has_hr = moving & ~np.isnan(step_hr)
+        segment = ((ns[:-1] - self.start_ns) // (SEGMENT_SECONDS * 1e9)).astype(np.int64)
+        segment = np.maximum(segment, 0)
+
+        size = int(segment.max()) + 1
+        values = {
+            "moving_seconds": np.where(moving, dt, 0),
+            "distance_m": np.where(moving, step_m, 0),
+            "ascent_m": ascent,
+            "hr_seconds": np.where(has_hr, dt, 0),
+            "hr_weighted": np.where(has_hr, np.nan_to_num(step_hr) * dt, 0),
+        }
+        for column, value in values.items():
+            total = self.totals[column]
+            if len(total) < size:
+                total = self.totals[column] = np.concatenate((total, np.zeros(size - len(total))))
+            total[:size] += np.bincount(segment, weights=value, minlength=size)
+
+
+# --- 読み込み: ファイルを CHUNK_BYTES ずつ読み、読み終えた点から順に集計へ渡す ---
+# XML の木は作らず、点のタグと値を正規表現でまとめて探して配列にし、値の位置がどの点の中かを np.searchsorted で決める。
+# 値ごとの処理は位置と値を集めるだけにし、点への対応づけと数値への変換は numpy でまとめて行う
+def _read_points(source, fmt, accumulator):
+    patterns = TRACK_PATTERNS[fmt]
+    sport = None
+    buffer = b""
+    read_bytes = 0
+    found_point = False
+    while True:
+        chunk = source.read(CHUNK_BYTES)
+        read_bytes += len(chunk)
+        buffer += chunk
+        if sport is None:
+            match = patterns.sport.search(buffer)
+            sport = match.group(1).decode("utf-8", "replace") if match else None
+        # 最後に閉じた点までを処理し、残りは次の読み込みにつなぐ
+        cut = buffer.rfind(patterns.point_end.pattern)
+        if cut >= 0:
+            found_point = True
+            cut += len(patterns.point_end.pattern)
+            accumulator.add_block(*_scan_points(buffer, cut, patterns))
+            buffer = buffer[cut:]
+        elif not found_point and read_bytes > MAX_BYTES_BEFORE_FIRST_POINT:
+            raise ValueError(f"活動の記録ファイル ({fmt.upper()}) の点が見つかりません")
+        if not chunk:
+            return SPORT_ALIASES.get((sport or "").strip().casefold())
+        buffer = _unclosed_point(buffer, patterns)
+
+
+# 閉じていない点の開始タグから後ろだけを次の読み込みにつなぐ (点の外は、途中で切れたタグになりうる末尾だけを残す)
+def _unclosed_point(buffer, patterns):
+    match = patterns.point_start.search(buffer)
+    if match is None:
+        return buffer[-len(patterns.point_start.pattern):]
+    if len(buffer) - match.start() > MAX_POINT_BYTES:
+        raise ValueError(f"活動の記録ファイルに閉じていない点があります ({MAX_POINT_BYTES // 1024} KB を超えています)")
+    return buffer[match.start():]
+
+
+def _scan_points(buffer, end, patterns):
+    starts, point_ends = _point_positions(buffer, end, patterns)
+    count = len(starts)
+    first = int(starts[0]) if count else end
+    columns = {name: np.full(count, np.nan) for name in NUMBER_FIELDS}
+    times = np.full(count, None, dtype=object)
+    for name, pattern in patterns.fields.items():
+        # 値の数が点の数と同じでも、値のない点と点の外の値 (周回の平均心拍など) が重なっていることがあるため、
+        # 値ごとにどの点の中にあるかを必ず調べる
+        values, positions = [], []
+        for match in pattern.finditer(buffer, first, end):
+            values.append(match[1])
+            positions.append(match.start())
+        positions = np.array(positions, dtype=np.int64)
+        index = np.searchsorted(starts, positions, side="right") - 1
+        inside = (index >= 0) & (positions < point_ends[np.maximum(index, 0)])
+        if not inside.all():
+            values = [value for value, keep in zip(values, inside) if keep]
+            index = index[inside]
+        if name == 'time':
+            times[index] = values
+        else:
+            columns[name][index] = _to_float(values)
+    return _parse_times(times), columns['lat'], columns['lon'], columns['ele'], columns['distance'], columns['hr']
+
+
+def _point_positions(buffer, end, patterns):
+    starts = np.fromiter((match.start() for match in patterns.point_start.finditer(buffer, 0, end)), dtype=np.int64)
+    ends = np.fromiter((match.start() for match in patterns.point_end.finditer(buffer, 0, end)), dtype=np.int64)
+    # 各点の終わり = 点の開始より後にある最初の終了タグ
+    return starts, ends[np.minimum(np.searchsorted(ends, starts), len(ends) - 1)]
+
+
+def _to_float(values):
+    try:
+        return np.fromiter(map(float, values), dtype=np.float64, count=len(values))
+    except ValueError:
+        # 数値でない値が混じっている場合だけ1つずつ変換し、読めないものは NaN にする
+        return np.array([_float_or_nan(value) for value in values], dtype=np.float64)
+
+
+def _float_or_nan(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+# ISO 8601 の時刻を UTC の ns に。末尾が Z の時刻 (GPX / TCX でふつうの書き方) は NumPy で直接読み、
+# 時差つきや欠けた時刻が混じる場合だけ pandas で読む。読めない時刻は NAT
+def _parse_times(times):
+    if not len(times):
+        return np.zeros(0, dtype=np.int64)
+    if None not in times:
+        texts = times.astype(bytes)
+        if np.char.endswith(texts, b"Z").all():
+            try:
+                return np.char.rstrip(texts, b"Z").astype("datetime64[ns]").astype(np.int64)
+            except ValueError:
+                pass
+    texts = [value.decode("ascii", "replace") if value is not None else None for value in times]
+    return pd.to_datetime(texts, utc=True, format="ISO8601", errors="coerce").tz_localize(None).as_unit("ns").asi8
+
+
+# --- 区間ごとの水分の損失 ---
+# 区間の活動時間 × 活動の種類の1分あたりの量 × 強度 (速さ・上り勾配) × その時刻の暑さ指数の発汗倍率。
+# city_table (hourly_plan.CityHourTable) がなければ暑さの補正はしない (倍率 1.0)
+def segment_frame(accumulator, activity_type, city_table=None):
+    totals = accumulator.totals
+    keep = totals["moving_seconds"] > 0
+    segment_index = np.flatnonzero(keep)
+    moving_minutes = totals["moving_seconds"][keep] / 60
+    distance_m = totals["distance_m"][keep]
+    speed_kmh = distance_m / np.maximum(totals["moving_seconds"][keep], 1e-9) * 3.6
+    grade = totals["ascent_m"][keep] / np.maximum(distance_m, 1.0)
+    hr_seconds = totals["hr_seconds"][keep]
+    heart_rate = np.where(hr_seconds > 0, totals["hr_weighted"][keep] / np.maximum(hr_seconds, 1e-9), np.nan)
+
+    start_ns = accumulator.start_ns if accumulator.start_ns is not None else 0
+    segment_start = (start_ns + segment_index * SEGMENT_SECONDS * 1e9).astype(np.int64).astype("datetime64[ns]")
+    wbgt = track_wbgt(city_table, segment_start + np.timedelta64(SEGMENT_SECONDS // 2, "s"))
+    level_index = wbgt_level_index_array(np.nan_to_num(wbgt))
+    sweat_factor = np.where(np.isnan(wbgt), 1.0, np.asarray(_SWEAT_FACTORS, dtype=np.float64)[level_index])
+    level = np.where(np.isnan(wbgt), None, np.asarray(LEVEL_LABELS, dtype=object)[level_index])
+
+    intensity = np.clip(
+        speed_kmh / REFERENCE_SPEED_KMH.get(activity_type, 5.0) * (1 + GRADE_FACTOR * grade), 0, MAX_INTENSITY
+    )
+    water_loss_ml = moving_minutes * ACTIVITY_WATER_LOSS_PER_MINUTE.get(activity_type, 0) * intensity * sweat_factor
+    local_offset = np.timedelta64(city_table.utc_offset if city_table is not None else _local_utc_offset(), "s")
+    return pd.DataFrame({
+        '開始': (segment_start + local_offset).astype("datetime64[s]"),
+        '活動時間 (分)': np.round(moving_minutes, 1),
+        '距離 (km)': np.round(distance_m / 1000, 2),
+        '速さ (km/h)': np.round(speed_kmh, 1),
+        '上昇 (m)': np.round(totals["ascent_m"][keep]).astype(np.int64),
+        '心拍': np.round(heart_rate),
+        '強度': np.round(intensity, 2),
+        '暑さ指数 (WBGT)': np.round(wbgt, 1),
+        '警戒レベル': level,
+        '失われる水分 (ml)': np.rint(water_loss_ml).astype(np.int64),
+    })
+
+
+# 時刻 (UTC、datetime64) ごとの暑さ指数。都市の1時間ごとの表から補間し、表の範囲外は最初・最後の時の値を使う
+def track_wbgt(city_table, times):
+    if city_table is None or not len(times):
+        return np.full(len(times), np.nan)
+    table_minutes = city_table.hours.astype("datetime64[m]").astype(np.int64) - city_table.utc_offset // 60
+    return np.interp(times.astype("datetime64[m]").astype(np.int64), table_minutes, city_table.wbgt)
+
+
+def _local_utc_offset():
+    return -time.timezone if not time.localtime().tm_isdst else -time.altzone
+
+
+# ファイルを読み、区間ごとの水分の損失を求める。種目がファイルに書かれていなければ activity_type を使う
+def load_activity_track(source, fmt, activity_type=None, city_table=None):
+    started = time.perf_counter()
+    accumulator = _SegmentAccumulator()
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            return load_activity_track(f, fmt, activity_type, city_table)
+    detected_type = _read_points(source, fmt, accumulator)
+    if accumulator.points < 2 and accumulator.skipped:
+        raise ValueError(f"活動の記録ファイルの時刻が、最初の点から{MAX_ACTIVITY_HOURS}時間の範囲にありません")
+    if accumulator.points < 2:
+        raise ValueError("活動の記録ファイルに時刻つきの点が2つ以上ありません")
+    activity_type = detected_type or activity_type
+    if activity_type not in ACTIVITY_WATER_LOSS_PER_MINUTE:
+        raise ValueError("活動の種類が分かりません。ファイルに種目がない場合は活動の種類を選んでください")
+    segments = segment_frame(accumulator, activity_type, city_table)
+    return ActivityTrack(
+        activity_type=activity_type,
+        start=np.datetime64(int(accumulator.start_ns), "ns").astype("datetime64[s]"),
+        points=accumulator.points,
+        skipped_points=accumulator.skipped,
+        moving_minutes=float(segments['活動時間 (分)'].sum()),
+        distance_km=float(accumulator.totals["distance_m"].sum() / 1000),
+        water_loss_ml=int(segments['失われる水分 (ml)'].sum()),
+        segments=segments,
+        seconds=time.perf_counter() - started,
+    )
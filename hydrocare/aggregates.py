@@ -0,0 +1,36 @@
+import datetime
+
+
+# --- 1日分の水分摂取量の集計 ---
+# 記録ボタンが押されるたびに O(1) で加算し、ホーム・サイドバー・推奨量の表示はこの値を直接読む
+class DailyIntakeTotals:
+    def __init__(self, date, by_type=None, last_intake_time=None):
+        self.date = date
+        self.by_type = dict(by_type or {})
+        self.total_ml = sum(self.by_type.values())
+        self.last_intake_time = last_intake_time
+
+    @classmethod
+    def load(cls, store, user_id, date):
+        return cls(date, store.daily_totals_by_type(user_id, date), store.last_intake_time(user_id))
+
+    def add(self, time, amount_ml, drink_type):
+        if time.date() == self.date:
+            self.total_ml += amount_ml
+            self.by_type[drink_type] = self.by_type.get(drink_type, 0) + amount_ml
+        if self.last_intake_time is None or time > self.last_intake_time:
+            self.last_intake_time = time
+
+    # 一括取り込みなどでまとめて記録が増えたときに、ストレージから読み直す
+    def reload(self, store, user_id):
+        self.by_type = store.daily_totals_by_type(user_id, self.date)
+        self.total_ml = sum(self.by_type.values())
+        self.last_intake_time = store.last_intake_time(user_id)
+
+    # 日付が変わったら、過去の記録を走査せずに新しい日の集計 (日別集計テーブルの1行) へ切り替える
+    def roll_over(self, store, user_id, today=None):
+        today = today or datetime.date.today()
+        if today != self.date:
+            self.date = today
+            self.by_type = store.daily_totals_by_type(user_id, today)
+            self.total_ml = sum(self.by_type.values())
@@ -0,0 +1,255 @@
+# --- 水分補給記録のまとめて取り込み・書き出し (CSV / JSON Lines / Parquet) ---
+# 使い方:
+#   python -m hydrocare.bulk_io import USER_ID history.csv
+#   python -m hydrocare.bulk_io export USER_ID -o history.parquet
+#
+# ファイルは --chunksize 行ずつ読み込み、時刻・量・種類をまとめて (配列演算で) 検証・正規化してから、
+# 1かたまりを1回のトランザクションで追加する (取り消しはファイル全体で1回の操作)。
+# ファイル全体をメモリに載せないため、行数が増えてもメモリ使用量は変わらない。
+# 書き出しも同じく、記録を時刻順に少しずつ読み出しては書き足す。
+import argparse
+import collections
+import datetime
+import os
+import sys
+import time
+
+from hydrocare.columnar import DRINK_TYPES
+from hydrocare.lazy import lazy_import
+from hydrocare.storage import WaterLogStore
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+pa = lazy_import("pyarrow")
+pq = lazy_import("pyarrow.parquet")
+
+FORMATS = ["csv", "jsonl", "parquet"]
+FORMAT_EXTENSIONS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "jsonl", ".parquet": "parquet", ".pq": "parquet"}
+DEFAULT_CHUNKSIZE = 100_000
+
+# 1件の量として受け付ける範囲 (ml)
+MIN_IMPORT_AMOUNT_ML = 1
+MAX_IMPORT_AMOUNT_ML = 5000
+
+# 他のアプリ・表計算ソフトで使われがちな列名 (小文字にして比べる)
+COLUMN_ALIASES = {
+    'time': ["time", "timestamp", "datetime", "date", "日時", "時刻"],
+    'amount_ml': ["amount_ml", "amount", "ml", "volume", "volume_ml", "量", "摂取量"],
+    'type': ["type", "drink_type", "drink", "beverage", "種類", "飲み物"],
+}
+
+# 飲み物の種類の表記ゆれ (小文字にして比べる)。どれにも当たらない種類は「その他」にする
+DRINK_TYPE_ALIASES = {
+    "water": "水", "mineral water": "水",
+    "tea": "お茶", "green tea": "お茶", "緑茶": "お茶", "麦茶": "お茶",
+    "sports drink": "スポーツドリンク", "sports": "スポーツドリンク",
+    "juice": "ジュース",
+    "coffee": "コーヒー",
+    **{drink_type.casefold(): drink_type for drink_type in DRINK_TYPES},
+}
+DEFAULT_DRINK_TYPE = "その他"
+
+# 取り込みの結果 (拒否した行の番号はファイル内の0始まりの行番号で、先頭の数件だけ残す)
+ImportReport = collections.namedtuple("ImportReport", ["rows", "imported", "rejected", "rejected_rows", "seconds"])
+MAX_REPORTED_REJECTIONS = 20
+
+
+def detect_format(filename):
+    fmt = FORMAT_EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+    if fmt is None:
+        raise ValueError(f"対応していないファイル形式です: {filename} (CSV / JSON Lines / Parquet に対応しています)")
+    return fmt
+
+
+def rows_per_second(report):
+    return report.rows / max(report.seconds, 1e-9)
+
+
+# --- 読み込み: ファイルを DataFrame のかたまりに分けて順に返す ---
+def read_chunks(source, fmt, chunksize=DEFAULT_CHUNKSIZE):
+    if fmt == "csv":
+        yield from pd.read_csv(source, chunksize=chunksize, dtype=str, keep_default_na=False)
+    elif fmt == "jsonl":
+        yield from pd.read_json(source, lines=True, chunksize=chunksize, dtype=False, convert_dates=False)
+    elif fmt == "parquet":
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"対応していない形式です: {fmt}")
+
+
+def _resolve_columns(columns):
+    lowered = {str(column).strip().casefold(): column for column in columns}
+    resolved = {}
+    for name, aliases in COLUMN_ALIASES.items():
+        found = next((lowered[alias] for alias in aliases if alias in lowered), None)
+        if found is None and name != 'type':
+            raise ValueError(f"取り込むファイルに {name} の列がありません (使える列名: {', '.join(aliases)})")
+        resolved[name] = found
+    return resolved
+
+
+# 時刻の末尾の UTC からの時差 (Z / +09:00 / -0500)
+UTC_OFFSET_PATTERN = r"\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?\s*(?:Z|[+-]\d{2}:?\d{2})$"
+
+
+# 時刻をタイムゾーンなしの現地時刻 (datetime64[us]) にする。読めない値は NaT
+# ISO 8601 の表記はまとめて変換し、読めなかった行だけ1行ずつ書式を推測する。時差つきの時刻は現地時刻に直す
+def _normalize_times(values):
+    local_timezone = datetime.datetime.now().astimezone().tzinfo
+    if pd.api.types.is_datetime64_any_dtype(values):
+        if getattr(values.dt, "tz", None) is not None:
+            values = values.dt.tz_convert(local_timezone).dt.tz_localize(None)
+        return values.astype("datetime64[us]")
+
+    text = values.astype(str).str.strip()
+    times = pd.Series(pd.NaT, index=text.index, dtype="datetime64[us]")
+    has_offset = text.str.contains(UTC_OFFSET_PATTERN, regex=True).to_numpy()
+    if has_offset.any():
+        times[has_offset] = (
+            pd.to_datetime(text[has_offset], errors="coerce", format="ISO8601", utc=True)
+            .dt.tz_convert(local_timezone).dt.tz_localize(None)
+        )
+    times[~has_offset] = pd.to_datetime(text[~has_offset], errors="coerce", format="ISO8601")
+    retry = times.isna().to_numpy() & (text != "").to_numpy()
+    if retry.any():
+        times[retry] = pd.to_datetime(text[retry], errors="coerce", format="mixed")
+    return times
+
+
+def _normalize_drink_types(values):
+    if values is None:
+        return None
+    # 種類は数種類しかないので、出てきた表記ごとに1回だけ表を引いてから全行に展開する
+    categories = pd.Categorical(values.astype(str).str.strip())
+    mapped = np.array(
+        [DRINK_TYPE_ALIASES.get(category.casefold(), DEFAULT_DRINK_TYPE) for category in categories.categories] + [DEFAULT_DRINK_TYPE],
+        dtype=object,
+    )
+    return mapped[categories.codes]
+
+
+# --- 1かたまり分の検証と正規化 ---
+# (時刻のマイクロ秒, 量, 種類) の配列と、受け付けた行を示す真偽値の配列を返す
+def normalize_chunk(chunk):
+    columns = _resolve_columns(chunk.columns)
+    times = _normalize_times(chunk[columns['time']])
+    amounts = pd.to_numeric(chunk[columns['amount_ml']], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    drink_types = _normalize_drink_types(chunk[columns['type']] if columns['type'] is not None else None)
+    if drink_types is None:
+        drink_types = np.full(len(chunk), DEFAULT_DRINK_TYPE, dtype=object)
+
+    timestamps = times.to_numpy().astype(np.int64)
+    valid = (
+        ~times.isna().to_numpy()
+        & ~np.isnan(amounts)
+        & (amounts >= MIN_IMPORT_AMOUNT_ML)
+        & (amounts <= MAX_IMPORT_AMOUNT_ML)
+    )
+    amounts = np.rint(np.where(valid, amounts, 0)).astype(np.int64)
+    return timestamps, amounts, drink_types, valid
+
+
+def import_log(store, user_id, source, fmt, chunksize=DEFAULT_CHUNKSIZE, on_progress=None):
+    started = time.perf_counter()
+    rows = imported = 0
+    rejected_rows = []
+    # ファイル全体で1回の操作にする (途中のかたまりで失敗しても、それまでに取り込んだ分をまとめて取り消せる)
+    with store.import_action(user_id) as revision:
+        for chunk in read_chunks(source, fmt, chunksize):
+            timestamps, amounts, drink_types, valid = normalize_chunk(chunk)
+            store.append_rows(
+                user_id, zip(timestamps[valid].tolist(), amounts[valid].tolist(), drink_types[valid].tolist()), revision
+            )
+            if len(rejected_rows) < MAX_REPORTED_REJECTIONS:
+                rejected_rows.extend((np.flatnonzero(~valid)[:MAX_REPORTED_REJECTIONS - len(rejected_rows)] + rows).tolist())
+            rows += len(chunk)
+            imported += int(valid.sum())
+            if on_progress is not None:
+                on_progress(rows, imported)
+    return ImportReport(rows, imported, rows - imported, rejected_rows, time.perf_counter() - started)
+
+
+# --- 書き出し: 記録を時刻順に batch_size 件ずつ読み出して書き足す ---
+def _export_frame(rows):
+    timestamps, amounts, drink_types = zip(*rows)
+    return pd.DataFrame({
+        'time': np.array(timestamps, dtype=np.int64).view("datetime64[us]"),
+        'amount_ml': np.array(amounts, dtype=np.int64),
+        'type': np.array(drink_types, dtype=object),
+    })
+
+
+def export_log(store, user_id, destination, fmt, batch_size=DEFAULT_CHUNKSIZE):
+    started = time.perf_counter()
+    rows = 0
+    writer = None
+    try:
+        for batch in store.iter_rows(user_id, batch_size):
+            frame = _export_frame(batch)
+            if fmt == "csv":
+                frame['time'] = np.datetime_as_string(frame['time'].to_numpy(), unit="us")
+                _write_text(destination, frame.to_csv(header=rows == 0, index=False))
+            elif fmt == "jsonl":
+                frame['time'] = np.datetime_as_string(frame['time'].to_numpy(), unit="us")
+                _write_text(destination, frame.to_json(orient="records", lines=True, force_ascii=False))
+            elif fmt == "parquet":
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(destination, table.schema)
+                writer.write_table(table)
+            else:
+                raise ValueError(f"対応していない形式です: {fmt}")
+            rows += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows, time.perf_counter() - started
+
+
+# 書き出し先がバイナリ (BytesIO・"wb" で開いたファイル) でもテキストでも書けるようにする
+def _write_text(destination, text):
+    if text and not text.endswith("\n"):
+        text += "\n"
+    try:
+        destination.write(text)
+    except TypeError:
+        destination.write(text.encode("utf-8"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="水分補給記録をまとめて取り込み・書き出しします。")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="ファイルから記録を取り込む")
+    import_parser.add_argument("user_id")
+    import_parser.add_argument("source", help="CSV / JSON Lines / Parquet のファイル")
+    import_parser.add_argument("--format", choices=FORMATS, help="ファイル形式 (省略時は拡張子から判断)")
+    import_parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="一度に読み込む行数")
+    export_parser = subparsers.add_parser("export", help="記録をファイルに書き出す")
+    export_parser.add_argument("user_id")
+    export_parser.add_argument("-o", "--output", required=True, help="書き出し先のファイル")
+    export_parser.add_argument("--format", choices=FORMATS, help="ファイル形式 (省略時は拡張子から判断)")
+    export_parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="一度に読み出す行数")
+    parser.add_argument("--db", default=None, help="データベースのパス (省略時は HYDROCARE_DB_PATH)")
+    args = parser.parse_args(argv)
+
+    store = WaterLogStore(args.db) if args.db else WaterLogStore()
+    if args.command == "import":
+        fmt = args.format or detect_format(args.source)
+        report = import_log(store, args.user_id, args.source, fmt, args.chunksize)
+        print(
+            f"{report.imported} / {report.rows} rows imported, {report.rejected} rejected "
+            f"in {report.seconds:.2f}s ({rows_per_second(report):,.0f} rows/s)",
+            file=sys.stderr,
+        )
+        if report.rejected_rows:
+            print(f"rejected rows (first {len(report.rejected_rows)}): {report.rejected_rows}", file=sys.stderr)
+    else:
+        fmt = args.format or detect_format(args.output)
+        with open(args.output, "wb") as destination:
+            rows, seconds = export_log(store, args.user_id, destination, fmt, args.chunksize)
+        print(f"{rows} rows exported in {seconds:.2f}s ({rows / max(seconds, 1e-9):,.0f} rows/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+from hydrocare.lazy import lazy_import
+
+alt = lazy_import("altair")
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# 1本の線あたりの点数の上限 (これを超える期間は LTTB で間引いてから送る)
+MAX_CHART_POINTS = 120
+
+# 縦持ちにしたときの項目名 (凡例の並び順 = 色の順: 青, オレンジ)
+SERIES_LABELS = {'Total_ML': "摂取量", 'Target_ML': "目標量"}
+
+
+# --- Largest-Triangle-Three-Buckets による間引き ---
+# 先頭と末尾を残し、残りを threshold - 2 個の区間に分けて、前後の点と作る三角形が最も大きい点を1つずつ選ぶ。
+# 山や谷の形を保ったまま点数を減らせる。選んだ点の位置 (昇順) を返す
+def lttb_indices(x, y, threshold):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # 次の区間の平均点 (最後の区間では末尾の点) を三角形の3つ目の頂点にする
+        next_start, next_end = end, edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x = x[next_start:next_end].mean() if next_end > next_start else x[-1]
+        next_y = y[next_start:next_end].mean() if next_end > next_start else y[-1]
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = selected[bucket + 1] = start + int(np.argmax(areas))
+    return selected
+
+
+# 点数が max_points を超える場合は、摂取量の線の形を基準に間引く (目標量も同じ日付の点を使う)
+def downsample_summary(summary, max_points=MAX_CHART_POINTS):
+    if len(summary) <= max_points:
+        return summary
+    x = summary['Date'].to_numpy(dtype="datetime64[us]").astype(np.int64)
+    return summary.iloc[lttb_indices(x, summary['Total_ML'].to_numpy(), max_points)].reset_index(drop=True)
+
+
+# ブラウザ側の transform_fold の代わりに、サーバー側で (Date, 項目, 量) の縦持ちにする
+def fold_summary(summary, include_target=True):
+    columns = ['Total_ML', 'Target_ML'] if include_target else ['Total_ML']
+    folded = summary.melt(id_vars='Date', value_vars=columns, var_name='項目', value_name='摂取量 (ml)')
+    folded['項目'] = folded['項目'].map(SERIES_LABELS)
+    return folded
+
+
+# --- 摂取ログのグラフの Vega-Lite 仕様 (dict) を作る ---
+# 同じ記録・期間なら同じ dict になるため、呼び出し側でキャッシュすれば再実行時に作り直さずに済む
+def build_intake_chart_spec(summary, title, y_max, include_target=True, max_points=MAX_CHART_POINTS):
+    folded = fold_summary(downsample_summary(summary, max_points), include_target)
+    labels = [SERIES_LABELS['Total_ML'], SERIES_LABELS['Target_ML']] if include_target else [SERIES_LABELS['Total_ML']]
+    y_title = '摂取量/目標量 (ml)' if include_target else '摂取量 (ml)'
+    chart = alt.Chart(folded).mark_line().encode(
+        x=alt.X('Date:T', title='日付'),
+        y=alt.Y('摂取量 (ml):Q', title=y_title, scale=alt.Scale(domain=[0, y_max])),
+        color=alt.Color('項目:N', title='項目', scale=alt.Scale(domain=labels), legend=alt.Legend(title="項目") if include_target else None),
+    ).properties(
+        title=title
+    )
+    return chart.to_dict()
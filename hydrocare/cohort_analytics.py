@@ -0,0 +1,493 @@
+import collections
+import contextlib
+import datetime
+import sqlite3
+import threading
+import time
+
+from hydrocare.hydration import WBGT_LEVELS
+from hydrocare.lazy import lazy_import
+from hydrocare.storage import (
+    DEFAULT_DB_PATH, MICROSECONDS_PER_DAY, MICROSECONDS_PER_HOUR, WaterLogStore, from_day_number, to_day_number,
+)
+from hydrocare.weather import normalize_city_name
+
+pd = lazy_import("pandas")
+
+# water_log_events を読む仕組みとしての名前 (event_consumers に読み終えたイベントの番号を登録する)。
+# まだ最初の集計をしていない間は NOT_BUILT を登録し、整理でイベントが消されないようにする
+CONSUMER_NAME = "cohorts"
+NOT_BUILT = -1
+# 1回の反映で読むイベントの数 (1トランザクションで書き込みのロックを持つ時間を抑える)
+REFRESH_BATCH_EVENTS = 20_000
+UNKNOWN = "未設定"
+AGE_BANDS = [(60, "60歳以上"), (50, "50代"), (40, "40代"), (30, "30代"), (20, "20代"), (0, "19歳以下")]
+# 暑い日 = その都市のその日の最高の暑さ指数が厳重警戒以上
+HOT_WBGT = next(threshold for threshold, label in WBGT_LEVELS if label == "厳重警戒")
+
+COHORT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cohort_user_days (
+    user_id TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    city TEXT NOT NULL,
+    age_band TEXT NOT NULL,
+    target_ml INTEGER NOT NULL,
+    total_ml INTEGER NOT NULL,
+    entry_count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cohort_daily (
+    day INTEGER NOT NULL,
+    city TEXT NOT NULL,
+    age_band TEXT NOT NULL,
+    users INTEGER NOT NULL,
+    targeted_users INTEGER NOT NULL,
+    attained_users INTEGER NOT NULL,
+    total_ml INTEGER NOT NULL,
+    entry_count INTEGER NOT NULL,
+    PRIMARY KEY (day, city, age_band)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cohort_drinks (
+    day INTEGER NOT NULL,
+    drink_type TEXT NOT NULL,
+    total_ml INTEGER NOT NULL,
+    entry_count INTEGER NOT NULL,
+    PRIMARY KEY (day, drink_type)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cohort_hourly (
+    day INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    total_ml INTEGER NOT NULL,
+    entry_count INTEGER NOT NULL,
+    PRIMARY KEY (day, hour)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cohort_wbgt (
+    day INTEGER NOT NULL,
+    city TEXT NOT NULL,
+    max_wbgt REAL NOT NULL,
+    PRIMARY KEY (day, city)
+) WITHOUT ROWID;
+"""
+COHORT_TABLES = ["cohort_user_days", "cohort_daily", "cohort_drinks", "cohort_hourly"]
+
+# --- 最初の集計: その時点の記録全体から一時テーブルに集計する ({day} と {hour} は時刻から日・時を求める式) ---
+BUILD_STATEMENTS = [
+    f"""
+    CREATE TEMP TABLE build_cohort_user_days AS
+    SELECT w.user_id, w.ts / {MICROSECONDS_PER_DAY} AS day,
+        COALESCE(p.city, '{UNKNOWN}') AS city, COALESCE(p.age_band, '{UNKNOWN}') AS age_band, COALESCE(p.target_ml, 0) AS target_ml,
+        SUM(w.amount_ml) AS total_ml, COUNT(*) AS entry_count
+    FROM water_log AS w LEFT JOIN temp.cohort_profiles AS p ON p.user_id = w.user_id
+    GROUP BY w.user_id, day
+    """,
+    f"""
+    CREATE TEMP TABLE build_cohort_drinks AS
+    SELECT ts / {MICROSECONDS_PER_DAY} AS day, drink_type, SUM(amount_ml) AS total_ml, COUNT(*) AS entry_count
+    FROM water_log GROUP BY day, drink_type
+    """,
+    f"""
+    CREATE TEMP TABLE build_cohort_hourly AS
+    SELECT ts / {MICROSECONDS_PER_DAY} AS day, (ts / {MICROSECONDS_PER_HOUR}) % 24 AS hour, SUM(amount_ml) AS total_ml, COUNT(*) AS entry_count
+    FROM water_log GROUP BY day, hour
+    """,
+]
+COPY_STATEMENTS = [
+    "INSERT INTO cohort_user_days SELECT * FROM temp.build_cohort_user_days",
+    """
+    INSERT INTO cohort_daily
+    SELECT day, city, age_band, COUNT(*), SUM(target_ml > 0), SUM(target_ml > 0 AND total_ml >= target_ml), SUM(total_ml), SUM(entry_count)
+    FROM temp.build_cohort_user_days GROUP BY day, city, age_band
+    """,
+    "INSERT INTO cohort_drinks SELECT * FROM temp.build_cohort_drinks",
+    "INSERT INTO cohort_hourly SELECT * FROM temp.build_cohort_hourly",
+]
+BUILD_TEMP_TABLES = ["cohort_profiles", "build_cohort_user_days", "build_cohort_drinks", "build_cohort_hourly"]
+
+UPSERT_USER_DAY = """
+INSERT INTO cohort_user_days (user_id, day, city, age_band, target_ml, total_ml, entry_count) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (user_id, day) DO UPDATE SET total_ml = excluded.total_ml, entry_count = excluded.entry_count
+"""
+UPSERT_DAILY = """
+INSERT INTO cohort_daily (day, city, age_band, users, targeted_users, attained_users, total_ml, entry_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (day, city, age_band) DO UPDATE SET
+    users = users + excluded.users, targeted_users = targeted_users + excluded.targeted_users,
+    attained_users = attained_users + excluded.attained_users,
+    total_ml = total_ml + excluded.total_ml, entry_count = entry_count + excluded.entry_count
+"""
+UPSERT_DRINKS = """
+INSERT INTO cohort_drinks (day, drink_type, total_ml, entry_count) VALUES (?, ?, ?, ?)
+ON CONFLICT (day, drink_type) DO UPDATE SET
+    total_ml = total_ml + excluded.total_ml, entry_count = entry_count + excluded.entry_count
+"""
+UPSERT_HOURLY = """
+INSERT INTO cohort_hourly (day, hour, total_ml, entry_count) VALUES (?, ?, ?, ?)
+ON CONFLICT (day, hour) DO UPDATE SET
+    total_ml = total_ml + excluded.total_ml, entry_count = entry_count + excluded.entry_count
+"""
+UPSERT_WBGT = """
+INSERT INTO cohort_wbgt (day, city, max_wbgt) VALUES (?, ?, ?)
+ON CONFLICT (day, city) DO UPDATE SET max_wbgt = MAX(max_wbgt, excluded.max_wbgt)
+"""
+
+
+def age_band(age):
+    if age is None:
+        return UNKNOWN
+    for lower, label in AGE_BANDS:
+        if age >= lower:
+            return label
+    return UNKNOWN
+
+
+def city_label(city_name):
+    city_name = normalize_city_name(city_name or "")
+    return city_name.title() if city_name else UNKNOWN
+
+
+# プロフィールの行 (user_id, age, daily_target_ml, city_name) から集計の分け方 (user_id, 都市, 年代, 目標量) へ
+def _profile_attributes(row):
+    user_id, age, daily_target_ml, city_name = row
+    return user_id, city_label(city_name), age_band(age), int(daily_target_ml or 0)
+
+
+def _attained(target_ml, total_ml, entry_count):
+    return target_ml > 0 and entry_count > 0 and total_ml >= target_ml
+
+
+# --- 全ユーザーの集計 (運用者向けの分析) ---
+# 日・都市・年代ごとの利用者数と目標の達成数、日・飲み物の種類ごとと日・時間帯ごとの量を集計テーブルに持つ。
+# 最初に一度だけ記録全体から集計し、その後は記録の変更イベント (water_log_events) を読んだ分だけ足し引きするため、
+# 分析の画面の問い合わせは記録の件数によらず集計テーブルの範囲検索で済む。
+# 記録のある日ごとに、その日に最初に集計したときのプロフィールの都市・年代・目標量で分ける
+# (後からプロフィールを変えても、それまでの日の集計は変わらない)
+class CohortRollups:
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        # 記録のテーブルと event_consumers を先に作っておく (記録のストレージより先に開かれた場合)
+        WaterLogStore(path, compact_min_events=None).close()
+        self._lock = threading.RLock()
+        # 書き込み (集計の更新) と読み出し (分析の画面) は別の接続にして、集計中も画面の問い合わせを待たせない
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._read_lock = threading.Lock()
+        self._read_conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        for conn in (self._conn, self._read_conn):
+            conn.execute("PRAGMA journal_mode=WAL")
+        with self._transaction() as conn:
+            for statement in COHORT_SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            conn.execute("INSERT OR IGNORE INTO event_consumers (name, seq) VALUES (?, ?)", (CONSUMER_NAME, NOT_BUILT))
+
+    def close(self):
+        with self._lock, self._read_lock:
+            self._conn.close()
+            self._read_conn.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _checkpoint(self, conn):
+        row = conn.execute("SELECT seq FROM event_consumers WHERE name = ?", (CONSUMER_NAME,)).fetchone()
+        return row[0] if row else NOT_BUILT
+
+    def is_built(self):
+        with self._read_lock:
+            return self._checkpoint(self._read_conn) != NOT_BUILT
+
+    # --- 最初の集計 ---
+    # 読み出しのトランザクションで見えている記録と、その時点の最後のイベントの番号を一時テーブルに集計してから、
+    # 書き込みのトランザクションで集計テーブルへ移す (記録全体を読む間、記録の追加を待たせない)。
+    # 他のプロセスが先に集計を終えていた場合は何もしない。集計した記録の件数を返す
+    def build(self):
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN")
+            try:
+                row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'water_log_events'").fetchone()
+                checkpoint = row[0] if row else 0
+                conn.execute(
+                    "CREATE TEMP TABLE cohort_profiles (user_id TEXT PRIMARY KEY, city TEXT, age_band TEXT, target_ml INTEGER) WITHOUT ROWID"
+                )
+                conn.executemany("INSERT INTO temp.cohort_profiles VALUES (?, ?, ?, ?)", [
+                    _profile_attributes(row)
+                    for row in conn.execute("SELECT user_id, age, daily_target_ml, city_name FROM user_profiles").fetchall()
+                ])
+                for statement in BUILD_STATEMENTS:
+                    conn.execute(statement)
+                entries = conn.execute("SELECT COALESCE(SUM(entry_count), 0) FROM temp.build_cohort_user_days").fetchone()[0]
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                self._drop_build_tables()
+                raise
+        try:
+            with self._transaction() as conn:
+                if self._checkpoint(conn) != NOT_BUILT:
+                    return 0
+                for table in COHORT_TABLES:
+                    conn.execute(f"DELETE FROM {table}")
+                for statement in COPY_STATEMENTS:
+                    conn.execute(statement)
+                conn.execute("UPDATE event_consumers SET seq = ? WHERE name = ?", (checkpoint, CONSUMER_NAME))
+        finally:
+            self._drop_build_tables()
+        return entries
+
+    def _drop_build_tables(self):
+        with self._lock:
+            for table in BUILD_TEMP_TABLES:
+                self._conn.execute(f"DROP TABLE IF EXISTS temp.{table}")
+
+    # --- 変更イベントの反映 ---
+    # 前回の続きから最大 max_events 件のイベントを読み、集計テーブルに足し引きする。反映したイベントの数を返す
+    # (まだ最初の集計をしていない場合は 0)
+    def refresh(self, max_events=REFRESH_BATCH_EVENTS):
+        with self._transaction() as conn:
+            checkpoint = self._checkpoint(conn)
+            if checkpoint == NOT_BUILT:
+                return 0
+            events = conn.execute(
+                "SELECT seq, user_id, ts, amount_ml, drink_type, prev_ts, prev_amount_ml, prev_drink_type "
+                "FROM water_log_events WHERE seq > ? ORDER BY seq LIMIT ?",
+                (checkpoint, max_events)
+            ).fetchall()
+            if events:
+                self._apply_events(conn, events)
+                conn.execute("UPDATE event_consumers SET seq = ? WHERE name = ?", (events[-1][0], CONSUMER_NAME))
+        return len(events)
+
+    # 追いつくまで refresh を繰り返す (max_seconds を超えたらそこまで)。反映したイベントの数を返す
+    def refresh_all(self, max_seconds=None):
+        started = time.monotonic()
+        total = 0
+        while True:
+            applied = self.refresh()
+            total += applied
+            if applied < REFRESH_BATCH_EVENTS or (max_seconds is not None and time.monotonic() - started >= max_seconds):
+                return total
+
+    def _apply_events(self, conn, events):
+        # イベントを (ユーザー, 日) ごとの増減にまとめる。修正は変更前の値を引いて変更後の値を足す
+        user_days = collections.defaultdict(lambda: [0, 0])
+        drinks = collections.defaultdict(lambda: [0, 0])
+        hourly = collections.defaultdict(lambda: [0, 0])
+        for _, user_id, ts, amount_ml, drink_type, prev_ts, prev_amount_ml, prev_drink_type in events:
+            for row_ts, row_amount_ml, row_drink_type, sign in (
+                (ts, amount_ml, drink_type, 1), (prev_ts, prev_amount_ml, prev_drink_type, -1)
+            ):
+                if row_ts is None:
+                    continue
+                day = row_ts // MICROSECONDS_PER_DAY
+                for totals in (
+                    user_days[(user_id, day)], drinks[(day, row_drink_type)], hourly[(day, row_ts // MICROSECONDS_PER_HOUR % 24)],
+                ):
+                    totals[0] += sign * row_amount_ml
+                    totals[1] += sign
+
+        profiles = self._profiles(conn, {user_id for user_id, _ in user_days})
+        daily = collections.defaultdict(lambda: [0, 0, 0, 0, 0])
+        for (user_id, day), (delta_ml, delta_count) in user_days.items():
+            row = conn.execute(
+                "SELECT city, age_band, target_ml, total_ml, entry_count FROM cohort_user_days WHERE user_id = ? AND day = ?",
+                (user_id, day)
+            ).fetchone()
+            if row is None:
+                city, band, target_ml = profiles.get(user_id, (UNKNOWN, UNKNOWN, 0))
+                total_ml = entry_count = 0
+            else:
+                city, band, target_ml, total_ml, entry_count = row
+            new_total_ml, new_count = total_ml + delta_ml, entry_count + delta_count
+            if new_count > 0:
+                conn.execute(UPSERT_USER_DAY, (user_id, day, city, band, target_ml, new_total_ml, new_count))
+            else:
+                conn.execute("DELETE FROM cohort_user_days WHERE user_id = ? AND day = ?", (user_id, day))
+            counts = daily[(day, city, band)]
+            counts[0] += (new_count > 0) - (entry_count > 0)
+            counts[1] += (target_ml > 0) * ((new_count > 0) - (entry_count > 0))
+            counts[2] += _attained(target_ml, new_total_ml, new_count) - _attained(target_ml, total_ml, entry_count)
+            counts[3] += delta_ml
+            counts[4] += delta_count
+
+        conn.executemany(UPSERT_DAILY, [(*key, *counts) for key, counts in daily.items()])
+        conn.executemany(UPSERT_DRINKS, [(*key, *totals) for key, totals in drinks.items()])
+        conn.executemany(UPSERT_HOURLY, [(*key, *totals) for key, totals in hourly.items()])
+        # 記録がなくなった行は主キーで消す
+        conn.executemany(
+            "DELETE FROM cohort_daily WHERE day = ? AND city = ? AND age_band = ? AND entry_count = 0", list(daily)
+        )
+        conn.executemany("DELETE FROM cohort_drinks WHERE day = ? AND drink_type = ? AND entry_count = 0", list(drinks))
+        conn.executemany("DELETE FROM cohort_hourly WHERE day = ? AND hour = ? AND entry_count = 0", list(hourly))
+
+    def _profiles(self, conn, user_ids):
+        user_ids = list(user_ids)
+        profiles = {}
+        for offset in range(0, len(user_ids), 500):
+            chunk = user_ids[offset:offset + 500]
+            rows = conn.execute(
+                f"SELECT user_id, age, daily_target_ml, city_name FROM user_profiles WHERE user_id IN ({', '.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+            for row in rows:
+                user_id, city, band, target_ml = _profile_attributes(row)
+                profiles[user_id] = (city, band, target_ml)
+        return profiles
+
+    # --- 暑さ指数 ---
+    # 都市のその日の暑さ指数を記録する (同じ日に何度記録しても最高値だけを残す)
+    def record_wbgt(self, city_name, date, wbgt):
+        with self._transaction() as conn:
+            conn.execute(UPSERT_WBGT, (to_day_number(date), city_label(city_name), float(wbgt)))
+
+    # 利用者の多い都市 (プロフィールの都市名) を多い順に最大 limit 件
+    def top_cities(self, limit=20):
+        with self._read_lock:
+            rows = self._read_conn.execute("SELECT city_name, COUNT(*) FROM user_profiles WHERE city_name IS NOT NULL GROUP BY city_name").fetchall()
+        counts = collections.Counter()
+        names = {}
+        for city_name, count in rows:
+            label = city_label(city_name)
+            if label != UNKNOWN:
+                counts[label] += count
+                names.setdefault(label, city_name.strip())
+        return [names[label] for label, _ in counts.most_common(limit)]
+
+    # 最初の集計が済んでいるか、読み終えたイベントの番号と、まだ反映していないイベントの数
+    def status(self):
+        with self._read_lock:
+            checkpoint = self._checkpoint(self._read_conn)
+            pending = self._read_conn.execute(
+                "SELECT COUNT(*) FROM water_log_events WHERE seq > ?", (max(checkpoint, 0),)
+            ).fetchone()[0]
+        return {'built': checkpoint != NOT_BUILT, 'checkpoint': checkpoint, 'pending_events': pending}
+
+    # --- 分析の画面の問い合わせ (start 以上 end 未満の日付。どれも集計テーブルの日付の範囲検索) ---
+    def _frame(self, sql, params, columns):
+        with self._read_lock:
+            rows = self._read_conn.execute(sql, params).fetchall()
+        return pd.DataFrame(rows, columns=columns)
+
+    def _days(self, start, end):
+        return to_day_number(start), to_day_number(end)
+
+    # 日ごとの利用者数 (記録のあった人)・目標の達成率・1人あたりの量
+    def daily_trend(self, start, end):
+        frame = self._frame(
+            "SELECT day, SUM(users), SUM(targeted_users), SUM(attained_users), SUM(total_ml) FROM cohort_daily "
+            "WHERE day >= ? AND day < ? GROUP BY day ORDER BY day",
+            self._days(start, end), ['day', 'users', 'targeted_users', 'attained_users', 'total_ml']
+        )
+        frame.insert(0, '日付', [from_day_number(day) for day in frame.pop('day')])
+        return _with_rates(frame)
+
+    # 都市・年代ごとの延べ利用者数 (記録のあった人の日数)・目標の達成率・1人1日あたりの量
+    def by_group(self, column, start, end):
+        frame = self._frame(
+            f"SELECT {column}, SUM(users), SUM(targeted_users), SUM(attained_users), SUM(total_ml) FROM cohort_daily "
+            f"WHERE day >= ? AND day < ? GROUP BY {column} ORDER BY SUM(users) DESC",
+            self._days(start, end), [column, 'users', 'targeted_users', 'attained_users', 'total_ml']
+        )
+        return _with_rates(frame)
+
+    # 都市ごとの暑さ指数の記録と、暑い日 (厳重警戒以上) とそれ以外の日の1人1日あたりの量
+    def wbgt_exposure(self, start, end):
+        return self._frame(
+            f"""
+            SELECT w.city, COUNT(*), ROUND(AVG(w.max_wbgt), 1), SUM(w.max_wbgt >= {HOT_WBGT}),
+                ROUND(SUM(CASE WHEN w.max_wbgt >= {HOT_WBGT} THEN d.total_ml END) * 1.0
+                    / SUM(CASE WHEN w.max_wbgt >= {HOT_WBGT} THEN d.users END)),
+                ROUND(SUM(CASE WHEN w.max_wbgt < {HOT_WBGT} THEN d.total_ml END) * 1.0
+                    / SUM(CASE WHEN w.max_wbgt < {HOT_WBGT} THEN d.users END))
+            FROM cohort_wbgt AS w LEFT JOIN (
+                SELECT day, city, SUM(users) AS users, SUM(total_ml) AS total_ml FROM cohort_daily
+                WHERE day >= ? AND day < ? GROUP BY day, city
+            ) AS d ON d.day = w.day AND d.city = w.city
+            WHERE w.day >= ? AND w.day < ? GROUP BY w.city ORDER BY w.city
+            """,
+            self._days(start, end) * 2,
+            ['city', 'wbgt_days', 'avg_max_wbgt', 'hot_days', 'hot_day_ml_per_user', 'other_day_ml_per_user']
+        )
+
+    def by_drink_type(self, start, end):
+        frame = self._frame(
+            "SELECT drink_type, SUM(total_ml), SUM(entry_count) FROM cohort_drinks WHERE day >= ? AND day < ? "
+            "GROUP BY drink_type ORDER BY SUM(total_ml) DESC",
+            self._days(start, end), ['drink_type', 'total_ml', 'entry_count']
+        )
+        frame['share'] = frame['total_ml'] / max(frame['total_ml'].sum(), 1)
+        return frame
+
+    # 時間帯 (0〜23時) ごとの量と、全体に占める割合
+    def by_hour(self, start, end):
+        frame = self._frame(
+            "SELECT hour, SUM(total_ml), SUM(entry_count) FROM cohort_hourly WHERE day >= ? AND day < ? GROUP BY hour ORDER BY hour",
+            self._days(start, end), ['hour', 'total_ml', 'entry_count']
+        )
+        frame['share'] = frame['total_ml'] / max(frame['total_ml'].sum(), 1)
+        return frame
+
+
+def _with_rates(frame):
+    frame['attainment_rate'] = (frame['attained_users'] / frame['targeted_users'].where(frame['targeted_users'] > 0)).round(3)
+    frame['ml_per_user_day'] = (frame['total_ml'] / frame['users'].where(frame['users'] > 0)).round()
+    return frame
+
+
+# --- 集計の裏での更新 (全セッションで1つ) ---
+# interval_seconds ごとに変更イベントを反映する。最初の集計がまだなら先に行う。
+# wbgt_source (都市名 -> 暑さ指数、取れなければ None) があれば、利用者の多い都市の今日の暑さ指数を wbgt_interval_seconds ごとに記録する
+class CohortRefresher:
+    def __init__(self, rollups, interval_seconds=30, wbgt_source=None, wbgt_interval_seconds=1800, max_seconds=10):
+        self.rollups = rollups
+        self.interval_seconds = interval_seconds
+        self.wbgt_source = wbgt_source
+        self.wbgt_interval_seconds = wbgt_interval_seconds
+        self.max_seconds = max_seconds
+        self.last_refreshed = None
+        self.last_applied = 0
+        self.last_error = None
+        self._wbgt_recorded_at = None
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cohort-refresh", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def refresh_once(self):
+        if not self.rollups.is_built():
+            self.rollups.build()
+        self.last_applied = self.rollups.refresh_all(self.max_seconds)
+        now = time.monotonic()
+        if self.wbgt_source is not None and (
+            self._wbgt_recorded_at is None or now - self._wbgt_recorded_at >= self.wbgt_interval_seconds
+        ):
+            self._wbgt_recorded_at = now
+            today = datetime.date.today()
+            for city_name in self.rollups.top_cities():
+                wbgt = self.wbgt_source(city_name)
+                if wbgt is not None:
+                    self.rollups.record_wbgt(city_name, today, wbgt)
+        self.last_refreshed = datetime.datetime.now()
+        return self.last_applied
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.refresh_once()
+                self.last_error = None
+            except Exception as e:
+                # 一時的な失敗 (ロック待ちの時間切れや天気の取得の失敗など) は次の回にやり直す
+                self.last_error = e
+            self._stop_event.wait(self.interval_seconds)
@@ -0,0 +1,74 @@
+# --- 名簿 (CSV) から多人数分の水分補給計画を作るコマンド ---
+# 使い方:
+#   python -m hydrocare.cohort_plan roster.csv -o plan.csv
+#   cat roster.csv | python -m hydrocare.cohort_plan - > plan.csv
+#
+# 名簿の列: age, gender, weight_kg, temp_c, humidity, activity, duration_min (その他の列はそのまま出力に残す)
+# activity は「ランニング」などの日本語名か running / walking / cycling のコード。
+# 名簿は --chunksize 行ずつ読み込んで計算し、計算できた分から順に書き出す。
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from hydrocare.hydration import (
+    calculate_activity_water_loss_array,
+    calculate_base_water_intake_array,
+    calculate_wbgt_array,
+    classify_wbgt_array,
+)
+
+ROSTER_COLUMNS = ["age", "gender", "weight_kg", "temp_c", "humidity", "activity", "duration_min"]
+# 数値の列は計算時に float へ変換するので、入力の表記を出力でも保つために文字列の列だけ型を固定する
+ROSTER_DTYPES = {"gender": "object", "activity": "object"}
+
+
+# 名簿の DataFrame に計画の列 (wbgt, wbgt_level, base_ml, activity_ml, target_ml) を加えて返す
+def plan_hydration(roster):
+    missing = [column for column in ROSTER_COLUMNS if column not in roster.columns]
+    if missing:
+        raise ValueError(f"名簿に必要な列がありません: {', '.join(missing)}")
+    plan = roster.copy()
+    wbgt = calculate_wbgt_array(roster["temp_c"], roster["humidity"])
+    base_ml = calculate_base_water_intake_array(roster["age"], roster["gender"], roster["weight_kg"])
+    activity_ml = calculate_activity_water_loss_array(roster["activity"], roster["duration_min"])
+    plan["wbgt"] = np.round(wbgt, 1)
+    plan["wbgt_level"] = classify_wbgt_array(wbgt)
+    plan["base_ml"] = np.rint(base_ml).astype(np.int64)
+    plan["activity_ml"] = np.rint(activity_ml).astype(np.int64)
+    plan["target_ml"] = plan["base_ml"] + plan["activity_ml"]
+    return plan
+
+
+def plan_csv(source, destination, chunksize=100_000):
+    rows = 0
+    header = True
+    for chunk in pd.read_csv(source, chunksize=chunksize, dtype=ROSTER_DTYPES):
+        plan_hydration(chunk).to_csv(destination, header=header, index=False)
+        header = False
+        rows += len(chunk)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="名簿 (CSV) から水分補給計画 (CSV) を作成します。")
+    parser.add_argument("roster", help="名簿の CSV ファイル (- で標準入力)")
+    parser.add_argument("-o", "--output", default="-", help="出力先の CSV ファイル (- で標準出力)")
+    parser.add_argument("--chunksize", type=int, default=100_000, help="一度に読み込む行数")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.roster == "-" else args.roster
+    started = time.perf_counter()
+    if args.output == "-":
+        rows = plan_csv(source, sys.stdout, args.chunksize)
+    else:
+        with open(args.output, "w", newline="", encoding="utf-8") as destination:
+            rows = plan_csv(source, destination, args.chunksize)
+    elapsed = time.perf_counter() - started
+    print(f"{rows} rows in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import datetime
+
+from hydrocare.lazy import lazy_import
+from hydrocare.storage import from_timestamp, to_timestamp
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# 飲み物の種類の一覧 (記録画面の選択肢と、種類コードの対応表を兼ねる)
+DRINK_TYPES = ["水", "お茶", "スポーツドリンク", "ジュース", "コーヒー", "その他"]
+
+# 1件の量は 65,535ml まで、種類は127種類まで (Categorical の codes と同じ int8 にして pandas へそのまま渡す)
+AMOUNT_DTYPE = "uint16"
+TYPE_CODE_DTYPE = "int8"
+MAX_DRINK_TYPES = 127
+
+
+# --- 水分補給記録の列指向コンテナ ---
+# 記録を dict のリストではなく型付きの配列 (時刻: int64 のマイクロ秒、量: uint16、種類: int8 のコード) で持つ。
+# 1件あたり11バイトで、時刻の範囲指定は二分探索、pandas / NumPy へはコピーせずに配列のビューを渡す
+class WaterLogColumns:
+    def __init__(self, capacity=0, drink_types=DRINK_TYPES):
+        self.drink_types = list(drink_types)
+        self._codes_by_type = {drink_type: code for code, drink_type in enumerate(self.drink_types)}
+        self._timestamps = np.empty(capacity, dtype=np.int64)
+        self._amounts = np.empty(capacity, dtype=AMOUNT_DTYPE)
+        self._type_codes = np.empty(capacity, dtype=TYPE_CODE_DTYPE)
+        self._size = 0
+        self._sorted = True
+
+    # 既存の配列をそのまま包む (between() の結果など。追記すると新しい配列に移るので元の配列は書き換わらない)
+    @classmethod
+    def _wrap(cls, timestamps, amounts, type_codes, drink_types, is_sorted):
+        columns = cls(0, drink_types)
+        columns._timestamps = timestamps
+        columns._amounts = amounts
+        columns._type_codes = type_codes
+        columns._size = len(timestamps)
+        columns._sorted = is_sorted
+        return columns
+
+    # ストレージから start 以上 end 未満の記録を読み込む
+    @classmethod
+    def load(cls, store, user_id, start, end, drink_types=DRINK_TYPES):
+        return cls.from_rows(store.rows_between(user_id, start, end), drink_types)
+
+    # {'time', 'amount_ml', 'type'} の dict のリスト (従来の形式) から作る
+    @classmethod
+    def from_entries(cls, entries, drink_types=DRINK_TYPES):
+        return cls.from_rows(
+            ((to_timestamp(entry['time']), entry['amount_ml'], entry['type']) for entry in entries), drink_types
+        )
+
+    # (時刻のマイクロ秒, 量, 種類) の行 (SQLite から読んだ行) から作る
+    @classmethod
+    def from_rows(cls, rows, drink_types=DRINK_TYPES):
+        rows = rows if isinstance(rows, list) else list(rows)
+        columns = cls(len(rows), drink_types)
+        if not rows:
+            return columns
+        timestamps, amounts, drink_type_names = zip(*rows)
+        columns._extend_arrays(
+            np.fromiter(timestamps, dtype=np.int64, count=len(rows)),
+            np.fromiter(amounts, dtype=np.int64, count=len(rows)),
+            np.fromiter((columns._code_for(name) for name in drink_type_names), dtype=TYPE_CODE_DTYPE, count=len(rows)),
+        )
+        return columns
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def timestamps(self):
+        self._ensure_sorted()
+        return self._timestamps[:self._size]
+
+    @property
+    def amounts(self):
+        self._ensure_sorted()
+        return self._amounts[:self._size]
+
+    @property
+    def type_codes(self):
+        self._ensure_sorted()
+        return self._type_codes[:self._size]
+
+    # 時刻を datetime64[us] として見たビュー (保存形式がタイムゾーンなしの現地時刻なのでそのまま対応する)
+    @property
+    def times(self):
+        return self.timestamps.view("datetime64[us]")
+
+    @property
+    def nbytes(self):
+        return self._timestamps.nbytes + self._amounts.nbytes + self._type_codes.nbytes
+
+    def total_ml(self):
+        return int(self.amounts.sum(dtype=np.int64))
+
+    def append(self, time, amount_ml, drink_type):
+        self._extend_arrays(
+            np.array([to_timestamp(time)], dtype=np.int64),
+            np.array([amount_ml], dtype=np.int64),
+            np.array([self._code_for(drink_type)], dtype=TYPE_CODE_DTYPE),
+        )
+
+    def extend(self, entries):
+        other = WaterLogColumns.from_entries(entries, self.drink_types)
+        for drink_type in other.drink_types[len(self.drink_types):]:
+            self._code_for(drink_type)
+        self._extend_arrays(other._timestamps, other._amounts.astype(np.int64), other._type_codes)
+
+    # start 以上 end 未満の記録 (配列を共有するビュー)
+    def between(self, start, end):
+        timestamps = self.timestamps
+        lo = int(np.searchsorted(timestamps, to_timestamp(start), side="left"))
+        hi = int(np.searchsorted(timestamps, to_timestamp(end), side="left"))
+        return WaterLogColumns._wrap(
+            timestamps[lo:hi], self._amounts[lo:hi], self._type_codes[lo:hi], self.drink_types, True
+        )
+
+    def on(self, date):
+        return self.between(date, date + datetime.timedelta(days=1))
+
+    # 時刻・量は配列のビューのまま、種類は Categorical として DataFrame にする
+    def to_frame(self):
+        return pd.DataFrame({
+            'time': self.times,
+            'amount_ml': self.amounts,
+            'type': pd.Categorical.from_codes(self.type_codes, categories=self.drink_types, validate=False),
+        }, copy=False)
+
+    def to_entries(self):
+        return [
+            {'time': from_timestamp(int(ts)), 'amount_ml': int(amount_ml), 'type': self.drink_types[code]}
+            for ts, amount_ml, code in zip(self.timestamps, self.amounts, self.type_codes)
+        ]
+
+    def _code_for(self, drink_type):
+        code = self._codes_by_type.get(drink_type)
+        if code is None:
+            if len(self.drink_types) >= MAX_DRINK_TYPES:
+                raise ValueError(f"飲み物の種類は{MAX_DRINK_TYPES}種類までです: {drink_type}")
+            code = self._codes_by_type[drink_type] = len(self.drink_types)
+            self.drink_types.append(drink_type)
+        return code
+
+    def _extend_arrays(self, timestamps, amounts, type_codes):
+        count = len(timestamps)
+        if count == 0:
+            return
+        if amounts.min() < 0 or amounts.max() > np.iinfo(AMOUNT_DTYPE).max:
+            raise ValueError(f"摂取量は0〜{np.iinfo(AMOUNT_DTYPE).max}mlの範囲で指定してください。")
+        self._reserve(self._size + count)
+        end = self._size + count
+        if self._sorted and (
+            (self._size and timestamps[0] < self._timestamps[self._size - 1]) or np.any(timestamps[1:] < timestamps[:-1])
+        ):
+            self._sorted = False
+        self._timestamps[self._size:end] = timestamps
+        self._amounts[self._size:end] = amounts
+        self._type_codes[self._size:end] = type_codes
+        self._size = end
+
+    # 容量が足りなければ倍々に広げる (追記1件あたり償却 O(1))
+    def _reserve(self, capacity):
+        if capacity <= len(self._timestamps):
+            return
+        new_capacity = max(capacity, 2 * len(self._timestamps), 16)
+        for name in ('_timestamps', '_amounts', '_type_codes'):
+            old = getattr(self, name)
+            new = np.empty(new_capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    # 時刻が前後する記録が追加されていたら、読み出す前に時刻順に並べ直す
+    def _ensure_sorted(self):
+        if self._sorted:
+            return
+        order = np.argsort(self._timestamps[:self._size], kind="stable")
+        self._timestamps[:self._size] = self._timestamps[:self._size][order]
+        self._amounts[:self._size] = self._amounts[:self._size][order]
+        self._type_codes[:self._size] = self._type_codes[:self._size][order]
+        self._sorted = True
@@ -0,0 +1,257 @@
+import argparse
+import collections
+import contextlib
+import functools
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL,
+    accessed_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cache_entries_accessed_at ON cache_entries (accessed_at);
+CREATE INDEX IF NOT EXISTS cache_entries_expires_at ON cache_entries (expires_at) WHERE expires_at IS NOT NULL;
+CREATE TABLE IF NOT EXISTS cache_meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+INSERT OR IGNORE INTO cache_meta (name, value) SELECT 'total_bytes', COALESCE(SUM(size), 0) FROM cache_entries;
+CREATE TABLE IF NOT EXISTS cache_stats (
+    namespace TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (namespace, name)
+) WITHOUT ROWID;
+"""
+
+# 名前空間ごとに数える統計。キーの「:」より前を名前空間とし、「:」のないキーは DEFAULT_NAMESPACE にまとめる
+STAT_NAMES = ["hits", "misses", "sets", "expired", "evictions"]
+DEFAULT_NAMESPACE = "default"
+# 統計はプロセス内で数えておき、この間隔ごとにまとめてデータベースへ足し込む (参照のたびに書き込まない)
+STATS_FLUSH_SECONDS = 5.0
+# 最後に使われた時刻は、前回の更新からこの秒数以上たった場合だけ書き込む (読み出しのたびに書き込みのロックを取らない)
+ACCESS_RESOLUTION_SECONDS = 1.0
+EVICT_BATCH = 64
+
+UPSERT_STAT = """
+INSERT INTO cache_stats (namespace, name, value) VALUES (?, ?, ?)
+ON CONFLICT (namespace, name) DO UPDATE SET value = value + excluded.value
+"""
+
+
+def key_namespace(key):
+    namespace, separator, _ = key.partition(":")
+    return namespace if separator else DEFAULT_NAMESPACE
+
+
+# --- ディスク上の共有キャッシュ (SQLite) ---
+# 複数のプロセスから同じファイルを開いて使える。合計サイズが max_bytes を超えたら、最後に使われたのが古いものから削除する。
+# 合計サイズは cache_meta に持ち、追加・削除と同じトランザクションで更新する (追加のたびに全体を数え直さない)
+class DiskCache:
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, default_ttl=None, clock=time.time):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pending_stats = collections.Counter()  # (名前空間, 統計の名前) -> まだ書き込んでいない数
+        self._stats_flushed_at = time.monotonic()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._transaction():
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    self._conn.execute(statement)
+
+    def close(self):
+        with self._lock:
+            self._flush_stats()
+            self._conn.close()
+
+    def get(self, key):
+        now = self._clock()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at, accessed_at FROM cache_entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count(key, "misses")
+                return None
+            value, expires_at, accessed_at = row
+            if expires_at is not None and expires_at <= now:
+                with self._transaction():
+                    self._delete(key)
+                self._count(key, "expired")
+                self._count(key, "misses")
+                return None
+            if now - accessed_at >= ACCESS_RESOLUTION_SECONDS:
+                self._conn.execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key))
+            self._count(key, "hits")
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.default_ttl
+        now = self._clock()
+        expires_at = now + ttl if ttl is not None else None
+        if len(value) > self.max_bytes:
+            # 1件で上限を超えるものは、他をすべて追い出すことになるので保存しない
+            return
+        with self._lock:
+            with self._transaction():
+                self._delete(key)
+                self._conn.execute(
+                    "INSERT INTO cache_entries (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value), expires_at, now)
+                )
+                self._add_total_bytes(len(value))
+                self._evict(now)
+            self._count(key, "sets")
+
+    def delete(self, key):
+        with self._lock:
+            with self._transaction():
+                self._delete(key)
+
+    def total_bytes(self):
+        with self._lock:
+            return self._conn.execute("SELECT value FROM cache_meta WHERE name = 'total_bytes'").fetchone()[0]
+
+    # 全プロセス分の統計 (まだ書き込んでいないこのプロセスの分も含む)。namespaces は名前空間ごとの数と hit_rate
+    def stats(self):
+        with self._lock:
+            self._flush_stats()
+            entries, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), (SELECT value FROM cache_meta WHERE name = 'total_bytes') FROM cache_entries"
+            ).fetchone()
+            namespaces = {}
+            for namespace, name, value in self._conn.execute("SELECT namespace, name, value FROM cache_stats ORDER BY namespace"):
+                namespaces.setdefault(namespace, dict.fromkeys(STAT_NAMES, 0))[name] = value
+        for counts in namespaces.values():
+            lookups = counts['hits'] + counts['misses']
+            counts['hit_rate'] = counts['hits'] / lookups if lookups else None
+        return {'entries': entries, 'total_bytes': total_bytes, 'max_bytes': self.max_bytes, 'namespaces': namespaces}
+
+    def reset_stats(self):
+        with self._lock:
+            self._pending_stats.clear()
+            self._conn.execute("DELETE FROM cache_stats")
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    # 他のプロセスが先に削除していた場合は何もしない (削除できた分だけ合計サイズを減らす)
+    def _delete(self, key):
+        row = self._conn.execute("DELETE FROM cache_entries WHERE key = ? RETURNING size", (key,)).fetchone()
+        if row is not None:
+            self._add_total_bytes(-row[0])
+        return row is not None
+
+    def _add_total_bytes(self, delta):
+        self._conn.execute("UPDATE cache_meta SET value = value + ? WHERE name = 'total_bytes'", (delta,))
+
+    def _evict(self, now):
+        expired = self._conn.execute(
+            "DELETE FROM cache_entries WHERE expires_at IS NOT NULL AND expires_at <= ? RETURNING key, size", (now,)
+        ).fetchall()
+        for key, size in expired:
+            self._add_total_bytes(-size)
+            self._count(key, "expired")
+        total_bytes = self._conn.execute("SELECT value FROM cache_meta WHERE name = 'total_bytes'").fetchone()[0]
+        while total_bytes > self.max_bytes:
+            rows = self._conn.execute("SELECT key, size FROM cache_entries ORDER BY accessed_at LIMIT ?", (EVICT_BATCH,)).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._delete(key)
+                self._count(key, "evictions")
+                total_bytes -= size
+                if total_bytes <= self.max_bytes:
+                    break
+
+    def _count(self, key, name):
+        self._pending_stats[(key_namespace(key), name)] += 1
+        if time.monotonic() - self._stats_flushed_at >= STATS_FLUSH_SECONDS:
+            self._flush_stats()
+
+    def _flush_stats(self):
+        self._stats_flushed_at = time.monotonic()
+        if not self._pending_stats:
+            return
+        pending = [(namespace, name, value) for (namespace, name), value in self._pending_stats.items()]
+        self._pending_stats.clear()
+        try:
+            self._conn.executemany(UPSERT_STAT, pending)
+        except sqlite3.OperationalError:
+            # 書き込みが混み合っている場合は次の機会に回す (統計のためにキャッシュの読み書きを失敗させない)
+            for namespace, name, value in pending:
+                self._pending_stats[(namespace, name)] += value
+
+
+# --- 関数の結果を DiskCache に保存するデコレーター ---
+# 引数を pickle したもののハッシュを「name:」つきのキーにし、戻り値を pickle して保存する。
+# get_cache は DiskCache を返す関数で、初めて呼ばれたときに開く (None を返した場合はキャッシュせずに呼ぶ)
+def memoize(get_cache, name, ttl=None):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = get_cache()
+            if cache is None:
+                return func(*args, **kwargs)
+            key = memo_key(name, args, kwargs)
+            value = cache.get(key)
+            if value is not None:
+                return pickle.loads(value)
+            result = func(*args, **kwargs)
+            cache.set(key, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL), ttl)
+            return result
+        return wrapper
+    return decorator
+
+
+def memo_key(name, args, kwargs):
+    digest = hashlib.sha256(pickle.dumps((args, sorted(kwargs.items())), protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+    return f"{name}:{digest}"
+
+
+# --- コマンドライン: キャッシュの使用量と名前空間ごとの統計を表示 ---
+# 使い方: python -m hydrocare.disk_cache data/shared_cache.db [--reset]
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="共有キャッシュの使用量とヒット率を表示します。")
+    parser.add_argument("path", help="キャッシュのデータベースのパス")
+    parser.add_argument("--reset", action="store_true", help="表示した後に統計を 0 に戻す")
+    args = parser.parse_args(argv)
+
+    cache = DiskCache(args.path, max_bytes=float("inf"))
+    stats = cache.stats()
+    print(f"{stats['entries']:,} entries, {stats['total_bytes'] / 1e6:.2f} MB")
+    print(f"{'namespace':<20}{'hits':>10}{'misses':>10}{'hit rate':>10}{'sets':>10}{'expired':>10}{'evictions':>10}")
+    for namespace, counts in stats['namespaces'].items():
+        hit_rate = f"{counts['hit_rate']:.1%}" if counts['hit_rate'] is not None else "-"
+        print(
+            f"{namespace:<20}{counts['hits']:>10,}{counts['misses']:>10,}{hit_rate:>10}"
+            f"{counts['sets']:>10,}{counts['expired']:>10,}{counts['evictions']:>10,}"
+        )
+    if args.reset:
+        cache.reset_stats()
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import hashlib
+
+
+# 安全性フィルタなどで回答が生成されなかった場合
+class GeminiBlockedError(Exception):
+    pass
+
+
+# キャッシュのキーは「モデル名 + 最終的なプロンプト」のハッシュ
+def prompt_cache_key(model_name, prompt):
+    return hashlib.sha256(f"{model_name}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+def _chunk_text(chunk):
+    try:
+        return chunk.text
+    except ValueError:
+        # ブロックされた候補は text を持たない
+        return ""
+
+
+# --- Gemini で回答を生成 (同じプロンプトはディスクキャッシュから返す) ---
+def generate_text(model, model_name, prompt, cache=None):
+    key = prompt_cache_key(model_name, prompt)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached.decode("utf-8")
+
+    response = model.generate_content(prompt)
+    if not response._chunks:
+        raise GeminiBlockedError()
+    text = response.text
+    if cache is not None:
+        cache.set(key, text.encode("utf-8"))
+    return text
+
+
+# --- Gemini の回答を生成されたそばから返す (stream=True) ---
+# 最後まで受け取れた回答だけをキャッシュに保存する
+def stream_text(model, model_name, prompt, cache=None):
+    key = prompt_cache_key(model_name, prompt)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            yield cached.decode("utf-8")
+            return
+
+    parts = []
+    for chunk in model.generate_content(prompt, stream=True):
+        text = _chunk_text(chunk)
+        if text:
+            parts.append(text)
+            yield text
+    if not parts:
+        raise GeminiBlockedError()
+    if cache is not None:
+        cache.set(key, "".join(parts).encode("utf-8"))
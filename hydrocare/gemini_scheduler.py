@@ -0,0 +1,280 @@
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import queue
+import statistics
+import threading
+import time
+
+from hydrocare.metrics import METRICS
+
+# 優先度 (小さいほど先に実行する)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+_STREAM_END = object()
+
+
+# 混雑やクォータ超過で回答を得られなかった場合
+class GeminiBusyError(Exception):
+    pass
+
+
+# 実行枠を得た後、回答の生成が request_timeout_seconds 以内に終わらなかった場合
+class GeminiTimeoutError(Exception):
+    pass
+
+
+# google.api_core の ResourceExhausted (HTTP 429) を、SDK を import せずに判定する
+def is_quota_error(error):
+    return getattr(error, 'code', None) == 429 or type(error).__name__ in ("ResourceExhausted", "TooManyRequests")
+
+
+# --- トークンバケット (1秒あたり rate 個補充、最大 capacity 個まで貯まる) ---
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    # トークンが1個貯まるまでの秒数 (すぐ使えるなら 0)
+    def wait_time(self):
+        self._refill()
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    # クォータ超過を受けたら貯まっていた分を捨て、しばらく送信を控える
+    def drain(self):
+        self._refill()
+        self.tokens = min(self.tokens, 0)
+
+
+class _Job:
+    def __init__(self, prompt, priority, stream, enqueued_at):
+        self.prompt = prompt
+        self.priority = priority
+        self.stream = stream
+        self.enqueued_at = enqueued_at
+        self.future = concurrent.futures.Future()
+        self.waiters = 1
+        self.started = False
+        self.cancelled = False
+
+
+# --- Gemini へのリクエストをまとめて管理するスケジューラー ---
+# 送信レートの制限 (トークンバケット)、同時実行数の上限、優先度つきの待ち行列、
+# 同じプロンプトの重複リクエストの集約を行い、待ち行列の長さと待ち時間を記録する
+class GeminiScheduler:
+    def __init__(
+        self,
+        model,
+        requests_per_minute=15,
+        burst=None,
+        max_in_flight=4,
+        max_wait_seconds=60,
+        request_timeout_seconds=120,
+        quota_retries=2,
+        retry_backoff_seconds=2.0,
+        clock=time.monotonic,
+    ):
+        self.model = model
+        self.max_in_flight = max_in_flight
+        # max_wait_seconds は待ち行列で実行枠を待つ時間だけの上限。生成にかかる時間は request_timeout_seconds で別に区切る
+        self.max_wait_seconds = max_wait_seconds
+        self.request_timeout_seconds = request_timeout_seconds
+        self.quota_retries = quota_retries
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self._clock = clock
+        self._bucket = TokenBucket(requests_per_minute / 60, burst or max_in_flight, clock)
+
+        self._cond = threading.Condition()
+        self._heap = []
+        self._sequence = itertools.count()
+        self._pending = {}  # プロンプト -> 待機中または実行中の _Job
+        self._in_flight = 0
+        self._closed = False
+        self._wait_times = collections.deque(maxlen=1000)
+        self._counters = collections.Counter()
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="gemini")
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="gemini-scheduler", daemon=True)
+        self._dispatcher.start()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+
+    # 指定した優先度で generate_content を呼べる、モデルの代わりのオブジェクトを返す
+    def client(self, priority=PRIORITY_BACKGROUND):
+        return ScheduledModel(self, priority)
+
+    def submit(self, prompt, priority=PRIORITY_BACKGROUND, stream=False):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("GeminiScheduler is closed")
+            self._counters['submitted'] += 1
+            # ストリーミングは受け取り手が1人に限られるため集約しない
+            job = None if stream else self._pending.get(prompt)
+            if job is not None and not job.cancelled:
+                self._counters['deduplicated'] += 1
+                job.waiters += 1
+                if not job.started and priority < job.priority:
+                    # 後から来た優先度の高いリクエストに合わせて繰り上げる (古いエントリは取り出し時に読み飛ばす)
+                    job.priority = priority
+                    heapq.heappush(self._heap, (priority, next(self._sequence), job))
+                return job
+            job = _Job(prompt, priority, stream, self._clock())
+            heapq.heappush(self._heap, (priority, next(self._sequence), job))
+            if not stream:
+                self._pending[prompt] = job
+            self._cond.notify_all()
+            return job
+
+    def wait(self, job, timeout=None, request_timeout=None):
+        timeout = self.max_wait_seconds if timeout is None else timeout
+        request_timeout = self.request_timeout_seconds if request_timeout is None else request_timeout
+        with self._cond:
+            if not self._cond.wait_for(lambda: job.started or job.future.done(), timeout):
+                # まだ実行枠を得ていない。待っているのが自分だけなら取り消す
+                job.waiters -= 1
+                if job.waiters == 0:
+                    job.cancelled = True
+                    self._forget(job)
+                self._counters['timed_out'] += 1
+                raise GeminiBusyError("queue wait timed out")
+        try:
+            return job.future.result(timeout=request_timeout)
+        except concurrent.futures.TimeoutError:
+            # 実行中のリクエストは止められないので、終わるまで実行枠を使い続ける
+            with self._cond:
+                job.waiters -= 1
+                self._counters['generation_timed_out'] += 1
+            raise GeminiTimeoutError("generation timed out")
+
+    def metrics(self):
+        with self._cond:
+            wait_times = list(self._wait_times)
+            metrics = {
+                'queue_depth': sum(1 for _, _, job in self._heap if not job.started and not job.cancelled),
+                'in_flight': self._in_flight,
+                'tokens_available': round(max(self._bucket.tokens, 0), 2),
+            }
+            metrics.update(self._counters)
+        if wait_times:
+            wait_times.sort()
+            metrics['wait_seconds_avg'] = statistics.fmean(wait_times)
+            metrics['wait_seconds_p95'] = wait_times[min(len(wait_times) - 1, int(len(wait_times) * 0.95))]
+            metrics['wait_seconds_max'] = wait_times[-1]
+        return metrics
+
+    def _forget(self, job):
+        if self._pending.get(job.prompt) is job:
+            del self._pending[job.prompt]
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed and (not self._heap or self._in_flight >= self.max_in_flight):
+                    self._cond.wait()
+                if self._closed:
+                    return
+                _, _, job = self._heap[0]
+                if job.started or job.cancelled:
+                    heapq.heappop(self._heap)
+                    continue
+                wait_time = self._bucket.wait_time()
+                if wait_time > 0:
+                    self._counters['rate_limited'] += 1
+                    self._cond.wait(wait_time)
+                    continue
+                heapq.heappop(self._heap)
+                self._bucket.take()
+                job.started = True
+                self._in_flight += 1
+                self._wait_times.append(self._clock() - job.enqueued_at)
+                # 実行枠を待っている wait() に知らせる
+                self._cond.notify_all()
+            self._executor.submit(self._run, job)
+
+    def _release(self, job, succeeded):
+        with self._cond:
+            self._in_flight -= 1
+            self._counters['completed' if succeeded else 'failed'] += 1
+            self._forget(job)
+            self._cond.notify_all()
+
+    def _call_model(self, job):
+        for attempt in range(self.quota_retries + 1):
+            try:
+                return self.model.generate_content(job.prompt, stream=job.stream)
+            except Exception as e:
+                if not is_quota_error(e):
+                    raise
+                with self._cond:
+                    self._counters['quota_errors'] += 1
+                    self._bucket.drain()
+                if attempt == self.quota_retries:
+                    raise GeminiBusyError("quota exceeded") from e
+                time.sleep(self.retry_backoff_seconds * 2 ** attempt)
+
+    def _run(self, job):
+        with METRICS.time("hydrocare_external_call_seconds", service="gemini", endpoint="stream" if job.stream else "generate"):
+            self._run_job(job)
+
+    def _run_job(self, job):
+        try:
+            response = self._call_model(job)
+            if not job.stream:
+                job.future.set_result(response)
+                self._release(job, True)
+                return
+            # ストリーミングはこのスレッドで最後まで受け取りながら受け取り手へ渡し、実行枠を確実に返す
+            chunks = queue.Queue()
+            job.future.set_result(_iterate_queue(chunks))
+            try:
+                for chunk in response:
+                    chunks.put(chunk)
+            except Exception as e:
+                chunks.put(e)
+                self._release(job, False)
+                return
+            chunks.put(_STREAM_END)
+            self._release(job, True)
+        except Exception as e:
+            job.future.set_exception(e)
+            self._release(job, False)
+
+
+def _iterate_queue(chunks):
+    while True:
+        item = chunks.get()
+        if item is _STREAM_END:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+# --- スケジューラー経由で呼び出すモデル (generate_content だけを持つ) ---
+class ScheduledModel:
+    def __init__(self, scheduler, priority):
+        self.scheduler = scheduler
+        self.priority = priority
+
+    def generate_content(self, prompt, stream=False):
+        job = self.scheduler.submit(prompt, self.priority, stream)
+        return self.scheduler.wait(job)
@@ -0,0 +1,202 @@
+import collections
+import concurrent.futures
+import datetime
+import threading
+import time
+
+from hydrocare.hydration import (
+    ACTIVITY_WATER_LOSS_PER_MINUTE,
+    WBGT_EXTRA_ML_PER_HOUR,
+    WBGT_LEVELS,
+    WBGT_SWEAT_FACTORS,
+    calculate_wbgt_array,
+    wbgt_level_index_array,
+)
+from hydrocare.lazy import lazy_import
+from hydrocare.weather import normalize_city_name
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# 計画を立てる時間 (現在の時から何時間先まで)
+PLAN_HOURS = 24
+# 基本の推奨量を割り振る時間帯 (起床〜就寝の時。就寝の時は含まない)
+DEFAULT_WAKING_HOURS = (7, 23)
+
+# 警戒レベルを低い順に並べた表示名と、番号から引く補正値
+LEVEL_LABELS = [label for _, label in reversed(WBGT_LEVELS)]
+_SWEAT_FACTORS = [WBGT_SWEAT_FACTORS[label] for label in LEVEL_LABELS]
+_EXTRA_ML_PER_HOUR = [WBGT_EXTRA_ML_PER_HOUR[label] for label in LEVEL_LABELS]
+
+# 予定している活動 (開始時刻は都市の現地時刻)
+PlannedActivity = collections.namedtuple("PlannedActivity", ["start", "activity_type", "duration_minutes"])
+
+
+def current_hour_key(now=None):
+    return int(now if now is not None else time.time()) // 3600
+
+
+# --- 都市ごと・1時間ごとの暑さの表 ---
+# 3時間ごとの予報を1時間ごとに補間し、WBGT・警戒レベルと、そこから決まる補正値を配列で持つ。
+# 同じ都市・同じ時の間は全ユーザーで共有し、ユーザーごとの計画はこの表を引くだけで作る
+class CityHourTable:
+    def __init__(self, city_name, hour_key, utc_offset, hours, temp, humidity, wbgt):
+        self.city_name = city_name
+        self.hour_key = hour_key
+        self.utc_offset = utc_offset  # 都市の UTC からの時差 (秒)
+        self.hours = hours  # 各時の開始時刻 (現地時刻、datetime64[m])
+        self.temp = temp
+        self.humidity = humidity
+        self.wbgt = wbgt
+        self.level_index = wbgt_level_index_array(wbgt)
+        self.sweat_factor = np.asarray(_SWEAT_FACTORS, dtype=np.float64)[self.level_index]
+        self.extra_ml = np.asarray(_EXTRA_ML_PER_HOUR, dtype=np.float64)[self.level_index]
+
+    @classmethod
+    def from_forecast(cls, city_name, forecast_data, now=None, hours=PLAN_HOURS):
+        now = int(now if now is not None else time.time())
+        offset = forecast_data.get('city', {}).get('timezone', 0)
+        entries = forecast_data.get('list', [])
+        dt = np.array([entry['dt'] for entry in entries], dtype=np.float64)
+        temp = np.array([_number(entry.get('main', {}).get('temp')) for entry in entries], dtype=np.float64)
+        humidity = np.array([_number(entry.get('main', {}).get('humidity')) for entry in entries], dtype=np.float64)
+        valid = ~(np.isnan(temp) | np.isnan(humidity))
+        if not valid.any():
+            raise ValueError(f"予報に気温・湿度のデータがありません: {city_name}")
+
+        # 現在の時の始まりから1時間ごとの時刻 (UTC の秒)。予報の範囲外は最初・最後の値で埋める
+        slot_starts = np.arange(hours, dtype=np.float64) * 3600 + now // 3600 * 3600
+        slot_temp = np.interp(slot_starts, dt[valid], temp[valid])
+        slot_humidity = np.interp(slot_starts, dt[valid], humidity[valid])
+        local_hours = (slot_starts.astype(np.int64) + offset).astype("datetime64[s]").astype("datetime64[m]")
+        return cls(
+            city_name, current_hour_key(now), offset, local_hours, slot_temp, slot_humidity,
+            calculate_wbgt_array(slot_temp, slot_humidity),
+        )
+
+    def __len__(self):
+        return len(self.hours)
+
+    @property
+    def levels(self):
+        return np.asarray(LEVEL_LABELS, dtype=object)[self.level_index]
+
+    # 都市の現在の現地時刻 (予定の開始時刻の入力に使う)
+    def local_now(self, now=None):
+        timezone = datetime.timezone(datetime.timedelta(seconds=self.utc_offset))
+        return datetime.datetime.fromtimestamp(now if now is not None else time.time(), timezone).replace(tzinfo=None)
+
+
+def _number(value):
+    return np.nan if value is None else value
+
+
+# 予定している活動の時間 (分) を各時に振り分ける
+def activity_minutes_by_hour(hours, activities):
+    slot_starts = hours.astype("datetime64[m]").astype(np.int64)
+    minutes = {}
+    for activity in activities:
+        start = np.datetime64(activity.start, "m").astype(np.int64)
+        end = start + int(activity.duration_minutes)
+        overlap = np.clip(np.minimum(slot_starts + 60, end) - np.maximum(slot_starts, start), 0, 60)
+        minutes.setdefault(activity.activity_type, np.zeros(len(slot_starts), dtype=np.float64))
+        minutes[activity.activity_type] += overlap
+    return minutes
+
+
+# --- 1人分の1時間ごとの水分補給計画 ---
+# 基本の推奨量 (1日分) を起きている時間に均等に割り振り、暑さによる追加分と、
+# その時の警戒レベルで補正した活動中の発汗量を足す。計算は表の長さ (24) の配列演算だけで済む
+def plan_hourly(table, daily_target_ml, activities=(), waking_hours=DEFAULT_WAKING_HOURS):
+    hour_of_day = (table.hours.astype("datetime64[h]").astype(np.int64)) % 24
+    wake, sleep = waking_hours
+    awake = (hour_of_day >= wake) & (hour_of_day < sleep)
+    base_ml = np.where(awake, daily_target_ml / max(sleep - wake, 1), 0.0)
+    heat_ml = np.where(awake, table.extra_ml, 0.0)
+    activity_ml = np.zeros(len(table), dtype=np.float64)
+    for activity_type, minutes in activity_minutes_by_hour(table.hours, activities).items():
+        activity_ml += minutes * ACTIVITY_WATER_LOSS_PER_MINUTE.get(activity_type, 0) * table.sweat_factor
+    return base_ml, heat_ml, activity_ml
+
+
+def plan_hourly_frame(table, daily_target_ml, activities=(), waking_hours=DEFAULT_WAKING_HOURS):
+    base_ml, heat_ml, activity_ml = plan_hourly(table, daily_target_ml, activities, waking_hours)
+    return pd.DataFrame({
+        '時刻': table.hours,
+        '暑さ指数 (WBGT)': np.round(table.wbgt, 1),
+        '警戒レベル': table.levels,
+        '基本 (ml)': np.rint(base_ml).astype(np.int64),
+        '暑さ (ml)': np.rint(heat_ml).astype(np.int64),
+        '活動 (ml)': np.rint(activity_ml).astype(np.int64),
+        '推奨量 (ml)': np.rint(base_ml + heat_ml + activity_ml).astype(np.int64),
+    })
+
+
+# --- 都市ごとの表を1時間に1回だけ作って共有するエンジン (全セッションで1つ) ---
+# 表は (都市, 時) ごとに作り、同じ都市への同時の要求は1回の作成にまとめる。
+# 予報の取得は WeatherClient (キャッシュつき) に任せ、時が変わった都市だけ作り直す
+class HourlyPlanEngine:
+    def __init__(self, client, hours=PLAN_HOURS, max_cities=256, clock=time.time):
+        self.client = client
+        self.hours = hours
+        self.max_cities = max_cities
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tables = collections.OrderedDict()  # 正規化した都市名 -> CityHourTable
+        self._in_flight = {}  # (正規化した都市名, 時) -> Future
+        self.builds = 0
+        self.hits = 0
+
+    def stats(self):
+        with self._lock:
+            return {'builds': self.builds, 'hits': self.hits, 'cities': len(self._tables)}
+
+    def table(self, city_name):
+        now = self._clock()
+        hour_key = current_hour_key(now)
+        city_key = normalize_city_name(city_name)
+        with self._lock:
+            table = self._tables.get(city_key)
+            if table is not None and table.hour_key == hour_key:
+                self._tables.move_to_end(city_key)
+                self.hits += 1
+                return table
+            future = self._in_flight.get((city_key, hour_key))
+            leader = future is None
+            if leader:
+                future = self._in_flight[(city_key, hour_key)] = concurrent.futures.Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            table = CityHourTable.from_forecast(city_name.strip(), self.client.forecast(city_name), now, self.hours)
+        except Exception as e:
+            with self._lock:
+                del self._in_flight[(city_key, hour_key)]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._tables[city_key] = table
+            self._tables.move_to_end(city_key)
+            while len(self._tables) > self.max_cities:
+                self._tables.popitem(last=False)
+            del self._in_flight[(city_key, hour_key)]
+            self.builds += 1
+        future.set_result(table)
+        return table
+
+    # 今の時の表が既にあれば返す (なければ予報を取得せずに None)
+    def cached_table(self, city_name):
+        hour_key = current_hour_key(self._clock())
+        with self._lock:
+            table = self._tables.get(normalize_city_name(city_name))
+            if table is None or table.hour_key != hour_key:
+                return None
+            self._tables.move_to_end(normalize_city_name(city_name))
+            self.hits += 1
+            return table
+
+    def plan(self, city_name, daily_target_ml, activities=(), waking_hours=DEFAULT_WAKING_HOURS):
+        return plan_hourly_frame(self.table(city_name), daily_target_ml, activities, waking_hours)
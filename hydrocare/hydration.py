@@ -0,0 +1,104 @@
+from hydrocare.lazy import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# --- 熱中症指数(WBGT)計算関数 ---
+def calculate_wbgt(temp_celsius, humidity_percent):
+    if temp_celsius is None or humidity_percent is None:
+        return None
+    wbgt_approx = 0.735 * temp_celsius + 0.057 * humidity_percent - 2.82
+    return max(0, wbgt_approx) 
+
+# 暑さ指数の警戒レベル (下限値, 表示名)。高い順に並べる
+WBGT_LEVELS = [
+    (31, "危険"),
+    (28, "厳重警戒"),
+    (25, "警戒"),
+    (0, "注意"),
+]
+
+def classify_wbgt(wbgt):
+    if wbgt is None:
+        return None
+    for threshold, label in WBGT_LEVELS:
+        if wbgt >= threshold:
+            return label
+    return WBGT_LEVELS[-1][1]
+
+# --- 水分補給量の計算ロジック ---
+def calculate_base_water_intake(age, gender, weight_kg):
+    if not all([age, gender, weight_kg]):
+        return 0
+    base_ml = 0
+    if age < 18:
+        base_ml = weight_kg * 40 
+    elif age >= 65:
+        base_ml = weight_kg * 30 
+    else:
+        base_ml = weight_kg * 35 
+    return base_ml
+
+# 活動の種類ごとの1分あたりの追加水分量 (ml)
+ACTIVITY_WATER_LOSS_PER_MINUTE = {
+    "ウォーキング": 5,
+    "ランニング": 10,
+    "サイクリング": 8,
+}
+# 名簿などで使える英語のコード
+ACTIVITY_CODES = {
+    "walking": "ウォーキング",
+    "running": "ランニング",
+    "cycling": "サイクリング",
+}
+
+_ACTIVITY_RATES_BY_NAME_OR_CODE = {
+    **ACTIVITY_WATER_LOSS_PER_MINUTE,
+    **{code: ACTIVITY_WATER_LOSS_PER_MINUTE[name] for code, name in ACTIVITY_CODES.items()},
+}
+
+def calculate_activity_water_loss(activity_type, duration_minutes):
+    return duration_minutes * ACTIVITY_WATER_LOSS_PER_MINUTE.get(activity_type, 0)
+
+# 警戒レベルごとの暑さの補正 (低い順: 注意, 警戒, 厳重警戒, 危険)
+# - 活動中の発汗量にかける倍率
+# - 起きている間、活動しなくても1時間あたりに追加で飲む量 (ml)
+WBGT_SWEAT_FACTORS = {"注意": 1.0, "警戒": 1.2, "厳重警戒": 1.4, "危険": 1.6}
+WBGT_EXTRA_ML_PER_HOUR = {"注意": 0, "警戒": 50, "厳重警戒": 100, "危険": 150}
+
+
+# --- 多人数分をまとめて計算する版 (NumPy 配列・pandas Series を受け取り、1回の配列演算で計算する) ---
+def calculate_wbgt_array(temp_celsius, humidity_percent):
+    temp_celsius = np.asarray(temp_celsius, dtype=np.float64)
+    humidity_percent = np.asarray(humidity_percent, dtype=np.float64)
+    # 欠損 (NaN) はそのまま NaN になる
+    return np.maximum(0.735 * temp_celsius + 0.057 * humidity_percent - 2.82, 0)
+
+# 警戒レベルの番号 (0: 注意 〜 3: 危険)。下限値を昇順に並べて二分探索する
+def wbgt_level_index_array(wbgt):
+    wbgt = np.asarray(wbgt, dtype=np.float64)
+    thresholds = np.array([threshold for threshold, _ in reversed(WBGT_LEVELS)], dtype=np.float64)
+    return np.maximum(np.searchsorted(thresholds, wbgt, side="right") - 1, 0)
+
+def classify_wbgt_array(wbgt):
+    wbgt = np.asarray(wbgt, dtype=np.float64)
+    labels = np.array([label for _, label in reversed(WBGT_LEVELS)] + [None], dtype=object)
+    # 欠損 (NaN) だけ None にする
+    return labels[np.where(np.isnan(wbgt), len(WBGT_LEVELS), wbgt_level_index_array(wbgt))]
+
+def calculate_base_water_intake_array(age, gender, weight_kg):
+    age = np.asarray(age, dtype=np.float64)
+    weight_kg = np.asarray(weight_kg, dtype=np.float64)
+    has_gender = pd.Series(gender).fillna("").astype(str).str.len().to_numpy() > 0
+    ml_per_kg = np.select([age < 18, age >= 65], [40, 30], default=35)
+    # 年齢・性別・体重のどれかが欠けている人は 0 (単体版と同じ扱い)
+    valid = (age > 0) & (weight_kg > 0) & has_gender
+    return np.where(valid, weight_kg * ml_per_kg, 0.0)
+
+def calculate_activity_water_loss_array(activity_type, duration_minutes):
+    # 種類は数種類しかないので、カテゴリごとに1回だけ表を引いてから全員分に展開する
+    activity = pd.Categorical(activity_type)
+    category_rates = np.array([_ACTIVITY_RATES_BY_NAME_OR_CODE.get(category, 0) for category in activity.categories] + [0], dtype=np.float64)
+    rates = category_rates[activity.codes]  # 欠損のコード -1 は末尾の 0 を指す
+    duration_minutes = np.nan_to_num(np.asarray(duration_minutes, dtype=np.float64))
+    return rates * np.maximum(duration_minutes, 0)
@@ -0,0 +1,76 @@
+import io
+import os
+import threading
+
+from hydrocare.lazy import lazy_import
+
+Image = lazy_import("PIL.Image")
+
+# 作成する幅 (px)。centered レイアウトの本文幅 (約700px) の等倍と2倍
+VARIANT_WIDTHS = (720, 1440)
+JPEG_QUALITY = 80
+
+# 画面幅の目安: スマートフォンは等倍、それ以外は高解像度ディスプレイ向けに2倍を使う
+MOBILE_TARGET_WIDTH = 720
+DESKTOP_TARGET_WIDTH = 1440
+
+
+# 元画像を指定した幅に縮小し、再圧縮したバイト列を返す (元画像より大きくはしない)
+# st.image は JPEG・PNG 以外 (WebP など) を受け取ると毎回 JPEG に変換し直すため、そのまま配信される JPEG・PNG で作る
+def encode_variant(image, width, quality=JPEG_QUALITY):
+    if image.width > width:
+        image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+    buffer = io.BytesIO()
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    if has_alpha:
+        image.save(buffer, format="PNG", optimize=True)
+    else:
+        image.convert("RGB").save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+# User-Agent から使う幅を決める
+def target_width_for(user_agent):
+    return MOBILE_TARGET_WIDTH if "Mobi" in (user_agent or "") else DESKTOP_TARGET_WIDTH
+
+
+# --- 縮小・再圧縮した画像のキャッシュ (プロセス内で共有) ---
+# 画像ごとに最初に要求されたときに全ての幅を作り、以降はメモリ上のバイト列を返す
+class ImageVariantCache:
+    def __init__(self, widths=VARIANT_WIDTHS, quality=JPEG_QUALITY):
+        self.widths = tuple(sorted(widths))
+        self.quality = quality
+        self._variants = {}
+        self._lock = threading.Lock()
+
+    def variants(self, path):
+        key = os.path.abspath(path)
+        with self._lock:
+            variants = self._variants.get(key)
+            if variants is None:
+                with Image.open(key) as image:
+                    image.load()
+                    # 元画像より幅の広い版は作らず、元の幅の版にまとめる
+                    widths = sorted({min(width, image.width) for width in self.widths})
+                    variants = self._variants[key] = {width: encode_variant(image, width, self.quality) for width in widths}
+        return variants
+
+    # target_width 以上で最も小さい版 (なければ最大の版) を返す
+    def get(self, path, target_width):
+        variants = self.variants(path)
+        for width in sorted(variants):
+            if width >= target_width:
+                return variants[width]
+        return variants[max(variants)]
+
+    def warm(self, paths):
+        for path in paths:
+            self.variants(path)
+        return self
+
+    def stats(self):
+        with self._lock:
+            return {
+                path: {width: len(data) for width, data in variants.items()}
+                for path, variants in self._variants.items()
+            }
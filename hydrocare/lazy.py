@@ -0,0 +1,34 @@
+import importlib
+
+
+# --- 重いライブラリの遅延 import ---
+# 最初に属性を参照したときにモジュールを読み込む代理オブジェクト (ウォークスルーだけを見る訪問者は読み込みを待たない)
+# importlib.util.LazyLoader は sys.modules に登録されるため、inspect や Streamlit のファイル監視が
+# __file__ を調べた時点で読み込まれてしまう。そのため sys.modules には登録しない
+class LazyModule:
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = self.__dict__['_module'] = importlib.import_module(self._name)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__['_module'] is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+
+# 遅延 import したモジュールを今すぐ読み込む (ウォームアップ用)
+def load_now(*modules):
+    for module in modules:
+        module._load()
@@ -0,0 +1,157 @@
+import collections
+import datetime
+
+from hydrocare.lazy import lazy_import
+from hydrocare.storage import MICROSECONDS_PER_HOUR
+
+np = lazy_import("numpy")
+
+# インサイト分析で見る期間 (日数)。時間帯の分布だけは全期間の集計を使う
+FEATURE_DAYS = 90
+# 時間帯の分布は3時間ごとの8区分で表す
+HOUR_BAND_WIDTH = 3
+# 表示する最長の間隔の件数と、割合を表示する飲み物の種類の数 (それ以外は「その他」にまとめる)
+MAX_GAPS = 3
+MAX_DRINK_TYPES = 4
+# 直近の傾向として比べる日数
+RECENT_DAYS = 7
+WEEKDAY_NAMES = "月火水木金土日"
+
+LogFeatures = collections.namedtuple("LogFeatures", [
+    'first_date',  # 期間内で最初に記録のある日
+    'today',
+    'entry_count',
+    'active_days',  # 期間内で記録のある日数
+    'weekday_hour_share',  # 平日の時間帯ごとの割合 (8区分、合計 1)
+    'weekend_hour_share',
+    'longest_gaps',  # [(開始時刻, 時間)] 日ごとの、同じ日の記録どうしの最長の間隔の長い順
+    'type_share',  # [(種類, 割合)] 多い順
+    'attained_days',  # 目標を達成した日数 (今日を除く)
+    'complete_days',  # 期間内の今日を除く日数
+    'current_streak',
+    'longest_streak',
+    'weekday_avg_ml',
+    'weekend_avg_ml',
+    'recent_avg_ml',
+    'period_avg_ml',
+])
+
+
+# --- 水分補給記録の特徴量の要約 ---
+# 記録の追加と同じトランザクションで更新される日別・曜日と時間帯別・日ごとの最長の間隔の集計テーブルから作るため、
+# 何か月分の記録があっても読むのは集計テーブルの数百行だけで済む。
+# 記録がない場合は None を返す
+def build_log_features(store, user_id, daily_target_ml, today=None, days=FEATURE_DAYS):
+    today = today or datetime.date.today()
+    start = today - datetime.timedelta(days=days - 1)
+    end = today + datetime.timedelta(days=1)
+    daily_totals = store.daily_totals_between(user_id, start, end)
+    if not daily_totals:
+        return None
+
+    # 記録を付け始める前の日は数えない (新しいユーザーの平均が 0 の日で下がらないようにする)
+    first_date = min(daily_totals)
+    dates = np.arange(np.datetime64(first_date, "D"), np.datetime64(end, "D"))
+    totals = np.array([daily_totals.get(date, 0) for date in dates.astype(datetime.date)], dtype=np.float64)
+    weekend = (dates.astype(np.int64) + 3) % 7 >= 5
+    # 今日はまだ途中なので、平均と達成率は昨日までで求める (今日しか記録がない場合は今日を使う)
+    complete = slice(0, len(totals) - 1) if len(totals) > 1 else slice(0, 1)
+    attained = totals >= daily_target_ml if daily_target_ml > 0 else np.zeros(len(totals), dtype=bool)
+    hourly_totals = store.hourly_totals(user_id)
+
+    return LogFeatures(
+        first_date=first_date,
+        today=today,
+        entry_count=store.count_between(user_id, first_date, end),
+        active_days=len(daily_totals),
+        weekday_hour_share=_hour_share(hourly_totals, weekend=False),
+        weekend_hour_share=_hour_share(hourly_totals, weekend=True),
+        longest_gaps=[
+            (started, gap / MICROSECONDS_PER_HOUR) for started, gap in store.longest_daily_gaps(user_id, first_date, end, MAX_GAPS)
+        ],
+        type_share=_type_share(store.type_totals_between(user_id, first_date, end)),
+        attained_days=int(attained[complete].sum()),
+        complete_days=len(totals[complete]),
+        current_streak=_current_streak(attained),
+        longest_streak=_longest_run(attained),
+        weekday_avg_ml=_mean(totals[complete][~weekend[complete]]),
+        weekend_avg_ml=_mean(totals[complete][weekend[complete]]),
+        recent_avg_ml=_mean(totals[complete][-RECENT_DAYS:]),
+        period_avg_ml=_mean(totals[complete]),
+    )
+
+
+def _mean(values):
+    return float(values.mean()) if len(values) else None
+
+
+def _hour_share(hourly_totals, weekend):
+    by_hour = np.zeros(24, dtype=np.float64)
+    for weekday, hour, total_ml, _ in hourly_totals:
+        if (weekday >= 5) == weekend:
+            by_hour[hour] += total_ml
+    bands = by_hour.reshape(-1, HOUR_BAND_WIDTH).sum(axis=1)
+    return bands / bands.sum() if bands.sum() > 0 else None
+
+
+def _type_share(type_totals):
+    total = sum(type_totals.values())
+    if total <= 0:
+        return []
+    ranked = sorted(type_totals.items(), key=lambda item: item[1], reverse=True)
+    if len(ranked) > MAX_DRINK_TYPES:
+        ranked = ranked[:MAX_DRINK_TYPES - 1] + [("その他", sum(total_ml for _, total_ml in ranked[MAX_DRINK_TYPES - 1:]))]
+    return [(drink_type, total_ml / total) for drink_type, total_ml in ranked]
+
+
+def _longest_run(flags):
+    padded = np.concatenate(([0], flags.astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(padded))
+    return int((edges[1::2] - edges[::2]).max()) if len(edges) else 0
+
+
+# 今日または昨日まで続いている連続達成日数 (今日はまだ途中なので、未達成でも連続は途切れていない扱い)
+def _current_streak(flags):
+    flags = flags if flags[-1] else flags[:-1]
+    if not len(flags) or not flags[-1]:
+        return 0
+    misses = np.flatnonzero(~flags)
+    return int(len(flags) - 1 - misses[-1]) if len(misses) else len(flags)
+
+
+# --- プロンプト用の文章 ---
+# 記録の件数や期間の長さによらず、行数と1行の長さが決まった短い文章にする
+def format_log_features(features, daily_target_ml):
+    lines = [
+        f"期間: {features.first_date:%Y-%m-%d}〜{features.today:%Y-%m-%d} "
+        f"(記録のある日 {features.active_days}日 / {features.entry_count}件)",
+    ]
+    if features.period_avg_ml is not None:
+        lines.append(
+            f"1日の平均: {features.period_avg_ml:.0f}ml (直近{RECENT_DAYS}日 {features.recent_avg_ml:.0f}ml)、"
+            f"平日 {_format_ml(features.weekday_avg_ml)} / 週末 {_format_ml(features.weekend_avg_ml)}"
+        )
+    if daily_target_ml > 0:
+        lines.append(
+            f"目標 {daily_target_ml}ml の達成: {features.attained_days}/{features.complete_days}日、"
+            f"現在 {features.current_streak}日連続、最長 {features.longest_streak}日連続"
+        )
+    for label, share in (("平日", features.weekday_hour_share), ("週末", features.weekend_hour_share)):
+        if share is not None:
+            bands = " ".join(
+                f"{i * HOUR_BAND_WIDTH}-{(i + 1) * HOUR_BAND_WIDTH}時 {value:.0%}" for i, value in enumerate(share)
+            )
+            lines.append(f"時間帯の割合 ({label}、全期間): {bands}")
+    if features.longest_gaps:
+        gaps = "、".join(
+            f"{started:%m/%d}({WEEKDAY_NAMES[started.weekday()]}) {started:%H:%M}から{hours:.1f}時間"
+            for started, hours in features.longest_gaps
+        )
+        lines.append(f"1日の中で最も長い間隔: {gaps}")
+    if features.type_share:
+        lines.append("種類の割合: " + "、".join(f"{drink_type} {share:.0%}" for drink_type, share in features.type_share))
+    return "\n".join(lines)
+
+
+def _format_ml(value):
+    return f"{value:.0f}ml" if value is not None else "記録なし"
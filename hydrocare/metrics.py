@@ -0,0 +1,283 @@
+import bisect
+import http.server
+import inspect
+import math
+import os
+import threading
+import time
+
+# 処理時間のヒストグラムの区切り (秒)。Prometheus の既定値とほぼ同じ
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# 計測が無効なときに返す、何もしないタイマー
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        if exc_type is not None:
+            self.registry.inc("hydrocare_errors_total", metric=self.name, **self.labels)
+        return False
+
+
+def _timed_generator(generator, timer):
+    try:
+        yield from generator
+    except GeneratorExit:
+        # 読み手が途中でやめた場合はそこまでの時間を記録する
+        timer.__exit__(None, None, None)
+        raise
+    except BaseException as e:
+        timer.__exit__(type(e), e, e.__traceback__)
+        raise
+    timer.__exit__(None, None, None)
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    # バケットの中を線形補間して分位点を推定し、実際の最小値・最大値の範囲に収める
+    def quantile(self, q):
+        if self.count == 0:
+            return math.nan
+        return min(max(self._interpolate(q), self.min), self.max)
+
+    # Prometheus の histogram_quantile と同じ考え方
+    def _interpolate(self, q):
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets):
+                    return self.max
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.max
+
+
+# --- 処理時間と回数の計測 ---
+# 無効な場合は time() が共有の空のタイマーを返し、instrument() は関数をそのまま返すため、ほぼ負荷がかからない
+class MetricsRegistry:
+    def __init__(self, enabled=False, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def time(self, name, **labels):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    # 関数の呼び出しごとの処理時間を記録するデコレーター (無効なら何もせずに関数を返す)
+    # ジェネレーターを返す関数 (ストリーミングの回答など) は、呼び出しから最後まで読み終えるまでの時間を記録する
+    def instrument(self, name, **labels):
+        def decorator(func):
+            if not self.enabled:
+                return func
+
+            def wrapper(*args, **kwargs):
+                timer = _Timer(self, name, labels).__enter__()
+                try:
+                    result = func(*args, **kwargs)
+                except BaseException as e:
+                    timer.__exit__(type(e), e, e.__traceback__)
+                    raise
+                if inspect.isgenerator(result):
+                    return _timed_generator(result, timer)
+                timer.__exit__(None, None, None)
+                return result
+
+            wrapper.__name__ = func.__name__
+            wrapper.__qualname__ = func.__qualname__
+            wrapper.__wrapped__ = func
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    # 画面表示用の一覧 (処理時間はミリ秒)
+    def summary(self):
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            rows = []
+            for (name, labels), histogram in histograms:
+                rows.append({
+                    'metric': name,
+                    'labels': ", ".join(f"{key}={value}" for key, value in labels),
+                    'count': histogram.count,
+                    'mean_ms': histogram.sum / histogram.count * 1000,
+                    'p50_ms': histogram.quantile(0.5) * 1000,
+                    'p95_ms': histogram.quantile(0.95) * 1000,
+                    'p99_ms': histogram.quantile(0.99) * 1000,
+                })
+        return rows
+
+    # Prometheus のテキスト形式で出力する
+    def render_prometheus(self):
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            lines = []
+            declared = set()
+            for (name, labels), histogram in histograms:
+                if name not in declared:
+                    lines.append(f"# TYPE {name} histogram")
+                    declared.add(name)
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (math.inf,), histogram.counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == math.inf else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum!r}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+            for (name, labels), value in counters:
+                if name not in declared:
+                    lines.append(f"# TYPE {name} counter")
+                    declared.add(name)
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    # node_exporter の textfile collector などから読めるよう、一時ファイル経由で置き換える
+    def write_textfile(self, path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in labels) + "}"
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# --- 計測結果の書き出し ---
+# textfile_path があれば interval_seconds ごとにファイルへ書き出し、port があれば /metrics で配信する
+class MetricsExporter:
+    def __init__(self, registry, textfile_path=None, port=None, host="127.0.0.1", interval_seconds=15):
+        self.registry = registry
+        self.textfile_path = textfile_path
+        self.port = port
+        self.host = host
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread = None
+        self._server = None
+
+    def start(self):
+        if self.textfile_path:
+            self._thread = threading.Thread(target=self._write_loop, name="hydrocare-metrics-writer", daemon=True)
+            self._thread.start()
+        if self.port is not None:
+            self._server = http.server.ThreadingHTTPServer((self.host, self.port), self._handler_class())
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, name="hydrocare-metrics-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if self.textfile_path:
+            self.registry.write_textfile(self.textfile_path)
+
+    @property
+    def url(self):
+        if self._server is None:
+            return None
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def _write_loop(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.registry.write_textfile(self.textfile_path)
+            except OSError:
+                pass
+
+    def _handler_class(self):
+        registry = self.registry
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return MetricsHandler
+
+
+# --- アプリ全体で共有する計測 (環境変数 HYDROCARE_METRICS=1 で有効) ---
+METRICS = MetricsRegistry(enabled=os.getenv("HYDROCARE_METRICS", "") == "1")
@@ -0,0 +1,195 @@
+import collections
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# 期限を過ぎた通知をまとめて送る件数の上限
+DEFAULT_BATCH_SIZE = 100
+# 送れなかった通知を送り直す回数と、1回目の送り直しまでの秒数 (2回目以降は倍ずつ延ばす)
+DEFAULT_RETRIES = 2
+DEFAULT_RETRY_BACKOFF_SECONDS = 30
+
+# 1件分の水分補給リマインダー (attempt は送り直しの回数)
+Reminder = collections.namedtuple("Reminder", ["user_id", "due_at", "interval_minutes", "attempt"], defaults=[0])
+
+
+# --- 通知の送り先 ---
+# notify(reminders) を持つオブジェクトなら何でもよい。期限を過ぎたリマインダーが最大 batch_size 件ずつ渡される
+
+# Webhook (JSON を POST) で通知する。1回の POST で1バッチ分を送る
+class WebhookNotifier:
+    def __init__(self, url, timeout=(3.05, 10), session=None):
+        self.url = url
+        self.timeout = timeout
+        self.session = session or requests.Session()
+
+    def notify(self, reminders):
+        payload = {
+            'reminders': [
+                {
+                    'user_id': reminder.user_id,
+                    'due_at': reminder.due_at.isoformat(timespec="seconds"),
+                    'interval_minutes': reminder.interval_minutes,
+                    'message': "水分補給の時間です！",
+                }
+                for reminder in reminders
+            ]
+        }
+        response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+
+
+# ログに書き出すだけの通知 (Webhook が設定されていない場合の動作確認用)
+class LoggingNotifier:
+    def notify(self, reminders):
+        for reminder in reminders:
+            logger.info("reminder due: user=%s due_at=%s", reminder.user_id, reminder.due_at)
+
+
+# --- プロセス全体で1つのリマインダースケジューラー ---
+# ユーザーごとの次の期限をヒープで管理し、1本のスレッドが最も早い期限まで眠って、期限を過ぎた分だけをまとめて送る。
+# 開いているタブの数には関係なく、処理は予定の登録と期限を迎えた通知の件数だけに比例する。
+# 予定を入れ直した場合、古いヒープの要素は消さずに残し、取り出したときに最新の予定でなければ読み飛ばす。
+# 通知先でエラーになったバッチは、その間に予定が入れ直されていない分だけを retries 回まで間隔を空けて送り直す
+class ReminderScheduler:
+    def __init__(
+        self,
+        notifier,
+        batch_size=DEFAULT_BATCH_SIZE,
+        retries=DEFAULT_RETRIES,
+        retry_backoff_seconds=DEFAULT_RETRY_BACKOFF_SECONDS,
+        clock=datetime.datetime.now,
+    ):
+        self.notifier = notifier
+        self.batch_size = batch_size
+        self.retries = retries
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.clock = clock
+        self._heap = []
+        self._scheduled = {}
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="reminder-scheduler", daemon=True)
+        self._counters = collections.Counter()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    # 最後に飲んだ時刻と通知間隔から次の期限を登録する (同じ期限ですでに登録済みなら何もしない)
+    # 期限を過ぎている場合は、古い記録で通知が一斉に飛ばないように登録しない
+    def schedule(self, user_id, last_intake_time, interval_minutes):
+        if last_intake_time is None:
+            self.cancel(user_id)
+            return None
+        due_at = last_intake_time + datetime.timedelta(minutes=interval_minutes)
+        with self._cond:
+            current = self._scheduled.get(user_id)
+            if current is not None and current.due_at == due_at and current.interval_minutes == interval_minutes:
+                return due_at
+            if due_at <= self.clock():
+                self._scheduled.pop(user_id, None)
+                return None
+            self._push(Reminder(user_id, due_at, interval_minutes), due_at)
+            self._counters['scheduled'] += 1
+        return due_at
+
+    def _push(self, reminder, send_at):
+        self._scheduled[reminder.user_id] = reminder
+        heapq.heappush(self._heap, (send_at, next(self._sequence), reminder))
+        self._compact()
+        # 先頭が入れ替わった場合だけスレッドを起こして待ち時間を計算し直させる
+        if self._heap[0][2] is reminder:
+            self._cond.notify()
+
+    # 時計 (clock) の外から時刻が進んだ場合などに、スレッドに期限を確かめ直させる
+    def wake(self):
+        with self._cond:
+            self._cond.notify()
+
+    def cancel(self, user_id):
+        with self._cond:
+            if self._scheduled.pop(user_id, None) is not None:
+                self._counters['cancelled'] += 1
+
+    def next_due(self, user_id):
+        with self._cond:
+            reminder = self._scheduled.get(user_id)
+        return reminder.due_at if reminder else None
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': len(self._scheduled),
+                'heap_size': len(self._heap),
+                **self._counters,
+            }
+
+    # 期限を過ぎたリマインダーを最大 batch_size 件取り出す (入れ直し・取り消し済みの古い要素は捨てる)
+    def _pop_due(self, now):
+        batch = []
+        while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+            _, _, reminder = heapq.heappop(self._heap)
+            if self._scheduled.get(reminder.user_id) is reminder:
+                del self._scheduled[reminder.user_id]
+                batch.append(reminder)
+        return batch
+
+    # 入れ直しで古い要素が溜まりすぎたらヒープを作り直す (償却すると登録1件あたり O(log n))
+    def _compact(self):
+        if len(self._heap) > 2 * len(self._scheduled) + 1024:
+            self._heap = [item for item in self._heap if self._scheduled.get(item[2].user_id) is item[2]]
+            heapq.heapify(self._heap)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    now = self.clock()
+                    batch = self._pop_due(now)
+                    if batch:
+                        break
+                    timeout = (self._heap[0][0] - now).total_seconds() if self._heap else None
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        started = time.perf_counter()
+        try:
+            self.notifier.notify(batch)
+        except Exception:
+            logger.exception("failed to send %d reminders", len(batch))
+            self._retry(batch)
+            return
+        with self._cond:
+            self._counters['dispatched'] += len(batch)
+            self._counters['batches'] += 1
+            self._counters['dispatch_seconds'] += time.perf_counter() - started
+
+    def _retry(self, batch):
+        with self._cond:
+            now = self.clock()
+            for reminder in batch:
+                if reminder.attempt >= self.retries:
+                    self._counters['failed'] += 1
+                # 送れなかった間に新しく飲んで予定が入れ直されていれば、古い通知は送り直さない
+                elif reminder.user_id not in self._scheduled:
+                    delay = datetime.timedelta(seconds=self.retry_backoff_seconds * 2 ** reminder.attempt)
+                    self._push(reminder._replace(attempt=reminder.attempt + 1), now + delay)
+                    self._counters['retried'] += 1
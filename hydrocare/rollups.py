@@ -0,0 +1,60 @@
+import datetime
+
+from hydrocare.lazy import lazy_import
+from hydrocare.storage import from_month_number, to_month_number
+
+pd = lazy_import("pandas")
+
+# 摂取ログで選べる集計期間 (日数) と集計単位
+SUMMARY_WINDOWS = [7, 30, 90, 365]
+SUMMARY_GRANULARITIES = {
+    "day": "日ごと",
+    "week": "週ごと",
+    "month": "月ごと",
+}
+
+
+# --- 日別・月別の集計テーブルから期間ごとの摂取量サマリーを作る ---
+# 記録そのものは読まないため、1年分の記録があっても集計テーブルの数百行を読むだけで済む
+def summarize_intake(store, user_id, base_daily_target_ml, days=7, granularity="day", today=None):
+    today = today or datetime.date.today()
+    start = today - datetime.timedelta(days=days - 1)
+
+    bucket_dates = []
+    bucket_totals = []
+    bucket_days = []
+    if granularity == "month":
+        # 月ごとの場合は、期間の初日を含む月から今月までを暦月単位で表示する
+        first_month = to_month_number(start)
+        last_month = to_month_number(today)
+        monthly_totals = store.monthly_totals_between(user_id, first_month, last_month)
+        for month in range(first_month, last_month + 1):
+            month_start = from_month_number(month)
+            month_end = min(from_month_number(month + 1) - datetime.timedelta(days=1), today)
+            bucket_dates.append(month_start)
+            bucket_totals.append(monthly_totals.get(month, 0))
+            bucket_days.append((month_end - month_start).days + 1)
+    else:
+        daily_totals = store.daily_totals_between(user_id, start, today + datetime.timedelta(days=1))
+        for offset in range(days):
+            date = start + datetime.timedelta(days=offset)
+            if granularity == "week":
+                # 週は月曜始まり。期間の初日で切れる週は初日から数える
+                bucket_date = max(date - datetime.timedelta(days=date.weekday()), start)
+            else:
+                bucket_date = date
+            if bucket_dates and bucket_dates[-1] == bucket_date:
+                bucket_totals[-1] += daily_totals.get(date, 0)
+                bucket_days[-1] += 1
+            else:
+                bucket_dates.append(bucket_date)
+                bucket_totals.append(daily_totals.get(date, 0))
+                bucket_days.append(1)
+
+    summary = pd.DataFrame({
+        'Date': pd.to_datetime(bucket_dates),
+        'Total_ML': bucket_totals,
+        'Target_ML': [base_daily_target_ml * bucket_day_count for bucket_day_count in bucket_days],
+    })
+    summary['Total_ML'] = summary['Total_ML'].astype(int)
+    return summary
@@ -0,0 +1,823 @@
+import collections
+import contextlib
+import datetime
+import io
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import zlib
+
+from hydrocare.lazy import lazy_import
+
+np = lazy_import("numpy")
+
+DEFAULT_DB_PATH = os.getenv(
+    "HYDROCARE_DB_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "hydrocare.db")
+)
+
+# 時刻は「現地時刻の 1970-01-01 00:00 からのマイクロ秒」で保存する。
+# タイムゾーン変換をしないので、ts // MICROSECONDS_PER_DAY がそのまま現地の日付になる。
+LOCAL_EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECONDS_PER_DAY = 86_400_000_000
+MICROSECONDS_PER_HOUR = 3_600_000_000
+# 1970-01-01 は木曜日 (月曜日を 0 とした曜日の番号で 3)
+EPOCH_WEEKDAY = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS water_log (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    amount_ml INTEGER NOT NULL,
+    drink_type TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS water_log_user_ts ON water_log (user_id, ts);
+CREATE TABLE IF NOT EXISTS daily_totals (
+    user_id TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    drink_type TEXT NOT NULL,
+    total_ml INTEGER NOT NULL,
+    entry_count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, day, drink_type)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS monthly_totals (
+    user_id TEXT NOT NULL,
+    month INTEGER NOT NULL,
+    total_ml INTEGER NOT NULL,
+    entry_count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, month)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hourly_totals (
+    user_id TEXT NOT NULL,
+    weekday INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    total_ml INTEGER NOT NULL,
+    entry_count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, weekday, hour)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS daily_gaps (
+    user_id TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    gap_start INTEGER NOT NULL,
+    gap INTEGER NOT NULL,
+    PRIMARY KEY (user_id, day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS user_revisions (
+    user_id TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS water_log_events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    entry_id INTEGER NOT NULL,
+    ts INTEGER,
+    amount_ml INTEGER,
+    drink_type TEXT,
+    prev_ts INTEGER,
+    prev_amount_ml INTEGER,
+    prev_drink_type TEXT,
+    reverts INTEGER
+);
+CREATE INDEX IF NOT EXISTS water_log_events_user_revision ON water_log_events (user_id, revision);
+CREATE INDEX IF NOT EXISTS water_log_events_reverts ON water_log_events (reverts) WHERE reverts IS NOT NULL;
+CREATE TABLE IF NOT EXISTS water_log_snapshots (
+    user_id TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL,
+    entry_count INTEGER NOT NULL,
+    pending_events INTEGER NOT NULL,
+    drink_types TEXT NOT NULL,
+    data BLOB
+);
+CREATE TABLE IF NOT EXISTS user_profiles (
+    user_id TEXT PRIMARY KEY,
+    age INTEGER,
+    gender TEXT,
+    weight_kg REAL,
+    daily_target_ml INTEGER NOT NULL DEFAULT 0,
+    city_name TEXT,
+    updated_at INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS event_consumers (
+    name TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+SCHEMA_VERSION = 6
+
+# --- 集計テーブルを記録から作り直す SQL ({where} にユーザーの絞り込みを入れる) ---
+REBUILD_DAILY_TOTALS = f"""
+INSERT INTO daily_totals (user_id, day, drink_type, total_ml, entry_count)
+SELECT user_id, ts / {MICROSECONDS_PER_DAY}, drink_type, SUM(amount_ml), COUNT(*)
+FROM water_log {{where}} GROUP BY user_id, ts / {MICROSECONDS_PER_DAY}, drink_type
+"""
+REBUILD_MONTHLY_TOTALS = """
+INSERT INTO monthly_totals (user_id, month, total_ml, entry_count)
+SELECT user_id,
+    CAST(strftime('%Y', day * 86400, 'unixepoch') AS INTEGER) * 12
+        + CAST(strftime('%m', day * 86400, 'unixepoch') AS INTEGER) - 1 AS month,
+    SUM(total_ml), SUM(entry_count)
+FROM daily_totals {where} GROUP BY user_id, month
+"""
+REBUILD_HOURLY_TOTALS = f"""
+INSERT INTO hourly_totals (user_id, weekday, hour, total_ml, entry_count)
+SELECT user_id, (ts / {MICROSECONDS_PER_DAY} + {EPOCH_WEEKDAY}) % 7 AS weekday,
+    (ts / {MICROSECONDS_PER_HOUR}) % 24 AS hour, SUM(amount_ml), COUNT(*)
+FROM water_log {{where}} GROUP BY user_id, weekday, hour
+"""
+ROLLUP_TABLES = ["daily_totals", "monthly_totals", "hourly_totals", "daily_gaps"]
+# 日ごとの、同じ日の連続する記録の間隔のうち最も長いもの (開始時刻と長さ。記録が1件以下の日は行を作らない)
+INSERT_DAILY_GAP = "INSERT INTO daily_gaps (user_id, day, gap_start, gap) VALUES (?, ?, ?, ?)"
+
+UPSERT_DAILY_TOTAL = """
+INSERT INTO daily_totals (user_id, day, drink_type, total_ml, entry_count) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (user_id, day, drink_type) DO UPDATE SET
+    total_ml = total_ml + excluded.total_ml,
+    entry_count = entry_count + excluded.entry_count
+"""
+
+UPSERT_MONTHLY_TOTAL = """
+INSERT INTO monthly_totals (user_id, month, total_ml, entry_count) VALUES (?, ?, ?, ?)
+ON CONFLICT (user_id, month) DO UPDATE SET
+    total_ml = total_ml + excluded.total_ml,
+    entry_count = entry_count + excluded.entry_count
+"""
+
+UPSERT_HOURLY_TOTAL = """
+INSERT INTO hourly_totals (user_id, weekday, hour, total_ml, entry_count) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (user_id, weekday, hour) DO UPDATE SET
+    total_ml = total_ml + excluded.total_ml,
+    entry_count = entry_count + excluded.entry_count
+"""
+
+BUMP_REVISION = """
+INSERT INTO user_revisions (user_id, revision) VALUES (?, 1)
+ON CONFLICT (user_id) DO UPDATE SET revision = revision + 1
+"""
+
+INSERT_ENTRY = "INSERT INTO water_log (id, user_id, ts, amount_ml, drink_type) VALUES (?, ?, ?, ?, ?)"
+INSERT_EVENT = """
+INSERT INTO water_log_events (seq, user_id, revision, kind, entry_id, ts, amount_ml, drink_type, prev_ts, prev_amount_ml, prev_drink_type, reverts)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+EVENT_COLUMNS = "seq, kind, entry_id, ts, amount_ml, drink_type, prev_ts, prev_amount_ml, prev_drink_type, reverts"
+# 取り消されていない最後の操作 (取り消しのイベント自体は取り消しの対象にしない)
+LAST_UNDOABLE_REVISION = """
+SELECT revision FROM water_log_events AS e
+WHERE user_id = ? AND reverts IS NULL AND NOT EXISTS (SELECT 1 FROM water_log_events AS u WHERE u.reverts = e.seq)
+ORDER BY revision DESC LIMIT 1
+"""
+UPSERT_SNAPSHOT = """
+INSERT INTO water_log_snapshots (user_id, revision, entry_count, pending_events, drink_types, data) VALUES (?, ?, ?, 0, ?, ?)
+ON CONFLICT (user_id) DO UPDATE SET
+    revision = excluded.revision, entry_count = excluded.entry_count, pending_events = 0,
+    drink_types = excluded.drink_types, data = excluded.data
+"""
+UPSERT_PROFILE = """
+INSERT INTO user_profiles (user_id, age, gender, weight_kg, daily_target_ml, city_name, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (user_id) DO UPDATE SET
+    age = excluded.age, gender = excluded.gender, weight_kg = excluded.weight_kg,
+    daily_target_ml = excluded.daily_target_ml, city_name = excluded.city_name, updated_at = excluded.updated_at
+"""
+# イベントを読んで集計する仕組み (hydrocare.cohort_analytics など) が event_consumers に登録している場合、
+# 整理ではどれかがまだ読んでいないイベント (登録した番号より後) を消さない
+CONSUMED_SEQ = "(SELECT COALESCE(MIN(seq), 9223372036854775807) FROM event_consumers)"
+ADD_PENDING_EVENTS = """
+INSERT INTO water_log_snapshots (user_id, revision, entry_count, pending_events, drink_types, data) VALUES (?, 0, 0, ?, '[]', NULL)
+ON CONFLICT (user_id) DO UPDATE SET pending_events = pending_events + excluded.pending_events
+RETURNING pending_events, entry_count
+"""
+
+# --- 記録の変更イベント ---
+# 記録は追加・修正・削除のイベントとして water_log_events に積み、water_log と集計テーブルはその結果 (現在の状態) として
+# 同じトランザクションで更新する。row / prev_row は変更後 / 変更前の (時刻のマイクロ秒, 量, 種類) で、
+# 修正・削除は変更前の値を持つため、取り消しは逆向きのイベントを積むだけで済む
+EVENT_ADD = "add"
+EVENT_EDIT = "edit"
+EVENT_DELETE = "delete"
+INSERT_ADD_EVENT = f"""
+INSERT INTO water_log_events (seq, user_id, revision, kind, entry_id, ts, amount_ml, drink_type) VALUES (?, ?, ?, '{EVENT_ADD}', ?, ?, ?, ?)
+"""
+LogEvent = collections.namedtuple("LogEvent", ["kind", "entry_id", "row", "prev_row", "reverts"])
+# 取り消せる直前の操作 (画面の表示用。kind は最初のイベントの種類、amount_ml は操作による量の増減)
+LogAction = collections.namedtuple("LogAction", ["revision", "kind", "entry_count", "amount_ml"])
+
+# スナップショットを作るのは、前回のスナップショット以降のイベントが
+# max(COMPACT_MIN_EVENTS, スナップショットの記録の件数) に達したとき。スナップショットの作成は記録の件数に比例するため、
+# 記録の件数以上のイベントがたまるまで待てば、1イベントあたりの作成時間は一定に収まる
+COMPACT_MIN_EVENTS = 10_000
+# スナップショットを作っても、直近の操作のイベントは取り消し用に残す
+UNDO_HISTORY_ACTIONS = 20
+
+# スナップショットの記録は時刻順に並べ、ID と時刻は前の行との差にしてから圧縮する
+SNAPSHOT_DTYPE = [('id', '<i8'), ('ts', '<i8'), ('amount_ml', '<i4'), ('type_code', '<i2')]
+
+
+
+def to_timestamp(value):
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    delta = value - LOCAL_EPOCH
+    return (delta.days * 86_400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def from_timestamp(ts):
+    return LOCAL_EPOCH + datetime.timedelta(microseconds=ts)
+
+
+def to_day_number(date):
+    return (date - LOCAL_EPOCH.date()).days
+
+
+def from_day_number(day):
+    return LOCAL_EPOCH.date() + datetime.timedelta(days=day)
+
+
+# 月は「西暦 × 12 + (月 - 1)」の通し番号で扱う
+def to_month_number(date):
+    return date.year * 12 + date.month - 1
+
+
+def from_month_number(month):
+    return datetime.date(month // 12, month % 12 + 1, 1)
+
+
+def _row_to_entry(row):
+    return {'time': from_timestamp(row[0]), 'amount_ml': row[1], 'type': row[2]}
+
+
+def _event_to_columns(event):
+    row = event.row or (None, None, None)
+    prev_row = event.prev_row or (None, None, None)
+    return (event.kind, event.entry_id, *row, *prev_row, event.reverts)
+
+
+# EVENT_COLUMNS の順の行を (seq, LogEvent) にする
+def _columns_to_event(columns):
+    seq, kind, entry_id, ts, amount_ml, drink_type, prev_ts, prev_amount_ml, prev_drink_type, reverts = columns
+    row = (ts, amount_ml, drink_type) if ts is not None else None
+    prev_row = (prev_ts, prev_amount_ml, prev_drink_type) if prev_ts is not None else None
+    return seq, LogEvent(kind, entry_id, row, prev_row, reverts)
+
+
+# イベントを打ち消すイベント (追加 → 削除、修正 → 元の値への修正、削除 → 同じ ID での追加)
+def _inverse_event(seq, event):
+    kind = {EVENT_ADD: EVENT_DELETE, EVENT_EDIT: EVENT_EDIT, EVENT_DELETE: EVENT_ADD}[event.kind]
+    return LogEvent(kind, event.entry_id, event.prev_row, event.row, seq)
+
+
+# 記録 (water_log) へイベントを順に反映する。同じ種類が続くイベントはまとめて実行する
+def _apply_to_log(conn, user_id, events):
+    for kind, group in itertools.groupby(events, key=lambda event: event.kind):
+        if kind == EVENT_ADD:
+            conn.executemany(INSERT_ENTRY, [(event.entry_id, user_id, *event.row) for event in group])
+        elif kind == EVENT_EDIT:
+            conn.executemany(
+                "UPDATE water_log SET ts = ?, amount_ml = ?, drink_type = ? WHERE id = ?",
+                [(*event.row, event.entry_id) for event in group]
+            )
+        else:
+            conn.executemany("DELETE FROM water_log WHERE id = ?", [(event.entry_id,) for event in group])
+
+
+# 追加された行を足し、消えた行を引いて、日別・月別・曜日と時間帯別の集計を更新する
+def _apply_to_rollups(conn, user_id, added, removed):
+    daily = {}
+    hourly = {}
+    for rows, sign in ((added, 1), (removed, -1)):
+        for ts, amount_ml, drink_type in rows:
+            key = (ts // MICROSECONDS_PER_DAY, drink_type)
+            total_ml, entry_count = daily.get(key, (0, 0))
+            daily[key] = (total_ml + sign * amount_ml, entry_count + sign)
+            key = ((ts // MICROSECONDS_PER_DAY + EPOCH_WEEKDAY) % 7, ts // MICROSECONDS_PER_HOUR % 24)
+            total_ml, entry_count = hourly.get(key, (0, 0))
+            hourly[key] = (total_ml + sign * amount_ml, entry_count + sign)
+    # 月別の集計は日別の集計からまとめる (日付の変換は日の数だけで済む)
+    monthly = {}
+    months_by_day = {}
+    for (day, _), (day_total_ml, day_entry_count) in daily.items():
+        month = months_by_day.get(day)
+        if month is None:
+            month = months_by_day[day] = to_month_number(from_day_number(day))
+        total_ml, entry_count = monthly.get(month, (0, 0))
+        monthly[month] = (total_ml + day_total_ml, entry_count + day_entry_count)
+    conn.executemany(
+        UPSERT_DAILY_TOTAL,
+        [(user_id, day, drink_type, total_ml, entry_count) for (day, drink_type), (total_ml, entry_count) in daily.items()]
+    )
+    conn.executemany(
+        UPSERT_MONTHLY_TOTAL,
+        [(user_id, month, total_ml, entry_count) for month, (total_ml, entry_count) in monthly.items()]
+    )
+    conn.executemany(
+        UPSERT_HOURLY_TOTAL,
+        [(user_id, weekday, hour, total_ml, entry_count) for (weekday, hour), (total_ml, entry_count) in hourly.items()]
+    )
+    _refresh_daily_gaps(conn, user_id, {day for day, _ in daily})
+    if removed:
+        # 記録がなくなった日・月・時間帯の行は消す (減らした行だけを主キーで調べる)
+        conn.executemany(
+            "DELETE FROM daily_totals WHERE user_id = ? AND day = ? AND drink_type = ? AND entry_count <= 0",
+            [(user_id, day, drink_type) for (day, drink_type), (_, entry_count) in daily.items() if entry_count < 0]
+        )
+        conn.executemany(
+            "DELETE FROM monthly_totals WHERE user_id = ? AND month = ? AND entry_count <= 0",
+            [(user_id, month) for month, (_, entry_count) in monthly.items() if entry_count < 0]
+        )
+        conn.executemany(
+            "DELETE FROM hourly_totals WHERE user_id = ? AND weekday = ? AND hour = ? AND entry_count <= 0",
+            [(user_id, weekday, hour) for (weekday, hour), (_, entry_count) in hourly.items() if entry_count < 0]
+        )
+
+
+# 変更のあった日の最長の間隔を、その日の記録の時刻 (インデックスの範囲検索) から求め直す。連続する日はまとめて1回で求める
+def _refresh_daily_gaps(conn, user_id, days):
+    runs = []
+    for day in sorted(days):
+        if runs and runs[-1][1] == day:
+            runs[-1][1] = day + 1
+        else:
+            runs.append([day, day + 1])
+    for first, end in runs:
+        conn.execute("DELETE FROM daily_gaps WHERE user_id = ? AND day >= ? AND day < ?", (user_id, first, end))
+        timestamps = [row[0] for row in conn.execute(
+            "SELECT ts FROM water_log WHERE user_id = ? AND ts >= ? AND ts < ? ORDER BY ts",
+            (user_id, first * MICROSECONDS_PER_DAY, end * MICROSECONDS_PER_DAY)
+        )]
+        conn.executemany(INSERT_DAILY_GAP, _daily_gap_rows(user_id, timestamps))
+
+
+# 時刻順の記録の時刻から、日ごとの最長の間隔の行 (ユーザーID, 日, 開始時刻, 長さ) を作る (同じ長さなら早いほう)
+def _daily_gap_rows(user_id, timestamps):
+    if len(timestamps) < 2:
+        return []
+    timestamps = np.array(timestamps, dtype=np.int64)
+    days = timestamps // MICROSECONDS_PER_DAY
+    gaps = np.diff(timestamps)
+    inside = np.flatnonzero((days[1:] == days[:-1]) & (gaps > 0))
+    days, gaps, starts = days[inside], gaps[inside], timestamps[inside]
+    order = np.lexsort((starts, -gaps, days))
+    days, gaps, starts = days[order], gaps[order], starts[order]
+    first = np.flatnonzero(np.diff(days, prepend=days[:1] - 1))
+    return zip(itertools.repeat(user_id), days[first].tolist(), starts[first].tolist(), gaps[first].tolist())
+
+
+# (ID, 時刻のマイクロ秒, 量, 種類) の行を、種類の一覧 (JSON) と圧縮したバイト列にする
+def _encode_snapshot(rows):
+    drink_types = sorted({row[3] for row in rows})
+    codes = {drink_type: code for code, drink_type in enumerate(drink_types)}
+    array = np.zeros(len(rows), dtype=SNAPSHOT_DTYPE)
+    if rows:
+        ids, timestamps, amounts, types = zip(*rows)
+        array['id'] = np.diff(np.array(ids, dtype=np.int64), prepend=0)
+        array['ts'] = np.diff(np.array(timestamps, dtype=np.int64), prepend=0)
+        array['amount_ml'] = amounts
+        array['type_code'] = [codes[drink_type] for drink_type in types]
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return json.dumps(drink_types, ensure_ascii=False), zlib.compress(buffer.getvalue(), 1)
+
+
+# _encode_snapshot の逆。INSERT_ENTRY の引数の行を返す
+def _decode_snapshot(user_id, drink_types, data):
+    if data is None:
+        return []
+    array = np.load(io.BytesIO(zlib.decompress(data)), allow_pickle=False)
+    types = np.array(json.loads(drink_types) or [""], dtype=object)[array['type_code']]
+    return zip(
+        np.cumsum(array['id']).tolist(), itertools.repeat(user_id), np.cumsum(array['ts']).tolist(),
+        array['amount_ml'].tolist(), types.tolist()
+    )
+
+
+# --- 水分補給記録の永続ストレージ (SQLite) ---
+# ユーザーIDと時刻の複合インデックスで、期間指定の読み出しを範囲検索にする
+class WaterLogStore:
+    # compact_min_events: スナップショットを作るイベント数の下限 (None にすると自動では作らない)
+    def __init__(self, path=DEFAULT_DB_PATH, compact_min_events=COMPACT_MIN_EVENTS):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.compact_min_events = compact_min_events
+        # Streamlit はセッションごとに別スレッドでスクリプトを実行するため、接続を共有してロックで保護する
+        self._lock = threading.RLock()
+        # 取り込み中 (import_action の中) のユーザーごとの数
+        self._importing = collections.Counter()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._transaction():
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    self._conn.execute(statement)
+            self._migrate()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _migrate(self):
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 2:
+            # 日別集計テーブル追加前のデータベースは、既存の記録から一度だけ集計し直す
+            self._conn.execute("DELETE FROM daily_totals")
+            self._conn.execute(REBUILD_DAILY_TOTALS.format(where=""))
+        if version < 3:
+            # 月別集計と更新番号は日別集計から作り直す
+            self._conn.execute("DELETE FROM monthly_totals")
+            self._conn.execute(REBUILD_MONTHLY_TOTALS.format(where=""))
+            self._conn.execute("DELETE FROM user_revisions")
+            self._conn.execute(
+                "INSERT INTO user_revisions (user_id, revision) SELECT user_id, SUM(entry_count) FROM daily_totals GROUP BY user_id"
+            )
+        if version < 4:
+            # 曜日・時間帯別の集計は既存の記録から一度だけ集計する
+            self._conn.execute("DELETE FROM hourly_totals")
+            self._conn.execute(REBUILD_HOURLY_TOTALS.format(where=""))
+        if version < 5:
+            # イベント導入前の記録は、その時点の状態を各ユーザーのスナップショットにして、以降の変更だけをイベントとして積む。
+            # 新しい記録の ID はイベントの番号から付けるため、番号は既存の記録の ID の続きから始める
+            max_id = self._conn.execute("SELECT MAX(id) FROM water_log").fetchone()[0]
+            if max_id is not None:
+                self._conn.execute("DELETE FROM sqlite_sequence WHERE name = 'water_log_events'")
+                self._conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('water_log_events', ?)", (max_id,))
+            for (user_id,) in self._conn.execute("SELECT DISTINCT user_id FROM water_log").fetchall():
+                self._write_snapshot(self._conn, user_id, keep_actions=0)
+        if version < 6:
+            # 日ごとの最長の間隔は既存の記録から一度だけ求める
+            self._conn.execute("DELETE FROM daily_gaps")
+            for (user_id,) in self._conn.execute("SELECT DISTINCT user_id FROM water_log").fetchall():
+                self._write_daily_gaps(self._conn, user_id)
+        self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def append(self, user_id, time, amount_ml, drink_type):
+        self.append_many(user_id, [{'time': time, 'amount_ml': amount_ml, 'type': drink_type}])
+
+    def append_many(self, user_id, entries):
+        self.append_rows(user_id, [(to_timestamp(entry['time']), int(entry['amount_ml']), entry['type']) for entry in entries])
+
+    # (時刻のマイクロ秒, 量, 種類) の行をまとめて追加する (rows_between と同じ形。一括取り込みはこちらを使う)
+    # 1回の呼び出しが1回の操作 (取り消しの単位) になる。revision に import_action の更新番号を渡すと、その操作に追加する
+    # (一括取り込みの速度を落とさないよう、追加だけの操作は LogEvent を作らずに行をそのまま書く)
+    def append_rows(self, user_id, rows, revision=None):
+        rows = list(rows)
+        if not rows:
+            return
+        with self._transaction() as conn:
+            revision, first_seq = self._begin_action(conn, user_id, revision)
+            conn.executemany(INSERT_ADD_EVENT, [(seq, user_id, revision, seq, *row) for seq, row in enumerate(rows, first_seq)])
+            conn.executemany(INSERT_ENTRY, [(seq, user_id, *row) for seq, row in enumerate(rows, first_seq)])
+            _apply_to_rollups(conn, user_id, rows, ())
+            compact_due = self._end_action(conn, user_id, len(rows))
+        if compact_due:
+            self.compact(user_id)
+
+    # 何回かに分けて append_rows する追加 (一括取り込み) を1回の操作にまとめる。
+    # 返す更新番号を append_rows の revision に渡すと、途中で失敗しても、それまでに追加した分をまとめて取り消せる。
+    # 取り込み中のイベントの更新番号は取り込み中に行われた他の操作より小さくなるため、作り直しでの再生の順を保つよう、
+    # 取り込みが終わるまでスナップショットは作らない。終わったときに更新番号を進め、途中の状態の集計結果のキャッシュを使わせない
+    @contextlib.contextmanager
+    def import_action(self, user_id):
+        with self._transaction() as conn:
+            revision, _ = self._begin_action(conn, user_id)
+            self._importing[user_id] += 1
+        try:
+            yield revision
+        finally:
+            with self._transaction() as conn:
+                self._importing[user_id] -= 1
+                if not self._importing[user_id]:
+                    del self._importing[user_id]
+                conn.execute(BUMP_REVISION, (user_id,))
+                compact_due = self._end_action(conn, user_id, 0)
+            if compact_due:
+                self.compact(user_id)
+
+    # 記録を修正する (指定しなかった項目はそのまま)
+    def edit_entry(self, user_id, entry_id, time=None, amount_ml=None, drink_type=None):
+        with self._lock:
+            prev_row = self._entry_row(user_id, entry_id)
+            row = (
+                to_timestamp(time) if time is not None else prev_row[0],
+                int(amount_ml) if amount_ml is not None else prev_row[1],
+                drink_type if drink_type is not None else prev_row[2],
+            )
+            if row != prev_row:
+                self._write_events(user_id, [LogEvent(EVENT_EDIT, entry_id, row, prev_row, None)])
+
+    def delete_entry(self, user_id, entry_id):
+        with self._lock:
+            self._write_events(user_id, [LogEvent(EVENT_DELETE, entry_id, None, self._entry_row(user_id, entry_id), None)])
+
+    def _entry_row(self, user_id, entry_id):
+        row = self._conn.execute(
+            "SELECT ts, amount_ml, drink_type FROM water_log WHERE id = ? AND user_id = ?", (entry_id, user_id)
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"記録が見つかりません: {entry_id}")
+        return row
+
+    # 取り消されていない最後の操作 (なければ None)
+    def last_action(self, user_id):
+        with self._lock:
+            revision, events = self._last_action_events(user_id)
+        if not events:
+            return None
+        amount_ml = sum((event.row[1] if event.row else 0) - (event.prev_row[1] if event.prev_row else 0) for _, event in events)
+        return LogAction(revision, events[0][1].kind, len(events), amount_ml)
+
+    # 取り消されていない最後の操作の更新番号と [(seq, LogEvent)]
+    def _last_action_events(self, user_id):
+        row = self._conn.execute(LAST_UNDOABLE_REVISION, (user_id,)).fetchone()
+        if row is None:
+            return None, []
+        return row[0], [
+            _columns_to_event(columns) for columns in self._conn.execute(
+                f"SELECT {EVENT_COLUMNS} FROM water_log_events WHERE user_id = ? AND revision = ? ORDER BY seq", (user_id, row[0])
+            )
+        ]
+
+    # 取り消されていない最後の操作を、逆向きのイベントを積んで取り消す。取り消したイベントの数を返す
+    def undo_last(self, user_id):
+        with self._lock:
+            _, events = self._last_action_events(user_id)
+            if events:
+                self._write_events(user_id, [_inverse_event(seq, event) for seq, event in reversed(events)])
+            return len(events)
+
+    # 1回の操作のイベントを積み、記録・集計・更新番号に反映する (すべて同じトランザクションで書く)
+    def _write_events(self, user_id, events):
+        with self._transaction() as conn:
+            revision, first_seq = self._begin_action(conn, user_id)
+            conn.executemany(
+                INSERT_EVENT, [(seq, user_id, revision, *_event_to_columns(event)) for seq, event in enumerate(events, first_seq)]
+            )
+            _apply_to_log(conn, user_id, events)
+            _apply_to_rollups(
+                conn, user_id,
+                [event.row for event in events if event.row is not None],
+                [event.prev_row for event in events if event.prev_row is not None],
+            )
+            compact_due = self._end_action(conn, user_id, len(events))
+        if compact_due:
+            self.compact(user_id)
+
+    # ユーザーの更新番号を進め、この操作の更新番号と最初のイベントの番号を返す (revision を渡すとその操作の続きにする)。
+    # 新しい記録の ID は追加イベントの番号にする (AUTOINCREMENT なので、削除した記録の ID も使い回さない)
+    def _begin_action(self, conn, user_id, revision=None):
+        if revision is None:
+            conn.execute(BUMP_REVISION, (user_id,))
+            revision = conn.execute("SELECT revision FROM user_revisions WHERE user_id = ?", (user_id,)).fetchone()[0]
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'water_log_events'").fetchone()
+        return revision, (row[0] if row else 0) + 1
+
+    # スナップショット以降のイベントの数を進め、スナップショットを作る時期になったかを返す (取り込み中は作らない)
+    def _end_action(self, conn, user_id, event_count):
+        pending_events, entry_count = conn.execute(ADD_PENDING_EVENTS, (user_id, event_count)).fetchone()
+        return (
+            self.compact_min_events is not None and not self._importing[user_id]
+            and pending_events >= max(self.compact_min_events, entry_count)
+        )
+
+    # --- スナップショットとイベントの整理 ---
+    # 現在の記録をスナップショットにして、それより前のイベントを (直近 keep_actions 回の操作の分を除いて) 消す。
+    # 作り直し (rebuild) で再生するのは、スナップショットより後のイベントだけになる
+    def compact(self, user_id, keep_actions=UNDO_HISTORY_ACTIONS):
+        with self._transaction() as conn:
+            self._write_snapshot(conn, user_id, keep_actions)
+
+    def _write_snapshot(self, conn, user_id, keep_actions):
+        row = conn.execute("SELECT revision FROM user_revisions WHERE user_id = ?", (user_id,)).fetchone()
+        revision = row[0] if row else 0
+        rows = conn.execute(
+            "SELECT id, ts, amount_ml, drink_type FROM water_log WHERE user_id = ? ORDER BY ts", (user_id,)
+        ).fetchall()
+        conn.execute(UPSERT_SNAPSHOT, (user_id, revision, len(rows), *_encode_snapshot(rows)))
+        conn.execute(
+            f"DELETE FROM water_log_events WHERE user_id = ? AND revision <= ? AND seq <= {CONSUMED_SEQ}",
+            (user_id, revision - keep_actions)
+        )
+
+    # ユーザーの全期間の日ごとの最長の間隔を書く (作り直し・移行用。先に古い行を消しておく)
+    def _write_daily_gaps(self, conn, user_id):
+        timestamps = [row[0] for row in conn.execute("SELECT ts FROM water_log WHERE user_id = ? ORDER BY ts", (user_id,))]
+        conn.executemany(INSERT_DAILY_GAP, _daily_gap_rows(user_id, timestamps))
+
+    # スナップショットとその後のイベントから、記録と集計テーブルを作り直す (集計が食い違ったときの修復・検証用)。
+    # 再生したイベントの数を返す
+    def rebuild(self, user_id):
+        with self._transaction() as conn:
+            snapshot = conn.execute(
+                "SELECT revision, drink_types, data FROM water_log_snapshots WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            conn.execute("DELETE FROM water_log WHERE user_id = ?", (user_id,))
+            for table in ROLLUP_TABLES:
+                conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+            snapshot_revision = 0
+            if snapshot is not None:
+                snapshot_revision = snapshot[0]
+                conn.executemany(INSERT_ENTRY, _decode_snapshot(user_id, snapshot[1], snapshot[2]))
+            events = [
+                _columns_to_event(columns)[1] for columns in conn.execute(
+                    f"SELECT {EVENT_COLUMNS} FROM water_log_events WHERE user_id = ? AND revision > ? ORDER BY revision, seq",
+                    (user_id, snapshot_revision)
+                ).fetchall()
+            ]
+            _apply_to_log(conn, user_id, events)
+            for statement in (REBUILD_DAILY_TOTALS, REBUILD_MONTHLY_TOTALS, REBUILD_HOURLY_TOTALS):
+                conn.execute(statement.format(where="WHERE user_id = ?"), (user_id,))
+            self._write_daily_gaps(conn, user_id)
+            return len(events)
+
+    # スナップショットより後のイベントの数、保存しているイベントの総数、スナップショットの件数と大きさ (バイト)
+    def event_stats(self, user_id):
+        with self._lock:
+            snapshot = self._conn.execute(
+                "SELECT pending_events, entry_count, LENGTH(data) FROM water_log_snapshots WHERE user_id = ?", (user_id,)
+            ).fetchone() or (0, 0, None)
+            stored_events = self._conn.execute(
+                "SELECT COUNT(*) FROM water_log_events WHERE user_id = ?", (user_id,)
+            ).fetchone()[0]
+        return {
+            'pending_events': snapshot[0], 'stored_events': stored_events,
+            'snapshot_entries': snapshot[1], 'snapshot_bytes': snapshot[2] or 0,
+        }
+
+    # --- プロフィール (全ユーザーの集計で年代・都市・目標量ごとに分けるために保存する) ---
+    def save_profile(self, user_id, age, gender, weight_kg, daily_target_ml, city_name):
+        with self._transaction() as conn:
+            conn.execute(UPSERT_PROFILE, (
+                user_id, age, gender, weight_kg, int(daily_target_ml or 0), city_name,
+                to_timestamp(datetime.datetime.now()),
+            ))
+
+    # 保存したプロフィール (なければ None)
+    def load_profile(self, user_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT age, gender, weight_kg, daily_target_ml, city_name FROM user_profiles WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(['age', 'gender', 'weight_kg', 'daily_target_ml', 'city_name'], row))
+
+    # 記録が追加されるたびに増える番号 (集計結果のキャッシュキーに使う)
+    def revision(self, user_id):
+        with self._lock:
+            row = self._conn.execute("SELECT revision FROM user_revisions WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    # 指定日の飲み物の種類ごとの合計量 (日別集計テーブルの主キー検索のみ)
+    def daily_totals_by_type(self, user_id, date):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT drink_type, total_ml FROM daily_totals WHERE user_id = ? AND day = ?",
+                (user_id, to_day_number(date))
+            ).fetchall()
+        return dict(rows)
+
+    # start 以上 end 未満の記録を時刻順に返す
+    def entries_between(self, user_id, start, end):
+        return [_row_to_entry(row) for row in self.rows_between(user_id, start, end)]
+
+    # entries_between と同じ記録を、変換せずに (時刻のマイクロ秒, 量, 種類) の行で返す
+    def rows_between(self, user_id, start, end):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT ts, amount_ml, drink_type FROM water_log WHERE user_id = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                (user_id, to_timestamp(start), to_timestamp(end))
+            ).fetchall()
+
+    def entries_on(self, user_id, date):
+        return self.entries_between(user_id, date, date + datetime.timedelta(days=1))
+
+    # start 以上 end 未満の記録の件数
+    def count_between(self, user_id, start, end):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM water_log WHERE user_id = ? AND ts >= ? AND ts < ?",
+                (user_id, to_timestamp(start), to_timestamp(end))
+            ).fetchone()[0]
+
+    # start 以上 end 未満の記録のうち、時刻順で offset 件目から limit 件を rows_between と同じ形で返す
+    # (ユーザーIDと時刻のインデックスで範囲の先頭を探すため、全体の件数ではなく範囲内の位置とページの大きさで決まる)
+    # with_ids=True なら行の先頭に記録の ID を付ける (修正・削除用)
+    def rows_page(self, user_id, start, end, offset, limit, with_ids=False):
+        columns = "id, ts, amount_ml, drink_type" if with_ids else "ts, amount_ml, drink_type"
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT {columns} FROM water_log WHERE user_id = ? AND ts >= ? AND ts < ? "
+                "ORDER BY ts, id LIMIT ? OFFSET ?",
+                (user_id, to_timestamp(start), to_timestamp(end), limit, offset)
+            ).fetchall()
+
+    # 記録を時刻順に limit 件ずつ読み出す (書き出し用)。前回の最後の (時刻, id) より後ろから読むため、
+    # 何件目まで読み進めても1回の読み出しはインデックスの範囲検索で済む
+    def iter_rows(self, user_id, batch_size=10_000):
+        last_ts, last_id = -1 << 62, -1
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, ts, amount_ml, drink_type FROM water_log WHERE user_id = ? AND ts >= ? AND (ts > ? OR id > ?) "
+                    "ORDER BY ts, id LIMIT ?",
+                    (user_id, last_ts, last_ts, last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            last_id, last_ts = rows[-1][0], rows[-1][1]
+            yield [row[1:] for row in rows]
+
+    # before より前の最後の記録の時刻 (なければ None)
+    def previous_entry_time(self, user_id, before):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(ts) FROM water_log WHERE user_id = ? AND ts < ?", (user_id, to_timestamp(before))
+            ).fetchone()
+        return from_timestamp(row[0]) if row[0] is not None else None
+
+    # after 以降の最初の記録の時刻 (なければ None)
+    def next_entry_time(self, user_id, after):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(ts) FROM water_log WHERE user_id = ? AND ts >= ?", (user_id, to_timestamp(after))
+            ).fetchone()
+        return from_timestamp(row[0]) if row[0] is not None else None
+
+    # 直近 n 件の記録を時刻順 (古い順) に返す
+    def last_entries(self, user_id, n):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ts, amount_ml, drink_type FROM water_log WHERE user_id = ? ORDER BY ts DESC LIMIT ?",
+                (user_id, n)
+            ).fetchall()
+        return [_row_to_entry(row) for row in reversed(rows)]
+
+    def last_intake_time(self, user_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(ts) FROM water_log WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return from_timestamp(row[0]) if row[0] is not None else None
+
+    def count(self, user_id):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM water_log WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    # start 以上 end 未満の日ごとの合計量 {日付: ml}
+    def daily_totals_between(self, user_id, start, end):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT day, SUM(total_ml) FROM daily_totals WHERE user_id = ? AND day >= ? AND day < ? GROUP BY day",
+                (user_id, to_day_number(start), to_day_number(end))
+            ).fetchall()
+        return {from_day_number(day): total_ml for day, total_ml in rows}
+
+    # start 以上 end 未満の飲み物の種類ごとの合計量 {種類: ml} (日別集計テーブルから求める)
+    def type_totals_between(self, user_id, start, end):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT drink_type, SUM(total_ml) FROM daily_totals WHERE user_id = ? AND day >= ? AND day < ? GROUP BY drink_type",
+                (user_id, to_day_number(start), to_day_number(end))
+            ).fetchall()
+        return dict(rows)
+
+    # 曜日 (月曜日が 0)・時間帯 (0〜23時) ごとの全期間の合計量と件数 [(曜日, 時, ml, 件数)]
+    def hourly_totals(self, user_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT weekday, hour, total_ml, entry_count FROM hourly_totals WHERE user_id = ?", (user_id,)
+            ).fetchall()
+
+    # start 以上 end 未満の日の、同じ日の連続する記録の最長の間隔を長い順に limit 日分 [(開始時刻, マイクロ秒)]
+    def longest_daily_gaps(self, user_id, start, end, limit):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT gap_start, gap FROM daily_gaps WHERE user_id = ? AND day >= ? AND day < ? ORDER BY gap DESC, day DESC LIMIT ?",
+                (user_id, to_day_number(start), to_day_number(end), limit)
+            ).fetchall()
+        return [(from_timestamp(gap_start), gap) for gap_start, gap in rows]
+
+    # first_month から last_month まで (両端を含む) の月ごとの合計量 {月の通し番号: ml}
+    def monthly_totals_between(self, user_id, first_month, last_month):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT month, total_ml FROM monthly_totals WHERE user_id = ? AND month >= ? AND month <= ?",
+                (user_id, first_month, last_month)
+            ).fetchall()
+        return dict(rows)
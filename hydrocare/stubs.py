@@ -0,0 +1,264 @@
+import abc
+import argparse
+import datetime
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# --- 外部APIの代わりに使うローカルのスタブサーバー ---
+# 遅延とエラー率を指定でき、テスト・ベンチマーク・負荷試験で本物のAPIを呼ばずに済む。
+# 応答の中身はサブクラスの handle_request が (ステータス, JSON にする値) で返す
+class StubServer(abc.ABC):
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.request_count = 0
+        self._random = random.Random(seed)
+        self._count_lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @abc.abstractmethod
+    def handle_request(self, method, path, query, body):
+        pass
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self, method):
+                with server._count_lock:
+                    server.request_count += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                parsed = urllib.parse.urlsplit(self.path)
+                query = dict(urllib.parse.parse_qsl(parsed.query))
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                if server.error_rate and server._random.random() < server.error_rate:
+                    status, payload = 503, {'message': "stub error"}
+                else:
+                    status, payload = server.handle_request(method, parsed.path, query, body)
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json; charset=utf-8")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # タイムアウトしたクライアントが先に切断した場合
+                    pass
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+# --- OpenWeatherMap (/data/2.5/weather, /data/2.5/forecast) のスタブ ---
+class StubOpenWeatherServer(StubServer):
+    def __init__(self, temperature=31.0, humidity=65, unknown_cities=(), **kwargs):
+        super().__init__(**kwargs)
+        self.temperature = temperature
+        self.humidity = humidity
+        self.unknown_cities = {city.casefold() for city in unknown_cities}
+
+    @property
+    def weather_url(self):
+        return f"{self.base_url}/data/2.5/weather"
+
+    def handle_request(self, method, path, query, body):
+        city_name = query.get('q', '')
+        if not city_name or city_name.casefold() in self.unknown_cities:
+            return 404, {'cod': "404", 'message': "city not found"}
+        if path == "/data/2.5/weather":
+            return 200, {
+                'name': city_name,
+                'main': {'temp': self.temperature, 'humidity': self.humidity},
+                'weather': [{'description': "晴れ"}],
+                'timezone': 32400,
+            }
+        if path == "/data/2.5/forecast":
+            # 3時間ごと40件。気温は昼に高く夜に低くなるように変化させる
+            start = int(time.time()) // 10800 * 10800 + 10800
+            entries = []
+            for i in range(40):
+                dt = start + i * 10800
+                hour = (datetime.datetime.fromtimestamp(dt, datetime.timezone.utc).hour + 9) % 24
+                temperature = self.temperature - 6 + 6 * (1 - abs(hour - 14) / 12)
+                entries.append({
+                    'dt': dt,
+                    'main': {'temp': round(temperature, 1), 'humidity': self.humidity},
+                    'weather': [{'description': "晴れ"}],
+                })
+            return 200, {'list': entries, 'city': {'name': city_name, 'timezone': 32400}}
+        return 404, {'cod': "404", 'message': "not found"}
+
+
+# --- リマインダーの Webhook (POST /reminders) の受け口のスタブ ---
+# 受け取ったリマインダーを received に順に溜める
+class StubWebhookServer(StubServer):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.received = []
+        self.batches = 0
+        self._received_lock = threading.Lock()
+
+    @property
+    def webhook_url(self):
+        return f"{self.base_url}/reminders"
+
+    def handle_request(self, method, path, query, body):
+        if method != "POST" or path != "/reminders":
+            return 404, {'message': "not found"}
+        reminders = json.loads(body or b"{}").get('reminders', [])
+        with self._received_lock:
+            self.received.extend(reminders)
+            self.batches += 1
+        return 200, {'received': len(reminders)}
+
+
+# --- Gemini API (REST: /v1beta/models/{model}:generateContent, :streamGenerateContent) のスタブ ---
+# google-generativeai を transport="rest"・client_options={"api_endpoint": api_endpoint} で設定すると、
+# SDK の通信をそのままこのサーバーへ向けられる。quota_error_rate の割合で 429 (クォータ超過) を返す
+class StubGeminiServer(StubServer):
+    def __init__(self, reply="こまめに水分を補給しましょう。", quota_error_rate=0.0, chunk_size=8, **kwargs):
+        super().__init__(**kwargs)
+        self.reply = reply
+        self.quota_error_rate = quota_error_rate
+        self.chunk_size = chunk_size
+
+    @property
+    def api_endpoint(self):
+        return self.base_url
+
+    def handle_request(self, method, path, query, body):
+        prefix = "/v1beta/models/"
+        if method != "POST" or not path.startswith(prefix):
+            return 404, {'error': {'code': 404, 'message': "not found", 'status': "NOT_FOUND"}}
+        _, _, action = path[len(prefix):].partition(":")
+        if self.quota_error_rate and self._random.random() < self.quota_error_rate:
+            return 429, {'error': {'code': 429, 'message': "Resource has been exhausted", 'status': "RESOURCE_EXHAUSTED"}}
+        request = json.loads(body or b"{}")
+        prompt = "".join(part.get('text', "") for content in request.get('contents', []) for part in content.get('parts', []))
+        reply = self.reply(prompt) if callable(self.reply) else self.reply
+        if action == "generateContent":
+            return 200, self._candidate(reply)
+        if action == "streamGenerateContent":
+            # ストリーミングの応答は JSON の配列 (要素ごとに1チャンク)
+            pieces = [reply[i:i + self.chunk_size] for i in range(0, len(reply), self.chunk_size)]
+            return 200, [self._candidate(piece) for piece in pieces]
+        return 404, {'error': {'code': 404, 'message': "not found", 'status': "NOT_FOUND"}}
+
+    @staticmethod
+    def _candidate(text):
+        return {'candidates': [{'content': {'parts': [{'text': text}], 'role': "model"}, 'finishReason': "STOP", 'index': 0}]}
+
+
+# --- Gemini の GenerativeModel の代わりに使う偽モデル ---
+# generate_content(prompt, stream=...) だけを実装し、遅延・エラー率・クォータ超過率を指定できる
+class FakeQuotaError(Exception):
+    code = 429
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self._chunks = [text] if text else []
+
+
+class FakeGenerativeModel:
+    def __init__(self, reply="こまめに水分を補給しましょう。", latency=0.0, error_rate=0.0, quota_error_rate=0.0, chunk_size=8, seed=None):
+        self.reply = reply
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota_error_rate = quota_error_rate
+        self.chunk_size = chunk_size
+        self.call_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, stream=False):
+        with self._lock:
+            self.call_count += 1
+            roll = self._random.random()
+        if roll < self.quota_error_rate:
+            raise FakeQuotaError("429 Resource has been exhausted")
+        if roll < self.quota_error_rate + self.error_rate:
+            raise RuntimeError("fake model error")
+        reply = self.reply(prompt) if callable(self.reply) else self.reply
+        if not stream:
+            time.sleep(self.latency)
+            return _FakeResponse(reply)
+        return self._stream(reply)
+
+    def _stream(self, reply):
+        pieces = [reply[i:i + self.chunk_size] for i in range(0, len(reply), self.chunk_size)]
+        for piece in pieces:
+            time.sleep(self.latency / max(len(pieces), 1))
+            yield _FakeResponse(piece)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカルのスタブAPIサーバー (OpenWeatherMap・Gemini) を起動します。")
+    parser.add_argument("--port", type=int, default=8081, help="OpenWeatherMap のスタブのポート")
+    parser.add_argument("--gemini-port", type=int, default=8082, help="Gemini API のスタブのポート")
+    parser.add_argument("--latency", type=float, default=0.0, help="1リクエストあたりの遅延 (秒)")
+    parser.add_argument("--gemini-latency", type=float, default=None, help="Gemini の遅延 (秒。省略時は --latency)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="503 を返す割合 (0〜1)")
+    parser.add_argument("--quota-error-rate", type=float, default=0.0, help="Gemini が 429 を返す割合 (0〜1)")
+    args = parser.parse_args()
+
+    weather_server = StubOpenWeatherServer(port=args.port, latency=args.latency, error_rate=args.error_rate)
+    gemini_server = StubGeminiServer(
+        port=args.gemini_port,
+        latency=args.latency if args.gemini_latency is None else args.gemini_latency,
+        error_rate=args.error_rate,
+        quota_error_rate=args.quota_error_rate,
+    )
+    print(f"OPENWEATHER_URL={weather_server.weather_url}")
+    print(f"GEMINI_API_ENDPOINT={gemini_server.api_endpoint}")
+    try:
+        gemini_server.start()
+        weather_server.start()._thread.join()
+    except KeyboardInterrupt:
+        weather_server.stop()
+        gemini_server.stop()
+
+
+if __name__ == "__main__":
+    main()
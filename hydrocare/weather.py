@@ -0,0 +1,176 @@
+import collections
+import concurrent.futures
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from hydrocare.metrics import METRICS
+
+OPENWEATHER_URL = "http://api.openweathermap.org/data/2.5/weather"
+
+
+# 現在の天気の URL (…/weather) から予報の URL (…/forecast) を作る
+def forecast_url_for(weather_url):
+    return weather_url.rsplit("/", 1)[0] + "/forecast"
+
+
+# 「 tokyo 」「Tokyo」「TOKYO」を同じ都市として扱う
+def normalize_city_name(city_name):
+    return " ".join(city_name.split()).casefold()
+
+
+# 例外の説明文には APIキーを含む URL が入るため、画面にはステータスと種類だけを出す
+def describe_weather_error(error):
+    response = getattr(error, 'response', None)
+    if response is not None:
+        return f"HTTP {response.status_code}"
+    return type(error).__name__
+
+
+# --- OpenWeatherMap クライアント ---
+# 全セッションで1つを共有し、接続の再利用・タイムアウト・リトライと、都市ごとの結果キャッシュを行う
+def _shared_key(key):
+    return "weather:" + "\0".join(key)
+
+
+class WeatherClient:
+    def __init__(
+        self,
+        api_key,
+        base_url=OPENWEATHER_URL,
+        forecast_url=None,
+        timeout=(3.05, 10),
+        retries=2,
+        backoff_factor=0.5,
+        cache_ttl=600,
+        cache_size=256,
+        pool_size=16,
+        clock=time.monotonic,
+        shared_cache=None,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.forecast_url = forecast_url or forecast_url_for(base_url)
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._clock = clock
+        # 複数のプロセスで取得結果を共有する DiskCache (省略時はこのプロセスのキャッシュだけを使う)
+        self.shared_cache = shared_cache
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._cache = collections.OrderedDict()  # key -> (有効期限, 取得結果)
+        self._in_flight = {}  # key -> Future (同じ都市への同時リクエストを1つにまとめる)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+
+    def close(self):
+        self.session.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced,
+                'shared_hits': self.shared_hits, 'cached': len(self._cache),
+            }
+
+    def current_weather(self, city_name, units="metric", lang="ja", refresh=False):
+        return self._get("weather", self.base_url, city_name, units, lang, refresh)
+
+    # 5日間・3時間ごとの予報 (OpenWeatherMap /data/2.5/forecast)
+    def forecast(self, city_name, units="metric", lang="ja", refresh=False):
+        return self._get("forecast", self.forecast_url, city_name, units, lang, refresh)
+
+    # refresh=True の場合はキャッシュを読まずに取り直す (先読みで有効期限前に更新するため)
+    def _get(self, kind, url, city_name, units, lang, refresh):
+        key = (kind, normalize_city_name(city_name), units, lang)
+        with self._lock:
+            cached = self._cache.get(key)
+            if not refresh and cached is not None and cached[0] > self._clock():
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = concurrent.futures.Future()
+                self._in_flight[key] = future
+                self.misses += 1
+                leader = True
+
+        if not leader:
+            # 先に問い合わせ中のリクエストの結果 (または例外) をそのまま使う
+            return future.result()
+
+        try:
+            shared = None if refresh else self._shared_get(key)
+            if shared is not None:
+                weather_data, age = shared
+            else:
+                with METRICS.time("hydrocare_external_call_seconds", service="openweathermap", endpoint=kind):
+                    weather_data = self._fetch(url, city_name.strip(), units, lang)
+                age = 0
+                self._shared_set(key, weather_data)
+        except Exception as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            if shared is not None:
+                self.shared_hits += 1
+            # 他のプロセスが取得した結果は、取得してからの時間を差し引いた残りの間だけ使う
+            self._cache[key] = (self._clock() + self.cache_ttl - age, weather_data)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            del self._in_flight[key]
+        future.set_result(weather_data)
+        return weather_data
+
+    # 共有キャッシュには取得した時刻 (UNIX 時刻) と取得結果を JSON で保存し、cache_ttl で期限切れにする
+    def _shared_get(self, key):
+        if self.shared_cache is None:
+            return None
+        value = self.shared_cache.get(_shared_key(key))
+        if value is None:
+            return None
+        entry = json.loads(value)
+        return entry['data'], max(time.time() - entry['fetched_at'], 0)
+
+    def _shared_set(self, key, weather_data):
+        if self.shared_cache is not None:
+            entry = {'fetched_at': time.time(), 'data': weather_data}
+            self.shared_cache.set(_shared_key(key), json.dumps(entry).encode("utf-8"), self.cache_ttl)
+
+    def _fetch(self, url, city_name, units, lang):
+        params = {
+            'q': city_name,
+            'appid': self.api_key,
+            'units': units,
+            'lang': lang
+        }
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
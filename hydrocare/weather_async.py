@@ -0,0 +1,119 @@
+import asyncio
+import datetime
+import threading
+
+from hydrocare.hydration import calculate_wbgt, classify_wbgt
+from hydrocare.lazy import lazy_import
+from hydrocare.weather import describe_weather_error
+
+pd = lazy_import("pandas")
+
+# 比較表で先の予報を見る時間 (時間)
+FORECAST_HORIZON_HOURS = 24
+
+
+# 予報データから (現地時刻, 気温, 湿度, WBGT) の一覧を作る
+def forecast_wbgt_points(forecast_data, horizon_hours=FORECAST_HORIZON_HOURS):
+    timezone = datetime.timezone(datetime.timedelta(seconds=forecast_data.get('city', {}).get('timezone', 0)))
+    points = []
+    for entry in forecast_data.get('list', []):
+        local_time = datetime.datetime.fromtimestamp(entry['dt'], timezone).replace(tzinfo=None)
+        main_data = entry.get('main', {})
+        temp = main_data.get('temp')
+        humidity = main_data.get('humidity')
+        points.append((local_time, temp, humidity, calculate_wbgt(temp, humidity)))
+    if points and horizon_hours is not None:
+        limit = points[0][0] + datetime.timedelta(hours=horizon_hours)
+        points = [point for point in points if point[0] < limit]
+    return points
+
+
+# --- 複数都市の現在の天気と予報を並行して取得 ---
+# 通信は共有の WeatherClient (接続プール・キャッシュ・同時リクエストの集約つき) をスレッドで呼び出し、
+# 同時に実行する通信の数をセマフォで max_concurrency 件までに抑える
+async def fetch_city_conditions(client, city_names, max_concurrency=4, refresh=False):
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def call(method, city_name):
+        async with semaphore:
+            return await asyncio.to_thread(method, city_name, refresh=refresh)
+
+    async def fetch_one(city_name):
+        current, forecast = await asyncio.gather(
+            call(client.current_weather, city_name), call(client.forecast, city_name), return_exceptions=True
+        )
+        return city_name, current, forecast
+
+    return await asyncio.gather(*(fetch_one(city_name) for city_name in city_names))
+
+
+def build_comparison_table(results):
+    rows = []
+    for city_name, current, forecast in results:
+        row = {'都市': city_name}
+        if isinstance(current, Exception):
+            row['エラー'] = f"天気情報の取得に失敗しました ({describe_weather_error(current)})"
+        else:
+            main_data = current.get('main', {})
+            wbgt = calculate_wbgt(main_data.get('temp'), main_data.get('humidity'))
+            row.update({
+                '気温 (°C)': main_data.get('temp'),
+                '湿度 (%)': main_data.get('humidity'),
+                '天気': current.get('weather', [{}])[0].get('description', '不明'),
+                '暑さ指数 (WBGT)': round(wbgt, 1) if wbgt is not None else None,
+                '警戒レベル': classify_wbgt(wbgt),
+            })
+        if not isinstance(forecast, Exception):
+            points = [point for point in forecast_wbgt_points(forecast) if point[3] is not None]
+            if points:
+                peak_time, _, _, peak_wbgt = max(points, key=lambda point: point[3])
+                row.update({
+                    f'{FORECAST_HORIZON_HOURS}時間以内の最高WBGT': round(peak_wbgt, 1),
+                    '最高WBGTの時刻': peak_time.strftime('%m/%d %H:%M'),
+                    '最高時の警戒レベル': classify_wbgt(peak_wbgt),
+                })
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def compare_cities(client, city_names, max_concurrency=4):
+    results = asyncio.run(fetch_city_conditions(client, city_names, max_concurrency))
+    return build_comparison_table(results)
+
+
+# --- よく使われる都市の天気を裏で先読みする ---
+# キャッシュの有効期限より短い間隔で取り直しておき、ページ表示時は取得済みのデータを使えるようにする
+class WeatherPrefetcher:
+    def __init__(self, client, city_names, interval_seconds=None, max_concurrency=4):
+        self.client = client
+        self.city_names = list(city_names)
+        self.interval_seconds = interval_seconds or max(client.cache_ttl * 0.8, 1)
+        self.max_concurrency = max_concurrency
+        self.last_refreshed = None
+        self.last_errors = {}
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="weather-prefetch", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def refresh_once(self):
+        results = asyncio.run(fetch_city_conditions(self.client, self.city_names, self.max_concurrency, refresh=True))
+        self.last_errors = {
+            city_name: error
+            for city_name, current, forecast in results
+            for error in (current, forecast)
+            if isinstance(error, Exception)
+        }
+        self.last_refreshed = datetime.datetime.now()
+        return results
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self.refresh_once()
+            self._stop_event.wait(self.interval_seconds)
@@ -0,0 +1,133 @@
+import datetime
+import io
+
+import numpy as np
+import pytest
+
+from hydrocare.activity_tracks import CHUNK_BYTES, MAX_BYTES_BEFORE_FIRST_POINT, load_activity_track
+
+START = datetime.datetime(2026, 7, 1, 6, 0, 0)
+
+
+def tcx_point(i, hr=140):
+    time = START + datetime.timedelta(seconds=i * 5)
+    heart_rate = f"<HeartRateBpm><Value>{hr}</Value></HeartRateBpm>" if hr is not None else ""
+    return (
+        f"<Trackpoint><Time>{time:%Y-%m-%dT%H:%M:%S}Z</Time>"
+        f"<Position><LatitudeDegrees>{35.0 + i * 0.0001:.7f}</LatitudeDegrees><LongitudeDegrees>139.0</LongitudeDegrees></Position>"
+        f"<AltitudeMeters>10.0</AltitudeMeters><DistanceMeters>{i * 11.1:.1f}</DistanceMeters>{heart_rate}</Trackpoint>\n"
+    )
+
+
+def tcx_lap(points, summary=""):
+    return f'<Lap StartTime="{START:%Y-%m-%dT%H:%M:%S}Z">{summary}<Track>\n' + "".join(points) + "</Track></Lap>\n"
+
+
+def tcx_document(laps):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">'
+        '<Activities><Activity Sport="Running"><Id>2026-07-01T06:00:00Z</Id>\n' + "".join(laps) +
+        "</Activity></Activities></TrainingCenterDatabase>\n"
+    ).encode("utf-8")
+
+
+def test_tcx_heart_rate_ignores_lap_summary_values():
+    # 値のない点が1つと、周回の平均心拍が1つあり、心拍の値の数がちょうど点の数と同じになる
+    lap_1 = [tcx_point(i) for i in range(30)]
+    lap_2 = [tcx_point(i, hr=None if i == 40 else 140) for i in range(30, 60)]
+    data = tcx_document([
+        tcx_lap(lap_1),
+        tcx_lap(lap_2, "<AverageHeartRateBpm><Value>200</Value></AverageHeartRateBpm>"),
+    ])
+    track = load_activity_track(io.BytesIO(data), "tcx")
+    assert track.points == 60
+    assert track.activity_type == "ランニング"
+    np.testing.assert_allclose(track.segments['心拍'].dropna(), 140)
+
+
+def test_tcx_lap_maximum_heart_rate_is_not_a_point_value():
+    points = [tcx_point(i, hr=None) for i in range(20)]
+    data = tcx_document([
+        tcx_lap(points, "<AverageHeartRateBpm><Value>150</Value></AverageHeartRateBpm>"
+                        "<MaximumHeartRateBpm><Value>180</Value></MaximumHeartRateBpm>"),
+    ])
+    track = load_activity_track(io.BytesIO(data), "tcx")
+    assert track.segments['心拍'].isna().all()
+
+
+def test_gpx_values_are_matched_to_their_points():
+    points = []
+    for i in range(20):
+        time = START + datetime.timedelta(seconds=i * 5)
+        ele = f"<ele>{100 + i}</ele>" if i != 3 else ""
+        points.append(f'<trkpt lat="{35.0 + i * 0.0001:.7f}" lon="139.0">{ele}<time>{time:%Y-%m-%dT%H:%M:%S}Z</time></trkpt>\n')
+    data = (
+        '<?xml version="1.0"?><gpx version="1.1"><metadata><time>2026-07-01T05:00:00Z</time></metadata>'
+        "<trk><type>walking</type><trkseg>\n" + "".join(points) + "</trkseg></trk></gpx>\n"
+    ).encode("utf-8")
+    track = load_activity_track(io.BytesIO(data), "gpx")
+    assert track.points == 20
+    assert track.activity_type == "ウォーキング"
+    # 標高のない点の前後の2区間は上昇に数えない (他の点の標高がずれて入ることはない)
+    assert track.segments['上昇 (m)'].sum() == 17
+
+
+def gpx_document(points):
+    return (
+        '<?xml version="1.0"?><gpx version="1.1"><trk><type>running</type><trkseg>\n'
+        + "".join(points) + "</trkseg></trk></gpx>\n"
+    ).encode("utf-8")
+
+
+def gpx_point(time, i):
+    return f'<trkpt lat="{35.0 + i * 0.0001:.7f}" lon="139.0"><ele>10</ele><time>{time:%Y-%m-%dT%H:%M:%S}Z</time></trkpt>\n'
+
+
+# 同じバイト列を限りなく返すファイル (読んだ回数を数える)
+class EndlessSource:
+    def __init__(self, head, filler):
+        self.head = head
+        self.filler = filler
+        self.reads = 0
+
+    def read(self, size):
+        self.reads += 1
+        data, self.head = self.head, b""
+        return data + self.filler * (size // len(self.filler))
+
+
+def test_points_far_from_the_start_are_skipped():
+    points = [gpx_point(START + datetime.timedelta(seconds=i * 5), i) for i in range(120)]
+    expected = load_activity_track(io.BytesIO(gpx_document(points)), "gpx")
+    # 数か月後と、開始より前の壊れた時刻
+    points.insert(60, gpx_point(START + datetime.timedelta(days=120), 60))
+    points.insert(30, gpx_point(START - datetime.timedelta(days=3), 30))
+    track = load_activity_track(io.BytesIO(gpx_document(points)), "gpx")
+
+    assert track.points == 120
+    assert track.skipped_points == 2
+    assert len(track.segments) == len(expected.segments) == 2
+    assert track.water_loss_ml == expected.water_loss_ml
+
+
+def test_first_point_with_a_broken_time_is_reported():
+    points = [gpx_point(datetime.datetime(1999, 1, 1), 0)]
+    points += [gpx_point(START + datetime.timedelta(seconds=i * 5), i) for i in range(1, 20)]
+    with pytest.raises(ValueError, match="48時間"):
+        load_activity_track(io.BytesIO(gpx_document(points)), "gpx")
+
+
+def test_file_without_points_is_rejected_without_reading_it_all():
+    source = EndlessSource(b"", b"not a track file " * 64)
+    with pytest.raises(ValueError, match="点が見つかりません"):
+        load_activity_track(source, "gpx")
+    assert source.reads * CHUNK_BYTES <= MAX_BYTES_BEFORE_FIRST_POINT + 2 * CHUNK_BYTES
+
+
+def test_unclosed_point_is_rejected():
+    head = gpx_document([gpx_point(START, 0)])[:-len("</trkseg></trk></gpx>\n")] + b'<trkpt lat="35.0" lon="139.0">'
+    source = EndlessSource(head, b"<ele>10</ele>")
+    with pytest.raises(ValueError, match="閉じていない点"):
+        load_activity_track(source, "gpx")
+    assert source.reads <= 2
@@ -0,0 +1,126 @@
+import datetime
+import io
+
+import pandas as pd
+import pytest
+
+from hydrocare.bulk_io import (
+    DEFAULT_DRINK_TYPE,
+    FORMATS,
+    MAX_IMPORT_AMOUNT_ML,
+    MAX_REPORTED_REJECTIONS,
+    MIN_IMPORT_AMOUNT_ML,
+    detect_format,
+    export_log,
+    import_log,
+)
+from hydrocare.storage import WaterLogStore, to_timestamp
+
+USER_ID = "user-a"
+EVERYTHING = (datetime.datetime(2000, 1, 1), datetime.datetime(2100, 1, 1))
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = WaterLogStore(str(tmp_path / "hydrocare.db"), compact_min_events=None)
+    yield store
+    store.close()
+
+
+def csv_source(lines, header="time,amount_ml,type"):
+    return io.StringIO(header + "\n" + "".join(line + "\n" for line in lines))
+
+
+def test_detect_format():
+    assert detect_format("history.CSV") == "csv"
+    assert detect_format("history.ndjson") == "jsonl"
+    assert detect_format("history.pq") == "parquet"
+    with pytest.raises(ValueError):
+        detect_format("history.xlsx")
+
+
+def test_aliases_and_types_are_normalized(store):
+    source = csv_source([
+        "2024-05-01 08:00,250,Water",
+        "2024/05/01 12:30,300.4,緑茶",
+        "2024-05-01T18:00:00,500,lemonade",
+    ], header="Timestamp,Volume,Beverage")
+    report = import_log(store, USER_ID, source, "csv")
+    assert (report.rows, report.imported, report.rejected) == (3, 3, 0)
+    assert store.rows_between(USER_ID, *EVERYTHING) == [
+        (to_timestamp(datetime.datetime(2024, 5, 1, 8)), 250, "水"),
+        (to_timestamp(datetime.datetime(2024, 5, 1, 12, 30)), 300, "お茶"),
+        (to_timestamp(datetime.datetime(2024, 5, 1, 18)), 500, DEFAULT_DRINK_TYPE),
+    ]
+
+
+def test_missing_required_column_is_an_error(store):
+    with pytest.raises(ValueError, match="amount_ml"):
+        import_log(store, USER_ID, csv_source(["2024-05-01 08:00,水"], header="time,type"), "csv")
+
+
+def test_time_with_utc_offset_is_converted_to_local_time(store):
+    local_timezone = datetime.datetime.now().astimezone().tzinfo
+    utc_time = datetime.datetime(2024, 5, 1, 3, 0, tzinfo=datetime.timezone.utc)
+    import_log(store, USER_ID, csv_source(["2024-05-01T03:00:00Z,200,water"]), "csv")
+    expected = utc_time.astimezone(local_timezone).replace(tzinfo=None)
+    assert store.entries_between(USER_ID, *EVERYTHING)[0]['time'] == expected
+
+
+def test_rejected_rows_are_reported_across_chunks(store):
+    lines = [
+        "2024-05-01 08:00,200,水",  # 0
+        "not a time,200,水",  # 1
+        f"2024-05-01 09:00,{MIN_IMPORT_AMOUNT_ML - 1},水",  # 2
+        f"2024-05-01 10:00,{MIN_IMPORT_AMOUNT_ML},水",  # 3
+        f"2024-05-01 11:00,{MAX_IMPORT_AMOUNT_ML},水",  # 4
+        f"2024-05-01 12:00,{MAX_IMPORT_AMOUNT_ML + 1},水",  # 5
+        "2024-05-01 13:00,a lot,水",  # 6
+        ",200,水",  # 7
+        "2024-05-01 14:00,,水",  # 8
+        "2024-05-01 15:00,-50,水",  # 9
+    ]
+    progress = []
+    report = import_log(store, USER_ID, csv_source(lines), "csv", chunksize=3, on_progress=lambda *args: progress.append(args))
+    assert (report.rows, report.imported, report.rejected) == (10, 3, 7)
+    assert report.rejected_rows == [1, 2, 5, 6, 7, 8, 9]
+    assert progress == [(3, 1), (6, 3), (9, 3), (10, 3)]
+    assert [row[1] for row in store.rows_between(USER_ID, *EVERYTHING)] == [200, MIN_IMPORT_AMOUNT_ML, MAX_IMPORT_AMOUNT_ML]
+
+
+def test_only_the_first_rejected_rows_are_listed(store):
+    lines = ["bad,200,水"] * (MAX_REPORTED_REJECTIONS + 5)
+    report = import_log(store, USER_ID, csv_source(lines), "csv", chunksize=7)
+    assert report.rejected == MAX_REPORTED_REJECTIONS + 5
+    assert report.rejected_rows == list(range(MAX_REPORTED_REJECTIONS))
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_export_and_import_round_trip(store, fmt):
+    start = datetime.datetime(2023, 12, 31, 22, 0, 0, 123456)
+    store.append_many(USER_ID, [
+        {'time': start + datetime.timedelta(minutes=37 * i), 'amount_ml': 100 + i, 'type': ["水", "お茶", "コーヒー", "その他"][i % 4]}
+        for i in range(250)
+    ])
+    # 同じ時刻の記録も落とさずに書き出す
+    store.append(USER_ID, start, 999, "ジュース")
+
+    destination = io.BytesIO()
+    rows, _ = export_log(store, USER_ID, destination, fmt, batch_size=40)
+    assert rows == 251
+    if fmt == "csv":
+        assert pd.read_csv(io.BytesIO(destination.getvalue())).shape == (251, 3)
+
+    destination.seek(0)
+    report = import_log(store, "user-b", destination, fmt, chunksize=60)
+    assert (report.rows, report.imported, report.rejected) == (251, 251, 0)
+    assert store.rows_between("user-b", *EVERYTHING) == store.rows_between(USER_ID, *EVERYTHING)
+    assert store.daily_totals_between("user-b", EVERYTHING[0].date(), EVERYTHING[1].date()) == store.daily_totals_between(
+        USER_ID, EVERYTHING[0].date(), EVERYTHING[1].date()
+    )
+
+
+def test_export_of_empty_log(store):
+    destination = io.BytesIO()
+    assert export_log(store, USER_ID, destination, "csv")[0] == 0
+    assert destination.getvalue() == b""
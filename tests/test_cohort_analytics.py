@@ -0,0 +1,144 @@
+import datetime
+import random
+import sqlite3
+
+import pytest
+
+from hydrocare.cohort_analytics import CONSUMER_NAME, COHORT_TABLES, NOT_BUILT, CohortRollups
+from hydrocare.storage import MICROSECONDS_PER_DAY, WaterLogStore, to_timestamp
+
+# 月末の真夜中をまたぐ記録が多くなるようにする
+MIDNIGHT = datetime.datetime(2024, 3, 1)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "hydrocare.db")
+
+
+@pytest.fixture
+def store(path):
+    store = WaterLogStore(path, compact_min_events=None)
+    store.save_profile("user-a", 34, "女性", 55, 1500, "Tokyo")
+    store.save_profile("user-b", 61, "男性", 70, 2000, " osaka ")
+    # user-c はプロフィールなし
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def rollups(path, store):
+    rollups = CohortRollups(path)
+    yield rollups
+    rollups.close()
+
+
+def at(minutes):
+    return MIDNIGHT + datetime.timedelta(minutes=minutes)
+
+
+def table_rows(path):
+    conn = sqlite3.connect(path)
+    rows = {table: sorted(conn.execute(f"SELECT * FROM {table}").fetchall()) for table in COHORT_TABLES}
+    conn.close()
+    return rows
+
+
+# 同じ記録を別のファイルに写し、最初から集計し直した集計テーブルの中身
+def fresh_build_rows(path, tmp_path):
+    copy_path = str(tmp_path / "fresh.db")
+    source, copy = sqlite3.connect(path), sqlite3.connect(copy_path)
+    source.backup(copy)
+    copy.execute("UPDATE event_consumers SET seq = ? WHERE name = ?", (NOT_BUILT, CONSUMER_NAME))
+    copy.commit()
+    source.close()
+    copy.close()
+    fresh = CohortRollups(copy_path)
+    fresh.build()
+    fresh.close()
+    return table_rows(copy_path)
+
+
+def entry_ids(store, user_id):
+    return [row[0] for row in store.rows_page(user_id, at(-10 * 24 * 60).date(), at(10 * 24 * 60).date(), 0, 1000, with_ids=True)]
+
+
+def test_refresh_matches_a_fresh_build(path, tmp_path, store, rollups):
+    rng = random.Random(0)
+    users = ["user-a", "user-b", "user-c"]
+    # 最初の集計の前の記録
+    for user_id in users:
+        store.append_many(user_id, [
+            {'time': at(rng.randrange(-3 * 24 * 60, 3 * 24 * 60)), 'amount_ml': rng.choice([150, 250, 500]), 'type': rng.choice(["水", "お茶"])}
+            for _ in range(20)
+        ])
+    assert rollups.build() == 60
+    assert table_rows(path) == fresh_build_rows(path, tmp_path)
+
+    # 追加・修正 (日や月をまたぐ移動を含む)・削除・取り消しを混ぜる
+    for step in range(200):
+        user_id = rng.choice(users)
+        ids = entry_ids(store, user_id)
+        action = rng.random()
+        if action < 0.4 or not ids:
+            store.append(user_id, at(rng.randrange(-3 * 24 * 60, 3 * 24 * 60)), rng.choice([100, 200, 350]), rng.choice(["水", "コーヒー"]))
+        elif action < 0.6:
+            store.edit_entry(
+                user_id, rng.choice(ids), time=at(rng.randrange(-3 * 24 * 60, 3 * 24 * 60)),
+                amount_ml=rng.choice([100, 900]), drink_type=rng.choice(["水", "ジュース"]),
+            )
+        elif action < 0.8:
+            store.delete_entry(user_id, rng.choice(ids))
+        else:
+            store.undo_last(user_id)
+        if step % 50 == 49:
+            rollups.refresh(max_events=7)
+    rollups.refresh_all()
+
+    assert rollups.status()['pending_events'] == 0
+    rows = table_rows(path)
+    assert rows == fresh_build_rows(path, tmp_path)
+    # 記録がなくなった日・種類・時間帯の行は残さない
+    assert all(row[-1] > 0 for table in COHORT_TABLES for row in rows[table])
+
+
+def test_deleting_every_entry_removes_the_rows(path, store, rollups):
+    store.append("user-a", at(-1), 300, "水")
+    store.append("user-a", at(1), 300, "水")
+    rollups.build()
+    for entry_id in entry_ids(store, "user-a"):
+        store.delete_entry("user-a", entry_id)
+    rollups.refresh_all()
+    assert table_rows(path) == {table: [] for table in COHORT_TABLES}
+
+
+def pending_seqs(path, user_id):
+    conn = sqlite3.connect(path)
+    seqs = [row[0] for row in conn.execute("SELECT seq FROM water_log_events WHERE user_id = ? ORDER BY seq", (user_id,))]
+    conn.close()
+    return seqs
+
+
+def test_compaction_keeps_events_the_rollups_have_not_read(path, store, rollups):
+    store.append("user-a", at(0), 200, "水")
+    # 最初の集計の前は、どのイベントも消さない
+    store.compact("user-a", keep_actions=0)
+    assert len(pending_seqs(path, "user-a")) == 1
+
+    rollups.build()
+    checkpoint = rollups.status()['checkpoint']
+    for minutes in range(1, 6):
+        store.append("user-a", at(minutes), 200, "水")
+    store.delete_entry("user-a", entry_ids(store, "user-a")[0])
+    store.compact("user-a", keep_actions=0)
+    # 読み終えたイベントだけが消え、まだ読んでいないものは残る
+    assert all(seq > checkpoint for seq in pending_seqs(path, "user-a"))
+    assert len(pending_seqs(path, "user-a")) == 6
+
+    assert rollups.refresh_all() == 6
+    assert table_rows(path)['cohort_user_days'] == [("user-a", to_timestamp(at(0)) // MICROSECONDS_PER_DAY, "Tokyo", "30代", 1500, 1000, 5)]
+    store.compact("user-a", keep_actions=0)
+    assert pending_seqs(path, "user-a") == []
+    # 整理した後も記録は作り直せる
+    store.rebuild("user-a")
+    assert store.count("user-a") == 5
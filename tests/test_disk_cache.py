@@ -0,0 +1,152 @@
+import multiprocessing
+
+import pytest
+
+from hydrocare.disk_cache import DEFAULT_NAMESPACE, DiskCache, memo_key, memoize
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    cache = DiskCache(str(tmp_path / "cache.db"), max_bytes=1000, clock=clock)
+    yield cache
+    cache.close()
+
+
+def test_entries_expire_after_ttl(cache, clock):
+    cache.set("weather:tokyo", b"sunny", ttl=60)
+    cache.set("weather:osaka", b"cloudy")
+    clock.now += 59
+    assert cache.get("weather:tokyo") == b"sunny"
+    clock.now += 1
+    assert cache.get("weather:tokyo") is None
+    # 有効期限のないものは残る
+    assert cache.get("weather:osaka") == b"cloudy"
+    assert cache.total_bytes() == len(b"cloudy")
+    assert cache.stats()['namespaces']['weather']['expired'] == 1
+
+
+def test_default_ttl(tmp_path, clock):
+    cache = DiskCache(str(tmp_path / "cache.db"), default_ttl=10, clock=clock)
+    cache.set("key", b"value")
+    clock.now += 10
+    assert cache.get("key") is None
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted_by_size(cache, clock):
+    for key in ("a", "b", "c"):
+        cache.set(key, bytes(300))
+        clock.now += 2
+    # a を使うと、最後に使われたのが一番古いのは b になる
+    assert cache.get("a") is not None
+    clock.now += 2
+    cache.set("d", bytes(300))
+
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in ("a", "c", "d"))
+    assert cache.total_bytes() == 900
+    assert cache.stats()['namespaces'][DEFAULT_NAMESPACE]['evictions'] == 1
+
+    # 上書きは古い値の分を差し引く
+    cache.set("a", bytes(100))
+    assert cache.total_bytes() == 700
+    # 1件で上限を超えるものは保存しない
+    cache.set("huge", bytes(1001))
+    assert cache.get("huge") is None
+    assert cache.total_bytes() == 700
+
+
+def test_stats_are_counted_per_namespace(cache):
+    cache.set("weather:tokyo", b"1")
+    cache.get("weather:tokyo")
+    cache.get("weather:tokyo")
+    cache.get("weather:osaka")
+    cache.get("summary:abc")
+    cache.get("plain")
+
+    namespaces = cache.stats()['namespaces']
+    assert namespaces['weather'] == {
+        'hits': 2, 'misses': 1, 'sets': 1, 'expired': 0, 'evictions': 0, 'hit_rate': 2 / 3,
+    }
+    assert namespaces['summary']['misses'] == 1
+    assert namespaces[DEFAULT_NAMESPACE]['misses'] == 1
+
+    cache.reset_stats()
+    assert cache.stats()['namespaces'] == {}
+
+
+def test_memo_key_is_stable():
+    assert memo_key("summary", ("user-a", 3), {'days': 7, 'granularity': "day"}) == memo_key(
+        "summary", ("user-a", 3), {'granularity': "day", 'days': 7}
+    )
+    assert memo_key("summary", ("user-a", 3), {}) != memo_key("summary", ("user-a", 4), {})
+    assert memo_key("summary", ("user-a",), {}) != memo_key("features", ("user-a",), {})
+    assert memo_key("summary", (), {}).startswith("summary:")
+
+
+def test_memoize_stores_results(cache):
+    calls = []
+
+    @memoize(lambda: cache, "square")
+    def square(value, offset=0):
+        calls.append(value)
+        return {'value': value * value + offset}
+
+    assert square(3) == {'value': 9}
+    assert square(3) == {'value': 9}
+    assert square(3, offset=1) == {'value': 10}
+    assert calls == [3, 3]
+    assert cache.stats()['namespaces']['square']['hits'] == 1
+
+    # キャッシュがない場合は毎回呼ぶ
+    uncached = memoize(lambda: None, "square")(lambda value: calls.append(value) or value)
+    uncached(5)
+    uncached(5)
+    assert calls == [3, 3, 5, 5]
+
+
+def _fill_from_process(path, worker, keys):
+    cache = DiskCache(path, max_bytes=10_000)
+    for index in range(keys):
+        # 半分のキーは両方のプロセスで同じ
+        key = f"shared:{index}" if index % 2 else f"worker{worker}:{index}"
+        if cache.get(key) is None:
+            cache.set(key, bytes(100))
+    cache.close()
+
+
+def test_two_processes_share_the_cache(tmp_path):
+    path = str(tmp_path / "cache.db")
+    DiskCache(path).close()
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=_fill_from_process, args=(path, worker, 60)) for worker in range(2)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    cache = DiskCache(path, max_bytes=10_000)
+    stats = cache.stats()
+    # 30 + 30 件の各プロセスのキーと、30 件の共有のキー
+    assert stats['entries'] == 90
+    # 合計サイズは同時に書き込んでも実際の合計と一致する
+    assert stats['total_bytes'] == 90 * 100
+    namespaces = stats['namespaces']
+    assert namespaces['worker0']['sets'] == namespaces['worker1']['sets'] == 30
+    assert namespaces['shared']['misses'] + namespaces['shared']['hits'] == 60
+    assert 30 <= namespaces['shared']['sets'] <= 60
+    cache.close()
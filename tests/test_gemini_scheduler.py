@@ -0,0 +1,156 @@
+import threading
+import time
+
+import pytest
+
+from hydrocare.gemini_scheduler import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    GeminiBusyError,
+    GeminiScheduler,
+    GeminiTimeoutError,
+)
+from hydrocare.stubs import FakeGenerativeModel
+
+
+# プロンプトごとの生成時間を決められる偽モデル (呼ばれた順を calls に残す)
+class RecordingModel(FakeGenerativeModel):
+    def __init__(self, delays=None, **kwargs):
+        super().__init__(reply=self._reply, **kwargs)
+        self.delays = delays or {}
+        self.calls = []
+
+    def _reply(self, prompt):
+        self.calls.append(prompt)
+        time.sleep(self.delays.get(prompt, 0))
+        return f"answer:{prompt}"
+
+
+@pytest.fixture
+def make_scheduler():
+    schedulers = []
+
+    def make(model, **kwargs):
+        kwargs.setdefault('requests_per_minute', 60_000)
+        kwargs.setdefault('burst', 100)
+        scheduler = GeminiScheduler(model, **kwargs)
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield make
+    for scheduler in schedulers:
+        scheduler.close()
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_requests_are_rate_limited(make_scheduler):
+    scheduler = make_scheduler(RecordingModel(), requests_per_minute=600, burst=1)
+    started = time.monotonic()
+    jobs = [scheduler.submit(f"prompt {i}") for i in range(4)]
+    answers = [scheduler.wait(job).text for job in jobs]
+    # 1個目はすぐ、残り3個は 0.1 秒ごとに1個ずつ送られる
+    assert time.monotonic() - started >= 0.25
+    assert answers == [f"answer:prompt {i}" for i in range(4)]
+    assert scheduler.metrics()['rate_limited'] > 0
+
+
+def test_duplicate_prompts_share_one_request(make_scheduler):
+    model = RecordingModel(delays={"same": 0.2})
+    scheduler = make_scheduler(model)
+    jobs = [scheduler.submit("same") for _ in range(3)]
+    assert all(scheduler.wait(job).text == "answer:same" for job in jobs)
+    assert model.call_count == 1
+    assert scheduler.metrics()['deduplicated'] == 2
+
+
+def test_interactive_duplicate_promotes_queued_job(make_scheduler):
+    model = RecordingModel(delays={"blocker": 0.3})
+    scheduler = make_scheduler(model, max_in_flight=1)
+    blocker = scheduler.submit("blocker", PRIORITY_BACKGROUND)
+    wait_until(lambda: blocker.started)
+    first = scheduler.submit("first", PRIORITY_BACKGROUND)
+    second = scheduler.submit("second", PRIORITY_BACKGROUND)
+    # 後から同じプロンプトを対話的な優先度で頼むと、待ち行列の先頭に繰り上がる
+    promoted = scheduler.submit("second", PRIORITY_INTERACTIVE)
+    assert promoted is second
+    for job in (blocker, first, second):
+        scheduler.wait(job)
+    assert model.calls == ["blocker", "second", "first"]
+
+
+def test_quota_errors_are_retried_then_reported_as_busy(make_scheduler):
+    model = FakeGenerativeModel(quota_error_rate=1.0)
+    scheduler = make_scheduler(model, quota_retries=1, retry_backoff_seconds=0)
+    with pytest.raises(GeminiBusyError):
+        scheduler.client().generate_content("prompt")
+    assert model.call_count == 2
+    metrics = scheduler.metrics()
+    assert metrics['quota_errors'] == 2
+    assert metrics['failed'] == 1
+
+
+def test_queue_wait_timeout_cancels_job(make_scheduler):
+    model = RecordingModel(delays={"blocker": 0.4})
+    scheduler = make_scheduler(model, max_in_flight=1, max_wait_seconds=0.1)
+    blocker = scheduler.submit("blocker")
+    wait_until(lambda: blocker.started)
+    queued = scheduler.submit("queued")
+    with pytest.raises(GeminiBusyError):
+        scheduler.wait(queued)
+    scheduler.wait(blocker)
+    # 取り消した依頼はモデルに送られない
+    time.sleep(0.1)
+    assert model.calls == ["blocker"]
+    assert scheduler.metrics()['timed_out'] == 1
+
+
+def test_slow_generation_is_not_reported_as_busy(make_scheduler):
+    model = RecordingModel(delays={"slow": 0.3})
+    scheduler = make_scheduler(model, max_wait_seconds=0.1, request_timeout_seconds=5)
+    assert scheduler.client().generate_content("slow").text == "answer:slow"
+    assert 'timed_out' not in scheduler.metrics()
+
+
+def test_generation_timeout_is_reported_separately(make_scheduler):
+    model = RecordingModel(delays={"slow": 0.5})
+    scheduler = make_scheduler(model, max_wait_seconds=5, request_timeout_seconds=0.1)
+    with pytest.raises(GeminiTimeoutError):
+        scheduler.client().generate_content("slow")
+    metrics = scheduler.metrics()
+    assert metrics['generation_timed_out'] == 1
+    assert 'timed_out' not in metrics
+
+
+def test_streaming_yields_all_chunks(make_scheduler):
+    model = FakeGenerativeModel(reply="0123456789abcdef", chunk_size=4)
+    scheduler = make_scheduler(model)
+    chunks = [chunk.text for chunk in scheduler.client(PRIORITY_INTERACTIVE).generate_content("prompt", stream=True)]
+    assert chunks == ["0123", "4567", "89ab", "cdef"]
+    wait_until(lambda: scheduler.metrics().get('completed') == 1)
+
+
+def test_concurrent_requests_respect_max_in_flight(make_scheduler):
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def reply(prompt):
+        with lock:
+            active.append(prompt)
+            peak.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.remove(prompt)
+        return prompt
+
+    scheduler = make_scheduler(FakeGenerativeModel(reply=reply), max_in_flight=2)
+    jobs = [scheduler.submit(f"prompt {i}") for i in range(6)]
+    for job in jobs:
+        scheduler.wait(job)
+    assert max(peak) == 2
@@ -0,0 +1,214 @@
+import datetime
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from hydrocare.hourly_plan import (
+    LEVEL_LABELS,
+    CityHourTable,
+    HourlyPlanEngine,
+    PlannedActivity,
+    activity_minutes_by_hour,
+    plan_hourly,
+    plan_hourly_frame,
+)
+from hydrocare.hydration import (
+    ACTIVITY_WATER_LOSS_PER_MINUTE,
+    WBGT_EXTRA_ML_PER_HOUR,
+    WBGT_SWEAT_FACTORS,
+    calculate_wbgt,
+    classify_wbgt,
+)
+
+# 2024-07-01 00:00 UTC (東京の 9:00) の少し後
+HOUR_START = int(datetime.datetime(2024, 7, 1, tzinfo=datetime.timezone.utc).timestamp())
+NOW = HOUR_START + 20 * 60
+TOKYO_OFFSET = 9 * 3600
+
+
+def forecast(temps, start=HOUR_START, step_hours=3, humidity=60, offset=TOKYO_OFFSET):
+    return {
+        'city': {'timezone': offset},
+        'list': [
+            {'dt': start + index * step_hours * 3600, 'main': {'temp': temp, 'humidity': humidity}}
+            for index, temp in enumerate(temps)
+        ],
+    }
+
+
+# 現地時刻 first_hour から1時間ごとに、どの時も同じ気温・湿度の表
+def flat_table(temp, humidity=60, first_hour="2024-07-01T00:00", hours=24):
+    local_hours = np.datetime64(first_hour, "m") + np.arange(hours) * np.timedelta64(60, "m")
+    temps = np.full(hours, float(temp))
+    humidities = np.full(hours, float(humidity))
+    return CityHourTable("Tokyo", 0, TOKYO_OFFSET, local_hours, temps, humidities, np.array([calculate_wbgt(temp, humidity)] * hours))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = NOW
+
+    def __call__(self):
+        return self.now
+
+
+# 都市ごとに決まった予報を返し、呼ばれた回数を数える WeatherClient の代わり
+class FakeClient:
+    def __init__(self, temps=(30, 30, 30), release=None, error=None):
+        self.temps = temps
+        self.release = release
+        self.error = error
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def forecast(self, city_name):
+        with self._lock:
+            self.calls.append(city_name)
+        if self.release is not None:
+            self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return forecast(self.temps)
+
+
+def test_forecast_is_interpolated_to_hours():
+    data = forecast([20, 23, 29, 32], start=HOUR_START + 3600)
+    # 気温の欠けた予報は使わず、前後の値から補間する
+    data['list'][2]['main']['temp'] = None
+    table = CityHourTable.from_forecast("Tokyo", data, now=NOW, hours=12)
+
+    # 最初の予報より前と最後の予報より後は、端の値のまま
+    expected_temps = [20, 20, 21, 22, 23, 24.5, 26, 27.5, 29, 30.5, 32, 32]
+    assert table.temp.tolist() == pytest.approx(expected_temps)
+    assert table.humidity.tolist() == pytest.approx([60] * 12)
+    assert table.wbgt.tolist() == pytest.approx([calculate_wbgt(temp, 60) for temp in expected_temps])
+    assert table.levels.tolist() == [classify_wbgt(calculate_wbgt(temp, 60)) for temp in expected_temps]
+    assert table.sweat_factor.tolist() == [WBGT_SWEAT_FACTORS[level] for level in table.levels]
+    # 時刻は都市の現地時刻の各時の始まり
+    assert table.hours[0] == np.datetime64("2024-07-01T09:00")
+    assert table.hours[-1] == np.datetime64("2024-07-01T20:00")
+    assert table.local_now(NOW) == datetime.datetime(2024, 7, 1, 9, 20)
+
+    with pytest.raises(ValueError):
+        CityHourTable.from_forecast("Tokyo", forecast([None, None]), now=NOW)
+
+
+def test_target_is_spread_over_waking_hours():
+    table = flat_table(30)
+    level = classify_wbgt(calculate_wbgt(30, 60))
+    base_ml, heat_ml, activity_ml = plan_hourly(table, 2400)
+    # 7時〜22時の16時間に均等に割り振る
+    assert base_ml.tolist() == [0.0] * 7 + [150.0] * 16 + [0.0]
+    assert base_ml.sum() == pytest.approx(2400)
+    assert heat_ml.tolist() == [0.0] * 7 + [WBGT_EXTRA_ML_PER_HOUR[level]] * 16 + [0.0]
+    assert not activity_ml.any()
+
+    base_ml, heat_ml, _ = plan_hourly(table, 2400, waking_hours=(6, 18))
+    assert base_ml.tolist() == [0.0] * 6 + [200.0] * 12 + [0.0] * 6
+    # 涼しければ暑さの追加はない
+    assert not plan_hourly(flat_table(15), 2400)[1].any()
+
+
+def test_waking_hours_follow_the_local_clock_across_midnight():
+    table = flat_table(20, first_hour="2024-07-01T21:00", hours=12)
+    base_ml, _, _ = plan_hourly(table, 1600)
+    # 21時, 22時, (23時〜6時は寝ている), 7時, 8時
+    assert base_ml.tolist() == [100.0, 100.0] + [0.0] * 8 + [100.0, 100.0]
+
+
+def test_activity_minutes_are_split_by_overlap():
+    hours = np.datetime64("2024-07-01T09:00", "m") + np.arange(6) * np.timedelta64(60, "m")
+    minutes = activity_minutes_by_hour(hours, [
+        PlannedActivity(datetime.datetime(2024, 7, 1, 9, 45), "ランニング", 90),
+        PlannedActivity(datetime.datetime(2024, 7, 1, 11, 50), "ランニング", 20),
+        # 表より前に始まった分と、表より後の分は数えない
+        PlannedActivity(datetime.datetime(2024, 7, 1, 8, 30), "ウォーキング", 45),
+        PlannedActivity(datetime.datetime(2024, 7, 1, 14, 30), "ウォーキング", 120),
+        PlannedActivity(datetime.datetime(2024, 7, 2, 9, 0), "ウォーキング", 30),
+    ])
+    assert minutes["ランニング"].tolist() == [15, 60, 25, 10, 0, 0]
+    assert minutes["ウォーキング"].tolist() == [15, 0, 0, 0, 0, 30]
+    assert activity_minutes_by_hour(hours, []) == {}
+
+
+def test_activity_water_is_scaled_by_the_hour_level():
+    table = flat_table(20, first_hour="2024-07-01T09:00", hours=3)
+    table.sweat_factor[:] = [1.0, 1.4, 1.6]
+    activities = [
+        PlannedActivity(datetime.datetime(2024, 7, 1, 9, 30), "ランニング", 60),
+        PlannedActivity(datetime.datetime(2024, 7, 1, 11, 0), "サイクリング", 10),
+        PlannedActivity(datetime.datetime(2024, 7, 1, 11, 0), "ヨガ", 30),
+    ]
+    _, _, activity_ml = plan_hourly(table, 1600, activities)
+    running, cycling = ACTIVITY_WATER_LOSS_PER_MINUTE["ランニング"], ACTIVITY_WATER_LOSS_PER_MINUTE["サイクリング"]
+    # 知らない種類の活動は 0
+    assert activity_ml.tolist() == pytest.approx([30 * running * 1.0, 30 * running * 1.4, 10 * cycling * 1.6])
+
+    frame = plan_hourly_frame(table, 1600, activities)
+    assert (frame['推奨量 (ml)'] == np.rint(100 + activity_ml).astype(np.int64)).all()
+    assert list(frame['警戒レベル']) == [LEVEL_LABELS[0]] * 3
+
+
+def test_tables_are_reused_within_the_hour():
+    clock = FakeClock()
+    client = FakeClient()
+    engine = HourlyPlanEngine(client, hours=6, max_cities=2, clock=clock)
+
+    assert engine.cached_table("Tokyo") is None
+    table = engine.table("Tokyo")
+    # 表記の揺れは同じ都市として扱う
+    assert engine.table("  TOKYO ") is table
+    assert engine.cached_table("tokyo") is table
+    assert client.calls == ["Tokyo"]
+    assert engine.stats() == {'builds': 1, 'hits': 2, 'cities': 1}
+    assert len(engine.plan("Tokyo", 2000)) == 6
+
+    # 時が変わったら作り直す
+    clock.now += 40 * 60
+    assert engine.cached_table("Tokyo") is None
+    assert engine.table("Tokyo") is not table
+    assert len(client.calls) == 2
+
+    # 都市の数の上限を超えたら、最後に使われたのが一番古い都市から捨てる
+    engine.table("Osaka")
+    engine.table("Tokyo")
+    engine.table("Sapporo")
+    assert engine.cached_table("Osaka") is None
+    assert engine.cached_table("Tokyo") is not None
+    assert engine.stats()['cities'] == 2
+
+
+def test_failed_build_is_not_cached():
+    client = FakeClient(error=RuntimeError("forecast unavailable"))
+    engine = HourlyPlanEngine(client, clock=FakeClock())
+    with pytest.raises(RuntimeError):
+        engine.table("Tokyo")
+    client.error = None
+    assert len(engine.table("Tokyo")) == 24
+    assert len(client.calls) == 2
+
+
+def test_concurrent_requests_are_coalesced():
+    release = threading.Event()
+    client = FakeClient(release=release)
+    engine = HourlyPlanEngine(client, clock=FakeClock())
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(engine.table("Tokyo"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while not client.calls:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    # 他のスレッドが作成中の表を待つところまで進める
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(results) == 8
+    assert all(table is results[0] for table in results)
+    assert client.calls == ["Tokyo"]
+    assert engine.stats()['builds'] == 1
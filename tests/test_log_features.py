@@ -0,0 +1,130 @@
+import datetime
+import random
+
+import pytest
+
+from hydrocare.log_features import MAX_GAPS, build_log_features, format_log_features
+from hydrocare.storage import WaterLogStore, to_timestamp
+
+USER_ID = "user-a"
+TARGET_ML = 2000
+# 2024-03-10 は日曜日
+TODAY = datetime.date(2024, 3, 10)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = WaterLogStore(str(tmp_path / "hydrocare.db"), compact_min_events=None)
+    yield store
+    store.close()
+
+
+def at(date, hour, minute=0):
+    return datetime.datetime.combine(date, datetime.time(hour, minute))
+
+
+def day(offset):
+    return TODAY - datetime.timedelta(days=offset)
+
+
+# 記録そのものから求めた、日ごとの最長の間隔の長い順 MAX_GAPS 件
+def direct_longest_gaps(store):
+    by_day = {}
+    for entry in store.entries_between(USER_ID, day(400), day(-1)):
+        by_day.setdefault(entry['time'].date(), []).append(entry['time'])
+    gaps = []
+    for times in by_day.values():
+        candidates = [(later - earlier, earlier) for earlier, later in zip(times, times[1:]) if later > earlier]
+        if candidates:
+            gap, started = max(candidates, key=lambda candidate: (candidate[0], -candidate[1].timestamp()))
+            gaps.append((started, gap.total_seconds() / 3600))
+    return sorted(gaps, key=lambda gap: (gap[1], gap[0].date()), reverse=True)[:MAX_GAPS]
+
+
+def test_streaks_and_weekday_weekend_averages(store):
+    # 2/26(月)〜3/8(金) の12日間は 1日 1000ml + 100ml × 何日前か (3/2(土) だけ 1000ml)。3/9(土) は記録なし
+    for offset in range(13, 1, -1):
+        date = day(offset)
+        amount_ml = 1000 if date == datetime.date(2024, 3, 2) else 1000 + offset * 100
+        store.append_many(USER_ID, [
+            {'time': at(date, 8), 'amount_ml': amount_ml // 2, 'type': "水"},
+            {'time': at(date, 18), 'amount_ml': amount_ml - amount_ml // 2, 'type': "お茶"},
+        ])
+    # 今日はまだ途中 (目標に届いていなくても連続は途切れない)
+    store.append(USER_ID, at(TODAY, 9), 300, "水")
+
+    features = build_log_features(store, USER_ID, TARGET_ML, TODAY)
+    amounts = {day(offset): (1000 if day(offset) == datetime.date(2024, 3, 2) else 1000 + offset * 100) for offset in range(13, 1, -1)}
+    amounts[day(1)] = 0
+    weekday = [amount for date, amount in amounts.items() if date.weekday() < 5]
+    weekend = [amount for date, amount in amounts.items() if date.weekday() >= 5]
+    attained = sorted(date for date, amount in amounts.items() if amount >= TARGET_ML)
+
+    assert features.first_date == day(13)
+    assert features.active_days == 13 and features.entry_count == 25
+    assert features.complete_days == 13
+    # 目標に届くのは 2/26〜2/29 (10〜13日前) の4日
+    assert features.attained_days == len(attained) == 4
+    assert features.longest_streak == 4
+    # 昨日 (3/9) は記録がないので、現在の連続は 0
+    assert features.current_streak == 0
+    assert features.weekday_avg_ml == pytest.approx(sum(weekday) / len(weekday))
+    assert features.weekend_avg_ml == pytest.approx(sum(weekend) / len(weekend))
+    assert features.recent_avg_ml == pytest.approx(sum(amounts[day(offset)] for offset in range(7, 0, -1)) / 7)
+
+    text = format_log_features(features, TARGET_ML)
+    assert f"目標 {TARGET_ML}ml の達成: 4/13日、現在 0日連続、最長 4日連続" in text
+    assert f"平日 {sum(weekday) / len(weekday):.0f}ml / 週末 {sum(weekend) / len(weekend):.0f}ml" in text
+
+    # 昨日も目標を達成すると、今日が途中でも連続が続く
+    store.append(USER_ID, at(day(1), 12), 2500, "水")
+    features = build_log_features(store, USER_ID, TARGET_ML, TODAY)
+    assert features.current_streak == 1
+
+
+def test_longest_gaps_follow_edits_and_deletes(store):
+    store.append_many(USER_ID, [
+        {'time': at(day(3), hour), 'amount_ml': 200, 'type': "水"} for hour in (7, 9, 15, 16)
+    ] + [
+        {'time': at(day(2), hour), 'amount_ml': 200, 'type': "水"} for hour in (8, 12, 13, 23)
+    ] + [
+        # 日をまたぐ間隔 (23時 → 翌6時) は含めない
+        {'time': at(day(1), hour), 'amount_ml': 200, 'type': "水"} for hour in (6, 8)
+    ])
+    gaps = build_log_features(store, USER_ID, TARGET_ML, TODAY).longest_gaps
+    assert gaps == [(at(day(2), 13), 10.0), (at(day(3), 9), 6.0), (at(day(1), 6), 2.0)]
+    assert gaps == direct_longest_gaps(store)
+
+    ids = {row[1]: row[0] for row in store.rows_page(USER_ID, day(3), day(-1), 0, 100, with_ids=True)}
+    # 途中の記録を消すと前後の間隔がつながり、移すと元の日と移した先の日の両方が変わる
+    store.delete_entry(USER_ID, ids[to_timestamp(at(day(3), 15))])
+    store.edit_entry(USER_ID, ids[to_timestamp(at(day(2), 23))], time=at(day(1), 20))
+    gaps = build_log_features(store, USER_ID, TARGET_ML, TODAY).longest_gaps
+    assert gaps == [(at(day(1), 8), 12.0), (at(day(3), 9), 7.0), (at(day(2), 8), 4.0)]
+    assert gaps == direct_longest_gaps(store)
+
+    store.undo_last(USER_ID)
+    assert build_log_features(store, USER_ID, TARGET_ML, TODAY).longest_gaps == direct_longest_gaps(store)
+    store.rebuild(USER_ID)
+    assert build_log_features(store, USER_ID, TARGET_ML, TODAY).longest_gaps == direct_longest_gaps(store)
+
+
+def test_summary_size_does_not_grow_with_history(tmp_path):
+    rng = random.Random(0)
+    sizes = []
+    for days in (30, 365, 1000):
+        store = WaterLogStore(str(tmp_path / f"{days}.db"), compact_min_events=None)
+        store.append_many(USER_ID, [
+            {
+                'time': at(day(offset), 7) + datetime.timedelta(minutes=rng.randrange(15 * 60)),
+                'amount_ml': rng.choice([150, 250, 500]), 'type': rng.choice(["水", "お茶", "コーヒー", "ジュース", "スポーツドリンク"]),
+            }
+            for offset in range(days) for _ in range(10)
+        ])
+        text = format_log_features(build_log_features(store, USER_ID, TARGET_ML, TODAY), TARGET_ML)
+        sizes.append((len(text.splitlines()), len(text)))
+        store.close()
+    # 行数は同じで、文字数は数字の桁の違いの分しか変わらない
+    assert len({lines for lines, _ in sizes}) == 1
+    assert max(chars for _, chars in sizes) - min(chars for _, chars in sizes) < 20
+    assert max(chars for _, chars in sizes) < 600
@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+from hydrocare.metrics import MetricsRegistry
+
+
+def histogram_count_and_sum(registry, name):
+    row = next(row for row in registry.summary() if row['metric'] == name)
+    return row['count'], row['mean_ms'] * row['count'] / 1000
+
+
+def test_instrument_times_function_call():
+    registry = MetricsRegistry(enabled=True)
+
+    @registry.instrument("helper_seconds", helper="sleep")
+    def sleep():
+        time.sleep(0.05)
+        return "done"
+
+    assert sleep() == "done"
+    count, seconds = histogram_count_and_sum(registry, "helper_seconds")
+    assert count == 1
+    assert seconds >= 0.05
+
+
+def test_instrument_times_returned_generator_until_exhausted():
+    registry = MetricsRegistry(enabled=True)
+
+    @registry.instrument("helper_seconds", helper="stream")
+    def stream():
+        for chunk in ("a", "b", "c"):
+            time.sleep(0.03)
+            yield chunk
+
+    chunks = stream()
+    assert registry.summary() == []
+    assert "".join(chunks) == "abc"
+    count, seconds = histogram_count_and_sum(registry, "helper_seconds")
+    assert count == 1
+    assert seconds >= 0.09
+
+
+def test_instrument_counts_errors_raised_while_streaming():
+    registry = MetricsRegistry(enabled=True)
+
+    @registry.instrument("helper_seconds", helper="broken")
+    def broken():
+        yield "a"
+        raise RuntimeError("stream failed")
+
+    with pytest.raises(RuntimeError):
+        list(broken())
+    assert "hydrocare_errors_total" in registry.render_prometheus()
@@ -0,0 +1,200 @@
+import datetime
+import threading
+import time
+
+import pytest
+import requests
+
+from hydrocare.reminders import ReminderScheduler, WebhookNotifier
+
+NOW = datetime.datetime(2024, 7, 1, 9, 0)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = NOW
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, **kwargs):
+        self.now += datetime.timedelta(**kwargs)
+
+
+# 受け取ったバッチを残す通知先 (failures 回目までは例外にする)
+class FakeNotifier:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def notify(self, reminders):
+        with self._lock:
+            self.calls += 1
+            if self.calls <= self.failures:
+                raise requests.ConnectionError("webhook is down")
+            self.batches.append(list(reminders))
+
+    def sent(self):
+        with self._lock:
+            return [reminder.user_id for batch in self.batches for reminder in batch]
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+
+# POST された JSON を残す Session の代わり (statuses の順に応答する)
+class FakeSession:
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.posts = []
+
+    def post(self, url, json, timeout):
+        self.posts.append((url, json))
+        return FakeResponse(self.statuses.pop(0) if self.statuses else 200)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def make_scheduler(clock):
+    schedulers = []
+
+    def make(notifier, **kwargs):
+        scheduler = ReminderScheduler(notifier, clock=clock, **kwargs).start()
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield make
+    for scheduler in schedulers:
+        scheduler.stop()
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_reminders_are_sent_in_due_order_in_batches(make_scheduler, clock):
+    notifier = FakeNotifier()
+    scheduler = make_scheduler(notifier, batch_size=2)
+    # 登録の順と期限の順を変えておく
+    for user_id, minutes in [("d", 40), ("a", 10), ("e", 50), ("c", 30), ("b", 20)]:
+        assert scheduler.schedule(user_id, NOW, minutes) == NOW + datetime.timedelta(minutes=minutes)
+    assert scheduler.next_due("c") == NOW + datetime.timedelta(minutes=30)
+
+    clock.advance(minutes=30)
+    scheduler.wake()
+    wait_until(lambda: len(notifier.sent()) == 3)
+    assert notifier.sent() == ["a", "b", "c"]
+    assert all(len(batch) <= 2 for batch in notifier.batches)
+    assert scheduler.next_due("c") is None
+    assert scheduler.next_due("d") == NOW + datetime.timedelta(minutes=40)
+
+    clock.advance(minutes=30)
+    scheduler.wake()
+    wait_until(lambda: len(notifier.sent()) == 5)
+    assert notifier.sent() == ["a", "b", "c", "d", "e"]
+    stats = scheduler.stats()
+    assert stats['pending'] == 0 and stats['dispatched'] == 5
+
+
+def test_new_intake_reschedules_the_reminder(make_scheduler, clock):
+    notifier = FakeNotifier()
+    scheduler = make_scheduler(notifier)
+    scheduler.schedule("user-a", NOW, 60)
+    scheduler.schedule("user-b", NOW, 60)
+    # 同じ期限でもう一度登録しても (画面の再実行など) ヒープは増えない
+    scheduler.schedule("user-a", NOW, 60)
+    assert scheduler.stats()['heap_size'] == 2
+
+    # 30分後に飲んだので、期限は 90分後になる
+    clock.advance(minutes=30)
+    assert scheduler.schedule("user-a", clock.now, 60) == NOW + datetime.timedelta(minutes=90)
+    assert scheduler.stats()['pending'] == 2
+
+    clock.advance(minutes=30)
+    scheduler.wake()
+    wait_until(lambda: notifier.sent() == ["user-b"])
+    # 古い期限 (60分後) の要素は読み飛ばされる
+    assert scheduler.next_due("user-a") == NOW + datetime.timedelta(minutes=90)
+
+    clock.advance(minutes=30)
+    scheduler.wake()
+    wait_until(lambda: notifier.sent() == ["user-b", "user-a"])
+    assert notifier.batches[-1][0].due_at == NOW + datetime.timedelta(minutes=90)
+
+
+def test_past_or_missing_intake_is_not_scheduled(make_scheduler, clock):
+    scheduler = make_scheduler(FakeNotifier())
+    scheduler.schedule("user-a", NOW, 60)
+    assert scheduler.schedule("user-a", None, 60) is None
+    assert scheduler.next_due("user-a") is None
+    # 期限をもう過ぎている古い記録からは通知しない
+    assert scheduler.schedule("user-b", NOW - datetime.timedelta(hours=2), 60) is None
+    assert scheduler.stats()['pending'] == 0
+
+
+def test_webhook_batches_are_retried_after_a_failure(make_scheduler, clock):
+    session = FakeSession([503])
+    scheduler = make_scheduler(WebhookNotifier("https://hooks.example.com/water", session=session), batch_size=3, retry_backoff_seconds=30)
+    for index in range(3):
+        scheduler.schedule(f"user-{index}", NOW, 60)
+
+    clock.advance(minutes=60)
+    scheduler.wake()
+    wait_until(lambda: scheduler.stats().get('retried') == 3)
+    assert len(session.posts) == 1
+    # 送り直しの間隔が空くまでは送らない
+    clock.advance(seconds=29)
+    scheduler.wake()
+    time.sleep(0.05)
+    assert len(session.posts) == 1
+
+    clock.advance(seconds=1)
+    scheduler.wake()
+    wait_until(lambda: scheduler.stats().get('dispatched') == 3)
+    assert len(session.posts) == 2
+    url, payload = session.posts[-1]
+    assert url == "https://hooks.example.com/water"
+    assert [reminder['user_id'] for reminder in payload['reminders']] == ["user-0", "user-1", "user-2"]
+    # 送り直しても期限は元の時刻のまま
+    assert {reminder['due_at'] for reminder in payload['reminders']} == {"2024-07-01T10:00:00"}
+    assert scheduler.stats()['batches'] == 1
+
+
+def test_retries_stop_after_the_limit_or_a_new_intake(make_scheduler, clock):
+    notifier = FakeNotifier(failures=10)
+    scheduler = make_scheduler(notifier, retries=2, retry_backoff_seconds=10)
+    scheduler.schedule("user-a", NOW, 60)
+    scheduler.schedule("user-b", NOW, 60)
+
+    clock.advance(minutes=60)
+    scheduler.wake()
+    wait_until(lambda: notifier.calls == 1)
+    wait_until(lambda: scheduler.stats().get('retried') == 2)
+    # 送れない間に user-b が飲んだので、user-b の古い通知は送り直さない
+    scheduler.schedule("user-b", clock.now, 60)
+
+    # 2回目の送り直しは倍の間隔を空ける
+    for seconds, calls in ((10, 2), (20, 3)):
+        clock.advance(seconds=seconds)
+        scheduler.wake()
+        wait_until(lambda: notifier.calls == calls)
+    wait_until(lambda: scheduler.stats().get('failed') == 1)
+    stats = scheduler.stats()
+    assert stats['retried'] == 3 and stats.get('dispatched', 0) == 0
+    assert scheduler.next_due("user-a") is None
+    assert scheduler.next_due("user-b") == NOW + datetime.timedelta(minutes=120)
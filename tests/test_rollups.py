@@ -0,0 +1,101 @@
+import datetime
+import random
+
+import pytest
+
+from hydrocare.rollups import SUMMARY_GRANULARITIES, SUMMARY_WINDOWS, summarize_intake
+from hydrocare.storage import WaterLogStore
+
+USER_ID = "user-a"
+TARGET_ML = 2000
+TODAY = datetime.date(2024, 3, 5)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = WaterLogStore(str(tmp_path / "hydrocare.db"), compact_min_events=None)
+    yield store
+    store.close()
+
+
+# 記録そのものから集計した (日付, 合計量, 日数) の一覧 (summarize_intake と比べる基準)
+def direct_summary(store, days, granularity):
+    start = TODAY - datetime.timedelta(days=days - 1)
+    if granularity == "month":
+        start = start.replace(day=1)
+    entries = store.entries_between(USER_ID, start, TODAY + datetime.timedelta(days=1))
+    buckets = {}
+    date = start
+    while date <= TODAY:
+        if granularity == "month":
+            key = date.replace(day=1)
+        elif granularity == "week":
+            key = max(date - datetime.timedelta(days=date.weekday()), TODAY - datetime.timedelta(days=days - 1))
+        else:
+            key = date
+        total_ml, day_count = buckets.get(key, (0, 0))
+        buckets[key] = (total_ml, day_count + 1)
+        date += datetime.timedelta(days=1)
+    for entry in entries:
+        date = entry['time'].date()
+        key = next(key for key in sorted(buckets, reverse=True) if key <= date)
+        total_ml, day_count = buckets[key]
+        buckets[key] = (total_ml + entry['amount_ml'], day_count)
+    return [(key, total_ml, TARGET_ML * day_count) for key, (total_ml, day_count) in sorted(buckets.items())]
+
+
+def summary_rows(summary):
+    return [
+        (row.Date.date(), row.Total_ML, row.Target_ML)
+        for row in summary.itertuples(index=False)
+    ]
+
+
+def assert_matches_raw_rows(store):
+    for days in SUMMARY_WINDOWS:
+        for granularity in SUMMARY_GRANULARITIES:
+            summary = summarize_intake(store, USER_ID, TARGET_ML, days, granularity, TODAY)
+            assert summary_rows(summary) == direct_summary(store, days, granularity), (days, granularity)
+
+
+def test_summary_matches_raw_rows(store):
+    rng = random.Random(0)
+    first = datetime.datetime.combine(TODAY - datetime.timedelta(days=400), datetime.time())
+    store.append_many(USER_ID, [
+        {'time': first + datetime.timedelta(minutes=rng.randrange(401 * 24 * 60)), 'amount_ml': rng.choice([100, 250, 500]), 'type': "水"}
+        for _ in range(2000)
+    ])
+    # 他のユーザーの記録は含めない
+    store.append("user-b", datetime.datetime.combine(TODAY, datetime.time(9)), 999, "水")
+    assert_matches_raw_rows(store)
+
+
+def test_summary_follows_edits_and_deletes_across_boundaries(store):
+    end_of_february = datetime.datetime(2024, 2, 29, 23, 50)
+    store.append_many(USER_ID, [
+        {'time': end_of_february, 'amount_ml': 300, 'type': "水"},
+        {'time': datetime.datetime(2024, 3, 3, 23, 59), 'amount_ml': 200, 'type': "お茶"},
+        {'time': datetime.datetime(2024, 3, 4, 8, 0), 'amount_ml': 400, 'type': "水"},
+    ])
+    february_id, sunday_id, monday_id = [row[0] for row in store.rows_page(
+        USER_ID, datetime.date(2024, 1, 1), datetime.date(2024, 4, 1), 0, 10, with_ids=True
+    )]
+    assert_matches_raw_rows(store)
+
+    # 月末の記録を翌月へ、日曜日の記録を翌週の月曜日へ動かす
+    store.edit_entry(USER_ID, february_id, time=datetime.datetime(2024, 3, 1, 0, 10))
+    store.edit_entry(USER_ID, sunday_id, time=datetime.datetime(2024, 3, 4, 0, 5), amount_ml=250)
+    assert_matches_raw_rows(store)
+    monthly = summarize_intake(store, USER_ID, TARGET_ML, 30, "month", TODAY)
+    assert summary_rows(monthly) == [(datetime.date(2024, 2, 1), 0, TARGET_ML * 29), (datetime.date(2024, 3, 1), 950, TARGET_ML * 5)]
+
+    # 前の月へ戻してから削除する
+    store.edit_entry(USER_ID, monday_id, time=datetime.datetime(2024, 1, 31, 12, 0))
+    assert_matches_raw_rows(store)
+    store.delete_entry(USER_ID, monday_id)
+    store.delete_entry(USER_ID, february_id)
+    assert_matches_raw_rows(store)
+    store.undo_last(USER_ID)
+    assert_matches_raw_rows(store)
+    weekly = summarize_intake(store, USER_ID, TARGET_ML, 7, "week", TODAY)
+    assert summary_rows(weekly) == [(datetime.date(2024, 2, 28), 300, TARGET_ML * 5), (datetime.date(2024, 3, 4), 250, TARGET_ML * 2)]
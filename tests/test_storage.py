@@ -0,0 +1,271 @@
+import datetime
+import io
+import sqlite3
+
+import pytest
+
+from hydrocare.bulk_io import import_log
+from hydrocare.storage import EVENT_ADD, SCHEMA_VERSION, WaterLogStore, to_month_number, to_timestamp
+
+USER_ID = "user-a"
+START = datetime.datetime(2024, 1, 1)
+EVERYTHING = (datetime.datetime(2000, 1, 1), datetime.datetime(2100, 1, 1))
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = WaterLogStore(str(tmp_path / "hydrocare.db"), compact_min_events=None)
+    yield store
+    store.close()
+
+
+def entry(minutes, amount_ml=200, drink_type="水"):
+    return {'time': START + datetime.timedelta(minutes=minutes), 'amount_ml': amount_ml, 'type': drink_type}
+
+
+def entry_ids(store, user_id=USER_ID):
+    return [row[0] for row in store.rows_page(user_id, *EVERYTHING, 0, 1_000_000, with_ids=True)]
+
+
+# 記録と集計テーブルの中身 (作り直しの前後で比べる)
+def state(store, user_id=USER_ID):
+    return {
+        'rows': store.rows_page(user_id, *EVERYTHING, 0, 1_000_000, with_ids=True),
+        'daily': store.daily_totals_between(user_id, EVERYTHING[0].date(), EVERYTHING[1].date()),
+        'types': store.type_totals_between(user_id, EVERYTHING[0].date(), EVERYTHING[1].date()),
+        'monthly': store.monthly_totals_between(user_id, 0, 10 ** 6),
+        'hourly': sorted(store.hourly_totals(user_id)),
+        'gaps': store.longest_daily_gaps(user_id, EVERYTHING[0].date(), EVERYTHING[1].date(), 1_000_000),
+    }
+
+
+def make_history(store):
+    # 月をまたぐ記録を追加し、修正・削除・取り消しを混ぜる
+    store.append_many(USER_ID, [entry(minutes) for minutes in (60, 600, 60 * 24 * 30 + 30, 60 * 24 * 31 + 90)])
+    first, second, third, fourth = entry_ids(store)
+    store.edit_entry(USER_ID, first, amount_ml=350)
+    store.edit_entry(USER_ID, second, time=START + datetime.timedelta(days=40), drink_type="お茶")
+    store.delete_entry(USER_ID, third)
+    store.append(USER_ID, START + datetime.timedelta(days=2), 500, "コーヒー")
+    store.undo_last(USER_ID)
+    store.delete_entry(USER_ID, fourth)
+    store.undo_last(USER_ID)
+
+
+def test_undo_reverts_add_edit_and_delete(store):
+    store.append_many(USER_ID, [entry(0), entry(30)])
+    first, _ = entry_ids(store)
+    before = state(store)
+
+    store.edit_entry(USER_ID, first, amount_ml=500, drink_type="お茶")
+    assert store.last_action(USER_ID).amount_ml == 300
+    assert store.undo_last(USER_ID) == 1
+    assert state(store) == before
+
+    store.delete_entry(USER_ID, first)
+    assert store.undo_last(USER_ID) == 1
+    # 削除した記録は同じ ID で戻る
+    assert state(store) == before
+
+    assert store.undo_last(USER_ID) == 2
+    assert store.count(USER_ID) == 0
+    assert state(store)['daily'] == {}
+    assert store.last_action(USER_ID) is None
+    assert store.undo_last(USER_ID) == 0
+
+
+def test_rebuild_matches_incremental_updates(store):
+    make_history(store)
+    expected = state(store)
+    assert expected['rows']
+    assert store.rebuild(USER_ID) > 0
+    assert state(store) == expected
+
+
+def test_compaction_keeps_undo_history(store):
+    make_history(store)
+    for minutes in range(5):
+        store.append(USER_ID, START + datetime.timedelta(days=3, minutes=minutes), 100, "水")
+    expected = state(store)
+    stored_events = store.event_stats(USER_ID)['stored_events']
+
+    store.compact(USER_ID, keep_actions=2)
+    stats = store.event_stats(USER_ID)
+    assert stats['pending_events'] == 0
+    assert stats['snapshot_entries'] == len(expected['rows'])
+    assert stats['stored_events'] < stored_events
+    # スナップショットから作り直しても同じになる (残した操作のイベントはスナップショットに含まれるので再生しない)
+    assert store.rebuild(USER_ID) == 0
+    assert state(store) == expected
+
+    # 残した直近2回の操作は取り消せる
+    assert store.undo_last(USER_ID) == 1
+    assert store.undo_last(USER_ID) == 1
+    assert store.count(USER_ID) == len(expected['rows']) - 2
+    after_undo = state(store)
+    store.rebuild(USER_ID)
+    assert state(store) == after_undo
+
+
+def test_automatic_compaction(tmp_path):
+    store = WaterLogStore(str(tmp_path / "hydrocare.db"), compact_min_events=5)
+    for minutes in range(12):
+        store.append(USER_ID, START + datetime.timedelta(minutes=minutes), 100, "水")
+    stats = store.event_stats(USER_ID)
+    assert stats['snapshot_entries'] >= 5
+    assert stats['pending_events'] < 5
+    expected = state(store)
+    store.rebuild(USER_ID)
+    assert state(store) == expected
+    store.close()
+
+
+def test_import_is_one_undoable_action(store):
+    store.append(USER_ID, START, 100, "水")
+    source = io.StringIO("time,amount_ml,type\n" + "".join(f"2024-02-01T{hour:02d}:00:00,{100 + hour},水\n" for hour in range(24)))
+    revision = store.revision(USER_ID)
+
+    report = import_log(store, USER_ID, source, "csv", chunksize=5)
+    assert report.imported == 24
+    action = store.last_action(USER_ID)
+    assert (action.kind, action.entry_count, action.amount_ml) == (EVENT_ADD, 24, sum(range(100, 124)))
+    # 取り込みの後は更新番号が進んでいる
+    assert store.revision(USER_ID) > revision
+
+    assert store.undo_last(USER_ID) == 24
+    assert store.count(USER_ID) == 1
+
+
+def test_failed_import_can_be_undone_together(tmp_path):
+    store = WaterLogStore(str(tmp_path / "hydrocare.db"), compact_min_events=3)
+    store.append(USER_ID, START, 100, "水")
+    with pytest.raises(ValueError):
+        with store.import_action(USER_ID) as revision:
+            for chunk in range(3):
+                store.append_rows(USER_ID, [(to_timestamp(START) + (chunk * 10 + i + 1) * 60_000_000, 200, "水") for i in range(4)], revision)
+            raise ValueError("broken chunk")
+    # 取り込みの途中ではスナップショットを作らず、終わった後に作る
+    assert store.event_stats(USER_ID)['snapshot_entries'] == 13
+    assert store.last_action(USER_ID).entry_count == 12
+    expected = state(store)
+    store.rebuild(USER_ID)
+    assert state(store) == expected
+
+    assert store.undo_last(USER_ID) == 12
+    assert store.count(USER_ID) == 1
+    store.close()
+
+
+def test_actions_during_import_replay_in_order(store):
+    store.append(USER_ID, START, 100, "水")
+    with store.import_action(USER_ID) as revision:
+        store.append_rows(USER_ID, [(to_timestamp(START) + 60_000_000, 200, "水")], revision)
+        # 取り込みの途中に別の画面から修正した記録
+        imported_id = entry_ids(store)[1]
+        store.edit_entry(USER_ID, imported_id, amount_ml=250)
+        store.append_rows(USER_ID, [(to_timestamp(START) + 120_000_000, 300, "お茶")], revision)
+    expected = state(store)
+    store.rebuild(USER_ID)
+    assert state(store) == expected
+    # 後から行った修正が先に取り消される
+    assert store.undo_last(USER_ID) == 1
+    assert store.undo_last(USER_ID) == 2
+    assert store.count(USER_ID) == 1
+
+
+def test_migration_from_first_schema(tmp_path):
+    path = str(tmp_path / "old.db")
+    # 集計テーブルもイベントもない最初の版のデータベース
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE water_log (id INTEGER PRIMARY KEY, user_id TEXT NOT NULL, ts INTEGER NOT NULL, amount_ml INTEGER NOT NULL, drink_type TEXT NOT NULL);
+        CREATE INDEX water_log_user_ts ON water_log (user_id, ts);
+    """)
+    conn.executemany("INSERT INTO water_log (id, user_id, ts, amount_ml, drink_type) VALUES (?, ?, ?, ?, ?)", [
+        (1, "user-a", to_timestamp(START), 200, "水"),
+        (2, "user-a", to_timestamp(START + datetime.timedelta(days=31, hours=13)), 300, "お茶"),
+        (7, "user-b", to_timestamp(START + datetime.timedelta(hours=8)), 150, "水"),
+    ])
+    conn.commit()
+    conn.close()
+
+    store = WaterLogStore(path, compact_min_events=None)
+    assert store._conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    assert store.daily_totals_between("user-a", START.date(), START.date() + datetime.timedelta(days=40)) == {
+        START.date(): 200, (START + datetime.timedelta(days=31)).date(): 300,
+    }
+    assert store.monthly_totals_between("user-a", to_month_number(START), to_month_number(START) + 1) == {
+        to_month_number(START): 200, to_month_number(START) + 1: 300,
+    }
+    # 2024-02-01 は木曜日
+    assert sorted(store.hourly_totals("user-a")) == [(0, 0, 200, 1), (3, 13, 300, 1)]
+    assert store.revision("user-a") == 2 and store.revision("user-b") == 1
+    assert store.event_stats("user-a")['snapshot_entries'] == 2
+    # 新しい記録の ID は既存の記録の続きから付ける
+    store.append("user-a", START + datetime.timedelta(days=1), 100, "水")
+    assert entry_ids(store, "user-a")[1] == 8
+    # 移行前の記録も取り消しの対象にはならないが、作り直しでは残る
+    store.rebuild("user-a")
+    assert store.count("user-a") == 3
+    store.close()
+
+    # 開き直しても移行は繰り返さない
+    store = WaterLogStore(path, compact_min_events=None)
+    assert store.count("user-a") == 3 and store.revision("user-a") == 3
+    store.close()
+
+
+def test_rows_page_and_iter_rows_paginate_in_time_order(store):
+    # 同じ時刻の記録は ID の順に並ぶ
+    store.append_many(USER_ID, [entry(minutes % 7, amount_ml=100 + minutes) for minutes in range(25)])
+    all_rows = store.rows_page(USER_ID, *EVERYTHING, 0, 100, with_ids=True)
+    assert len(all_rows) == 25
+    assert all_rows == sorted(all_rows, key=lambda row: (row[1], row[0]))
+
+    pages = [store.rows_page(USER_ID, *EVERYTHING, offset, 10) for offset in (0, 10, 20, 30)]
+    assert [len(page) for page in pages] == [10, 10, 5, 0]
+    assert sum(pages, []) == [row[1:] for row in all_rows]
+
+    batches = list(store.iter_rows(USER_ID, batch_size=4))
+    assert [len(batch) for batch in batches] == [4, 4, 4, 4, 4, 4, 1]
+    assert sum(batches, []) == [row[1:] for row in all_rows]
+
+    # 期間の絞り込み (start 以上 end 未満)
+    start, end = START + datetime.timedelta(minutes=2), START + datetime.timedelta(minutes=4)
+    assert store.count_between(USER_ID, start, end) == len(store.rows_between(USER_ID, start, end)) == 8
+    assert store.rows_page(USER_ID, start, end, 0, 100) == store.rows_between(USER_ID, start, end)
+
+
+def test_previous_and_next_entry_time(store):
+    store.append_many(USER_ID, [entry(0), entry(90), entry(180)])
+    at_90 = START + datetime.timedelta(minutes=90)
+    assert store.previous_entry_time(USER_ID, at_90) == START
+    assert store.next_entry_time(USER_ID, at_90) == at_90
+    assert store.next_entry_time(USER_ID, at_90 + datetime.timedelta(seconds=1)) == START + datetime.timedelta(minutes=180)
+    assert store.previous_entry_time(USER_ID, START) is None
+    assert store.next_entry_time(USER_ID, START + datetime.timedelta(days=1)) is None
+    assert store.last_intake_time(USER_ID) == START + datetime.timedelta(minutes=180)
+
+
+def test_users_are_isolated(store):
+    store.append_many("user-a", [entry(0, 200), entry(60, 300)])
+    store.append_many("user-b", [entry(30, 500, "お茶")])
+    a_ids = entry_ids(store, "user-a")
+
+    assert store.count("user-a") == 2 and store.count("user-b") == 1
+    assert store.daily_totals_by_type("user-b", START.date()) == {"お茶": 500}
+    assert store.previous_entry_time("user-a", START + datetime.timedelta(minutes=59)) == START
+    assert [entry['amount_ml'] for entry in store.last_entries("user-b", 10)] == [500]
+    # 他のユーザーの記録は修正・削除できない
+    with pytest.raises(ValueError):
+        store.edit_entry("user-b", a_ids[0], amount_ml=1)
+    with pytest.raises(ValueError):
+        store.delete_entry("user-b", a_ids[0])
+
+    # 取り消し・作り直しは、そのユーザーの記録だけに効く
+    store.undo_last("user-b")
+    assert store.count("user-b") == 0 and store.count("user-a") == 2
+    expected = state(store, "user-a")
+    store.rebuild("user-b")
+    assert state(store, "user-a") == expected
+    assert store.revision("user-a") == 1 and store.revision("user-b") == 2
@@ -0,0 +1,143 @@
+import threading
+
+import pytest
+import requests
+
+from hydrocare.stubs import StubOpenWeatherServer
+from hydrocare.weather import WeatherClient, describe_weather_error
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+# 最初の failures 回だけ 503 を返すスタブ
+class FlakyOpenWeatherServer(StubOpenWeatherServer):
+    def __init__(self, failures, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+
+    def handle_request(self, method, path, query, body):
+        if self.failures > 0:
+            self.failures -= 1
+            return 503, {'message': "stub error"}
+        return super().handle_request(method, path, query, body)
+
+
+@pytest.fixture
+def server():
+    with StubOpenWeatherServer(temperature=30.0, humidity=70, unknown_cities=["Atlantis"]) as server:
+        yield server
+
+
+def make_client(server, **kwargs):
+    kwargs.setdefault('backoff_factor', 0)
+    return WeatherClient("test-key", base_url=server.weather_url, **kwargs)
+
+
+def test_current_weather_is_cached_until_ttl(server):
+    clock = FakeClock()
+    client = make_client(server, cache_ttl=600, clock=clock)
+
+    assert client.current_weather("Tokyo")['main']['temp'] == 30.0
+    # 表記の揺れは同じ都市として扱う
+    client.current_weather(" tokyo ")
+    clock.now = 599
+    client.current_weather("TOKYO")
+    assert server.request_count == 1
+    assert client.stats()['hits'] == 2
+
+    clock.now = 600
+    client.current_weather("Tokyo")
+    assert server.request_count == 2
+
+
+def test_refresh_bypasses_cache(server):
+    client = make_client(server)
+    client.current_weather("Tokyo")
+    client.current_weather("Tokyo", refresh=True)
+    assert server.request_count == 2
+
+
+def test_least_recently_used_city_is_evicted(server):
+    client = make_client(server, cache_size=2)
+    client.current_weather("Tokyo")
+    client.current_weather("Osaka")
+    client.current_weather("Tokyo")
+    client.current_weather("Nagoya")  # Osaka が追い出される
+    assert server.request_count == 3
+
+    client.current_weather("Tokyo")
+    assert server.request_count == 3
+    client.current_weather("Osaka")
+    assert server.request_count == 4
+    assert client.stats()['cached'] == 2
+
+
+def test_concurrent_requests_for_same_city_are_coalesced(server):
+    server.latency = 0.2
+    client = make_client(server)
+    sessions = 8
+    barrier = threading.Barrier(sessions)
+    results = []
+
+    def fetch():
+        barrier.wait()
+        results.append(client.current_weather("Tokyo"))
+
+    threads = [threading.Thread(target=fetch) for _ in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == sessions
+    assert server.request_count == 1
+    assert client.stats()['coalesced'] == sessions - 1
+
+
+def test_transient_server_errors_are_retried():
+    with FlakyOpenWeatherServer(failures=2) as server:
+        client = make_client(server, retries=2)
+        assert client.current_weather("Tokyo")['name'] == "Tokyo"
+        assert server.request_count == 3
+
+
+def test_error_after_retries_is_raised_and_not_cached():
+    with FlakyOpenWeatherServer(failures=2) as server:
+        client = make_client(server, retries=1)
+        with pytest.raises(requests.exceptions.HTTPError):
+            client.current_weather("Tokyo")
+        assert server.request_count == 2
+        # 失敗は保存しないので、次の呼び出しで取り直す
+        assert client.current_weather("Tokyo")['name'] == "Tokyo"
+        assert server.request_count == 3
+
+
+def test_unknown_city_raises_http_error(server):
+    client = make_client(server)
+    with pytest.raises(requests.exceptions.HTTPError) as excinfo:
+        client.current_weather("Atlantis")
+    assert excinfo.value.response.status_code == 404
+    # 404 はリトライしない
+    assert server.request_count == 1
+
+
+def test_error_description_does_not_contain_api_key(server):
+    client = make_client(server)
+    with pytest.raises(requests.exceptions.HTTPError) as excinfo:
+        client.current_weather("Atlantis")
+    # 例外の説明文そのものには APIキーを含む URL が入る
+    assert "test-key" in str(excinfo.value)
+    assert describe_weather_error(excinfo.value) == "HTTP 404"
+
+
+def test_connection_error_description_does_not_contain_api_key():
+    client = WeatherClient("test-key", base_url="http://127.0.0.1:9/data/2.5/weather", retries=0, timeout=1)
+    with pytest.raises(requests.exceptions.RequestException) as excinfo:
+        client.current_weather("Tokyo")
+    assert "test-key" not in describe_weather_error(excinfo.value)